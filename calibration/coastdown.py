@@ -0,0 +1,190 @@
+from machine import Pin
+import machine
+import math
+import time
+from array import array
+
+# Coast-down helpers shared by reed-wheel-callibration.py and the session
+# runner. Copy this file to the Pico next to them.
+
+INERTIA = 0.0588          # kg m^2, solid-disk estimate (see README)
+MIN_GAP_US = 25000        # Reed bounce rejection, as in reed-wheel-core.py
+_RING_SIZE = 16
+_RING_MASK = _RING_SIZE - 1
+
+
+class PulseCapture:
+    """Flywheel reed pulses timestamped with ticks_us in a hard IRQ, read back in order."""
+    def __init__(self, pin_id):
+        self.times = array("l", [0] * _RING_SIZE)
+        self.count = 0      # Written by the IRQ
+        self.read = 0       # Consumed by next()
+        self.lost = 0
+        self._last = time.ticks_add(time.ticks_us(), -MIN_GAP_US)
+        self.pin = Pin(pin_id, Pin.IN, Pin.PULL_UP)
+        self.pin.irq(trigger=Pin.IRQ_FALLING, handler=self._edge, hard=True)
+
+    def _edge(self, pin):
+        now = time.ticks_us()
+        if time.ticks_diff(now, self._last) < MIN_GAP_US:
+            return
+        self._last = now
+        self.times[self.count & _RING_MASK] = now
+        self.count += 1
+
+    def next(self):
+        """The oldest unread pulse time, or None. Pulses overwritten before being read are counted in lost."""
+        state = machine.disable_irq()
+        count = self.count
+        machine.enable_irq(state)
+        if count == self.read:
+            return None
+        if count - self.read > _RING_SIZE:
+            self.lost += count - self.read - _RING_SIZE
+            self.read = count - _RING_SIZE
+        t = self.times[self.read & _RING_MASK]
+        self.read += 1
+        return t
+
+    def stop(self):
+        self.pin.irq(handler=None)
+
+
+class OnlineKFit:
+    """
+    Streaming least-squares fit of the flywheel's braking power.
+
+    Each pair of consecutive revolutions gives the braking power
+    P = -I * w * dw/dt = k * w^2 + P_bearing at their mean w^2; P is
+    regressed on w^2, which is dw/dt regressed on w and 1/w. Only running
+    means and co-moments are kept (Welford's update, which stays accurate
+    in the Pico's single-precision floats), whatever the number of pulses.
+    """
+    def __init__(self, inertia=INERTIA):
+        self.inertia = inertia
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean_x = self.mean_y = 0.0
+        self.cxx = self.cxy = self.cyy = 0.0
+        self._last_w2 = None
+        self._last_mid = 0
+
+    def add_revolution(self, period_us, t_us):
+        """Adds one revolution of period_us that ended at t_us (ticks_us)."""
+        w = 2 * math.pi * 1000000 / period_us
+        w2 = w * w
+        # Mean speed over the revolution belongs to its midpoint
+        mid = time.ticks_add(t_us, -(period_us // 2))
+        if self._last_w2 is not None:
+            dt = time.ticks_diff(mid, self._last_mid) / 1000000
+            x = (w2 + self._last_w2) / 2
+            y = -self.inertia * (w2 - self._last_w2) / (2 * dt)
+            self.n += 1
+            dx = x - self.mean_x
+            dy = y - self.mean_y
+            self.mean_x += dx / self.n
+            self.mean_y += dy / self.n
+            self.cxx += dx * (x - self.mean_x)
+            self.cxy += dx * (y - self.mean_y)
+            self.cyy += dy * (y - self.mean_y)
+        self._last_w2 = w2
+        self._last_mid = mid
+
+    def break_run(self):
+        """Forgets the last revolution, so the next run does not pair with it."""
+        self._last_w2 = None
+
+    def estimate(self):
+        """(k, P_bearing, k 95% half-width), or None until there are enough points."""
+        if self.n < 4 or self.cxx <= 0:
+            return None
+        k = self.cxy / self.cxx
+        bearing = self.mean_y - k * self.mean_x
+        rss = max(self.cyy - k * self.cxy, 0.0)
+        dof = self.n - 2
+        se = math.sqrt(rss / dof / self.cxx)
+        # Student's t quantile for 95%, Cornish-Fisher expansion around 1.96
+        return k, bearing, se * (1.96 + 2.37 / dof + 2.82 / (dof * dof))
+
+
+# --- Coast-down run tracking ---
+SPUN_UP = 1      # Passed start_rpm; the rider can release
+PEDALLING = 2    # Sped up mid-run; the rest of the run is discarded
+RUN_ENDED = 3    # Reached fit_to_rpm without converging
+ESTIMATE = 4     # New estimate after a revolution
+CONVERGED = 5
+
+
+class CoastDown:
+    """Turns pulse times into coast-down runs and feeds their revolutions to an OnlineKFit."""
+    def __init__(self, start_rpm=800, fit_from_rpm=750, fit_to_rpm=300, target_ci=0.01, min_points=20):
+        self.start_rpm = start_rpm
+        self.fit_from_rpm = fit_from_rpm
+        self.fit_to_rpm = fit_to_rpm
+        self.target_ci = target_ci
+        self.min_points = min_points
+        self.fit = OnlineKFit()
+        self.runs = 0
+        self.rpm = 0
+        self.reset()
+
+    def reset(self):
+        """Starts over: forgets the current run and the fit."""
+        self.fit.reset()
+        self.runs = 0
+        self._abandon()
+
+    def _abandon(self):
+        self._last_t = None
+        self._last_period = 0
+        self._armed = False      # Spun up past start_rpm
+        self._fitting = False
+        self.fit.break_run()
+
+    def check_timeout(self, now_us, timeout_us=1200000):
+        """Ends the current run if the wheel has stopped."""
+        if self._last_t is not None and time.ticks_diff(now_us, self._last_t) > timeout_us:
+            self._abandon()
+
+    def pulse(self, t):
+        """Processes one pulse time; returns one of the event codes above, or None."""
+        if self._last_t is None:
+            self._last_t = t
+            return None
+        period = time.ticks_diff(t, self._last_t)
+        self._last_t = t
+        last_period = self._last_period
+        self._last_period = period
+        self.rpm = rpm = 60000000 / period
+
+        if rpm >= self.start_rpm:
+            if not self._armed:
+                self._armed = True
+                return SPUN_UP
+            return None
+        if not self._fitting:
+            if self._armed and rpm <= self.fit_from_rpm:
+                self._fitting = True
+                self.fit.add_revolution(period, t)
+            return None
+        if period < last_period * 0.98:
+            self._abandon()
+            self._last_t = t
+            return PEDALLING
+        if rpm < self.fit_to_rpm:
+            self.runs += 1
+            self._abandon()
+            self._last_t = t
+            return RUN_ENDED
+
+        self.fit.add_revolution(period, t)
+        estimate = self.fit.estimate()
+        if estimate is None:
+            return None
+        k, _, half_width = estimate
+        if self.fit.n >= self.min_points and half_width <= self.target_ci * k:
+            self.runs += 1
+            return CONVERGED
+        return ESTIMATE
@@ -1,8 +1,13 @@
 from machine import Pin
+import sys
 import time
 
 REED_PIN = 9
 
+# "timed":  five 750 -> 300 RPM runs timed end to end, k from the README formula
+# "online": fit k to every pulse of the coast-down and stop once it has converged
+MODE = "timed"
+
 reed_switch = Pin(REED_PIN, Pin.IN, Pin.PULL_UP)
 last_pulse_time = time.ticks_ms()
 smoothed_rpm = 0
@@ -20,6 +25,66 @@ current_run = 0
 run_times = []  # Store coast-down times for each run
 run_complete = False
 
+# Online mode
+TARGET_CI = 0.01      # Stop when the 95% interval is within 1% of k
+MIN_POINTS = 20
+START_RPM = 800       # Spin up past this,
+FIT_FROM_RPM = 750    # fit from here on the way down,
+FIT_TO_RPM = 300      # and end the run here
+
+
+def run_online():
+    import coastdown
+
+    print("Online Coast-Down k Fit")
+    print("=======================")
+    print(f"1. Spin up PAST {START_RPM} RPM")
+    print("2. RELEASE and let it coast down")
+    print(f"Every pulse between {FIT_FROM_RPM} and {FIT_TO_RPM} RPM is used; repeat until k converges")
+    print("")
+
+    capture = coastdown.PulseCapture(REED_PIN)
+    run = coastdown.CoastDown(START_RPM, FIT_FROM_RPM, FIT_TO_RPM, TARGET_CI, MIN_POINTS)
+    try:
+        while True:
+            t = capture.next()
+            if t is None:
+                run.check_timeout(time.ticks_us())
+                time.sleep_ms(5)
+                continue
+            event = run.pulse(t)
+            if event == coastdown.SPUN_UP:
+                print(f"Run {run.runs + 1}: ✅ Reached {START_RPM}+ RPM! Release and coast down...")
+            elif event == coastdown.PEDALLING:
+                print(f"Run {run.runs + 1}: pedalling detected, run discarded from here on")
+            elif event == coastdown.RUN_ENDED:
+                print(f"Run {run.runs} ended at {FIT_TO_RPM} RPM without converging; spin up again")
+            elif event == coastdown.ESTIMATE or event == coastdown.CONVERGED:
+                k, bearing, half_width = run.fit.estimate()
+                print(f"{run.rpm:6.1f} RPM | k = {k:.6f} ± {half_width:.6f} ({100 * half_width / k:.1f}%) | "
+                      f"bearing {bearing:.1f} W | {run.fit.n} points")
+                if event == coastdown.CONVERGED:
+                    print("")
+                    print("✅ k CONVERGED")
+                    print("======================")
+                    print(f"k:            {k:.10f} ± {half_width:.10f} (95%)")
+                    print(f"Bearing loss: {bearing:.2f} W")
+                    print(f"Runs:         {run.runs}, {run.fit.n} points")
+                    print("======================")
+                    return
+    except KeyboardInterrupt:
+        print("")
+        print("Measurement stopped by user")
+    finally:
+        if capture.lost:
+            print(f"WARNING: {capture.lost} pulses were not processed in time")
+        capture.stop()
+
+
+if MODE == "online":
+    run_online()
+    sys.exit()
+
 print("Multi-Run Coast-Down Timer")
 print("==========================")
 print(f"Recording {TOTAL_RUNS} runs automatically")
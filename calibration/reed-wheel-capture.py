@@ -0,0 +1,120 @@
+from machine import Pin, ADC
+import machine
+import micropython
+import binascii
+import struct
+import sys
+import time
+from array import array
+
+REED_PIN = 9
+POTENTIOMETER_PIN = 27
+
+# Binary capture stream for host/capture_stream.py. Nothing else may be
+# printed once capture starts: every byte on USB serial is part of a frame.
+#
+# Frame: sync, kind, sequence number, value count, count x uint32, CRC32
+# of everything before it. The sequence number counts frames of all kinds.
+SYNC = b"\xa5\x5a"
+HEADER_FORMAT = "<2sBHH"
+KIND_PULSES = 1    # ticks_us of each falling edge
+KIND_VOLTAGE = 2   # Potentiometer read_u16, averaged over 16 reads
+KIND_OVERFLOW = 3  # Edges lost because both halves were full, running total
+
+HALF_SIZE = 128           # Edges per half buffer
+MIN_GAP_US = 25000        # Same bounce rejection as reed-wheel-core.py
+FLUSH_MS = 200            # Send a partly filled half after this long
+VOLTAGE_EVERY_MS = 1000
+
+micropython.alloc_emergency_exception_buf(100)
+
+reed_switch = Pin(REED_PIN, Pin.IN, Pin.PULL_UP)
+potentiometer = ADC(POTENTIOMETER_PIN)
+out = sys.stdout.buffer
+
+# --- Double buffer written by the IRQ ---
+halves = (array("L", [0] * HALF_SIZE), array("L", [0] * HALF_SIZE))
+fill = array("l", [0, 0])  # Edges in each half
+state = array("l", [0, 0, 0])  # Active half, last edge ticks_us, edges lost
+_ACTIVE, _LAST, _LOST = 0, 1, 2
+
+frame = bytearray(struct.calcsize(HEADER_FORMAT) + 4 * HALF_SIZE + 4)
+frame_view = memoryview(frame)
+header_size = struct.calcsize(HEADER_FORMAT)
+sequence = 0
+
+
+def on_edge(pin):
+    now = time.ticks_us()
+    if time.ticks_diff(now, state[_LAST]) < MIN_GAP_US:
+        return
+    state[_LAST] = now
+    half = state[_ACTIVE]
+    n = fill[half]
+    if n == HALF_SIZE:
+        state[_LOST] += 1
+        return
+    halves[half][n] = now
+    fill[half] = n + 1
+
+
+def send(kind, values, count):
+    """Packs count values into the frame buffer and writes it in one call."""
+    global sequence
+    struct.pack_into(HEADER_FORMAT, frame, 0, SYNC, kind, sequence & 0xFFFF, count)
+    offset = header_size
+    for i in range(count):
+        struct.pack_into("<I", frame, offset, values[i])
+        offset += 4
+    struct.pack_into("<I", frame, offset, binascii.crc32(frame_view[:offset]))
+    out.write(frame_view[:offset + 4])
+    sequence += 1
+
+
+def swap():
+    """Hands the active half to the sender; returns its index."""
+    irq_state = machine.disable_irq()
+    half = state[_ACTIVE]
+    state[_ACTIVE] = half ^ 1
+    machine.enable_irq(irq_state)
+    return half
+
+
+scratch = array("L", [0])
+
+
+def send_voltage():
+    total = 0
+    for _ in range(16):
+        total += potentiometer.read_u16()
+    scratch[0] = total // 16
+    send(KIND_VOLTAGE, scratch, 1)
+
+
+state[_LAST] = time.ticks_add(time.ticks_us(), -MIN_GAP_US)
+reed_switch.irq(trigger=Pin.IRQ_FALLING, handler=on_edge, hard=True)
+
+try:
+    last_flush = time.ticks_ms()
+    last_voltage = time.ticks_add(last_flush, -VOLTAGE_EVERY_MS)
+    lost_sent = 0
+    while True:
+        now = time.ticks_ms()
+        active = state[_ACTIVE]
+        # Swap early when half full so the IRQ always has room
+        if fill[active] >= HALF_SIZE // 2 or (fill[active] and time.ticks_diff(now, last_flush) >= FLUSH_MS):
+            half = swap()
+            send(KIND_PULSES, halves[half], fill[half])
+            fill[half] = 0
+            last_flush = now
+        if state[_LOST] != lost_sent:
+            lost_sent = state[_LOST]
+            scratch[0] = lost_sent
+            send(KIND_OVERFLOW, scratch, 1)
+        if time.ticks_diff(now, last_voltage) >= VOLTAGE_EVERY_MS:
+            send_voltage()
+            last_voltage = now
+        time.sleep_ms(10)
+
+except KeyboardInterrupt:
+    reed_switch.irq(handler=None)
@@ -0,0 +1,172 @@
+from machine import ADC
+import json
+import os
+import time
+import config
+import coastdown
+
+# Unattended calibration of every resistance level. The level is read from
+# the potentiometer; each converged k is saved to flash immediately, so after
+# a power cut the session picks up where it stopped. Needs config.py (from
+# operation/) and coastdown.py on the Pico.
+
+STATE_FILE = "calibration_session.json"
+RESULT_FILE = "calibration_result.txt"
+
+OVERSAMPLE = 64        # ADC reads averaged per voltage sample
+SAMPLE_MS = 50
+SETTLE_MS = 1500       # Voltage must hold this long before a level counts
+SETTLE_VOLTS = 0.006   # ... within this much
+
+START_RPM = 800
+FIT_FROM_RPM = 750
+FIT_TO_RPM = 300
+TARGET_CI = 0.01
+MIN_POINTS = 20
+
+LEVELS = len(config.LEVEL_VOLTAGE_SORTED)
+
+
+class LevelMonitor:
+    """Oversampled potentiometer voltage, and whether it has settled on a level."""
+    def __init__(self, pin_id):
+        self.adc = ADC(pin_id)
+        self.volts = 0.0
+        self._ref = -1.0
+        self._since = time.ticks_ms()
+        self._sum = 0.0
+        self._n = 0
+
+    def sample(self, now_ms):
+        total = 0
+        for _ in range(OVERSAMPLE):
+            total += self.adc.read_u16()
+        volts = total / OVERSAMPLE / config.MAX_ADC_VALUE * config.PICO_REFERENCE_VOLTAGE
+        if abs(volts - self._ref) > SETTLE_VOLTS:
+            # Moving: restart the settle window from here
+            self._ref = volts
+            self._since = now_ms
+            self._sum = 0.0
+            self._n = 0
+        self._sum += volts
+        self._n += 1
+        self.volts = self._sum / self._n
+
+    def settled(self, now_ms):
+        return time.ticks_diff(now_ms, self._since) >= SETTLE_MS
+
+    def level(self):
+        """1-based level nearest the settled voltage, or None between levels."""
+        nominal = config.LEVEL_VOLTAGE_SORTED
+        best = 0
+        for i in range(1, LEVELS):
+            if abs(nominal[i] - self.volts) < abs(nominal[best] - self.volts):
+                best = i
+        # Accept only within half the gap to the neighbouring levels
+        gap = min(abs(nominal[j] - nominal[best]) for j in (best - 1, best + 1) if 0 <= j < LEVELS)
+        if abs(self.volts - nominal[best]) > gap / 2:
+            return None
+        return best + 1
+
+
+def load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"levels": {}}
+
+
+def save_state(state):
+    # Write a new file and rename it over the old one, so a power cut
+    # mid-write leaves the previous state intact
+    with open(STATE_FILE + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.rename(STATE_FILE + ".tmp", STATE_FILE)
+
+
+def remaining(state):
+    return [level for level in range(1, LEVELS + 1) if str(level) not in state["levels"]]
+
+
+def write_result(state):
+    results = [state["levels"][str(level)] for level in range(1, LEVELS + 1)]
+    voltages = ", ".join("{:.3f}".format(r["voltage"]) for r in results)
+    ks = ", ".join("{:.10f}".format(r["k"]) for r in results)
+    lines = ("LEVEL_VOLTAGE_SORTED = [{}]".format(voltages), "LEVEL_K_SORTED = [{}]".format(ks))
+    with open(RESULT_FILE, "w") as f:
+        for line in lines:
+            f.write(line + "\n")
+    return lines
+
+
+state = load_state()
+print("Calibration Session")
+print("===================")
+if state["levels"]:
+    print(f"Resuming: {len(state['levels'])} of {LEVELS} levels done, remaining {remaining(state)}")
+print("Select a resistance level, wait for it to be recognised, then spin up")
+print(f"past {START_RPM} RPM and coast down until k converges. Any order is fine.")
+print("")
+
+monitor = LevelMonitor(config.POTENTIOMETER_PIN)
+capture = coastdown.PulseCapture(config.REED_PIN)
+run = coastdown.CoastDown(START_RPM, FIT_FROM_RPM, FIT_TO_RPM, TARGET_CI, MIN_POINTS)
+level = None        # Settled level being calibrated
+last_sample = time.ticks_add(time.ticks_ms(), -SAMPLE_MS)
+
+try:
+    while remaining(state):
+        now = time.ticks_ms()
+        if time.ticks_diff(now, last_sample) >= SAMPLE_MS:
+            last_sample = now
+            monitor.sample(now)
+            detected = monitor.level() if monitor.settled(now) else None
+            if detected != level:
+                if level is not None:
+                    print(f"Level {level}: resistance changed, run abandoned")
+                level = detected
+                run.reset()
+                if level is not None:
+                    done = state["levels"].get(str(level))
+                    if done:
+                        print(f"Level {level} ({monitor.volts:.3f} V): already calibrated, k = {done['k']:.6f}. "
+                              f"Remaining: {remaining(state)}")
+                    else:
+                        print(f"Level {level} ({monitor.volts:.3f} V): spin up past {START_RPM} RPM")
+
+        t = capture.next()
+        if t is None:
+            run.check_timeout(time.ticks_us())
+            time.sleep_ms(5)
+            continue
+        if level is None or str(level) in state["levels"]:
+            continue
+
+        event = run.pulse(t)
+        if event == coastdown.SPUN_UP:
+            print(f"Level {level}, run {run.runs + 1}: release and coast down...")
+        elif event == coastdown.PEDALLING:
+            print(f"Level {level}, run {run.runs + 1}: pedalling detected, run discarded from here on")
+        elif event == coastdown.RUN_ENDED:
+            k, _, half_width = run.fit.estimate() or (0, 0, 0)
+            print(f"Level {level}, run {run.runs}: not converged yet (k = {k:.6f} ± {half_width:.6f}); spin up again")
+        elif event == coastdown.CONVERGED:
+            k, bearing, half_width = run.fit.estimate()
+            state["levels"][str(level)] = {"voltage": monitor.volts, "k": k, "ci95": half_width,
+                                           "bearing_w": bearing, "points": run.fit.n, "runs": run.runs}
+            save_state(state)
+            print(f"Level {level}: ✅ k = {k:.10f} ± {half_width:.10f}, saved. Remaining: {remaining(state)}")
+
+    print("")
+    print("🎉 ALL LEVELS CALIBRATED")
+    print("=======================")
+    for line in write_result(state):
+        print(line)
+    print(f"Written to {RESULT_FILE}; copy these lines into config.py")
+
+except KeyboardInterrupt:
+    print("")
+    print(f"Session paused; {len(state['levels'])} of {LEVELS} levels saved in {STATE_FILE}")
+finally:
+    capture.stop()
@@ -0,0 +1 @@
+"""Host-side tools for data taken off the Pico."""
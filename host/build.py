@@ -0,0 +1,123 @@
+"""Cross-compiles operation/ to .mpy bytecode for the Pico.
+
+Usage (from the repository root):
+    python -m host.build [-o build/pico] [--march armv6m] [--deploy] [--manifest]
+
+Each module is compiled with mpy-cross (pip install mpy-cross; its version
+must produce the .mpy format of the firmware on the Pico, e.g. mpy-cross
+1.22 or newer for MicroPython 1.22 and newer). config.py stays source, so
+it can still be edited on the Pico after calibration. main.py is compiled
+as app.mpy; a two-line main.py stub runs it, since MicroPython only starts
+main.py from source.
+
+--deploy copies the build to the Pico with mpremote, first removing any
+.py copies of compiled modules (MicroPython imports a .py ahead of a
+.mpy of the same name). --manifest also writes a manifest.py to freeze the
+modules into a custom firmware image instead.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+OPERATION_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "operation")
+KEEP_SOURCE = ("config.py",)
+APP_MODULE = "app"
+
+MAIN_STUB = """# Generated by host/build.py: the application is the compiled {0}.mpy
+import {0}
+{0}.start()
+""".format(APP_MODULE)
+
+
+def modules():
+    return sorted(name for name in os.listdir(OPERATION_DIR) if name.endswith(".py"))
+
+
+def _target(name):
+    if name == "main.py":
+        return APP_MODULE + ".mpy"
+    if name in KEEP_SOURCE:
+        return name
+    return name[:-3] + ".mpy"
+
+
+def build(output, mpy_cross, march=None):
+    """Compiles every module into output; returns [(source name, output name, source bytes, output bytes)]."""
+    os.makedirs(output, exist_ok=True)
+    for name in os.listdir(output):
+        if name.endswith((".py", ".mpy")):
+            os.remove(os.path.join(output, name))
+    results = []
+    for name in modules():
+        source = os.path.join(OPERATION_DIR, name)
+        target = os.path.join(output, _target(name))
+        if name in KEEP_SOURCE:
+            shutil.copyfile(source, target)
+        else:
+            command = [mpy_cross, "-o", target]
+            if march:
+                command.append("-march=" + march)
+            # The module's name in tracebacks, as on the Pico
+            command += ["-s", os.path.basename(target)[:-4] + ".py", source]
+            subprocess.run(command, check=True)
+        results.append((name, os.path.basename(target), os.path.getsize(source), os.path.getsize(target)))
+    with open(os.path.join(output, "main.py"), "w") as f:
+        f.write(MAIN_STUB)
+    return results
+
+
+def write_manifest(output):
+    """Writes a manifest.py to freeze the modules into firmware; returns its path."""
+    # Frozen modules can't be named main either; freeze a copy of main.py as the app
+    shutil.copyfile(os.path.join(OPERATION_DIR, "main.py"), os.path.join(output, APP_MODULE + ".py"))
+    lines = ['include("$(PORT_DIR)/boards/manifest.py")']
+    for name in modules():
+        if name not in KEEP_SOURCE and name != "main.py":
+            lines.append('module("{}", base_path="{}")'.format(name, OPERATION_DIR))
+    lines.append('module("{}.py", base_path="{}")'.format(APP_MODULE, os.path.abspath(output)))
+    path = os.path.join(output, "manifest.py")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def deploy(output, results, mpremote):
+    """Copies main.py, config.py and the .mpy files to the Pico and resets it."""
+    for name, target, _, _ in results:
+        if target.endswith(".mpy"):
+            # A stale .py would be imported instead of the new .mpy; most won't exist
+            subprocess.run([mpremote, "fs", "rm", ":" + name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    files = [os.path.join(output, "main.py")] + [os.path.join(output, target) for _, target, _, _ in results]
+    subprocess.run([mpremote, "fs", "cp"] + files + [":"], check=True)
+    subprocess.run([mpremote, "reset"], check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", default=os.path.join("build", "pico"), help="output directory")
+    parser.add_argument("--march", help="native code architecture, e.g. armv6m (Pico) or armv7emsp (Pico 2)")
+    parser.add_argument("--deploy", action="store_true", help="copy the build to the Pico with mpremote")
+    parser.add_argument("--manifest", action="store_true", help="also write a manifest.py for frozen modules")
+    args = parser.parse_args()
+
+    mpy_cross = shutil.which("mpy-cross")
+    if mpy_cross is None:
+        sys.exit("error: needs mpy-cross (pip install mpy-cross)")
+    results = build(args.output, mpy_cross, args.march)
+    print("{:<20} {:<20} {:>8} {:>8}".format("module", "output", "source", "output"))
+    for name, target, source_bytes, target_bytes in results:
+        print("{:<20} {:<20} {:>8} {:>8}".format(name, target, source_bytes, target_bytes))
+    print("{:<41} {:>8} {:>8}".format("total", sum(r[2] for r in results), sum(r[3] for r in results)))
+    if args.manifest:
+        print("Manifest written to {}".format(write_manifest(args.output)))
+    if args.deploy:
+        mpremote = shutil.which("mpremote")
+        if mpremote is None:
+            sys.exit("error: --deploy needs mpremote (pip install mpremote)")
+        deploy(args.output, results, mpremote)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Reed pulse capture files for calibration.
+
+A capture is a text file of raw ``ticks_us`` pulse timestamps, one per line,
+preceded by ``# key: value`` header lines. ``level`` and ``voltage`` (the
+potentiometer reading for that resistance level) are required by
+host.fit_k_table; other keys are kept but not interpreted.
+"""
+import numpy as np
+
+TICKS_PERIOD_US = 1 << 30  # MicroPython ticks_us wraps here
+
+
+class Capture:
+    def __init__(self, ticks_us, level, voltage, source="", header=None):
+        self.ticks_us = np.asarray(ticks_us, dtype=np.int64)
+        self.level = int(level)
+        self.voltage = float(voltage)
+        self.source = source
+        self.header = dict(header or {})
+
+    def times_s(self):
+        """Pulse times in seconds from the first pulse, with ticks wraparound undone."""
+        if len(self.ticks_us) == 0:
+            return np.zeros(0)
+        steps = np.diff(self.ticks_us) % TICKS_PERIOD_US
+        return np.concatenate(([0], np.cumsum(steps))) / 1e6
+
+
+def load_capture(path):
+    header = {}
+    with open(path) as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            key, _, value = line[1:].partition(":")
+            header[key.strip()] = value.strip()
+    for key in ("level", "voltage"):
+        if key not in header:
+            raise ValueError("{}: missing '# {}:' header".format(path, key))
+    ticks = np.loadtxt(path, dtype=np.int64, comments="#", ndmin=1)
+    return Capture(ticks, header["level"], header["voltage"], str(path), header)
+
+
+def save_capture(path, capture):
+    header = dict(capture.header, level=capture.level, voltage=capture.voltage)
+    with open(path, "w") as f:
+        for key, value in header.items():
+            f.write("# {}: {}\n".format(key, value))
+        np.savetxt(f, capture.ticks_us, fmt="%d")
@@ -0,0 +1,171 @@
+"""Reads the binary pulse stream of calibration/reed-wheel-capture.py.
+
+Usage (from the repository root):
+    python -m host.capture_stream --port /dev/ttyACM0 --start --level 3 -o captures/s1/level_03.txt
+    python -m host.capture_stream --input stream.bin --level 3 -o level_03.txt
+
+With --port (needs pyserial) the stream is read live until Ctrl+C or
+--seconds; --start first interrupts whatever the Pico is running and starts
+the capture script from its flash. With --input a saved stream is decoded.
+--raw keeps a copy of every byte received.
+
+Frames carry a CRC and a sequence number, so REPL echo and other text is
+skipped, and a corrupted or missing frame is reported rather than silently
+shortening the capture. The result is a host.capture file.
+"""
+import argparse
+import binascii
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from host.capture import Capture, save_capture
+
+# Must match calibration/reed-wheel-capture.py
+SYNC = b"\xa5\x5a"
+HEADER_FORMAT = "<2sBHH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+KIND_PULSES = 1
+KIND_VOLTAGE = 2
+KIND_OVERFLOW = 3
+MAX_VALUES = 128
+
+PICO_REFERENCE_VOLTAGE = 3.3
+_START_SCRIPT = b"\x03\x03exec(open('reed-wheel-capture.py').read())\r"
+
+
+class StreamDecoder:
+    """Incremental frame decoder: feed() bytes as they arrive, in any chunking."""
+    def __init__(self):
+        self._buffer = bytearray()
+        self._next_sequence = None
+        self.ticks_us = []
+        self.voltage_codes = []
+        self.frames = 0
+        self.lost_frames = 0     # Sequence gaps
+        self.bad_frames = 0      # CRC failures
+        self.lost_edges = 0      # Reported by the Pico: its buffers were full
+        self.skipped_bytes = 0   # Non-frame bytes (REPL echo, noise)
+
+    def feed(self, data):
+        buf = self._buffer
+        buf += data
+        while True:
+            start = buf.find(SYNC)
+            if start < 0:
+                # Keep a trailing first sync byte; it may start the next frame
+                keep = 1 if buf[-1:] == SYNC[:1] else 0
+                self.skipped_bytes += len(buf) - keep
+                del buf[:len(buf) - keep]
+                return
+            if start:
+                self.skipped_bytes += start
+                del buf[:start]
+            if len(buf) < HEADER_SIZE:
+                return
+            _, kind, sequence, count = struct.unpack_from(HEADER_FORMAT, buf)
+            if count > MAX_VALUES or kind not in (KIND_PULSES, KIND_VOLTAGE, KIND_OVERFLOW):
+                self._reject(buf)
+                continue
+            size = HEADER_SIZE + 4 * count + 4
+            if len(buf) < size:
+                return
+            crc, = struct.unpack_from("<I", buf, size - 4)
+            if binascii.crc32(buf[:size - 4]) != crc:
+                self.bad_frames += 1
+                self._reject(buf)
+                continue
+            values = struct.unpack_from("<{}I".format(count), buf, HEADER_SIZE)
+            del buf[:size]
+            self._frame(kind, sequence, values)
+
+    def _reject(self, buf):
+        # Not a frame after all: resync from the next byte
+        self.skipped_bytes += 1
+        del buf[:1]
+
+    def _frame(self, kind, sequence, values):
+        if self._next_sequence is not None and sequence != self._next_sequence:
+            self.lost_frames += (sequence - self._next_sequence) & 0xFFFF
+        self._next_sequence = (sequence + 1) & 0xFFFF
+        self.frames += 1
+        if kind == KIND_PULSES:
+            self.ticks_us.extend(values)
+        elif kind == KIND_VOLTAGE:
+            self.voltage_codes.extend(values)
+        else:
+            self.lost_edges = values[0]
+
+    def voltage(self):
+        if not self.voltage_codes:
+            return float("nan")
+        return float(np.median(self.voltage_codes)) / 65535 * PICO_REFERENCE_VOLTAGE
+
+    def capture(self, level, voltage=None):
+        header = {"frames": self.frames, "lost_frames": self.lost_frames, "bad_frames": self.bad_frames,
+                  "lost_edges": self.lost_edges}
+        return Capture(self.ticks_us, level, self.voltage() if voltage is None else voltage, header=header)
+
+
+def _read_serial(args, decoder, raw):
+    try:
+        import serial
+    except ImportError:
+        sys.exit("error: --port needs pyserial (pip install pyserial)")
+    deadline = time.monotonic() + args.seconds if args.seconds else None
+    with serial.Serial(args.port, timeout=0.1) as port:
+        if args.start:
+            port.write(_START_SCRIPT)
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                data = port.read(4096)
+                if data:
+                    if raw:
+                        raw.write(data)
+                    decoder.feed(data)
+        except KeyboardInterrupt:
+            pass
+        # Stop the script so the REPL is usable again
+        port.write(b"\x03")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--port", help="Pico USB serial port")
+    source.add_argument("--input", help="saved stream to decode")
+    parser.add_argument("--start", action="store_true", help="start reed-wheel-capture.py on the Pico")
+    parser.add_argument("--seconds", type=float, help="stop reading after this long")
+    parser.add_argument("--raw", help="also save the received bytes here")
+    parser.add_argument("--level", type=int, required=True, help="resistance level of this capture")
+    parser.add_argument("--voltage", type=float, help="override the potentiometer voltage the Pico reported")
+    parser.add_argument("-o", "--output", required=True, help="capture file to write")
+    args = parser.parse_args()
+
+    decoder = StreamDecoder()
+    if args.input:
+        with open(args.input, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                decoder.feed(chunk)
+    else:
+        raw = open(args.raw, "wb") if args.raw else None
+        try:
+            _read_serial(args, decoder, raw)
+        finally:
+            if raw:
+                raw.close()
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    save_capture(args.output, decoder.capture(args.level, args.voltage))
+    print("{} pulses in {} frames, {:.3f} V".format(len(decoder.ticks_us), decoder.frames, decoder.voltage()))
+    if decoder.lost_frames or decoder.bad_frames or decoder.lost_edges:
+        print("WARNING: {} frames lost, {} failed CRC, {} edges dropped on the Pico".format(
+            decoder.lost_frames, decoder.bad_frames, decoder.lost_edges), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Reads the on-device statistics characteristic of operation/stats.py.
+
+Usage (from the repository root):
+    python -m host.device_stats --address AA:BB:CC:DD:EE:FF [--every 5] [--analytics]
+    python -m host.device_stats --input stats.bin [--analytics]
+
+With --address (needs bleak) the characteristic is read over BLE, once or
+every --every seconds; STATS_ENABLED must be set in operation/config.py.
+With --input a saved value is decoded. Prints the loop period histogram,
+the cost of each stage and the heap watermarks.
+
+With --analytics the power analytics characteristic of
+operation/power_analytics.py is read instead (POWER_ANALYTICS must be
+set): rolling averages, normalized power, energy and time in each zone.
+"""
+import argparse
+import asyncio
+import struct
+import sys
+
+# Must match operation/stats.py and operation/peripheral.py
+STATS_CHAR_UUID = "7e1a0002-5f3b-4c1e-9d2a-8b6c4f0e2d11"
+HEADER_FORMAT = "<BBBBIIIIIIIII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+VERSION = 1
+STAGE_NAMES = ("cadence", "k_constant", "power", "speed", "send_power", "send_csc", "send_speed", "send_cadence",
+               "send_bike")
+
+# Must match operation/power_analytics.py and operation/peripheral.py
+ANALYTICS_CHAR_UUID = "7e1a0004-5f3b-4c1e-9d2a-8b6c4f0e2d11"
+ANALYTICS_HEADER_FORMAT = "<BBHHHHII"
+ANALYTICS_HEADER_SIZE = struct.calcsize(ANALYTICS_HEADER_FORMAT)
+ANALYTICS_VERSION = 1
+
+_HEADER_FIELDS = ("version", "stages", "buckets", "reserved", "uptime_ms", "loops", "loop_bucket_us",
+                  "loop_max_us", "mem_free_min", "mem_free_last", "collections", "last_collection_ms",
+                  "last_collection_loop_us")
+_ANALYTICS_FIELDS = ("version", "zones", "avg_3s", "avg_30s", "normalized_power", "max_power", "energy_j",
+                     "seconds")
+
+
+class StatsError(ValueError):
+    pass
+
+
+def decode(payload):
+    """Returns the statistics as a dict; histograms are lists of counts."""
+    if len(payload) < HEADER_SIZE:
+        raise StatsError("payload too short for a header")
+    stats = dict(zip(_HEADER_FIELDS, struct.unpack_from(HEADER_FORMAT, payload)))
+    if stats["version"] != VERSION:
+        raise StatsError("unsupported version {}".format(stats["version"]))
+    stages, buckets = stats["stages"], stats["buckets"]
+    size = HEADER_SIZE + 2 * buckets + 4 * stages + 2 * stages * buckets
+    if len(payload) < size:
+        raise StatsError("payload is {} bytes, expected {}".format(len(payload), size))
+    offset = HEADER_SIZE
+    stats["loop_hist"] = list(struct.unpack_from("<{}H".format(buckets), payload, offset))
+    offset += 2 * buckets
+    stage_max = struct.unpack_from("<{}I".format(stages), payload, offset)
+    offset += 4 * stages
+    stats["stages"] = {}
+    for i in range(stages):
+        name = STAGE_NAMES[i] if i < len(STAGE_NAMES) else "stage_{}".format(i)
+        hist = struct.unpack_from("<{}H".format(buckets), payload, offset + 2 * i * buckets)
+        stats["stages"][name] = {"max_us": stage_max[i], "hist": list(hist)}
+    return stats
+
+
+def decode_analytics(payload):
+    """Returns the power analytics as a dict; zone_s lists the seconds in each zone."""
+    if len(payload) < ANALYTICS_HEADER_SIZE:
+        raise StatsError("payload too short for a header")
+    analytics = dict(zip(_ANALYTICS_FIELDS, struct.unpack_from(ANALYTICS_HEADER_FORMAT, payload)))
+    if analytics["version"] != ANALYTICS_VERSION:
+        raise StatsError("unsupported version {}".format(analytics["version"]))
+    size = ANALYTICS_HEADER_SIZE + 4 * analytics["zones"]
+    if len(payload) < size:
+        raise StatsError("payload is {} bytes, expected {}".format(len(payload), size))
+    analytics["zone_s"] = list(struct.unpack_from("<{}I".format(analytics["zones"]), payload,
+                                                  ANALYTICS_HEADER_SIZE))
+    return analytics
+
+
+def percentile_bucket(hist, fraction):
+    """Index of the bucket holding the given fraction of the counts."""
+    total = sum(hist)
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= fraction * total:
+            return i
+    return len(hist) - 1
+
+
+def report(stats):
+    lines = []
+    bucket_us = stats["loop_bucket_us"]
+    lines.append("Uptime {:.0f} s, {} loops, longest loop {:.1f} ms".format(
+        stats["uptime_ms"] / 1000, stats["loops"], stats["loop_max_us"] / 1000))
+    lines.append("Loop period")
+    hist = stats["loop_hist"]
+    for i, count in enumerate(hist):
+        if count:
+            high = "+" if i == len(hist) - 1 else "-{:.1f}".format((i + 1) * bucket_us / 1000)
+            lines.append("  {:>6.1f}{:<7} ms {:>7}".format(i * bucket_us / 1000, high, count))
+    lines.append("Stage cost (us): calls, median and p99 (power-of-two bucket bounds), max")
+    for name, stage in stats["stages"].items():
+        hist = stage["hist"]
+        if not sum(hist):
+            continue
+        # Bucket i holds [2^i, 2^(i+1)) us
+        p50 = "<{}".format(2 << percentile_bucket(hist, 0.5))
+        p99 = "<{}".format(2 << percentile_bucket(hist, 0.99))
+        lines.append("  {:<13} {:>7} {:>7} {:>7} {:>7}".format(name, sum(hist), p50, p99, stage["max_us"]))
+    lines.append("Heap: {} bytes free, lowest {}; {} collections seen, last at {:.1f} s in a {:.1f} ms loop".format(
+        stats["mem_free_last"], stats["mem_free_min"], stats["collections"],
+        stats["last_collection_ms"] / 1000, stats["last_collection_loop_us"] / 1000))
+    return lines
+
+
+def report_analytics(analytics):
+    lines = []
+    lines.append("Ride {}:{:02d}, {:.1f} kJ, max {} W".format(
+        analytics["seconds"] // 60, analytics["seconds"] % 60, analytics["energy_j"] / 1000,
+        analytics["max_power"]))
+    lines.append("Power: 3 s {} W, 30 s {} W, normalized {} W".format(
+        analytics["avg_3s"], analytics["avg_30s"], analytics["normalized_power"]))
+    lines.append("Time in zone")
+    total = sum(analytics["zone_s"]) or 1
+    for i, seconds in enumerate(analytics["zone_s"]):
+        lines.append("  Z{:<3} {:>6} s {:>5.1f}%".format(i + 1, seconds, 100 * seconds / total))
+    return lines
+
+
+async def _read_ble(address, every, analytics):
+    from bleak import BleakClient
+    async with BleakClient(address) as client:
+        while True:
+            if analytics:
+                payload = await client.read_gatt_char(ANALYTICS_CHAR_UUID)
+                print("\n".join(report_analytics(decode_analytics(payload))))
+            else:
+                payload = await client.read_gatt_char(STATS_CHAR_UUID)
+                print("\n".join(report(decode(payload))))
+            if not every:
+                return
+            print("")
+            await asyncio.sleep(every)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--address", help="BLE address of the Pico")
+    source.add_argument("--input", help="saved characteristic value to decode")
+    parser.add_argument("--every", type=float, help="keep reading, this many seconds apart")
+    parser.add_argument("--analytics", action="store_true", help="the power analytics characteristic instead")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, "rb") as f:
+            payload = f.read()
+        if args.analytics:
+            print("\n".join(report_analytics(decode_analytics(payload))))
+        else:
+            print("\n".join(report(decode(payload))))
+        return
+    try:
+        import bleak  # noqa: F401
+    except ImportError:
+        sys.exit("error: --address needs bleak (pip install bleak)")
+    try:
+        asyncio.run(_read_ble(args.address, args.every, args.analytics))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
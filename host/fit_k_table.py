@@ -0,0 +1,223 @@
+"""Fits the k table in operation/config.py from raw coast-down captures.
+
+Usage (from the repository root):
+    python -m host.fit_k_table SESSION [SESSION ...] [--per-session]
+
+Each SESSION is a capture file or a directory of them (see host.capture).
+Every coast-down in the captures between --max-rpm and --min-rpm is used,
+not just its end points. The flywheel is modelled as
+
+    I * w * dw/dt = -(k * w^2 + P_bearing)
+
+with one k per resistance level and one constant bearing loss shared by all
+levels. Writing E = I * w^2 / 2 and S(t) for the integral of w^2 over the
+coast-down, E(t) = E0 - k * S(t) - P_bearing * t is linear in the unknowns,
+so every pulse of every run at every level goes into one least-squares
+solve. Each run's E0 is taken out by subtracting the run's means, so the
+solve has a column per level and one for the bearing loss however many
+runs there are. The README's 750 -> 300 RPM rule, k = dE / (dt * w_avg^2),
+is reported alongside for comparison.
+"""
+import argparse
+import glob
+import math
+import os
+import sys
+
+import numpy as np
+
+from host.capture import load_capture
+
+INERTIA_KG_M2 = 0.0588  # Solid-disk estimate, see calibration/README.md
+_MIN_PERIOD_S = 60 / 2000  # Shorter gaps are reed bounce
+_MIN_INTERVALS = 8
+
+
+def coast_downs(times_s, min_rpm, max_rpm, tolerance=0.02):
+    """Splits pulse times into coast-down runs inside [min_rpm, max_rpm].
+
+    Returns a list of (t, w) arrays: the midpoint time and mean angular
+    speed (rad/s) of each revolution. A run ends where the wheel speeds up
+    by more than tolerance (pedalling) or leaves the speed window.
+    """
+    times_s = np.asarray(times_s, dtype=float)
+    if len(times_s) < 2:
+        return []
+    # Drop the second pulse of a bounce pair
+    keep = np.concatenate(([True], np.diff(times_s) >= _MIN_PERIOD_S))
+    times_s = times_s[keep]
+    periods = np.diff(times_s)
+    mids = times_s[:-1] + periods / 2
+    rpm = 60 / periods
+
+    usable = (rpm >= min_rpm) & (rpm <= max_rpm)
+    # Interval j continues the run from j-1 only if it is no faster than j-1
+    continues = np.concatenate(([False], periods[1:] >= periods[:-1] * (1 - tolerance)))
+    starts = usable & ~(continues & np.concatenate(([False], usable[:-1])))
+    run_id = np.cumsum(starts)
+
+    runs = []
+    for rid in np.unique(run_id[usable]):
+        idx = np.flatnonzero(usable & (run_id == rid))
+        if len(idx) < _MIN_INTERVALS:
+            continue
+        # Require at least half the speed window, so spin-up wobbles are not taken as runs
+        if rpm[idx[0]] - rpm[idx[-1]] < (max_rpm - min_rpm) / 2:
+            continue
+        runs.append((mids[idx], 2 * math.pi / periods[idx]))
+    return runs
+
+
+def rule_k(t, w, min_rpm, max_rpm, inertia):
+    """The README's two-point estimate, or None if the run does not reach both window edges."""
+    w_a, w_b = max_rpm * math.pi / 30, min_rpm * math.pi / 30
+    # Runs are clipped to the window, so the edge crossings lie just outside
+    # the first and last revolutions; extrapolate over at most one more step
+    if w_a - w[0] > 1.5 * (w[0] - w[1]) or w[-1] - w_b > 1.5 * (w[-2] - w[-1]):
+        return None
+    t_a = t[0] + (w[0] - w_a) / (w[0] - w[1]) * (t[1] - t[0])
+    t_b = t[-1] + (w[-1] - w_b) / (w[-2] - w[-1]) * (t[-1] - t[-2])
+    energy = inertia * (w_a ** 2 - w_b ** 2) / 2
+    return energy / ((t_b - t_a) * ((w_a + w_b) / 2) ** 2)
+
+
+class Fit:
+    """Result of fit(): per-level k, shared bearing loss, their standard errors and each run's E0."""
+    def __init__(self, levels, voltages, k, k_se, runs, rule, bearing_w, bearing_se, e0, rms_j):
+        self.levels = levels
+        self.voltages = voltages
+        self.k = k
+        self.k_se = k_se
+        self.runs = runs
+        self.rule = rule
+        self.bearing_w = bearing_w
+        self.bearing_se = bearing_se
+        self.e0 = e0
+        self.rms_j = rms_j
+
+
+def fit(captures, min_rpm=300, max_rpm=750, inertia=INERTIA_KG_M2):
+    """Joint least-squares fit over all captures; returns a Fit."""
+    levels = sorted({c.level for c in captures})
+    column = {level: i for i, level in enumerate(levels)}
+    voltages = {level: [] for level in levels}
+    rule = {level: [] for level in levels}
+
+    blocks = []  # (level column, t, w) per run
+    for capture in captures:
+        voltages[capture.level].append(capture.voltage)
+        for t, w in coast_downs(capture.times_s(), min_rpm, max_rpm):
+            blocks.append((column[capture.level], t, w))
+            k = rule_k(t, w, min_rpm, max_rpm, inertia)
+            if k is not None:
+                rule[capture.level].append(k)
+    if not blocks:
+        raise ValueError("no coast-downs between {} and {} RPM in the captures".format(min_rpm, max_rpm))
+
+    n_rows = sum(len(t) for _, t, _ in blocks)
+    n_levels = len(levels)
+    # E0 differs per run: subtracting each run's means from its rows takes it
+    # out, leaving one k per level and the bearing loss as the only columns
+    a = np.zeros((n_rows, n_levels + 1))
+    energy = np.empty(n_rows)
+    means = []  # (energy, integral, elapsed) means per run, to recover its E0
+    row = 0
+    for level_col, t, w in blocks:
+        rows = slice(row, row + len(t))
+        w2 = w * w
+        elapsed = t - t[0]
+        integral = np.concatenate(([0], np.cumsum((w2[1:] + w2[:-1]) / 2 * np.diff(t))))
+        run_energy = inertia * w2 / 2
+        means.append((run_energy.mean(), integral.mean(), elapsed.mean()))
+        a[rows, level_col] = means[-1][1] - integral
+        a[rows, -1] = means[-1][2] - elapsed
+        energy[rows] = run_energy - means[-1][0]
+        row += len(t)
+
+    solution, _, rank, _ = np.linalg.lstsq(a, energy, rcond=None)
+    if rank < a.shape[1]:
+        raise ValueError("captures do not determine every level's k and the bearing loss")
+    k, bearing_w = solution[:-1], solution[-1]
+    # E(t) = E0 - k * S(t) - P_bearing * t holds at the run means too
+    e0 = np.array([e + k[level_col] * s + bearing_w * el for (level_col, _, _), (e, s, el) in zip(blocks, means)])
+    residual = energy - a @ solution
+    # The E0 taken out by demeaning count as fitted parameters
+    dof = max(n_rows - len(blocks) - a.shape[1], 1)
+    variance = residual @ residual / dof
+    # (A^T A)^-1 = R^-1 R^-T from A = QR, without forming A^T A
+    r_inv = np.linalg.inv(np.linalg.qr(a, mode="r"))
+    se = np.sqrt(np.sum(r_inv * r_inv, axis=1) * variance)
+
+    runs = np.bincount([level_col for level_col, _, _ in blocks], minlength=n_levels)
+    return Fit(levels=levels,
+               voltages=np.array([np.mean(voltages[level]) for level in levels]),
+               k=k, k_se=se[:-1], runs=runs,
+               rule=[np.mean(rule[level]) if rule[level] else float("nan") for level in levels],
+               bearing_w=bearing_w, bearing_se=se[-1], e0=e0,
+               rms_j=math.sqrt(residual @ residual / n_rows))
+
+
+def config_lines(result):
+    """The two config.py lines, sorted by voltage."""
+    order = np.argsort(result.voltages)
+    return ("LEVEL_VOLTAGE_SORTED = [{}]".format(", ".join("{:.3g}".format(v) for v in result.voltages[order])),
+            "LEVEL_K_SORTED = [{}]".format(", ".join("{:.10g}".format(k) for k in result.k[order])))
+
+
+def report(result):
+    print("{:>5} {:>8} {:>5} {:>12} {:>10} {:>12}".format("Level", "Voltage", "Runs", "k (fit)", "+/-", "k (rule)"))
+    for i, level in enumerate(result.levels):
+        print("{:>5} {:>8.3f} {:>5} {:>12.6g} {:>10.2g} {:>12.6g}".format(
+            level, result.voltages[i], result.runs[i], result.k[i], result.k_se[i], result.rule[i]))
+    print("Bearing loss: {:.2f} W +/- {:.2f}".format(result.bearing_w, result.bearing_se))
+    print("RMS energy residual: {:.3f} J".format(result.rms_j))
+    if np.any(np.diff(result.k[np.argsort(result.voltages)]) <= 0):
+        print("WARNING: k does not increase with voltage; check the level headers", file=sys.stderr)
+
+
+def sessions(paths):
+    """Maps each argument to the captures it names, a file or a directory of *.txt files."""
+    found = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, "*.txt"))) if os.path.isdir(path) else [path]
+        found.append((path, [load_capture(f) for f in files]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sessions", nargs="+", help="capture files or directories of them")
+    parser.add_argument("--per-session", action="store_true",
+                        help="fit each session on its own and report the spread between them")
+    parser.add_argument("--min-rpm", type=float, default=300)
+    parser.add_argument("--max-rpm", type=float, default=750)
+    parser.add_argument("--inertia", type=float, default=INERTIA_KG_M2, help="flywheel inertia, kg m^2")
+    args = parser.parse_args()
+
+    found = sessions(args.sessions)
+    try:
+        if args.per_session:
+            fits = []
+            for path, captures in found:
+                print("== {} ==".format(path))
+                fits.append(fit(captures, args.min_rpm, args.max_rpm, args.inertia))
+                report(fits[-1])
+                print("")
+            if len(fits) > 1 and all(f.levels == fits[0].levels for f in fits):
+                ks = np.array([f.k for f in fits])
+                print("Spread between sessions (std / mean of k):")
+                for level, spread in zip(fits[0].levels, ks.std(axis=0) / ks.mean(axis=0)):
+                    print("  level {:>2}: {:.2%}".format(level, spread))
+                print("")
+        result = fit([c for _, captures in found for c in captures], args.min_rpm, args.max_rpm, args.inertia)
+    except ValueError as e:
+        sys.exit("error: {}".format(e))
+    print("== All sessions ==")
+    report(result)
+    print("")
+    for line in config_lines(result):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
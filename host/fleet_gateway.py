@@ -0,0 +1,552 @@
+"""Aggregates the live data of a room of sensors into one leaderboard.
+
+Usage (from the repository root):
+    python -m host.fleet_gateway [--name PicoPowerMeter | --address AA:BB:.. ...] [--http 8080] [--every 5]
+    python -m host.fleet_gateway --simulate 24 [--speed 1] [--seconds 60]
+
+Every sensor is a central's BLEPeripheral like any other; the gateway
+subscribes to its Cycling Power Measurement (0x2A63) and CSC Measurement
+(0x2A5B), or to Indoor Bike Data (0x2AD2) on a sensor with FTMS_PROFILE
+"only", and decodes them exactly as operation/peripheral.py encodes
+them. Notifications come in through a transport: BleakTransport (needs
+bleak) connects to every sensor advertising --name or to the given
+--address list; --simulate replays simulated rides instead (see
+simulator/fleet.py), so the gateway can be tried without radios.
+
+Notifications are only queued as they arrive and decoded in batches with
+NumPy every BATCH_INTERVAL_S, or sooner once BATCH_MAX are waiting. Each
+bike's state is a row of a few column arrays: power, a POWER_TAU_S
+rolling power, energy, cadence and speed from the CSC event times (as
+sent, from Indoor Bike Data), distance. --every prints the leaderboard; --http serves /snapshot and
+/leaderboard?by=energy_kj&top=10 as JSON. Needs NumPy.
+"""
+import abc
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from host.ride_analytics import OPERATION_CONFIG, load_config
+
+# Must match operation/peripheral.py
+CPS_MEASUREMENT = 0x2A63
+CSC_MEASUREMENT = 0x2A5B
+INDOOR_BIKE_DATA = 0x2AD2
+# CPS measurement by length: instantaneous power alone, or followed by accumulated energy (flags 0x0800)
+_POWER_DTYPES = {
+    4: (0x0000, np.dtype([("flags", "<u2"), ("power", "<i2")])),
+    6: (0x0800, np.dtype([("flags", "<u2"), ("power", "<i2"), ("energy_kj", "<u2")])),
+}
+# CSC measurement by flags: 0x03 wheel and crank, 0x01 wheel only, 0x02 crank only
+_CSC_DTYPES = {
+    11: (0x03, np.dtype([("flags", "u1"), ("wheel_revs", "<u4"), ("wheel_time", "<u2"),
+                         ("crank_revs", "<u2"), ("crank_time", "<u2")])),
+    7: (0x01, np.dtype([("flags", "u1"), ("wheel_revs", "<u4"), ("wheel_time", "<u2")])),
+    5: (0x02, np.dtype([("flags", "u1"), ("crank_revs", "<u2"), ("crank_time", "<u2")])),
+}
+# Indoor Bike Data by length: speed, cadence and power (flags 0x0044), or the resistance level too (0x0064)
+_BIKE_DTYPES = {
+    8: (0x0044, np.dtype([("flags", "<u2"), ("speed", "<u2"), ("cadence", "<u2"), ("power", "<i2")])),
+    10: (0x0064, np.dtype([("flags", "<u2"), ("speed", "<u2"), ("cadence", "<u2"), ("level", "<i2"),
+                           ("power", "<i2")])),
+}
+_EVENT_TIME_HZ = 1024  # CSC event times are in 1/1024 s and wrap at 16 bits
+
+BATCH_INTERVAL_S = 0.05
+BATCH_MAX = 4096
+POWER_TAU_S = 3.0
+# A value older than this is taken as stopped (the sensor re-sends every NOTIFY_KEEPALIVE_MS)
+STALE_S = 3.0
+LATENCY_WINDOW = 1 << 16
+METRICS = ("power", "power_avg", "cadence", "speed_kph", "energy_kj", "distance_km")
+
+_COLUMNS = {
+    "power": np.int32, "power_s": np.float64, "power_avg": np.float64, "energy_j": np.float64,
+    "crank_revs": np.int64, "crank_time": np.int64, "cadence": np.float64, "crank_event_s": np.float64,
+    "wheel_revs": np.int64, "wheel_time": np.int64, "speed_kph": np.float64, "wheel_event_s": np.float64,
+    "distance_m": np.float64, "notifications": np.int64, "last_seen_s": np.float64,
+}
+# Before a bike's first notification of each kind
+_NONE = {"power_s": -math.inf, "crank_revs": -1, "wheel_revs": -1, "crank_event_s": -math.inf,
+         "wheel_event_s": -math.inf, "last_seen_s": -math.inf}
+
+
+def _groups(bikes):
+    """Masks of the first and last entry of each bike's run in bikes (sorted by bike)."""
+    first = np.ones(len(bikes), dtype=bool)
+    last = np.ones(len(bikes), dtype=bool)
+    np.not_equal(bikes[1:], bikes[:-1], out=first[1:])
+    last[:-1] = first[1:]
+    return first, last
+
+
+def _previous(values, first, bikes, state):
+    """Each entry's predecessor of the same bike: the entry before it, or the bike's state."""
+    previous = np.empty_like(values)
+    previous[1:] = values[:-1]
+    previous[first] = state[bikes[first]]
+    return previous
+
+
+class FleetGateway:
+    """
+    Per-bike state of many sensors, updated from their notifications in batches.
+
+    Bikes are rows, added on their first notification; ingest() only queues,
+    process_pending() decodes everything queued, run() calls it as a task.
+    Times are seconds on clock(), time.perf_counter by default.
+    """
+    def __init__(self, wheel_circumference_mm, capacity=64, batch_interval_s=BATCH_INTERVAL_S,
+                 batch_max=BATCH_MAX, clock=time.perf_counter):
+        self.wheel_km = wheel_circumference_mm / 1e6
+        self.batch_interval_s = batch_interval_s
+        self.batch_max = batch_max
+        self.clock = clock
+        self.bike_ids = []
+        self._rows = {}
+        self._columns = {}
+        for name, dtype in _COLUMNS.items():
+            self._columns[name] = np.full(capacity, _NONE.get(name, 0), dtype=dtype)
+        self._power = []  # (row, payload, sent) waiting to be decoded
+        self._csc = []
+        self._bike = []
+        self._full = asyncio.Event()
+
+        self.received = 0
+        self.processed = 0
+        self.malformed = 0
+        self.batches = 0
+        self._latency = np.zeros(LATENCY_WINDOW)
+        self._latency_n = 0
+
+    def column(self, name):
+        """One of the state column arrays, an entry per bike (a view, not a copy)."""
+        return self._columns[name][:len(self.bike_ids)]
+
+    def row(self, bike_id):
+        """The bike's row, added on first use."""
+        row = self._rows.get(bike_id)
+        if row is None:
+            row = len(self.bike_ids)
+            if row == len(self._columns["power"]):
+                for name, column in self._columns.items():
+                    grown = np.full(2 * row, _NONE.get(name, 0), dtype=column.dtype)
+                    grown[:row] = column
+                    self._columns[name] = grown
+            self._rows[bike_id] = row
+            self.bike_ids.append(bike_id)
+        return row
+
+    def ingest(self, bike_id, characteristic, payload, sent_s=None):
+        """Queues one notification; sent_s (default now) is when it left the sensor, for latency."""
+        row = self._rows.get(bike_id)
+        if row is None:
+            row = self.row(bike_id)
+        if characteristic == CPS_MEASUREMENT:
+            queue = self._power
+        elif characteristic == INDOOR_BIKE_DATA:
+            queue = self._bike
+        else:
+            queue = self._csc
+        queue.append((row, payload, self.clock() if sent_s is None else sent_s))
+        self.received += 1
+        if len(self._power) + len(self._csc) + len(self._bike) >= self.batch_max:
+            self._full.set()
+
+    def process_pending(self):
+        """Decodes everything queued and updates the bikes' state; returns the number of notifications."""
+        power, csc, bike = self._power, self._csc, self._bike
+        self._power, self._csc, self._bike = [], [], []
+        self._full.clear()
+        n = len(power) + len(csc) + len(bike)
+        if not n:
+            return 0
+        now = self.clock()
+        columns = self._columns
+        rows, payloads, sent = zip(*(power + csc + bike))
+        rows, sent = np.array(rows, dtype=np.int64), np.array(sent)
+        np.add.at(columns["notifications"], rows, 1)
+        np.maximum.at(columns["last_seen_s"], rows, sent)
+        split, split_bike = len(power), len(power) + len(csc)
+        if power:
+            self._decode_power(rows[:split], payloads[:split], sent[:split])
+        if csc:
+            self._decode_csc(rows[split:split_bike], payloads[split:split_bike], sent[split:split_bike])
+        if bike:
+            self._decode_bike(rows[split_bike:], payloads[split_bike:], sent[split_bike:])
+        self._record_latency(now - sent)
+        self.processed += n
+        self.batches += 1
+        return n
+
+    def _decode_power(self, rows, payloads, sent):
+        # The gateway integrates energy itself, so a sensor's accumulated energy field is not read
+        lengths = np.fromiter(map(len, payloads), dtype=np.int64, count=len(payloads))
+        data = np.frombuffer(b"".join(payloads), dtype=np.uint8)
+        offsets = np.cumsum(lengths) - lengths
+        values = np.zeros(len(payloads), dtype=np.int64)
+        keep = np.zeros(len(payloads), dtype=bool)
+        for length, (flags, dtype) in _POWER_DTYPES.items():
+            index = np.flatnonzero(lengths == length)
+            if not len(index):
+                continue
+            records = data[offsets[index, None] + np.arange(length)].copy().view(dtype).ravel()
+            ok = records["flags"] == flags
+            values[index[ok]] = records["power"][ok]
+            keep[index[ok]] = True
+        self.malformed += int(np.count_nonzero(~keep))
+        self._update_power(rows[keep], values[keep], sent[keep])
+
+    def _update_power(self, rows, values, sent):
+        """Power, energy and rolling power from (row, watts, sent) in arrival order."""
+        if not len(rows):
+            return
+        order = np.argsort(rows, kind="stable")
+        rows, values, sent = rows[order], values[order], sent[order]
+        first, last = _groups(rows)
+        c = self._columns
+        # Each value holds until the next one; after a gap of over STALE_S the bike had stopped
+        previous = _previous(values, first, rows, c["power"].astype(np.int64))
+        gap = sent - _previous(sent, first, rows, c["power_s"])
+        previous = np.where(gap <= STALE_S, previous, 0)
+        dt = np.clip(gap, 0, 10 * POWER_TAU_S)
+        np.add.at(c["energy_j"], rows, previous * dt)
+        # Rolling power: an exponential average of the held values, in closed form per bike
+        decay = -dt / POWER_TAU_S
+        cumulative = np.cumsum(decay)
+        start = np.flatnonzero(first)
+        group = np.cumsum(first) - 1
+        within = cumulative - (cumulative[start] - decay[start])[group]
+        total = within[last][group]
+        weights = previous * -np.expm1(decay) * np.exp(total - within)
+        bikes = rows[start]
+        c["power_avg"][bikes] = c["power_avg"][bikes] * np.exp(total[start]) + np.bincount(
+            group, weights=weights, minlength=len(bikes))
+        c["power"][rows[last]] = values[last]
+        c["power_s"][rows[last]] = sent[last]
+
+    def _decode_bike(self, rows, payloads, sent):
+        # Indoor Bike Data carries cadence and speed as values, not event times
+        lengths = np.fromiter(map(len, payloads), dtype=np.int64, count=len(payloads))
+        data = np.frombuffer(b"".join(payloads), dtype=np.uint8)
+        offsets = np.cumsum(lengths) - lengths
+        power = np.zeros(len(payloads), dtype=np.int64)
+        cadence = np.zeros(len(payloads))
+        speed = np.zeros(len(payloads))
+        keep = np.zeros(len(payloads), dtype=bool)
+        for length, (flags, dtype) in _BIKE_DTYPES.items():
+            index = np.flatnonzero(lengths == length)
+            if not len(index):
+                continue
+            records = data[offsets[index, None] + np.arange(length)].copy().view(dtype).ravel()
+            ok = records["flags"] == flags
+            index, records = index[ok], records[ok]
+            power[index] = records["power"]
+            cadence[index] = records["cadence"] / 2
+            speed[index] = records["speed"] / 100
+            keep[index] = True
+        self.malformed += int(np.count_nonzero(~keep))
+        rows, power, cadence, speed, sent = rows[keep], power[keep], cadence[keep], speed[keep], sent[keep]
+        self._update_power(rows, power, sent)
+        if not len(rows):
+            return
+
+        order = np.argsort(rows, kind="stable")
+        rows, cadence, speed, sent = rows[order], cadence[order], speed[order], sent[order]
+        first, last = _groups(rows)
+        c = self._columns
+        # Distance integrates speed as energy does power: each value holds until the next one
+        gap = sent - _previous(sent, first, rows, c["wheel_event_s"])
+        previous = np.where(gap <= STALE_S, _previous(speed, first, rows, c["speed_kph"]), 0)
+        np.add.at(c["distance_m"], rows, previous / 3.6 * np.clip(gap, 0, STALE_S))
+        bikes = rows[last]
+        c["cadence"][bikes] = cadence[last]
+        c["speed_kph"][bikes] = speed[last]
+        c["crank_event_s"][bikes] = sent[last]
+        c["wheel_event_s"][bikes] = sent[last]
+
+    def _decode_csc(self, rows, payloads, sent):
+        lengths = np.fromiter(map(len, payloads), dtype=np.int64, count=len(payloads))
+        data = np.frombuffer(b"".join(payloads), dtype=np.uint8)
+        offsets = np.cumsum(lengths) - lengths
+        wheel, crank = [], []
+        for length, (flags, dtype) in _CSC_DTYPES.items():
+            index = np.flatnonzero(lengths == length)
+            if not len(index):
+                continue
+            records = data[offsets[index, None] + np.arange(length)].copy().view(dtype).ravel()
+            ok = records["flags"] == flags
+            self.malformed += int(np.count_nonzero(~ok))
+            index, records = index[ok], records[ok]
+            if "wheel_revs" in dtype.names:
+                wheel.append((index, records["wheel_revs"], records["wheel_time"]))
+            if "crank_revs" in dtype.names:
+                crank.append((index, records["crank_revs"], records["crank_time"]))
+        self.malformed += int(np.count_nonzero(~np.isin(lengths, list(_CSC_DTYPES))))
+        c = self._columns
+        if crank:
+            _, moved, rate = self._events(crank, rows, sent, "crank", 0xFFFF)
+            c["cadence"][moved] = rate * 60
+        if wheel:
+            revs, moved, rate = self._events(wheel, rows, sent, "wheel", 0xFFFFFFFF)
+            np.add.at(c["distance_m"], revs[0], revs[1] * self.wheel_km * 1000)
+            c["speed_kph"][moved] = rate * self.wheel_km * 3600
+
+    def _events(self, parts, rows, sent, name, revs_mask):
+        """Revolution counts and event times of one CSC channel, in arrival order per bike.
+
+        Returns (rows, revolutions) added, the rows with a new event and
+        their revolutions per second over the last one.
+        """
+        c = self._columns
+        index = np.concatenate([p[0] for p in parts])
+        revs = np.concatenate([p[1] for p in parts]).astype(np.int64)
+        times = np.concatenate([p[2] for p in parts]).astype(np.int64)
+        order = np.lexsort((index, rows[index]))
+        index, revs, times = index[order], revs[order], times[order]
+        bikes, arrived = rows[index], sent[index]
+        first, last = _groups(bikes)
+        previous_revs = _previous(revs, first, bikes, c[name + "_revs"])
+        previous_times = _previous(times, first, bikes, c[name + "_time"])
+        known = previous_revs >= 0
+        added = np.where(known, (revs - previous_revs) & revs_mask, 0)
+        ticks = (times - previous_times) & 0xFFFF
+        event = known & (ticks > 0)
+        c[name + "_revs"][bikes[last]] = revs[last]
+        c[name + "_time"][bikes[last]] = times[last]
+
+        # The rate over the last event of each bike in the batch
+        events = np.flatnonzero(event)
+        _, last_event = _groups(bikes[events])
+        newest = events[last_event]
+        moved = bikes[newest]
+        c[name + "_event_s"][moved] = arrived[newest]
+        return (bikes, added), moved, added[newest] * _EVENT_TIME_HZ / ticks[newest]
+
+    def _record_latency(self, latencies):
+        latencies = latencies[-LATENCY_WINDOW:]
+        at = self._latency_n % LATENCY_WINDOW
+        first = min(len(latencies), LATENCY_WINDOW - at)
+        self._latency[at:at + first] = latencies[:first]
+        self._latency[:len(latencies) - first] = latencies[first:]
+        self._latency_n += len(latencies)
+
+    def latency_ms(self, percentiles=(50, 99, 100)):
+        """Percentiles of sent-to-processed latency over the last LATENCY_WINDOW notifications."""
+        window = self._latency[:min(self._latency_n, LATENCY_WINDOW)]
+        if not len(window):
+            return [0.0] * len(percentiles)
+        return list(np.percentile(window, percentiles) * 1000)
+
+    def metrics(self, now=None):
+        """Every bike's current values, as columns; stale ones read 0."""
+        now = self.clock() if now is None else now
+        n = len(self.bike_ids)
+        c = {name: column[:n] for name, column in self._columns.items()}
+        since = now - c["power_s"]
+        live = since < STALE_S
+        # The last value has held since it arrived
+        hold = np.exp(-np.clip(since, 0, None) / POWER_TAU_S)
+        return {
+            "power": np.where(live, c["power"], 0),
+            "power_avg": np.where(live, c["power_avg"] * hold + c["power"] * (1 - hold), 0.0),
+            "cadence": np.where(now - c["crank_event_s"] < STALE_S, c["cadence"], 0.0),
+            "speed_kph": np.where(now - c["wheel_event_s"] < STALE_S, c["speed_kph"], 0.0),
+            "energy_kj": (c["energy_j"] + np.where(live, c["power"] * np.clip(since, 0, None), 0)) / 1000,
+            "distance_km": c["distance_m"] / 1000,
+        }
+
+    def snapshot(self, now=None):
+        """Every bike's current values, one dict per bike."""
+        now = self.clock() if now is None else now
+        m = self.metrics(now)
+        seen = now - self.column("last_seen_s")
+        notifications = self.column("notifications")
+        return [{"bike": str(bike), "power": int(m["power"][i]), "power_avg": round(float(m["power_avg"][i]), 1),
+                 "cadence": round(float(m["cadence"][i]), 1), "speed_kph": round(float(m["speed_kph"][i]), 1),
+                 "energy_kj": round(float(m["energy_kj"][i]), 2), "distance_km": round(float(m["distance_km"][i]), 3),
+                 "notifications": int(notifications[i]), "seen_s_ago": round(float(seen[i]), 1)}
+                for i, bike in enumerate(self.bike_ids)]
+
+    def leaderboard(self, by="energy_kj", top=10, now=None):
+        """The top bikes by one of METRICS, as snapshot() dicts with a rank."""
+        if by not in METRICS:
+            raise ValueError("unknown metric {!r}, one of {}".format(by, ", ".join(METRICS)))
+        now = self.clock() if now is None else now
+        values = self.metrics(now)[by]
+        snapshot = self.snapshot(now)
+        ranked = np.argsort(-values, kind="stable")[:top]
+        return [dict(snapshot[i], rank=rank) for rank, i in enumerate(ranked, start=1)]
+
+    async def run(self):
+        """Processes the queue every batch_interval_s, or as soon as batch_max are waiting."""
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.batch_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self.process_pending()
+
+
+def _uuid(characteristic):
+    """The 128-bit UUID string of a 16-bit SIG characteristic, as bleak takes it."""
+    return "0000{:04x}-0000-1000-8000-00805f9b34fb".format(characteristic)
+
+
+class Transport(abc.ABC):
+    """A source of notifications: run() calls gateway.ingest() for each, until the source ends."""
+    @abc.abstractmethod
+    async def run(self, gateway):
+        """Feeds every notification to gateway.ingest(); returns when the source ends."""
+
+
+class BleakTransport(Transport):
+    """Connects to every sensor found by name, or at the given addresses, and reconnects when one drops."""
+    def __init__(self, name=None, addresses=(), scan_s=10.0, reconnect_s=5.0):
+        self.name = name
+        self.addresses = list(addresses)
+        self.scan_s = scan_s
+        self.reconnect_s = reconnect_s
+
+    async def run(self, gateway):
+        from bleak import BleakScanner
+        addresses = self.addresses
+        if not addresses:
+            devices = await BleakScanner.discover(timeout=self.scan_s)
+            addresses = [d.address for d in devices if d.name == self.name]
+            print("Found {} sensors named '{}'".format(len(addresses), self.name), file=sys.stderr)
+        await asyncio.gather(*(self._bike(gateway, address) for address in addresses))
+
+    async def _bike(self, gateway, address):
+        from bleak import BleakClient
+        from bleak.exc import BleakError
+        missing = set()  # Characteristics this sensor lacks, reported once
+        while True:
+            dropped = asyncio.Event()
+            try:
+                async with BleakClient(address, disconnected_callback=lambda _: dropped.set()) as client:
+                    # Indoor Bike Data repeats what CPS and CSC send; read it only from a sensor without them
+                    if client.services.get_characteristic(_uuid(CPS_MEASUREMENT)) is not None:
+                        wanted = (CPS_MEASUREMENT, CSC_MEASUREMENT)
+                    else:
+                        wanted = (INDOOR_BIKE_DATA,)
+                    for characteristic in wanted:
+                        uuid = _uuid(characteristic)
+                        if client.services.get_characteristic(uuid) is None:
+                            if characteristic not in missing:
+                                missing.add(characteristic)
+                                print("{}: no 0x{:04X} characteristic, skipped".format(address, characteristic),
+                                      file=sys.stderr)
+                            continue
+                        await client.start_notify(uuid, lambda _, data, characteristic=characteristic:
+                                                  gateway.ingest(address, characteristic, bytes(data)))
+                    await dropped.wait()
+            except (BleakError, OSError, asyncio.TimeoutError) as e:
+                print("{}: {}".format(address, e), file=sys.stderr)
+            await asyncio.sleep(self.reconnect_s)
+
+
+async def serve_http(gateway, port, host="0.0.0.0"):
+    """Serves GET /snapshot and /leaderboard?by=..&top=.. as JSON."""
+    async def handle(reader, writer):
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()).strip():
+                pass
+            url = urlsplit(request[1] if len(request) > 1 else "/")
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            status = "200 OK"
+            try:
+                if url.path == "/snapshot":
+                    body = gateway.snapshot()
+                elif url.path == "/leaderboard":
+                    body = gateway.leaderboard(query.get("by", "energy_kj"), int(query.get("top", 10)))
+                else:
+                    status, body = "404 Not Found", {"error": "unknown path"}
+            except ValueError as e:
+                status, body = "400 Bad Request", {"error": str(e)}
+            data = json.dumps(body).encode()
+            writer.write("HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+                         "Connection: close\r\n\r\n".format(status, len(data)).encode() + data)
+            await writer.drain()
+        finally:
+            writer.close()
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def format_leaderboard(rows):
+    lines = ["{:>4} {:<20} {:>6} {:>7} {:>7} {:>7} {:>8} {:>8}".format(
+        "rank", "bike", "power", "avg", "cadence", "km/h", "kJ", "km")]
+    for r in rows:
+        lines.append("{:>4} {:<20} {:>4} W {:>5.0f} W {:>7.1f} {:>7.1f} {:>8.1f} {:>8.2f}".format(
+            r["rank"], r["bike"][-20:], r["power"], r["power_avg"], r["cadence"], r["speed_kph"],
+            r["energy_kj"], r["distance_km"]))
+    return lines
+
+
+async def _main(args, gateway, transport):
+    tasks = [asyncio.create_task(gateway.run())]
+    if args.http:
+        tasks.append(asyncio.create_task(serve_http(gateway, args.http)))
+    source = asyncio.create_task(transport.run(gateway))
+    deadline = time.perf_counter() + args.seconds if args.seconds else math.inf
+    try:
+        while not source.done() and time.perf_counter() < deadline:
+            await asyncio.sleep(min(args.every or 1.0, max(deadline - time.perf_counter(), 0)))
+            if args.every:
+                print("\n".join(format_leaderboard(gateway.leaderboard(args.by, args.top))))
+                p50, p99, _ = gateway.latency_ms()
+                print("{} bikes, {} notifications, latency p50 {:.1f} ms, p99 {:.1f} ms\n".format(
+                    len(gateway.bike_ids), gateway.processed, p50, p99))
+        if source.done():
+            source.result()
+    finally:
+        for task in tasks + [source]:
+            task.cancel()
+    gateway.process_pending()
+    print("\n".join(format_leaderboard(gateway.leaderboard(args.by, args.top))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=OPERATION_CONFIG, help="config.py with DEVICE_NAME and the wheel size")
+    parser.add_argument("--name", help="advertised name to connect to (default: DEVICE_NAME)")
+    parser.add_argument("--address", action="append", default=[], help="connect to this sensor; repeatable")
+    parser.add_argument("--simulate", type=int, metavar="BIKES", help="replay simulated rides instead of BLE")
+    parser.add_argument("--speed", type=float, default=1.0, help="with --simulate, replay this much faster (energy and rates follow the host clock)")
+    parser.add_argument("--seconds", type=float, help="stop after this long (default: until Ctrl+C)")
+    parser.add_argument("--http", type=int, metavar="PORT", help="serve /snapshot and /leaderboard on this port")
+    parser.add_argument("--every", type=float, help="print the leaderboard this many seconds apart")
+    parser.add_argument("--by", default="energy_kj", choices=METRICS, help="leaderboard order")
+    parser.add_argument("--top", type=int, default=10, help="leaderboard length")
+    args = parser.parse_args()
+
+    try:
+        settings = load_config(args.config)
+    except OSError as e:
+        sys.exit("error: {}".format(e))
+    gateway = FleetGateway(settings["WHEEL_CIRCUMFERENCE_MM"])
+    if args.simulate:
+        from simulator.fleet import SimulatedTransport
+        transport = SimulatedTransport(args.simulate, speed=args.speed)
+    else:
+        try:
+            import bleak  # noqa: F401
+        except ImportError:
+            sys.exit("error: BLE needs bleak (pip install bleak); or try --simulate")
+        transport = BleakTransport(args.name or settings["DEVICE_NAME"], args.address)
+    try:
+        asyncio.run(_main(args, gateway, transport))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""Reprocesses recorded rides with the operation/ model on whole arrays.
+
+Usage (from the repository root):
+    python -m host.ride_analytics RIDE [RIDE ...] [--config revised.py] [--weight 85]
+                                  [--recorded-config old.py] [--jobs 4] [-o summary.csv] [--samples-dir DIR]
+
+Each RIDE is a ride file or a directory of one ride's files (read in name
+order). The rides are re-run with the model of --config (default
+operation/config.py), optionally with SYSTEM_WEIGHT_KG replaced by
+--weight: k from the revised LEVEL_VOLTAGE_SORTED / LEVEL_K_SORTED table,
+then power and flat-road speed from the recorded cadence. The
+potentiometer position is not recorded, so each sample's is recovered
+from its recorded k through the config it was recorded with
+(--recorded-config, default operation/config.py): an ADC code, or a
+resistance level if that config has LEVEL_TRACKING on. Either config may
+track levels; the revised one then snaps the position to its nearest level.
+
+Files are memory-mapped and processed CHUNK records at a time, so memory
+does not grow with ride length; rides run in parallel, one per process.
+One summary line per ride is printed (or written as CSV with -o), with
+the recorded and reprocessed energy; --samples-dir also writes every
+reprocessed sample. Needs NumPy (pip install numpy).
+
+The vectorised functions mirror interpolate_k/build_k_table, get_power,
+get_flat_speed and CadenceSensor's smoothing step for step, so a sample
+gives the value the Pico would have computed; simulator.bench_analytics
+checks them against the on-device functions.
+"""
+import argparse
+import csv
+import glob
+import math
+import os
+import runpy
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from host.ride_decoder import HEADER_FORMAT, HEADER_SIZE, MAGIC, RECORD_SIZE, TICKS_PERIOD_MS, VERSION, RideFileError
+
+OPERATION_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "operation", "config.py")
+CHUNK_RECORDS = 1 << 16
+SUMMARY_COLUMNS = ("ride", "samples", "duration_s", "unmatched_k", "avg_cadence_rpm", "recorded_kj", "kj",
+                   "avg_power_w", "max_power_w", "distance_km", "avg_speed_kph")
+SAMPLE_COLUMNS = ("time_s", "cadence_rpm", "k_constant", "power_w", "speed_kph")
+
+# Must match operation/recorder.py
+RECORD_DTYPE = np.dtype([("ticks_ms", "<u4"), ("cadence_x10", "<u2"), ("k_x1e6", "<u2"), ("power", "<i2"),
+                         ("speed_x10", "<u2"), ("crank_revs", "<u2"), ("crank_event_time", "<u2")])
+
+# Must match operation/get_k_constant.py
+_ADC_SHIFT = 4
+_ADC_CODES = 4096
+
+# Must match operation/get_speed.py
+_G = 9.81
+_RHO = 1.225
+_CRR = 0.0032
+_CDA = 0.40
+_EFF = 0.975
+_MS_TO_KPH = 3.6
+
+# Must match operation/get_cadence.py: new = 0.8 * new + 0.2 * current
+_SMOOTHING_NEW = 0.8
+_SMOOTHING_OLD = 0.2
+# 0.2^32 is below double precision relative to any cadence, so older samples don't count
+_SMOOTHING_TAPS = 32
+
+
+def load_config(path):
+    """The settings of a config.py, as a dict."""
+    return runpy.run_path(path)
+
+
+class Model:
+    """The device's cadence -> k -> power -> speed model for one config, on NumPy arrays."""
+    def __init__(self, settings, weight_kg=None):
+        self.voltages = np.asarray(settings["LEVEL_VOLTAGE_SORTED"], dtype=float)
+        self.ks = np.asarray(settings["LEVEL_K_SORTED"], dtype=float)
+        if len(self.voltages) != len(self.ks) or len(self.voltages) < 2:
+            raise ValueError("LEVEL_VOLTAGE_SORTED and LEVEL_K_SORTED need the same length, at least 2")
+        self.g_ratio = settings["G_RATIO"]
+        self.weight_kg = settings["SYSTEM_WEIGHT_KG"] if weight_kg is None else weight_kg
+        self.max_adc_value = settings["MAX_ADC_VALUE"]
+        self.reference_voltage = settings["PICO_REFERENCE_VOLTAGE"]
+        self.speed_table_watts = settings["SPEED_TABLE_MAX_WATTS"] + 1 if settings["SPEED_SOLVER"] == "table" else 0
+        # Configs from before operation/level_tracker.py have no LEVEL_TRACKING
+        self.level_tracking = settings.get("LEVEL_TRACKING", False)
+        # LevelTracker's k per level, stored as float32
+        self.level_k = self.ks.astype(np.float32)
+
+        aero = 0.5 * _CDA * _RHO
+        self._p_third = _G * self.weight_kg * _CRR / aero / 3
+        self._p_third_cubed = self._p_third ** 3
+        self._half_q_per_watt = _EFF / aero / 2
+        self.k_table = self.build_k_table()
+        self._speed_by_watt = np.zeros(0)
+
+    def code_voltages(self, codes):
+        """The voltage each 12-bit ADC code stands for."""
+        codes = np.asarray(codes, dtype=np.int64)
+        raw_adc_value = (codes << _ADC_SHIFT) | (codes >> 8)
+        return (raw_adc_value / self.max_adc_value) * self.reference_voltage
+
+    def interpolate_k(self, voltages):
+        """interpolate_k(): the same interval choice and arithmetic, so the same floats."""
+        v = np.asarray(voltages, dtype=float)
+        xs, ys = self.voltages, self.ks
+        # interpolate_k takes the first interval with x1 <= v <= x2
+        i = np.clip(np.searchsorted(xs, v, side="left") - 1, 0, len(xs) - 2)
+        x1, y1, x2, y2 = xs[i], ys[i], xs[i + 1], ys[i + 1]
+        k = y1 + ((v - x1) * (y2 - y1) / (x2 - x1))
+        return np.where(v <= xs[0], ys[0], np.where(v >= xs[-1], ys[-1], k))
+
+    def build_k_table(self):
+        """KConstant's table: k per ADC code, stored as float32."""
+        return self.interpolate_k(self.code_voltages(np.arange(_ADC_CODES))).astype(np.float32)
+
+    def codes_from_k(self, k_x1e6):
+        """ADC codes whose k records as k_x1e6, and how many samples had no exact match.
+
+        Where several codes give the same k (the flat ends of the table), the
+        middle one is taken.
+        """
+        keys = (self.k_table.astype(float) * 1000000).astype(np.int64)
+        k_x1e6 = np.asarray(k_x1e6, dtype=np.int64)
+        low = np.searchsorted(keys, k_x1e6, side="left")
+        high = np.searchsorted(keys, k_x1e6, side="right")
+        codes = np.clip((low + high - 1) // 2, 0, _ADC_CODES - 1)
+        return codes, int(np.count_nonzero(low == high))
+
+    def voltages_from_k(self, k_x1e6):
+        """Potentiometer voltages that record as k_x1e6 with this config, and how many had no exact match.
+
+        With LEVEL_TRACKING that is the voltage of the level whose k it is,
+        otherwise the voltage of the ADC code (see codes_from_k).
+        """
+        if not self.level_tracking:
+            codes, unmatched = self.codes_from_k(k_x1e6)
+            return self.code_voltages(codes), unmatched
+        keys = (self.level_k.astype(float) * 1000000).astype(np.int64)
+        k_x1e6 = np.asarray(k_x1e6, dtype=np.int64)
+        levels = np.clip(np.searchsorted(keys, k_x1e6, side="left"), 0, len(keys) - 1)
+        return self.voltages[levels], int(np.count_nonzero(keys[levels] != k_x1e6))
+
+    def k_at(self, voltages):
+        """k the device computes at the given potentiometer voltages, as float32.
+
+        With LEVEL_TRACKING, the nearest level's; LevelTracker's hysteresis
+        only matters between samples, which a steady voltage doesn't have.
+        """
+        if not self.level_tracking:
+            return self.interpolate_k(voltages).astype(np.float32)
+        midpoints = (self.voltages[:-1] + self.voltages[1:]) / 2
+        return self.level_k[np.searchsorted(midpoints, np.asarray(voltages, dtype=float), side="right")]
+
+    def power(self, cadence, k):
+        """get_power(): whole watts, truncated."""
+        flywheel_speed = self.g_ratio * np.asarray(cadence, dtype=float) * (math.pi / 30)
+        return np.trunc(np.asarray(k, dtype=float) * flywheel_speed ** 2).astype(np.int64)
+
+    def _cardano(self, power_watts):
+        # get_flat_speed_cardano() in scalar math: NumPy's ** can differ from libm's pow() in the last bit
+        half_q = power_watts * self._half_q_per_watt
+        u = (half_q + math.sqrt(half_q * half_q + self._p_third_cubed)) ** (1 / 3)
+        return (u - self._p_third / u) * _MS_TO_KPH
+
+    def flat_speed(self, power_watts):
+        """get_flat_speed() of whole-watt powers, as get_power() returns them."""
+        p = np.maximum(np.asarray(power_watts, dtype=np.int64), 0)
+        top = int(p.max()) if p.size else 0
+        if top >= len(self._speed_by_watt):
+            # One solve per distinct watt, kept for the next chunk
+            speeds = np.array([0.0] + [self._cardano(w) for w in range(1, 2 * top + 1)])
+            table = min(self.speed_table_watts, len(speeds))
+            speeds[:table] = speeds[:table].astype(np.float32)
+            self._speed_by_watt = speeds
+        return self._speed_by_watt[p]
+
+
+def smooth_cadence(new_rpm):
+    """CadenceSensor's smoothing of the per-refresh window cadence.
+
+    new_rpm is 0 where the sensor timed out and NaN where it held its value
+    (no valid period in the window). As on the device, smoothing restarts
+    from the next cadence once the smoothed value is exactly 0: at the start,
+    and after a stop long enough for it to underflow. Agrees with the device
+    to rounding (the sum runs in a different order), not bit for bit.
+    """
+    x = np.asarray(new_rpm, dtype=float)
+    live = ~np.isnan(x)
+    xs = x[live]
+    ys = np.convolve(xs, _SMOOTHING_NEW * _SMOOTHING_OLD ** np.arange(_SMOOTHING_TAPS))[:len(xs)]
+    decay = _SMOOTHING_OLD ** np.arange(1, _SMOOTHING_TAPS + 1)
+
+    def restart(at):
+        # current == 0 takes the new cadence as it is: add the missing 0.2 share
+        end = min(at + _SMOOTHING_TAPS, len(ys))
+        ys[at:end] += xs[at] * decay[:end - at]
+
+    moving = np.flatnonzero(xs)
+    if len(moving):
+        restart(moving[0])
+    for last, following in zip(moving[:-1], moving[1:]):
+        if following - last <= 1:
+            continue
+        current = float(ys[last])
+        for _ in range(following - last - 1):
+            current *= _SMOOTHING_OLD
+            if not current:
+                restart(following)
+                break
+
+    # A held sample repeats the previous output
+    y = np.zeros(len(x))
+    y[live] = ys
+    last_live = np.maximum.accumulate(np.where(live, np.arange(len(x)), -1))
+    return np.where(last_live >= 0, y[np.maximum(last_live, 0)], 0.0)
+
+
+def ride_files(path):
+    return sorted(glob.glob(os.path.join(path, "*.bin"))) if os.path.isdir(path) else [path]
+
+
+def map_records(path):
+    """The records of one ride file as a read-only structured array, block padding included."""
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise RideFileError("{}: file too short for a header".format(path))
+    magic, version, record_size, _ = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC:
+        raise RideFileError("{}: not a ride file".format(path))
+    if version != VERSION or record_size != RECORD_SIZE:
+        raise RideFileError("{}: unsupported ride file version {} (record size {})".format(path, version, record_size))
+    # A truncated final record (power lost mid-write) is ignored
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_SIZE
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+def chunks(paths, chunk_records=CHUNK_RECORDS):
+    """Yields the ride's samples CHUNK records at a time, padding removed."""
+    for path in paths:
+        records = map_records(path)
+        for start in range(0, len(records), chunk_records):
+            chunk = np.asarray(records[start:start + chunk_records])
+            padding = ~chunk.view(np.uint8).reshape(-1, RECORD_SIZE).any(axis=1)
+            yield chunk[~padding]
+
+
+class _Totals:
+    """Running sums of a ride, kept across chunks."""
+    def __init__(self):
+        self.samples = 0
+        self.elapsed_ms = 0
+        self.last_ticks = None
+        self.unmatched = 0
+        self.cadence_sum = 0.0
+        self.recorded_j = 0.0
+        self.j = 0.0
+        self.power_sum = 0
+        self.max_power = 0
+        self.distance_m = 0.0
+
+    def elapsed(self, ticks_ms):
+        """Milliseconds since the ride's first sample, wraparound undone; dt of each sample."""
+        ticks_ms = ticks_ms.astype(np.int64)
+        previous = np.concatenate(([ticks_ms[0] if self.last_ticks is None else self.last_ticks], ticks_ms[:-1]))
+        dt = (ticks_ms - previous) % TICKS_PERIOD_MS
+        elapsed = self.elapsed_ms + np.cumsum(dt)
+        self.last_ticks = ticks_ms[-1]
+        self.elapsed_ms = int(elapsed[-1])
+        return elapsed, dt
+
+
+def reprocess(paths, settings, recorded_settings, weight_kg=None, samples_path=None, chunk_records=CHUNK_RECORDS):
+    """Re-runs one ride's files through the model of settings; returns its summary as a dict."""
+    model = Model(settings, weight_kg)
+    recorded = Model(recorded_settings)
+    totals = _Totals()
+    out = open(samples_path, "w", newline="") if samples_path else None
+    try:
+        writer = None
+        if out:
+            writer = csv.writer(out)
+            writer.writerow(SAMPLE_COLUMNS)
+        for chunk in chunks(paths, chunk_records):
+            if not len(chunk):
+                continue
+            elapsed, dt = totals.elapsed(chunk["ticks_ms"])
+            cadence = chunk["cadence_x10"] / 10
+            voltages, unmatched = recorded.voltages_from_k(chunk["k_x1e6"])
+            k = model.k_at(voltages)
+            power = model.power(cadence, k)
+            speed = model.flat_speed(power)
+
+            # Each sample covers the time since the previous one
+            totals.samples += len(chunk)
+            totals.unmatched += unmatched
+            totals.cadence_sum += float(cadence.sum())
+            totals.recorded_j += float((chunk["power"] * dt).sum()) / 1000
+            totals.j += float((power * dt).sum()) / 1000
+            totals.power_sum += int(power.sum())
+            totals.max_power = max(totals.max_power, int(power.max()))
+            totals.distance_m += float((speed * dt).sum()) / _MS_TO_KPH / 1000
+            if writer:
+                writer.writerows(zip(np.char.mod("%.3f", elapsed / 1000), np.char.mod("%.1f", cadence),
+                                     np.char.mod("%.6f", k), power, np.char.mod("%.1f", speed)))
+    finally:
+        if out:
+            out.close()
+
+    duration_s = totals.elapsed_ms / 1000
+    n = max(totals.samples, 1)
+    return {
+        "ride": os.path.commonpath(paths) if len(paths) > 1 else paths[0],
+        "samples": totals.samples,
+        "duration_s": round(duration_s, 1),
+        "unmatched_k": totals.unmatched,
+        "avg_cadence_rpm": round(totals.cadence_sum / n, 1),
+        "recorded_kj": round(totals.recorded_j / 1000, 1),
+        "kj": round(totals.j / 1000, 1),
+        "avg_power_w": round(totals.power_sum / n, 1),
+        "max_power_w": totals.max_power,
+        "distance_km": round(totals.distance_m / 1000, 2),
+        "avg_speed_kph": round(totals.distance_m / 1000 / (duration_s / 3600), 1) if duration_s else 0.0,
+    }
+
+
+def _reprocess_job(job):
+    return reprocess(*job)
+
+
+def reprocess_all(rides, settings, recorded_settings, weight_kg=None, samples_dir=None, jobs=None,
+                  chunk_records=CHUNK_RECORDS):
+    """Reprocesses each ride (a list of its files) in its own process; returns the summaries in order."""
+    work = []
+    for i, paths in enumerate(rides):
+        samples_path = None
+        if samples_dir:
+            samples_path = os.path.join(samples_dir, "ride_{:04d}.csv".format(i))
+        work.append((paths, settings, recorded_settings, weight_kg, samples_path, chunk_records))
+    if jobs == 1 or len(work) < 2:
+        return [_reprocess_job(job) for job in work]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(_reprocess_job, work))
+
+
+def _plain(settings):
+    """The settings a worker process needs; modules and functions don't pickle."""
+    return {key: value for key, value in settings.items() if key.isupper()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("rides", nargs="+", help="ride files, or directories holding one ride's files")
+    parser.add_argument("--config", default=OPERATION_CONFIG, help="config.py with the model to apply")
+    parser.add_argument("--recorded-config", default=OPERATION_CONFIG, help="config.py the rides were recorded with")
+    parser.add_argument("--weight", type=float, help="SYSTEM_WEIGHT_KG to use instead of --config's")
+    parser.add_argument("--jobs", type=int, help="rides processed at once (default: one per core)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_RECORDS, help="records processed at a time")
+    parser.add_argument("-o", "--output", help="write the summaries to this CSV file")
+    parser.add_argument("--samples-dir", help="write each ride's reprocessed samples here as ride_NNNN.csv")
+    args = parser.parse_args()
+
+    try:
+        settings = _plain(load_config(args.config))
+        recorded_settings = _plain(load_config(args.recorded_config))
+        if args.samples_dir:
+            os.makedirs(args.samples_dir, exist_ok=True)
+        summaries = reprocess_all([ride_files(path) for path in args.rides], settings, recorded_settings,
+                                  args.weight, args.samples_dir, args.jobs, args.chunk)
+    except (OSError, ValueError, KeyError) as e:
+        sys.exit("error: {}".format(e))
+
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, SUMMARY_COLUMNS)
+            writer.writeheader()
+            writer.writerows(summaries)
+        return
+    print("{:<24} {:>8} {:>9} {:>8} {:>9} {:>9} {:>8} {:>8} {:>8}".format(
+        "ride", "samples", "time", "cadence", "recorded", "energy", "power", "max", "distance"))
+    for s in summaries:
+        print("{:<24} {:>8} {:>7.0f} s {:>8.1f} {:>6.1f} kJ {:>6.1f} kJ {:>6.1f} W {:>6} W {:>5.2f} km".format(
+            s["ride"][-24:], s["samples"], s["duration_s"], s["avg_cadence_rpm"], s["recorded_kj"], s["kj"],
+            s["avg_power_w"], s["max_power_w"], s["distance_km"]))
+        if s["unmatched_k"]:
+            print("  {} samples' k is not in the --recorded-config table".format(s["unmatched_k"]), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
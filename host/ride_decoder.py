@@ -0,0 +1,90 @@
+"""Decodes ride files written by operation/recorder.py into CSV.
+
+Usage (from the repository root):
+    python -m host.ride_decoder ride_0000.bin [ride_0001.bin ...] [-o ride.csv]
+
+Files are read a block at a time, so memory use does not grow with ride
+length. Give the files of one ride in order; rows continue across files.
+Copy them off the Pico with e.g. ``mpremote cp -r :rides .``.
+"""
+import argparse
+import csv
+import struct
+import sys
+
+# Must match operation/recorder.py
+RECORD_FORMAT = "<IHHhHHH"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+HEADER_FORMAT = "<4sBBH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b"PPMR"
+VERSION = 1
+
+TICKS_PERIOD_MS = 1 << 30  # MicroPython ticks_ms wraps here
+COLUMNS = ("time_s", "cadence_rpm", "k_constant", "power_w", "speed_kph", "crank_revs", "crank_event_time")
+
+_PADDING = bytes(RECORD_SIZE)
+_READ_RECORDS = 256
+
+
+class RideFileError(ValueError):
+    pass
+
+
+def read_records(stream):
+    """Yields the raw record tuples of one ride file, skipping block padding."""
+    header = stream.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise RideFileError("file too short for a header")
+    magic, version, record_size, _ = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC:
+        raise RideFileError("not a ride file")
+    if version != VERSION or record_size != RECORD_SIZE:
+        raise RideFileError("unsupported ride file version {} (record size {})".format(version, record_size))
+    while True:
+        chunk = stream.read(RECORD_SIZE * _READ_RECORDS)
+        # A truncated final record (power lost mid-write) is ignored
+        whole = len(chunk) - len(chunk) % RECORD_SIZE
+        for offset in range(0, whole, RECORD_SIZE):
+            if chunk[offset:offset + RECORD_SIZE] != _PADDING:
+                yield struct.unpack_from(RECORD_FORMAT, chunk, offset)
+        if len(chunk) < RECORD_SIZE * _READ_RECORDS:
+            return
+
+
+def decode(paths):
+    """Yields CSV rows for the given files; time_s counts from the first sample."""
+    start_ms = None
+    last_ms = 0
+    elapsed_ms = 0
+    for path in paths:
+        with open(path, "rb") as stream:
+            for ticks, cadence, k, power, speed, crank_revs, crank_time in read_records(stream):
+                if start_ms is None:
+                    start_ms = last_ms = ticks
+                elapsed_ms += (ticks - last_ms) % TICKS_PERIOD_MS
+                last_ms = ticks
+                yield ("{:.3f}".format(elapsed_ms / 1000), "{:.1f}".format(cadence / 10),
+                       "{:.6f}".format(k / 1e6), power, "{:.1f}".format(speed / 10), crank_revs, crank_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+", help="ride files, in recording order")
+    parser.add_argument("-o", "--output", help="CSV file to write (default: stdout)")
+    args = parser.parse_args()
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(COLUMNS)
+        writer.writerows(decode(args.files))
+    except RideFileError as e:
+        sys.exit("error: {}".format(e))
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 import uasyncio
 from machine import Pin
+import config
+
+_BLINK_MS = 500
 
 
 class LEDManager:
@@ -8,12 +11,13 @@ class LEDManager:
         """Initializes the correct LED pin for Pico or Pico W."""
         self.led = Pin("LED", Pin.OUT)
         self.blink_task = None
+        self.blink_ms = _BLINK_MS
 
     async def _blink_runner(self):
         """The internal coroutine that toggles the LED."""
         while True:
             self.led.toggle()
-            await uasyncio.sleep_ms(500)
+            await uasyncio.sleep_ms(self.blink_ms)
 
     def start_blinking(self):
         """Starts the LED blinking task."""
@@ -23,6 +27,10 @@ class LEDManager:
         self.led.off() # Ensure LED is off before starting
         self.blink_task = uasyncio.create_task(self._blink_runner())
 
+    def set_idle(self, idle):
+        """Blinks every IDLE_BLINK_MS while idle (see idle.py), from the next toggle on."""
+        self.blink_ms = config.IDLE_BLINK_MS if idle else _BLINK_MS
+
     def set_stay_on(self):
         """Stops any blinking and sets the LED to be permanently on."""
         if self.blink_task:
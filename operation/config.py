@@ -21,6 +21,19 @@ PICO_REFERENCE_VOLTAGE = 3.3
 
 POTENTIOMETER_PIN = 27
 
+# Resistance level tracking: the potentiometer is read in the background and
+# snapped to the nearest LEVEL_VOLTAGE_SORTED entry, and power uses that
+# level's k from LEVEL_K_SORTED. False interpolates k from every reading.
+LEVEL_TRACKING = True
+LEVEL_SAMPLE_MS = 50
+LEVEL_OVERSAMPLE = 8  # ADC readings averaged per sample
+# A level is left once the reading is this far past the midpoint to the next
+# one, as a fraction of the gap between the two. A level parked more than
+# 0.5 - LEVEL_HYSTERESIS of the gap off its calibrated voltage is not reached.
+LEVEL_HYSTERESIS = 0.2
+# Samples in a row that must agree on a new level before it is taken
+LEVEL_CONFIRM_SAMPLES = 3
+
 ### Configuration for Reed RPM sensor ###
 #########################################
 REED_PIN = 9
@@ -28,3 +41,110 @@ TIMEOUT_MS = 3000
 MAX_RPM = 120
 # Ratio of crank revolution to flywheel revolutions
 G_RATIO = 9
+
+### Virtual speed model settings ###
+####################################
+# How get_flat_speed turns power into speed:
+#   "table"     - lookup by whole watt, built at boot (exact root, ~6 KB RAM)
+#   "cardano"   - exact closed-form cubic root on every call
+#   "iterative" - original 5-step fixed-point solver
+SPEED_SOLVER = "table"
+SPEED_TABLE_MAX_WATTS = 1500
+# Arithmetic of the cadence -> power -> speed model:
+#   "float" - floating point, as above
+#   "fixed" - scaled integers (fixed_point.py) and a speed lookup table
+#             whatever SPEED_SOLVER says; nothing is allocated per refresh.
+#             Power is within 1 W of "float". Not for LOOP_MODE "dual"
+MODEL_ARITHMETIC = "float"
+
+### Main loop settings ###
+##########################
+# "event": wake on every reed pulse and send crank events with the real
+#          pulse times; power and speed refresh on a slower timer
+# "poll":  fixed-rate loop, crank events synthesized from smoothed cadence
+# "dual":  like "event", but the reed IRQ, ADC and model run on the second
+#          core (_thread); core 0 only runs BLE, logging and the LED
+LOOP_MODE = "event"
+POLL_INTERVAL_MS = 100
+REFRESH_INTERVAL_MS = 250
+# How often the second core checks for new reed pulses in "dual" mode
+CORE1_POLL_MS = 2
+
+### Idle power saving settings ###
+##################################
+# With no reed pulse for IDLE_AFTER_MS the sensor goes idle (idle.py): the
+# main loop, the potentiometer sampling, advertising and the LED slow down.
+# The first pulse brings everything back to full rate at once.
+IDLE_SAVING = True
+# At least TIMEOUT_MS, so cadence and power have gone to 0 and been sent first
+IDLE_AFTER_MS = 10000
+# Main-loop period while idle, in every LOOP_MODE; at most 2000
+IDLE_REFRESH_MS = 1000
+IDLE_LEVEL_SAMPLE_MS = 1000
+# 1022.5 ms is on the list of intervals phones are known to scan well
+IDLE_ADV_INTERVAL_US = 1022500
+IDLE_BLINK_MS = 2000
+# Sleep the chip (machine.lightsleep) between idle loops while no central is
+# connected. The reed IRQ has to wake it: check that on the board before
+# turning this on. Not used in LOOP_MODE "dual".
+IDLE_LIGHTSLEEP = False
+
+### BLE notification settings ###
+#################################
+# Centrals connected at once, e.g. a training app and a head unit. Advertising
+# continues while fewer are connected. The firmware's BLE stack may allow
+# fewer; centrals beyond its limit then simply fail to connect.
+BLE_MAX_CONNECTIONS = 3
+# Assumed until the central negotiates a connection interval
+BLE_DEFAULT_CONN_INTERVAL_MS = 50
+# Unchanged measurements are suppressed, but re-sent this often
+NOTIFY_KEEPALIVE_MS = 1000
+# Fitness Machine Service: Indoor Bike Data carries power, cadence, speed and
+# the resistance level (with LEVEL_TRACKING) in one notification
+#   "off"     - Cycling Power and Cycling Speed and Cadence services only
+#   "primary" - FTMS advertised first, CPS and CSC still served next to it
+#   "only"    - FTMS alone: one notification per interval instead of two
+FTMS_PROFILE = "off"
+
+### Logging settings ###
+########################
+# DEBUG, INFO, WARN or ERROR; messages below this level cost nothing
+LOG_LEVEL = "INFO"
+# Hot-path records are kept in a RAM ring and printed in the background
+LOG_RING_RECORDS = 64
+LOG_FLUSH_MS = 1000
+# Minimum time between main-loop status records
+LOG_LOOP_INTERVAL_MS = 1000
+
+### Ride recorder settings ###
+##############################
+RECORD_ENABLED = True
+# Samples are taken on every main-loop refresh and written to flash a block at a time
+RECORD_DIR = "rides"
+RECORD_BLOCK_BYTES = 4096  # One flash erase block, 256 samples
+# 32 blocks per file is about 34 minutes at REFRESH_INTERVAL_MS = 250;
+# the oldest file is deleted once RECORD_MAX_FILES exist
+RECORD_FILE_BLOCKS = 32
+RECORD_MAX_FILES = 4
+
+### Power analytics settings ###
+##################################
+# Rolling 3 s and 30 s average power, normalized power, peak power, energy
+# and time in each power zone, kept on the device (power_analytics.py).
+# Energy goes out in every Cycling Power Measurement, the rest in a
+# read-only characteristic of the custom service (host/device_stats.py).
+POWER_ANALYTICS = True
+FTP_W = 200
+# Upper bounds of zones 1 to 6 in percent of FTP_W; zone 7 is everything above
+POWER_ZONES_PCT = [55, 75, 90, 105, 120, 150]
+# How often the characteristic's value is refreshed
+ANALYTICS_PUBLISH_MS = 2000
+
+### Instrumentation settings ###
+################################
+# Stage timers, loop-period histogram and heap watermarks, readable over BLE
+# from a custom characteristic (decode with host/device_stats.py).
+# When off, each instrumented call costs one test.
+STATS_ENABLED = False
+# How often the characteristic's value is refreshed
+STATS_PUBLISH_MS = 2000
@@ -0,0 +1,112 @@
+import math
+from array import array
+import config
+from get_speed import get_flat_speed_cardano
+
+# Integer version of the cadence -> flywheel speed -> power -> speed chain
+# (config.MODEL_ARITHMETIC = "fixed"). Every intermediate stays a small int
+# (below 2^30), so unlike the float path nothing is allocated on the heap.
+#
+#   cadence      1/64 RPM                     CADENCE_ONE = 1 RPM
+#   coefficient  2^-20 W per RPM^2            k * (G_RATIO * pi / 30)^2, per ADC code
+#   power        W, truncated like get_power.get_power()
+#   speed        1/100 km/h                   SPEED_ONE = 1 km/h
+
+CADENCE_SHIFT = 6
+CADENCE_ONE = 1 << CADENCE_SHIFT
+COEFFICIENT_SHIFT = 20
+SPEED_ONE = 100
+
+_US_PER_MINUTE = 60000000
+_SMALL_INT = 1 << 30
+# cadence() shifts what is left of a window of periods; a longer window (16.7 s)
+# would overflow a small int, so get_cadence.py checks its window against this
+MAX_WINDOW_US = _SMALL_INT >> CADENCE_SHIFT
+# power = coefficient * cadence^2 >> 32, split so the products stay small
+_POWER_SHIFT_1 = 12
+_POWER_SHIFT_2 = COEFFICIENT_SHIFT + 2 * CADENCE_SHIFT - _POWER_SHIFT_1
+
+# Flywheel rad/s per crank RPM, squared
+_RAD_S_PER_RPM_SQUARED = (config.G_RATIO * math.pi / 30) ** 2
+# k x 1e6 = coefficient * _K_X1E6_PER_COEFFICIENT >> 14, for the ride recorder
+_K_X1E6_PER_COEFFICIENT = int(1000000 * (1 << 14) / _RAD_S_PER_RPM_SQUARED / (1 << COEFFICIENT_SHIFT) + 0.5)
+_CRANK_MS_X_CADENCE = 60000 * CADENCE_ONE
+# ms per wheel revolution = circumference (mm) * 3.6 / km/h
+_WHEEL_MS_X_SPEED = config.WHEEL_CIRCUMFERENCE_MM * 36 * SPEED_ONE // 10
+
+_speed_table = None
+_speed_table_len = 0
+
+
+def cadence(period_sum, period_n):
+    """Cadence in 1/64 RPM from period_n periods totalling period_sum us, rounded down."""
+    # Whole RPM first, then the remainder, so the numerator is never shifted;
+    # rest << CADENCE_SHIFT stays a small int while period_sum < MAX_WINDOW_US
+    minutes = _US_PER_MINUTE * period_n
+    whole = minutes // period_sum
+    rest = minutes - whole * period_sum
+    return (whole << CADENCE_SHIFT) + (rest << CADENCE_SHIFT) // period_sum
+
+
+def power_coefficient(k_constant):
+    """The fixed-point power coefficient for a k constant."""
+    coefficient = int(k_constant * _RAD_S_PER_RPM_SQUARED * (1 << COEFFICIENT_SHIFT) + 0.5)
+    # The largest cadence the sensor reports must not overflow get_power()
+    max_cadence = (config.MAX_RPM + 1) * CADENCE_ONE
+    if coefficient * max_cadence >= _SMALL_INT or (coefficient * max_cadence >> _POWER_SHIFT_1) * max_cadence >= _SMALL_INT:
+        raise ValueError("k constant {} too large for fixed-point power".format(k_constant))
+    return coefficient
+
+
+def get_power(cadence, coefficient):
+    """Power in whole watts from cadence (1/64 RPM) and a power coefficient."""
+    return ((coefficient * cadence) >> _POWER_SHIFT_1) * cadence >> _POWER_SHIFT_2
+
+
+def k_x1e6(coefficient):
+    """k x 1e6 as an int, as the ride recorder stores it."""
+    return coefficient * _K_X1E6_PER_COEFFICIENT >> 14
+
+
+def _solve_speed(power_watts):
+    # Float, but only off the table: at boot, or beyond SPEED_TABLE_MAX_WATTS
+    return int(get_flat_speed_cardano(power_watts) * SPEED_ONE + 0.5)
+
+
+def build_speed_table(max_watts):
+    """Flat-road speed in 1/100 km/h for every whole watt up to max_watts."""
+    table = array("H")
+    for watts in range(max_watts + 1):
+        table.append(_solve_speed(watts))
+    return table
+
+
+def init_speed_table():
+    """Builds get_flat_speed()'s table (3 KB); like get_speed's, done after advertising starts."""
+    global _speed_table, _speed_table_len
+    if _speed_table is None:
+        _speed_table = build_speed_table(config.SPEED_TABLE_MAX_WATTS)
+        _speed_table_len = len(_speed_table)
+
+
+def get_flat_speed(power_watts):
+    """Flat-road speed in 1/100 km/h; beyond the table it falls back to the float solver."""
+    if power_watts <= 0:
+        return 0
+    if power_watts < _speed_table_len:
+        return _speed_table[power_watts]
+    return _solve_speed(power_watts)
+
+
+def crank_time_per_rev_ms(cadence):
+    """Milliseconds per crank revolution at cadence (1/64 RPM), rounded; 0 when stopped."""
+    if cadence <= 0:
+        return 0
+    return (_CRANK_MS_X_CADENCE + (cadence >> 1)) // cadence
+
+
+def wheel_time_per_rev_ms(speed):
+    """Milliseconds per wheel revolution at speed (1/100 km/h), rounded; 0 when stopped."""
+    if speed <= 0:
+        return 0
+    return (_WHEEL_MS_X_SPEED + (speed >> 1)) // speed
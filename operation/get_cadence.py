@@ -1,71 +1,165 @@
+import machine
 from machine import Pin
+from array import array
 import time
 import config
+import fixed_point
 
 
 _DEBOUNCE_TIME = 50
 _MIN_PULSE_INTERVAL = 100
 _AVG_SAMPLES = 3  # Average last 3 pulses for stability
 
+# Pulses closer together than either limit are bounce, not a new revolution
+_MIN_PULSE_GAP_US = max(_DEBOUNCE_TIME, _MIN_PULSE_INTERVAL) * 1000
+_MIN_PERIOD_US = 60000000 // config.MAX_RPM  # 500ms = 120 RPM max (practical)
+_TIMEOUT_US = config.TIMEOUT_MS * 1000
+
+# A period can be up to a ms over the timeout before reed_callback() starts a new streak
+if config.MODEL_ARITHMETIC == "fixed" and _AVG_SAMPLES * (_TIMEOUT_US + 1000) >= fixed_point.MAX_WINDOW_US:
+    raise ValueError("TIMEOUT_MS too long for fixed-point cadence")
+
+# Timestamp ring; must be a power of two so the write index is a mask
+_RING_SIZE = 8
+_RING_MASK = _RING_SIZE - 1
+
+
 class CadenceSensor:
-    def __init__(self):
-        self.pulse_times = []
-        self.debounce_time = 0
+    def __init__(self, pulse_flag=None):
+        # --- Written only by reed_callback, preallocated so the IRQ never allocates ---
+        self.pulse_times = array("l", [0] * _RING_SIZE)  # ticks_us of accepted pulses
+        self.pulse_count = 0      # Total accepted pulses; pulse_times[(pulse_count - 1) & _RING_MASK] is the latest
+        self.last_pulse_ms = 0    # ticks_ms of the latest, for gaps too long for ticks_diff on ticks_us
+        self.streak = 0           # Pulses since the last timeout
+        self.periods = array("l", [0] * _AVG_SAMPLES)  # Last periods in us, 0 if rejected
+        self.period_slot = 0
+        self.period_sum = 0       # Running sum and count of the valid entries in periods
+        self.period_n = 0
+
+        self.pulse_flag = pulse_flag  # Optional uasyncio.ThreadSafeFlag set on every pulse
+
         self.reed_switch = Pin(config.REED_PIN, Pin.IN, Pin.PULL_UP)
         self.current_rpm = 0.0
+        self.current_cadence = 0  # calculate_cadence_fixed()'s, in 1/64 RPM
+        self.cadence_smoothing = False
         self.last_display_rpm = -1
+        self.window_sum = 0       # Averaging window as of the last calculation
+        self.window_n = 0
 
-        # Set up interrupt
-        self.reed_switch.irq(trigger=Pin.IRQ_FALLING, handler=self.reed_callback)
+        # Set up interrupt; the handler is allocation-free so it can run as a hard IRQ
+        self.reed_switch.irq(trigger=Pin.IRQ_FALLING, handler=self.reed_callback, hard=True)
+
+    def last_pulse_us(self):
+        return self.pulse_times[(self.pulse_count - 1) & _RING_MASK]
 
     def reed_callback(self, pin):
-        current_time = time.ticks_ms()
-        
+        current_time = time.ticks_us()
+        current_ms = time.ticks_ms()
+
+        if self.streak and time.ticks_diff(current_ms, self.last_pulse_ms) > config.TIMEOUT_MS:
+            # A stop the main loop hasn't timed out yet (nobody connected), maybe
+            # longer than ticks_diff can span on ticks_us: this pulse starts a new streak
+            self._reset_window()
+
         # Check debounce and minimum interval
-        if (time.ticks_diff(current_time, self.debounce_time) > _DEBOUNCE_TIME and 
-            (not self.pulse_times or time.ticks_diff(current_time, self.pulse_times[-1]) > _MIN_PULSE_INTERVAL)):
-            
-            # Only register when switch is closed
-            if pin.value() == 0:
-                self.pulse_times.append(current_time)
-                self.debounce_time = current_time
-                
-                # Keep only recent samples
-                if len(self.pulse_times) > _AVG_SAMPLES + 2:  # Keep a few extra for averaging
-                    self.pulse_times.pop(0)
-    
-    def calculate_cadence(self, current_time):
-  
-        # Check for timeout (clear old pulses)
-        if self.pulse_times and time.ticks_diff(current_time, self.pulse_times[-1]) > config.TIMEOUT_MS:
-            self.pulse_times = []
-            new_rpm = 0.0
-        elif len(self.pulse_times) >= 2:
-            # Calculate average of last few pulses
-            recent_times = self.pulse_times[-min(len(self.pulse_times), _AVG_SAMPLES+1):]
-            periods = []
-            
-            for i in range(1, len(recent_times)):
-                period = recent_times[i] - recent_times[i-1]
-                if period >= 1000 * 60/config.MAX_RPM:  # Minimum 500ms = 120 RPM max (practical)
-                    periods.append(period)
-            
-            if periods:
-                avg_period = sum(periods) / len(periods)
-                new_rpm = 60000 / avg_period
+        if self.streak:
+            period = time.ticks_diff(current_time, self.pulse_times[(self.pulse_count - 1) & _RING_MASK])
+            if period <= _MIN_PULSE_GAP_US:
+                return
+
+        # Only register when switch is closed
+        if pin.value() != 0:
+            return
+
+        if self.streak:
+            # Slide the averaging window: drop the oldest period, add this one
+            if period < _MIN_PERIOD_US:
+                period = 0
+            slot = self.period_slot
+            old = self.periods[slot]
+            if old:
+                self.period_sum -= old
+                self.period_n -= 1
+            self.periods[slot] = period
+            if period:
+                self.period_sum += period
+                self.period_n += 1
+            self.period_slot = (slot + 1) % _AVG_SAMPLES
 
+        self.pulse_times[self.pulse_count & _RING_MASK] = current_time
+        self.last_pulse_ms = current_ms
+        self.pulse_count += 1
+        self.streak += 1
+        if self.pulse_flag is not None:
+            self.pulse_flag.set()
+
+    def _reset_window(self):
+        """Forgets the averaging window; call with IRQs disabled."""
+        self.streak = 0
+        self.period_sum = 0
+        self.period_n = 0
+        self.period_slot = 0
+        for i in range(_AVG_SAMPLES):
+            self.periods[i] = 0
+
+    def _take_window(self, current_time_us):
+        """Copies the averaging window to window_sum/window_n, applying the timeout; returns the streak."""
+        # Snapshot the IRQ-owned state so a pulse can't land between the reads
+        irq_state = machine.disable_irq()
+        streak = self.streak
+        self.window_sum = self.period_sum
+        self.window_n = self.period_n
+
+        # Check for timeout (clear old pulses); ticks_ms also catches a stop past ticks_us's half period
+        if streak and (time.ticks_diff(current_time_us, self.last_pulse_us()) > _TIMEOUT_US
+                       or time.ticks_diff(time.ticks_ms(), self.last_pulse_ms) > config.TIMEOUT_MS):
+            self._reset_window()
+            streak = 0
+        machine.enable_irq(irq_state)
+        return streak
+
+    def apply_timeout(self, current_time_us):
+        """The no-pulse timeout alone, for loops that don't calculate while nobody is connected."""
+        if not self._take_window(current_time_us):
+            # Nothing smooths towards zero meanwhile, so start the next connection from zero
+            self.current_rpm = 0.0
+            self.current_cadence = 0
+
+    def calculate_cadence(self, current_time_us):
+        if self._take_window(current_time_us) >= 2:
+            # Average of the last few valid periods
+            if self.window_n:
+                new_rpm = 60000000 * self.window_n / self.window_sum
             else:
                 new_rpm = self.current_rpm
         else:
             new_rpm = 0.0
-        
+
         # Update current RPM with smoothing
         if self.current_rpm == 0:
             self.current_rpm = new_rpm
         else:
             self.current_rpm = 0.8 * new_rpm + 0.2 * self.current_rpm
-        
-        # if (abs(self.current_rpm - self.last_display_rpm) > 0.5 or 
-        #     (self.current_rpm == 0 and self.last_display_rpm != 0)):
+
         self.last_display_rpm = self.current_rpm
-        return self.current_rpm
\ No newline at end of file
+        return self.current_rpm
+
+    def calculate_cadence_fixed(self, current_time_us):
+        """calculate_cadence() in integer 1/64 RPM (see fixed_point.py); allocates nothing."""
+        if self._take_window(current_time_us) >= 2:
+            if self.window_n:
+                new_cadence = fixed_point.cadence(self.window_sum, self.window_n)
+            else:
+                new_cadence = self.current_cadence
+        else:
+            new_cadence = 0
+
+        # Same 0.8 / 0.2 smoothing, rounded. current_rpm is only exactly 0 before
+        # the first revolution; after a stop it decays towards 0 and still
+        # damps the next cadence, so only the first one is taken as it is
+        if not self.cadence_smoothing:
+            self.current_cadence = new_cadence
+            self.cadence_smoothing = new_cadence != 0
+        else:
+            self.current_cadence = (4 * new_cadence + self.current_cadence + 2) // 5
+        return self.current_cadence
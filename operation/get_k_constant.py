@@ -1,40 +1,116 @@
 import machine
-import time
+from array import array
 import config
+import fixed_point
 
 # --- Setup ---
 # Set up the ADC on GPIO pin 27.
 
+# The Pico's ADC is 12-bit; read_u16() stretches each code to 16 bits,
+# so the top 12 bits of a reading index the lookup table directly.
+_ADC_SHIFT = 4
+_ADC_CODES = 4096
+
+
+def interpolate_k(voltage):
+    """
+    Performs linear interpolation to find the k constant for a given voltage.
+    Returns:
+        float: The interpolated k constant value.
+    """
+    voltage_data = config.LEVEL_VOLTAGE_SORTED
+    k_constant_data = config.LEVEL_K_SORTED
+
+    x1 = y1 = x2 = y2 = 0.00
+
+    # Check for values outside the range
+    if voltage <= voltage_data[0]:
+        return k_constant_data[0]
+    if voltage >= voltage_data[-1]:
+        return k_constant_data[-1]
+
+    # Find the correct interval
+    for i in range(len(voltage_data) - 1):
+        if voltage_data[i] <= voltage <= voltage_data[i+1]:
+            x1, y1 = voltage_data[i], k_constant_data[i]
+            x2, y2 = voltage_data[i+1], k_constant_data[i+1]
+            break
+
+    # Perform linear interpolation
+    return y1 + ((voltage - x1) * (y2 - y1) / (x2 - x1))
+
+
+def code_voltage(code):
+    """The voltage a 12-bit ADC code stands for."""
+    # Same bit-replication the ADC driver applies when scaling to 16 bits
+    raw_adc_value = (code << _ADC_SHIFT) | (code >> 8)
+    return (raw_adc_value / config.MAX_ADC_VALUE) * config.PICO_REFERENCE_VOLTAGE
+
+
+def _last_code_at_or_below(voltage):
+    """The highest 12-bit ADC code whose voltage is at most voltage, or 0."""
+    code = min(max(int(voltage / config.PICO_REFERENCE_VOLTAGE * _ADC_CODES), 0), _ADC_CODES - 1)
+    while code > 0 and code_voltage(code) > voltage:
+        code -= 1
+    while code < _ADC_CODES - 1 and code_voltage(code + 1) <= voltage:
+        code += 1
+    return code
+
+
+# The tables only cover the codes between the lowest and highest calibration
+# voltage; interpolate_k() is flat outside them, so other codes clamp to the ends
+_CODE_LOW = _last_code_at_or_below(config.LEVEL_VOLTAGE_SORTED[0])
+_CODE_HIGH = _last_code_at_or_below(config.LEVEL_VOLTAGE_SORTED[-1])
+if code_voltage(_CODE_HIGH) < config.LEVEL_VOLTAGE_SORTED[-1] and _CODE_HIGH < _ADC_CODES - 1:
+    _CODE_HIGH += 1
+_TABLE_LAST = _CODE_HIGH - _CODE_LOW
+
+
+def table_index(code):
+    """The k and power coefficient table entry for a 12-bit ADC code."""
+    return min(max(code - _CODE_LOW, 0), _TABLE_LAST)
+
+
+def build_k_table():
+    """Precomputes interpolate_k() for the calibrated ADC codes (float32; index with table_index())."""
+    table = array("f")
+    for code in range(_CODE_LOW, _CODE_HIGH + 1):
+        table.append(interpolate_k(code_voltage(code)))
+    return table
+
+
+def build_power_coefficient_table():
+    """Precomputes fixed_point.power_coefficient() for the calibrated ADC codes (int32; index with table_index())."""
+    table = array("l")
+    for code in range(_CODE_LOW, _CODE_HIGH + 1):
+        table.append(fixed_point.power_coefficient(interpolate_k(code_voltage(code))))
+    return table
+
 
 class KConstant:
     def __init__(self):
         self.pot = machine.ADC(config.POTENTIOMETER_PIN)
+        # Only the table the configured arithmetic reads is built
+        self.k_table = None
+        self.coefficient_table = None
+        if config.MODEL_ARITHMETIC == "fixed":
+            self.coefficient_table = build_power_coefficient_table()
+        else:
+            self.k_table = build_k_table()
 
     def get_k_constant(self):
         """
-        Performs linear interpolation to find the k constant for a given voltage.
+        Looks up the k constant for the current potentiometer position.
         Returns:
             float: The interpolated k constant value.
         """
-        raw_adc_value = self.pot.read_u16()
-        voltage = (raw_adc_value / config.MAX_ADC_VALUE) * config.PICO_REFERENCE_VOLTAGE
-        voltage_data = config.LEVEL_VOLTAGE_SORTED
-        k_constant_data = config.LEVEL_K_SORTED
-
-        x1 = y1 = x2 = y2 = 0.00
-        
-        # Check for values outside the range
-        if voltage <= voltage_data[0]:
-            return k_constant_data[0]
-        if voltage >= voltage_data[-1]:
-            return k_constant_data[-1]
-
-        # Find the correct interval
-        for i in range(len(voltage_data) - 1):
-            if voltage_data[i] <= voltage <= voltage_data[i+1]:
-                x1, y1 = voltage_data[i], k_constant_data[i]
-                x2, y2 = voltage_data[i+1], k_constant_data[i+1]
-                break
-
-        # Perform linear interpolation
-        return y1 + ((voltage - x1) * (y2 - y1) / (x2 - x1))
\ No newline at end of file
+        # table_index(), inline
+        return self.k_table[min(max((self.pot.read_u16() >> _ADC_SHIFT) - _CODE_LOW, 0), _TABLE_LAST)]
+
+    def get_power_coefficient(self):
+        """
+        Looks up the fixed-point power coefficient for the current potentiometer position.
+        Returns:
+            int: k * (G_RATIO * pi / 30)^2 in 2^-20 units, for fixed_point.get_power().
+        """
+        return self.coefficient_table[min(max((self.pot.read_u16() >> _ADC_SHIFT) - _CODE_LOW, 0), _TABLE_LAST)]
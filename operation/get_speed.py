@@ -1,7 +1,28 @@
 import math
+from array import array
 import config
 
-def get_flat_speed(power_watts):
+# --- Constants and Assumptions ---
+_G = 9.81      # Gravity in m/s^2
+_RHO = 1.225   # Air density in kg/m^3 (at sea level, 15°C)
+_CRR = 0.0032  # Coefficient of Rolling Resistance for 35mm road tires on asphalt
+_CDA = 0.40    # Aerodynamic Drag Area (m^2) for hands on hoods position
+_EFF = 0.975   # Drivetrain efficiency
+
+# --- Hoisted terms of the force balance ---
+_F_ROLLING = _G * config.SYSTEM_WEIGHT_KG * _CRR  # Rolling resistance in N
+_AERO = 0.5 * _CDA * _RHO                         # Drag in N per (m/s)^2
+
+# power * eff = F_rolling * v + aero * v^3 is the depressed cubic
+# v^3 + p*v + q = 0 with p = F_rolling / aero and q = -power * eff / aero.
+_P_THIRD = _F_ROLLING / _AERO / 3
+_P_THIRD_CUBED = _P_THIRD ** 3
+_HALF_Q_PER_WATT = _EFF / _AERO / 2
+_ONE_THIRD = 1 / 3
+_MS_TO_KPH = 3.6
+
+
+def get_flat_speed_iterative(power_watts):
     """
     Calculates cycling speed on a flat road with no wind.
 
@@ -13,16 +34,10 @@ def get_flat_speed(power_watts):
     """
     if power_watts <= 0:
         return 0.0
-    # --- Constants and Assumptions ---
-    g = 9.81      # Gravity in m/s^2
-    rho = 1.225   # Air density in kg/m^3 (at sea level, 15°C)
-    Crr = 0.0032   # Coefficient of Rolling Resistance for 35mm road tires on asphalt
-    CdA = 0.40    # Aerodynamic Drag Area (m^2) for hands on hoods position
-    eff = 0.975   # Drivetrain efficiency
     total_weight_kg = config.SYSTEM_WEIGHT_KG
 
     # --- Calculation ---
-    power_available = power_watts * eff
+    power_available = power_watts * _EFF
 
     # --- Why we have to iterate ---
     # The relationship between power and speed is a "chicken-and-egg" problem.
@@ -30,24 +45,88 @@ def get_flat_speed(power_watts):
     # 2. The speed you can hold depends on the force of air resistance.
     #
     # This creates a cubic equation (ax^3 + bx + c = 0) where 'x' is the speed.
-    # Since there's no simple, direct formula to solve this, we use a numerical
-    # method. This loop is a "guess and check" approach: it starts with a guess
+    # This loop is a "guess and check" approach: it starts with a guess
     # for speed, sees how much power that would require, and then makes a new,
     # smarter guess. After a few loops, the guess becomes extremely accurate.
-    
+
     v = 5.0  # Initial guess for speed in m/s (18 kph)
-    
+
     # Loop 5 times to refine the speed calculation
     for _ in range(5):
-        F_gravity = g * total_weight_kg
-        F_rolling = F_gravity * Crr
-        F_aero = 0.5 * CdA * rho * (v ** 2)
-        
+        F_gravity = _G * total_weight_kg
+        F_rolling = F_gravity * _CRR
+        F_aero = 0.5 * _CDA * _RHO * (v ** 2)
+
         power_required = (F_rolling + F_aero) * v
-        
+
         # Adjust the speed using a simplified numerical solver
         v = v * (power_available / power_required + 2) / 3
 
     # Convert final speed from meters/second to kilometers/hour
     return v * 3.6
-    
\ No newline at end of file
+
+
+def get_flat_speed_cardano(power_watts):
+    """
+    Calculates flat-road speed by solving the cubic force balance exactly.
+
+    Because p > 0 the cubic has a single real root, which Cardano's formula
+    gives as u - p / (3u) with u = cbrt(-q/2 + sqrt(q^2/4 + p^3/27)).
+
+    Args:
+        power_watts (float): The rider's power output in watts.
+
+    Returns:
+        float: The calculated speed in kilometers per hour (kph).
+    """
+    if power_watts <= 0:
+        return 0.0
+    half_q = power_watts * _HALF_Q_PER_WATT
+    u = (half_q + math.sqrt(half_q * half_q + _P_THIRD_CUBED)) ** _ONE_THIRD
+    return (u - _P_THIRD / u) * _MS_TO_KPH
+
+
+def build_speed_table(max_watts):
+    """Precomputes get_flat_speed_cardano() for every whole watt up to max_watts."""
+    table = array("f")
+    for watts in range(max_watts + 1):
+        table.append(get_flat_speed_cardano(watts))
+    return table
+
+
+_SPEED_TABLE = None
+_SPEED_TABLE_LEN = 0  # Stays 0 until init_speed_table(), so lookups fall back to the exact solver
+
+
+def init_speed_table():
+    """Builds the "table" solver's table. Done after boot, not on import, so advertising starts sooner."""
+    global _SPEED_TABLE, _SPEED_TABLE_LEN
+    if config.SPEED_SOLVER == "table" and _SPEED_TABLE is None:
+        _SPEED_TABLE = build_speed_table(config.SPEED_TABLE_MAX_WATTS)
+        _SPEED_TABLE_LEN = len(_SPEED_TABLE)
+
+
+def get_flat_speed_table(power_watts):
+    """
+    Looks up flat-road speed for a whole-watt power (get_power returns int).
+    Powers beyond the table fall back to the exact solver.
+
+    Returns:
+        float: The calculated speed in kilometers per hour (kph).
+    """
+    if power_watts <= 0:
+        return 0.0
+    if power_watts < _SPEED_TABLE_LEN:
+        return _SPEED_TABLE[int(power_watts)]
+    return get_flat_speed_cardano(power_watts)
+
+
+# --- Solver selection (config.SPEED_SOLVER) ---
+if config.SPEED_SOLVER == "table":
+    get_flat_speed = get_flat_speed_table
+elif config.SPEED_SOLVER == "cardano":
+    get_flat_speed = get_flat_speed_cardano
+elif config.SPEED_SOLVER == "iterative":
+    get_flat_speed = get_flat_speed_iterative
+else:
+    raise ValueError("Unknown SPEED_SOLVER: " + config.SPEED_SOLVER)
@@ -0,0 +1,76 @@
+import machine
+import time
+import uasyncio
+import config
+from logger import log
+
+if config.IDLE_AFTER_MS < config.TIMEOUT_MS:
+    raise ValueError("IDLE_AFTER_MS must be at least TIMEOUT_MS")
+
+
+class IdleScheduler:
+    """
+    Slows the sensor down while nobody pedals and brings it back on the first pulse.
+
+    The main loop calls update() once per iteration with the reed pulse
+    count. Once the count has not moved for IDLE_AFTER_MS, well past the
+    cadence timeout, the sensor is idle: the loop sleeps IDLE_REFRESH_MS
+    through sleep(), LevelTracker samples every IDLE_LEVEL_SAMPLE_MS,
+    advertising widens to IDLE_ADV_INTERVAL_US and the LED blinks every
+    IDLE_BLINK_MS. A reed pulse sets wake_flag, which ends the idle sleep at
+    once; the update() that follows sees the new count and restores every
+    rate. With IDLE_LIGHTSLEEP and no central connected, the idle sleep is a
+    machine.lightsleep() instead, which the reed IRQ ends just the same.
+    """
+    def __init__(self, peripheral, led_manager, level_tracker=None):
+        self.peripheral = peripheral
+        self.led_manager = led_manager
+        self.level_tracker = level_tracker
+        self.wake_flag = uasyncio.ThreadSafeFlag()  # Set on every reed pulse
+        self.idle = False
+        self.wakes = 0        # Idle spells a pulse has ended
+        self.slept_ms = 0     # Time spent in lightsleep
+        self._pulse_count = 0
+        self._quiet_ms = 0    # Since the last pulse, counted up to IDLE_AFTER_MS
+        self._last_ms = time.ticks_ms()
+        self._lightsleep = config.IDLE_LIGHTSLEEP and config.LOOP_MODE != "dual"
+
+    def update(self, pulse_count):
+        """Call once per main-loop iteration; returns True while idle."""
+        # Cleared before the count is compared, so any later pulse cuts the next sleep short
+        self.wake_flag.clear()
+        now_ms = time.ticks_ms()
+        if pulse_count != self._pulse_count:
+            self._pulse_count = pulse_count
+            self._quiet_ms = 0
+            if self.idle:
+                self.wakes += 1
+                self._set_idle(False)
+        elif self._quiet_ms < config.IDLE_AFTER_MS:
+            self._quiet_ms += time.ticks_diff(now_ms, self._last_ms)
+            if self._quiet_ms >= config.IDLE_AFTER_MS:
+                self._set_idle(True)
+        self._last_ms = now_ms
+        return self.idle
+
+    async def sleep(self):
+        """Sleeps one idle loop period, or until the next reed pulse."""
+        if self._lightsleep and not self.peripheral.is_connected():
+            start_ms = time.ticks_ms()
+            machine.lightsleep(config.IDLE_REFRESH_MS)
+            self.slept_ms += time.ticks_diff(time.ticks_ms(), start_ms)
+            # Nothing else ran meanwhile: let the tasks that came due (LED, level, log) run before the next loop
+            await uasyncio.sleep_ms(0)
+            return
+        try:
+            await uasyncio.wait_for_ms(self.wake_flag.wait(), config.IDLE_REFRESH_MS)
+        except uasyncio.TimeoutError:
+            pass
+
+    def _set_idle(self, idle):
+        self.idle = idle
+        self.peripheral.set_idle(idle)
+        self.led_manager.set_idle(idle)
+        if self.level_tracker is not None:
+            self.level_tracker.set_idle(idle)
+        log("INFO", "Idle, slowing down" if idle else "Pedalling, back to full rate")
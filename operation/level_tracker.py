@@ -0,0 +1,114 @@
+import machine
+import uasyncio
+from array import array
+import config
+import fixed_point
+
+_OVERSAMPLE = config.LEVEL_OVERSAMPLE
+_CONFIRM = config.LEVEL_CONFIRM_SAMPLES
+
+
+class LevelTracker:
+    """
+    Follows the bike's resistance level from the potentiometer.
+
+    run() takes LEVEL_OVERSAMPLE ADC readings every LEVEL_SAMPLE_MS and snaps
+    their sum to the nearest LEVEL_VOLTAGE_SORTED entry. A level is only
+    left once the reading is LEVEL_HYSTERESIS of the gap past the midpoint
+    to its neighbour, so noise at a midpoint can't flip between two levels,
+    and only for a level LEVEL_CONFIRM_SAMPLES samples in a row agree on,
+    so a single noisy sample can't either.
+
+    k is looked up when the level moves, never in between: get_k_constant()
+    returns the cached value, so this stands in for KConstant in the main
+    loop. Each move sets the changed flag. While the sensor is idle (see
+    idle.py) it samples every IDLE_LEVEL_SAMPLE_MS instead.
+    """
+    def __init__(self):
+        self.pot = machine.ADC(config.POTENTIOMETER_PIN)
+
+        # Thresholds on the sum of _OVERSAMPLE readings between level i and i + 1:
+        # entered from below at _up[i], from above at _down[i], nearest at _mid[i]
+        volts_to_sum = _OVERSAMPLE * config.MAX_ADC_VALUE / config.PICO_REFERENCE_VOLTAGE
+        voltages = config.LEVEL_VOLTAGE_SORTED
+        self._up = array("l")
+        self._down = array("l")
+        self._mid = array("l")
+        for i in range(len(voltages) - 1):
+            low, gap = voltages[i], voltages[i + 1] - voltages[i]
+            self._up.append(int((low + gap * (0.5 + config.LEVEL_HYSTERESIS)) * volts_to_sum))
+            self._down.append(int((low + gap * (0.5 - config.LEVEL_HYSTERESIS)) * volts_to_sum))
+            self._mid.append(int((low + gap * 0.5) * volts_to_sum))
+
+        self.k_by_level = array("f", config.LEVEL_K_SORTED)
+        self.coefficient_by_level = None
+        if config.MODEL_ARITHMETIC == "fixed":
+            self.coefficient_by_level = array("l", [fixed_point.power_coefficient(k) for k in config.LEVEL_K_SORTED])
+
+        self._candidate = -1  # Level the last samples pointed to, if not the current one
+        self._agreeing = 0    # Samples in a row that pointed to it
+        self.changed = uasyncio.ThreadSafeFlag()
+        self.changes = 0      # Level moves since boot, the first reading included
+        self.index = -1       # Into LEVEL_VOLTAGE_SORTED; -1 before the first reading
+        self.level = 0        # 1 to len(LEVEL_VOLTAGE_SORTED), as printed on the bike
+        self.k = 0.0
+        self.coefficient = 0
+        self.sample_ms = config.LEVEL_SAMPLE_MS
+        self.sample()
+
+    def read(self):
+        """Sum of _OVERSAMPLE ADC readings."""
+        total = 0
+        for _ in range(_OVERSAMPLE):
+            total += self.pot.read_u16()
+        return total
+
+    def sample(self):
+        """Takes one oversampled reading; returns True if the level moved."""
+        total = self.read()
+        index = self.index
+        last = len(self._up)
+        if index < 0:
+            # First reading: the nearest level, no hysteresis yet
+            index = 0
+            while index < last and total >= self._mid[index]:
+                index += 1
+        else:
+            while index < last and total >= self._up[index]:
+                index += 1
+            while index > 0 and total < self._down[index - 1]:
+                index -= 1
+            if index == self.index:
+                self._agreeing = 0
+                return False
+            if index != self._candidate:
+                self._candidate = index
+                self._agreeing = 0
+            self._agreeing += 1
+            if self._agreeing < _CONFIRM:
+                return False
+            self._agreeing = 0
+        self.index = index
+        self.level = index + 1
+        self.k = self.k_by_level[index]
+        if self.coefficient_by_level is not None:
+            self.coefficient = self.coefficient_by_level[index]
+        self.changes += 1
+        self.changed.set()
+        return True
+
+    async def run(self):
+        while True:
+            self.sample()
+            await uasyncio.sleep_ms(self.sample_ms)
+
+    def set_idle(self, idle):
+        self.sample_ms = config.IDLE_LEVEL_SAMPLE_MS if idle else config.LEVEL_SAMPLE_MS
+
+    def get_k_constant(self):
+        """k of the current level, as KConstant.get_k_constant() returns it."""
+        return self.k
+
+    def get_power_coefficient(self):
+        """fixed_point power coefficient of the current level, as KConstant.get_power_coefficient() returns it."""
+        return self.coefficient
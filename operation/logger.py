@@ -1,7 +1,100 @@
+import struct
 import time
+from array import array
+import uasyncio
+import config
+
+_LEVELS = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40}
+_THRESHOLD = _LEVELS[config.LOG_LEVEL]
+
+# --- Binary record ring for hot-path log sites ---
+# ticks_ms, site id, three values; formatted only when flushed
+_RECORD_FORMAT = "<IBfff"
+_RECORD_SIZE = struct.calcsize(_RECORD_FORMAT)
+_RING_RECORDS = config.LOG_RING_RECORDS
+_ring = bytearray(_RECORD_SIZE * _RING_RECORDS)
+_head = 0  # Records written
+_tail = 0  # Records flushed
+_overwritten = 0
+
+# --- Registered log sites ---
+DISABLED = -1
+_MAX_SITES = 32
+_site_level = []
+_site_format = []
+_site_interval = array("l", [0] * _MAX_SITES)  # Rate limit, ms between records
+_site_last = array("l", [0] * _MAX_SITES)      # ticks_ms of the last record
+_site_dropped = array("l", [0] * _MAX_SITES)   # Records skipped by the rate limit
+
 
 # --- Logging function ---
 def log(level, message):
     """Simple logger that prints messages with a timestamp."""
+    if _LEVELS[level] < _THRESHOLD:
+        return
     ms_since_boot = time.ticks_ms()
-    print(f"[{ms_since_boot}] [{level}] {message}")
\ No newline at end of file
+    print(f"[{ms_since_boot}] [{level}] {message}")
+
+
+def log_site(level, message_format, min_interval_ms=0):
+    """
+    Registers a hot-path log site and returns its id for log_values().
+
+    message_format takes up to three '{}' fields. A site below the configured
+    LOG_LEVEL gets the id DISABLED, so log_values() returns at its first test.
+    """
+    if _LEVELS[level] < _THRESHOLD:
+        return DISABLED
+    site = len(_site_format)
+    if site == _MAX_SITES:
+        raise ValueError("too many log sites")
+    _site_level.append(level)
+    _site_format.append(message_format)
+    _site_interval[site] = min_interval_ms
+    _site_last[site] = time.ticks_add(time.ticks_ms(), -min_interval_ms)
+    return site
+
+
+def log_values(site, a=0, b=0, c=0):
+    """Queues a record for site; no string is built until flush()."""
+    global _head, _tail, _overwritten
+    if site < 0:
+        return
+    now = time.ticks_ms()
+    if time.ticks_diff(now, _site_last[site]) < _site_interval[site]:
+        _site_dropped[site] += 1
+        return
+    _site_last[site] = now
+    if _head - _tail == _RING_RECORDS:
+        # Ring full: the oldest unflushed record is lost
+        _tail += 1
+        _overwritten += 1
+    struct.pack_into(_RECORD_FORMAT, _ring, (_head % _RING_RECORDS) * _RECORD_SIZE, now, site, a, b, c)
+    _head += 1
+
+
+def flush():
+    """Formats and prints every queued record; returns how many were printed."""
+    global _tail, _overwritten
+    printed = 0
+    while _tail != _head:
+        ms, site, a, b, c = struct.unpack_from(_RECORD_FORMAT, _ring, (_tail % _RING_RECORDS) * _RECORD_SIZE)
+        _tail += 1
+        print("[{}] [{}] {}".format(ms, _site_level[site], _site_format[site].format(a, b, c)))
+        printed += 1
+    if _overwritten:
+        print("[{}] [WARN] {} log records lost to ring overflow".format(time.ticks_ms(), _overwritten))
+        _overwritten = 0
+    return printed
+
+
+def dropped(site):
+    """Records the rate limit has skipped for site."""
+    return _site_dropped[site] if site >= 0 else 0
+
+
+async def flush_task():
+    """Prints queued records in the background, off the hot path."""
+    while True:
+        await uasyncio.sleep_ms(config.LOG_FLUSH_MS)
+        flush()
@@ -0,0 +1,52 @@
+from array import array
+
+# Copies tried before a read gives up and keeps the last snapshot
+_MAX_TRIES = 8
+
+
+class Mailbox:
+    """
+    Latest-value mailbox from one producer core to one consumer, without locks.
+
+    A sequence counter (seqlock) guards a fixed set of int slots: the producer
+    makes it odd while writing and even when done; the reader copies the
+    slots and retries if the counter was odd or changed meanwhile. Both cores
+    only ever store whole 32-bit words, so neither side blocks the other.
+    Slots hold small ints only, fractional values as fixed point: reading an
+    array("f") slot would allocate a float on every read. A reader that
+    overlaps writes _MAX_TRIES times in a row keeps the snapshot it had, so a
+    busy producer can't starve it. Values are overwritten, not queued.
+    """
+    def __init__(self, n_slots):
+        self.seq = array("l", [0])
+        self.slots = array("l", [0] * n_slots)
+        self._copy = array("l", [0] * n_slots)  # Read into first, so a failed read leaves the last snapshot
+        self.retries = 0  # Reads that overlapped a write; consumer side only
+        self.stale = 0    # Reads that gave up after _MAX_TRIES
+
+    # --- Producer ---
+    # The counter stays a small int; 2**30 keeps its parity when it wraps
+    def begin(self):
+        self.seq[0] = (self.seq[0] + 1) & 0x3FFFFFFF
+
+    def end(self):
+        self.seq[0] = (self.seq[0] + 1) & 0x3FFFFFFF
+
+    # --- Consumer ---
+    def read(self, slots):
+        """Copies a consistent snapshot into slots; returns its sequence number, or -1 if slots kept the last one."""
+        src = self.slots
+        copy = self._copy
+        n = len(src)
+        for _ in range(_MAX_TRIES):
+            seq = self.seq[0]
+            if seq & 1 == 0:
+                for i in range(n):
+                    copy[i] = src[i]
+                if self.seq[0] == seq:
+                    for i in range(n):
+                        slots[i] = copy[i]
+                    return seq
+            self.retries += 1
+        self.stale += 1
+        return -1
@@ -1,34 +1,84 @@
 import uasyncio
+import gc
 import time
+from array import array
 import config
 from peripheral import BLEPeripheral
-from get_cadence import CadenceSensor
-from get_k_constant import KConstant
-from get_power import get_power
-from get_speed import get_flat_speed
-from logger import log
-from blink import LEDManager
+import logger
+import stats
+from logger import log, log_site, log_values
+# Everything else is imported by main() once advertising has started, so
+# the Pico compiles it while centrals can already find the sensor
 
-async def main():
-    log("INFO", "Starting BLE Sensor...")
+# CSC event times are 1/1024 s in a uint16, so they wrap every 64 s
+_EVENT_TIME_WRAP_US = 64000000
+
+# --- Model arithmetic (config.MODEL_ARITHMETIC) ---
+if config.MODEL_ARITHMETIC not in ("float", "fixed"):
+    raise ValueError("Unknown MODEL_ARITHMETIC: " + config.MODEL_ARITHMETIC)
+_FIXED = config.MODEL_ARITHMETIC == "fixed"
+if _FIXED and config.LOOP_MODE == "dual":
+    raise ValueError('MODEL_ARITHMETIC "fixed" needs LOOP_MODE "event" or "poll"')
+
+_LOOP_LOG = log_site("INFO", "Cadence: {:.1f} RPM, Power: {:.0f} Watts, Flat Speed: {:.1f} KPH",
+                     config.LOG_LOOP_INTERVAL_MS)
+
+
+class RevolutionAccumulator:
+    """Synthesizes cumulative revolution events from a rate, for revolutions no sensor sees."""
+    def __init__(self):
+        self.revs = 0
+        self.time_ms = 0
+        self.since_last_rev_ms = 0
+
+    def advance(self, elapsed_ms, time_per_rev_ms):
+        """Adds every revolution completed in elapsed_ms; time_per_rev_ms <= 0 means stopped."""
+        if time_per_rev_ms <= 0:
+            # Reset accumulator if stopped
+            self.since_last_rev_ms = 0
+            return
+        # Add the elapsed time to our accumulator
+        self.since_last_rev_ms += elapsed_ms
+
+        # Use a while loop to add all revolutions that occurred during the elapsed time
+        while self.since_last_rev_ms >= time_per_rev_ms:
+            self.revs += 1
+            # Update timestamp to reflect a more accurate event time
+            self.time_ms += time_per_rev_ms
+            self.since_last_rev_ms -= time_per_rev_ms
+
+    def event_time_1024(self):
+        return int((self.time_ms / 1000) * 1024)
+
+
+def wheel_time_per_rev_ms(speed_kph):
+    if speed_kph <= 0:
+        return 0
+    # Corrected formula for time per revolution in milliseconds
+    return (config.WHEEL_CIRCUMFERENCE_MM * 3.6) / speed_kph
+
+
+def _half_rpm_fixed(cadence):
+    """A fixed-point cadence in the 0.5 RPM units of Indoor Bike Data, rounded."""
+    return (cadence + (fixed_point.CADENCE_ONE >> 2)) >> (fixed_point.CADENCE_SHIFT - 1)
+
+
+def _log_and_record_fixed(recorder, cadence, coefficient, power, speed, crank_revs, crank_event_time):
+    """Logs and records a fixed-point refresh without leaving integers; the log shows whole units."""
+    log_values(_LOOP_LOG, (cadence + fixed_point.CADENCE_ONE // 2) >> fixed_point.CADENCE_SHIFT, power,
+               (speed + fixed_point.SPEED_ONE // 2) // fixed_point.SPEED_ONE)
+    if recorder is not None:
+        recorder.append_scaled((cadence * 10) >> fixed_point.CADENCE_SHIFT, fixed_point.k_x1e6(coefficient), power,
+                               speed // (fixed_point.SPEED_ONE // 10), crank_revs, crank_event_time)
+
+
+async def polling_loop(pico_sensor, led_manager, cadence_sensor, k_constant, recorder=None, analytics=None,
+                       idle=None):
+    """Fixed-rate loop: crank events are synthesized from the smoothed cadence."""
     is_blinking = True
-    led_manager = LEDManager()
-    led_manager.start_blinking()
+    crank = RevolutionAccumulator()
+    wheel = RevolutionAccumulator()
 
-    pico_sensor = BLEPeripheral(name=config.DEVICE_NAME)
-    cadence_sensor = CadenceSensor()
-    k_constant = KConstant()
-    
-    # --- Cumulative values sent over BLE ---
-    cumulative_crank_revs = 0
-    cumulative_wheel_revs = 0
-    cumulative_crank_time = 0
-    cumulative_wheel_time = 0
-    
-    # --- Time accumulators for accurate simulation ---
-    time_since_last_crank_rev_ms = 0
-    time_since_last_wheel_rev_ms = 0
-    
     last_processing_time_ms = time.ticks_ms()
 
     while True:
@@ -43,72 +93,419 @@ async def main():
             last_processing_time_ms = current_time_ms
 
             # ---------------------- Cadence Calculation ---------------------------#
-            cadence = cadence_sensor.calculate_cadence(current_time_ms)
-            if cadence > 0:
-                time_per_crank_rev_ms = (60 / cadence) * 1000
-                
-                # Add the elapsed time to our accumulator
-                time_since_last_crank_rev_ms += elapsed_time_ms
-                
-                # Use a while loop to add all revolutions that occurred during the elapsed time
-                while time_since_last_crank_rev_ms >= time_per_crank_rev_ms:
-                    cumulative_crank_revs += 1
-                    # Update timestamp to reflect a more accurate event time
-                    cumulative_crank_time += time_per_crank_rev_ms 
-                    time_since_last_crank_rev_ms -= time_per_crank_rev_ms
+            stats.loop()
+            t = stats.start()
+            if _FIXED:
+                cadence = cadence_sensor.calculate_cadence_fixed(time.ticks_us())
+                t = stats.stop(stats.CADENCE, t)
+                crank.advance(elapsed_time_ms, fixed_point.crank_time_per_rev_ms(cadence))
             else:
-                # Reset accumulator if cadence is zero
-                time_since_last_crank_rev_ms = 0
-            
-            # Send cadence data on every loop to keep the client updated
-            last_crank_event_time_1024 = int((cumulative_crank_time / 1000) * 1024)
-            pico_sensor.send_cadence(cumulative_crank_revs, last_crank_event_time_1024)
+                cadence = cadence_sensor.calculate_cadence(time.ticks_us())
+                t = stats.stop(stats.CADENCE, t)
+                crank.advance(elapsed_time_ms, (60 / cadence) * 1000 if cadence > 0 else 0)
+
+            # Publish cadence data on every loop to keep the client updated
+            pico_sensor.scheduler.publish_crank(crank.revs, crank.event_time_1024())
             #-------------------------------------------------------------------------#
 
-            
+
             # --------------------------- Power Calculation ---------------------------#
-            power = get_power(cadence, k_constant.get_k_constant())
-            pico_sensor.send_power(power)
+            t = stats.start()
+            if _FIXED:
+                k = k_constant.get_power_coefficient()
+                t = stats.stop(stats.K_CONSTANT, t)
+                power = fixed_point.get_power(cadence, k)
+            else:
+                k = k_constant.get_k_constant()
+                t = stats.stop(stats.K_CONSTANT, t)
+                power = get_power(cadence, k)
+            stats.stop(stats.POWER, t)
+            energy_kj = analytics.update(power, elapsed_time_ms) if analytics is not None else 0
+            pico_sensor.scheduler.publish_power(power, energy_kj)
             #-------------------------------------------------------------------------#
 
 
             # ----------------------------- Speed Calculation ------------------------#
-            speed_kph = get_flat_speed(power)
-            if speed_kph > 0:
-                # Corrected formula for time per revolution in milliseconds
-                time_per_wheel_rev_ms = (config.WHEEL_CIRCUMFERENCE_MM * 3.6) / speed_kph
-                
-                # Add the elapsed time to our accumulator
-                time_since_last_wheel_rev_ms += elapsed_time_ms
-
-                # Use a while loop to add all revolutions that occurred
-                while time_since_last_wheel_rev_ms >= time_per_wheel_rev_ms:
-                    cumulative_wheel_revs += 1
-                    # Update timestamp to reflect a more accurate event time
-                    cumulative_wheel_time += time_per_wheel_rev_ms
-                    time_since_last_wheel_rev_ms -= time_per_wheel_rev_ms
+            t = stats.start()
+            if _FIXED:
+                speed_kph = fixed_point.get_flat_speed(power)
+                stats.stop(stats.SPEED, t)
+                wheel.advance(elapsed_time_ms, fixed_point.wheel_time_per_rev_ms(speed_kph))
+                pico_sensor.scheduler.publish_bike(speed_kph, _half_rpm_fixed(cadence))
             else:
-                # Reset accumulator if speed is zero
-                time_since_last_wheel_rev_ms = 0
+                speed_kph = get_flat_speed(power)
+                stats.stop(stats.SPEED, t)
+                wheel.advance(elapsed_time_ms, wheel_time_per_rev_ms(speed_kph))
+                pico_sensor.scheduler.publish_bike(int(speed_kph * 100 + 0.5), int(cadence * 2 + 0.5))
 
-            # Send speed data on every loop
-            last_wheel_event_time_1024 = int((cumulative_wheel_time / 1000) * 1024)
-            pico_sensor.send_speed(cumulative_wheel_revs, last_wheel_event_time_1024)
+            # Publish speed data on every loop; the scheduler merges it with cadence
+            pico_sensor.scheduler.publish_wheel(wheel.revs, wheel.event_time_1024())
+            pico_sensor.scheduler.commit()
             #-------------------------------------------------------------------------#
 
-            log("INFO", f"Generated Cadence: {cadence} RPM, Power: {power} Watts, Flat Speed: {speed_kph} KPH")
+            if _FIXED:
+                _log_and_record_fixed(recorder, cadence, k, power, speed_kph, crank.revs, crank.event_time_1024())
+            else:
+                log_values(_LOOP_LOG, cadence, power, speed_kph)
+                if recorder is not None:
+                    recorder.append(cadence, k, power, speed_kph, crank.revs, crank.event_time_1024())
         else: # Not connected
+            # Keep timing out the cadence window, however long the stop
+            cadence_sensor.apply_timeout(time.ticks_us())
             # --- Handle disconnection state change ---
             if not is_blinking:
                 log("INFO", "Device disconnected, LED blinking.")
+                if recorder is not None:
+                    recorder.end_ride()
                 led_manager.start_blinking()
                 is_blinking = True
-        # Main loop delay
-        await uasyncio.sleep_ms(100)
+        # Main loop delay, longer while nobody pedals
+        if idle is not None and idle.update(cadence_sensor.pulse_count):
+            await idle.sleep()
+        else:
+            await uasyncio.sleep_ms(config.POLL_INTERVAL_MS)
 
-# --- Run the main loop ---
-if __name__ == "__main__":
+
+class CrankEventClock:
+    """Cumulative crank revolutions and last event time taken from the captured reed pulses."""
+    def __init__(self, cadence_sensor):
+        self.cadence_sensor = cadence_sensor
+        self.revs = 0
+        self.event_time_1024 = 0
+        self.last_pulse_us = 0
+        self._event_time_us = 0
+        self._last_update_ms = 0
+
+    def update(self):
+        """Catches up with the reed IRQ; returns True if there was a new pulse."""
+        count = self.cadence_sensor.pulse_count
+        if count == self.revs:
+            return False
+        pulse_us = self.cadence_sensor.last_pulse_us()
+        now_ms = time.ticks_ms()
+        if self.revs:
+            gap_ms = time.ticks_diff(now_ms, self._last_update_ms)
+            if gap_ms > config.TIMEOUT_MS:
+                # After a stop the ticks_us gap may be past what ticks_diff can
+                # tell (about 537 s): count it in ms and restart from this pulse
+                elapsed_us = (gap_ms % (_EVENT_TIME_WRAP_US // 1000)) * 1000
+            else:
+                elapsed_us = time.ticks_diff(pulse_us, self.last_pulse_us)
+            self._event_time_us = (self._event_time_us + elapsed_us) % _EVENT_TIME_WRAP_US
+        self.revs = count
+        self.last_pulse_us = pulse_us
+        self._last_update_ms = now_ms
+        # ms * 1024 / 1000 stays a small int, unlike us * 1024
+        self.event_time_1024 = (self._event_time_us // 1000) * 128 // 125
+        return True
+
+
+async def crank_event_task(pico_sensor, crank, pulse_flag, idle=None):
+    """Sends a crank measurement as soon as the reed IRQ reports a pulse."""
+    while True:
+        await pulse_flag.wait()
+        if idle is not None:
+            # Ends the main loop's idle sleep
+            idle.wake_flag.set()
+        if crank.update():
+            # Refresh the smoothed cadence the power calculation uses
+            if _FIXED:
+                crank.cadence_sensor.calculate_cadence_fixed(crank.last_pulse_us)
+            else:
+                crank.cadence_sensor.calculate_cadence(crank.last_pulse_us)
+            pico_sensor.scheduler.publish_crank(crank.revs, crank.event_time_1024)
+            pico_sensor.scheduler.commit()
+
+
+async def level_change_task(pico_sensor, level_tracker):
+    """Publishes the resistance level whenever LevelTracker reports a move."""
+    while True:
+        await level_tracker.changed.wait()
+        pico_sensor.send_level(level_tracker.level)
+        pico_sensor.scheduler.publish_level(level_tracker.level)
+        pico_sensor.scheduler.commit()
+        log("INFO", f"Resistance level {level_tracker.level}, k {level_tracker.k:.6f}")
+
+
+async def event_driven_loop(pico_sensor, led_manager, cadence_sensor, k_constant, pulse_flag, recorder=None,
+                            analytics=None, idle=None):
+    """Crank events come from the reed IRQ; a slower timer handles timeout, power and speed."""
+    is_blinking = True
+    wheel = RevolutionAccumulator()
+    crank = CrankEventClock(cadence_sensor)
+    uasyncio.create_task(crank_event_task(pico_sensor, crank, pulse_flag, idle))
+
+    last_processing_time_ms = time.ticks_ms()
+
+    while True:
+        if pico_sensor.is_connected():
+            if is_blinking:
+                led_manager.set_stay_on()
+                is_blinking = False
+
+            current_time_ms = time.ticks_ms()
+            elapsed_time_ms = time.ticks_diff(current_time_ms, last_processing_time_ms)
+            last_processing_time_ms = current_time_ms
+
+            # Also applies the no-pulse timeout
+            stats.loop()
+            t = stats.start()
+            if _FIXED:
+                cadence = cadence_sensor.calculate_cadence_fixed(time.ticks_us())
+                t = stats.stop(stats.CADENCE, t)
+                k = k_constant.get_power_coefficient()
+                t = stats.stop(stats.K_CONSTANT, t)
+                power = fixed_point.get_power(cadence, k)
+            else:
+                cadence = cadence_sensor.calculate_cadence(time.ticks_us())
+                t = stats.stop(stats.CADENCE, t)
+                k = k_constant.get_k_constant()
+                t = stats.stop(stats.K_CONSTANT, t)
+                power = get_power(cadence, k)
+            stats.stop(stats.POWER, t)
+            energy_kj = analytics.update(power, elapsed_time_ms) if analytics is not None else 0
+            pico_sensor.scheduler.publish_power(power, energy_kj)
+
+            # The scheduler's keepalive repeats the last crank event while stopped,
+            # which is how apps see cadence fall to zero
+            t = stats.start()
+            if _FIXED:
+                speed_kph = fixed_point.get_flat_speed(power)
+                stats.stop(stats.SPEED, t)
+                wheel.advance(elapsed_time_ms, fixed_point.wheel_time_per_rev_ms(speed_kph))
+                pico_sensor.scheduler.publish_bike(speed_kph, _half_rpm_fixed(cadence))
+            else:
+                speed_kph = get_flat_speed(power)
+                stats.stop(stats.SPEED, t)
+                wheel.advance(elapsed_time_ms, wheel_time_per_rev_ms(speed_kph))
+                pico_sensor.scheduler.publish_bike(int(speed_kph * 100 + 0.5), int(cadence * 2 + 0.5))
+            pico_sensor.scheduler.publish_wheel(wheel.revs, wheel.event_time_1024())
+            pico_sensor.scheduler.commit()
+
+            if _FIXED:
+                _log_and_record_fixed(recorder, cadence, k, power, speed_kph, crank.revs, crank.event_time_1024)
+            else:
+                log_values(_LOOP_LOG, cadence, power, speed_kph)
+                if recorder is not None:
+                    recorder.append(cadence, k, power, speed_kph, crank.revs, crank.event_time_1024)
+        else: # Not connected
+            cadence_sensor.apply_timeout(time.ticks_us())
+            if not is_blinking:
+                log("INFO", "Device disconnected, LED blinking.")
+                if recorder is not None:
+                    recorder.end_ride()
+                led_manager.start_blinking()
+                is_blinking = True
+        if idle is not None and idle.update(cadence_sensor.pulse_count):
+            await idle.sleep()
+        else:
+            await uasyncio.sleep_ms(config.REFRESH_INTERVAL_MS)
+
+
+# --- Dual-core mode: mailbox slots written by core 1 ---
+_M_CRANK_REVS = 0
+_M_CRANK_TIME = 1
+_M_WHEEL_REVS = 2
+_M_WHEEL_TIME = 3
+_M_POWER = 4
+_M_REFRESHES = 5
+_M_CADENCE = 6  # x _M_SCALE
+_M_K = 7        # x 1e6, as recorded
+_M_SPEED = 8    # x _M_SCALE
+_M_SLOTS = 9
+_M_SCALE = 1000
+
+
+def acquisition_core(mailbox, ready_flag, k_constant, idle=None):
+    """Core 1: reed IRQ, ADC and the power/speed model; publishes through mailbox."""
+    # Created here so the reed IRQ is serviced by this core (main() imported CadenceSensor)
+    cadence_sensor = CadenceSensor()
+    crank = CrankEventClock(cadence_sensor)
+    wheel = RevolutionAccumulator()
+    slots = mailbox.slots
+    last_refresh_ms = time.ticks_ms()
+
+    while True:
+        new_pulse = crank.update()
+        now_ms = time.ticks_ms()
+        elapsed_ms = time.ticks_diff(now_ms, last_refresh_ms)
+        # Core 0 decides when the sensor is idle; a pulse is published at once either way
+        refresh_ms = config.IDLE_REFRESH_MS if idle is not None and idle.idle else config.REFRESH_INTERVAL_MS
+        if new_pulse or elapsed_ms >= refresh_ms:
+            t = stats.start()
+            if new_pulse:
+                cadence = cadence_sensor.calculate_cadence(crank.last_pulse_us)
+            else:
+                # Also applies the no-pulse timeout
+                cadence = cadence_sensor.calculate_cadence(time.ticks_us())
+            stats.stop(stats.CADENCE, t)
+            if elapsed_ms >= refresh_ms:
+                last_refresh_ms = now_ms
+                stats.loop()
+                t = stats.start()
+                k = k_constant.get_k_constant()
+                t = stats.stop(stats.K_CONSTANT, t)
+                power = get_power(cadence, k)
+                t = stats.stop(stats.POWER, t)
+                speed_kph = get_flat_speed(power)
+                stats.stop(stats.SPEED, t)
+                wheel.advance(elapsed_ms, wheel_time_per_rev_ms(speed_kph))
+
+                mailbox.begin()
+                slots[_M_WHEEL_REVS] = wheel.revs
+                slots[_M_WHEEL_TIME] = wheel.event_time_1024()
+                slots[_M_POWER] = power
+                slots[_M_REFRESHES] += 1
+                slots[_M_K] = int(k * 1000000)
+                slots[_M_SPEED] = int(speed_kph * _M_SCALE)
+            else:
+                mailbox.begin()
+            slots[_M_CRANK_REVS] = crank.revs
+            slots[_M_CRANK_TIME] = crank.event_time_1024
+            slots[_M_CADENCE] = int(cadence * _M_SCALE)
+            mailbox.end()
+            ready_flag.set()
+        time.sleep_ms(config.CORE1_POLL_MS)
+
+
+async def dual_core_loop(pico_sensor, led_manager, mailbox, ready_flag, recorder=None, analytics=None, idle=None):
+    """Core 0: turns mailbox snapshots from core 1 into BLE notifications."""
+    is_blinking = True
+    slots = array("l", [0] * _M_SLOTS)
+    last_crank_revs = 0
+    last_refresh = 0
+    last_refresh_ms = time.ticks_ms()
+
+    while True:
+        # Set on every crank pulse and every refresh, so also paces the LED checks
+        await ready_flag.wait()
+        # Keeps the last snapshot if core 1 was writing throughout; the next ready_flag brings a new one
+        mailbox.read(slots)
+        if idle is not None:
+            idle.update(slots[_M_CRANK_REVS])
+        if pico_sensor.is_connected():
+            if is_blinking:
+                led_manager.set_stay_on()
+                is_blinking = False
+
+            if slots[_M_CRANK_REVS] != last_crank_revs:
+                last_crank_revs = slots[_M_CRANK_REVS]
+                pico_sensor.scheduler.publish_crank(last_crank_revs, slots[_M_CRANK_TIME])
+            if slots[_M_REFRESHES] != last_refresh:
+                last_refresh = slots[_M_REFRESHES]
+                now_ms = time.ticks_ms()
+                energy_kj = 0
+                if analytics is not None:
+                    energy_kj = analytics.update(slots[_M_POWER], time.ticks_diff(now_ms, last_refresh_ms))
+                last_refresh_ms = now_ms
+                power = slots[_M_POWER]
+                cadence = slots[_M_CADENCE]
+                speed = slots[_M_SPEED]
+                pico_sensor.scheduler.publish_power(power, energy_kj)
+                pico_sensor.scheduler.publish_wheel(slots[_M_WHEEL_REVS], slots[_M_WHEEL_TIME])
+                pico_sensor.scheduler.publish_bike((speed + _M_SCALE // 200) // (_M_SCALE // 100),
+                                                   (cadence * 2 + _M_SCALE // 2) // _M_SCALE)
+                # Whole units, as the fixed-point model logs them, so nothing here leaves integers
+                log_values(_LOOP_LOG, (cadence + _M_SCALE // 2) // _M_SCALE, power,
+                           (speed + _M_SCALE // 2) // _M_SCALE)
+                if recorder is not None:
+                    recorder.append_scaled(cadence // (_M_SCALE // 10), slots[_M_K], power,
+                                           speed // (_M_SCALE // 10), last_crank_revs, slots[_M_CRANK_TIME])
+            pico_sensor.scheduler.commit()
+        else: # Not connected
+            if not is_blinking:
+                log("INFO", "Device disconnected, LED blinking.")
+                led_manager.start_blinking()
+                is_blinking = True
+                if recorder is not None:
+                    recorder.end_ride()
+
+
+async def main():
+    # Bound by the imports below; the loops use them as module globals
+    global fixed_point, get_power, get_flat_speed, CadenceSensor
+    log("INFO", "Starting BLE Sensor...")
+    # Advertise before anything else, so centrals can find the sensor while
+    # the rest (LED, lookup tables, sensors) is still being imported and set up
+    pico_sensor = BLEPeripheral(name=config.DEVICE_NAME)
+    log("INFO", f"Advertising {time.ticks_ms()} ms after boot, {gc.mem_free()} bytes free")
+    uasyncio.create_task(logger.flush_task())
+    uasyncio.create_task(pico_sensor.scheduler.run())
+
+    import fixed_point
+    from get_power import get_power
+    from get_speed import get_flat_speed, init_speed_table
+    from get_cadence import CadenceSensor
+    from blink import LEDManager
+
+    led_manager = LEDManager()
+    led_manager.start_blinking()
+    if config.LEVEL_TRACKING:
+        from level_tracker import LevelTracker
+        # Samples the potentiometer in the background; the loops read its cached k
+        k_constant = LevelTracker()
+        uasyncio.create_task(k_constant.run())
+        uasyncio.create_task(level_change_task(pico_sensor, k_constant))
+    else:
+        from get_k_constant import KConstant
+        k_constant = KConstant()
+    if _FIXED:
+        fixed_point.init_speed_table()
+    else:
+        init_speed_table()
+
+    if stats.ENABLED:
+        stats.set_loop_period(config.POLL_INTERVAL_MS if config.LOOP_MODE == "poll" else config.REFRESH_INTERVAL_MS)
+        uasyncio.create_task(stats.publish_task(pico_sensor))
+
+    recorder = None
+    if config.RECORD_ENABLED:
+        from recorder import RideRecorder
+        recorder = RideRecorder()
+        uasyncio.create_task(recorder.flush_task())
+
+    analytics = None
+    if config.POWER_ANALYTICS:
+        from power_analytics import PowerAnalytics
+        analytics = PowerAnalytics()
+        uasyncio.create_task(analytics.publish_task(pico_sensor))
+
+    idle = None
+    if config.IDLE_SAVING:
+        from idle import IdleScheduler
+        idle = IdleScheduler(pico_sensor, led_manager, k_constant if config.LEVEL_TRACKING else None)
+
+    gc.collect()
+    log("INFO", f"Ready {time.ticks_ms()} ms after boot, {gc.mem_free()} bytes free")
+
+    if config.LOOP_MODE == "dual":
+        import _thread
+        from mailbox import Mailbox
+        mailbox = Mailbox(_M_SLOTS)
+        ready_flag = uasyncio.ThreadSafeFlag()
+        _thread.start_new_thread(acquisition_core, (mailbox, ready_flag, k_constant, idle))
+        await dual_core_loop(pico_sensor, led_manager, mailbox, ready_flag, recorder, analytics, idle)
+    elif config.LOOP_MODE == "event":
+        pulse_flag = uasyncio.ThreadSafeFlag()
+        cadence_sensor = CadenceSensor(pulse_flag)
+        await event_driven_loop(pico_sensor, led_manager, cadence_sensor, k_constant, pulse_flag, recorder, analytics,
+                                idle)
+    elif config.LOOP_MODE == "poll":
+        # The polling loop has no use for a pulse flag; the idle sleep waits on it
+        cadence_sensor = CadenceSensor(idle.wake_flag if idle is not None else None)
+        await polling_loop(pico_sensor, led_manager, cadence_sensor, k_constant, recorder, analytics, idle)
+    else:
+        raise ValueError("Unknown LOOP_MODE: " + config.LOOP_MODE)
+
+
+def start():
+    """Runs the sensor until interrupted; the main.py stub of a compiled build calls this."""
     try:
         uasyncio.run(main())
     except KeyboardInterrupt:
-        print(f"[{time.ticks_ms()}] [INFO] Script stopped by user.")
\ No newline at end of file
+        print(f"[{time.ticks_ms()}] [INFO] Script stopped by user.")
+
+
+# --- Run the main loop ---
+if __name__ == "__main__":
+    start()
@@ -1,19 +1,79 @@
 import struct
+import time
+from array import array
 import bluetooth
+import uasyncio
+import config
+import stats
 from logger import log
 
 # --- BLE Service and Characteristic UUIDs ---
 _CPS_SERVICE_UUID = bluetooth.UUID(0x1818)
 _CPS_MEASUREMENT_CHAR_UUID = bluetooth.UUID(0x2A63)
+_CPS_FEATURE_CHAR_UUID = bluetooth.UUID(0x2A65)
 _CSCS_SERVICE_UUID = bluetooth.UUID(0x1816)
 _CSCS_MEASUREMENT_CHAR_UUID = bluetooth.UUID(0x2A5B)
 _CSCS_FEATURE_CHAR_UUID = bluetooth.UUID(0x2A5C)
+_FTMS_SERVICE_UUID = bluetooth.UUID(0x1826)
+_FTMS_FEATURE_CHAR_UUID = bluetooth.UUID(0x2ACC)
+_INDOOR_BIKE_DATA_CHAR_UUID = bluetooth.UUID(0x2AD2)
+# Custom service: on-device statistics (operation/stats.py), read-only, the
+# resistance level (operation/level_tracker.py), a uint8 from 1, and the ride
+# power analytics (operation/power_analytics.py), read-only
+_STATS_SERVICE_UUID = bluetooth.UUID("7e1a0001-5f3b-4c1e-9d2a-8b6c4f0e2d11")
+_STATS_CHAR_UUID = bluetooth.UUID("7e1a0002-5f3b-4c1e-9d2a-8b6c4f0e2d11")
+_LEVEL_CHAR_UUID = bluetooth.UUID("7e1a0003-5f3b-4c1e-9d2a-8b6c4f0e2d11")
+_ANALYTICS_CHAR_UUID = bluetooth.UUID("7e1a0004-5f3b-4c1e-9d2a-8b6c4f0e2d11")
+
+# --- Notification payload layouts ---
+_POWER_FORMAT = "<Hh"    # Flags, Instantaneous Power
+_POWER_ENERGY_FORMAT = "<HhH" # Flags, Instantaneous Power, Accumulated Energy (kJ)
+_POWER_FLAG_ENERGY = 0x0800 # Accumulated Energy Present
+_CPS_FEATURE_ENERGY = 1 << 3 # Accumulated Energy Supported
+_SPEED_FORMAT = "<BIH"   # Flags, Cumulative Wheel Revs, Last Wheel Event Time
+_CADENCE_FORMAT = "<BHH" # Flags, Cumulative Crank Revs, Last Crank Event Time
+_CSC_FORMAT = "<BIHHH"   # Flags, Wheel Revs, Wheel Event Time, Crank Revs, Crank Event Time
+# Indoor Bike Data: Flags, Instantaneous Speed (0.01 km/h), Instantaneous Cadence (0.5 RPM),
+# Resistance Level (only with LEVEL_TRACKING), Instantaneous Power
+_BIKE_FORMAT = "<HHHhh"
+_BIKE_FORMAT_NO_LEVEL = "<HHHh"
+# Flags: bit 0 (More Data) clear means Instantaneous Speed is present
+_BIKE_FLAG_CADENCE = 0x0004
+_BIKE_FLAG_RESISTANCE_LEVEL = 0x0020
+_BIKE_FLAG_POWER = 0x0040
+# Fitness Machine Features
+_FTMS_FEATURE_CADENCE = 1 << 1
+_FTMS_FEATURE_RESISTANCE_LEVEL = 1 << 7
+_FTMS_FEATURE_POWER = 1 << 14
+# Fitness Machine Type in the advertised service data
+_FTMS_TYPE_INDOOR_BIKE = 1 << 5
+
+if config.FTMS_PROFILE not in ("off", "primary", "only"):
+    raise ValueError("Unknown FTMS_PROFILE: " + config.FTMS_PROFILE)
 
 # --- Advertising Details ---
 _ADV_APPEARANCE_CYCLING_POWER = const(1156)
+_ADV_INTERVAL_US = 100000
 
 # --- BLE Peripheral Class ---
 class BLEPeripheral:
+    """
+    GATT server for up to BLE_MAX_CONNECTIONS centrals at once.
+
+    Each connection has a slot; bit n of a slot mask stands for slot n.
+    Advertising continues while a slot is free. A central enables a
+    characteristic's notifications by writing its CCCD, the handle after the
+    value's; subscribed maps each notifying value handle to the slot mask of
+    the connections that did. The send_* methods encode a measurement once
+    and notify it to every subscribed connection in the mask they are given
+    (all by default), and return the mask of those the stack refused, so a
+    caller can retry just those.
+
+    FTMS_PROFILE decides which services are registered: Cycling Power and
+    Cycling Speed and Cadence, the Fitness Machine Service's Indoor Bike
+    Data ahead of them, or Indoor Bike Data alone. The handles of services
+    that aren't registered are None.
+    """
     def __init__(self, name):
         self.name = name
         self.ble = bluetooth.BLE()
@@ -22,40 +82,176 @@ class BLEPeripheral:
         
         # Define services and characteristics
         power_char = (_CPS_MEASUREMENT_CHAR_UUID, bluetooth.FLAG_NOTIFY,)
-        power_service = (_CPS_SERVICE_UUID, (power_char,),)
+        power_feature_char = (_CPS_FEATURE_CHAR_UUID, bluetooth.FLAG_READ,)
+        power_service = (_CPS_SERVICE_UUID, (power_char, power_feature_char),)
         csc_char = (_CSCS_MEASUREMENT_CHAR_UUID, bluetooth.FLAG_NOTIFY,)
         csc_feature_char = (_CSCS_FEATURE_CHAR_UUID, bluetooth.FLAG_READ,) # Feature is read-only
 
         csc_service = (_CSCS_SERVICE_UUID, (csc_char,csc_feature_char),)
 
+        ftms_feature_char = (_FTMS_FEATURE_CHAR_UUID, bluetooth.FLAG_READ,)
+        bike_char = (_INDOOR_BIKE_DATA_CHAR_UUID, bluetooth.FLAG_NOTIFY,)
+        ftms_service = (_FTMS_SERVICE_UUID, (ftms_feature_char, bike_char),)
+
         # Register services and store handles
-        services = (power_service, csc_service)
-        ((self.power_handle,), (self.csc_handle,self.csc_feature_handle),) = self.ble.gatts_register_services(services)
+        services = ()
+        if config.FTMS_PROFILE != "off":
+            services += (ftms_service,)
+        if config.FTMS_PROFILE != "only":
+            services += (power_service, csc_service)
+        custom_chars = ()
+        if stats.ENABLED:
+            custom_chars += ((_STATS_CHAR_UUID, bluetooth.FLAG_READ,),)
+        if config.LEVEL_TRACKING:
+            custom_chars += ((_LEVEL_CHAR_UUID, bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY,),)
+        if config.POWER_ANALYTICS:
+            custom_chars += ((_ANALYTICS_CHAR_UUID, bluetooth.FLAG_READ,),)
+        if custom_chars:
+            services += ((_STATS_SERVICE_UUID, custom_chars,),)
+        handles = list(self.ble.gatts_register_services(services))
+        self.ftms_feature_handle = self.bike_handle = None
+        if config.FTMS_PROFILE != "off":
+            (self.ftms_feature_handle, self.bike_handle) = handles.pop(0)
+        self.power_handle = self.power_feature_handle = self.csc_handle = self.csc_feature_handle = None
+        if config.FTMS_PROFILE != "only":
+            ((self.power_handle, self.power_feature_handle), (self.csc_handle,self.csc_feature_handle),) = handles[:2]
+            del handles[:2]
+        custom_handles = list(handles[0]) if custom_chars else []
+        self.stats_handle = None
+        if stats.ENABLED:
+            self.stats_handle = custom_handles.pop(0)
+            # Longer than one ATT packet; centrals fetch it with read blob requests
+            self.ble.gatts_set_buffer(self.stats_handle, stats.PAYLOAD_SIZE)
+            self.write_stats(stats.pack())
+        self.level_handle = None
+        if config.LEVEL_TRACKING:
+            self.level_handle = custom_handles.pop(0)
+        self.analytics_handle = None
+        if config.POWER_ANALYTICS:
+            self.analytics_handle = custom_handles.pop(0)
         
+        # Cycling Power Feature: the accumulated energy in the measurement is only
+        # taken from a sensor that declares it here
+        if self.power_feature_handle is not None:
+            self.ble.gatts_write(self.power_feature_handle,
+                                 struct.pack("<I", _CPS_FEATURE_ENERGY if config.POWER_ANALYTICS else 0))
+
         # Set the value of the CSC Feature characteristic
         # Value 0x0003 indicates both Wheel and Crank Revolution Data are supported
-        self.ble.gatts_write(self.csc_feature_handle, struct.pack("<H", 0x0003))
+        if self.csc_feature_handle is not None:
+            self.ble.gatts_write(self.csc_feature_handle, struct.pack("<H", 0x0003))
+
+        # Indoor Bike Data carries the resistance level only when it is tracked
+        self._bike_flags = _BIKE_FLAG_CADENCE | _BIKE_FLAG_POWER
+        features = _FTMS_FEATURE_CADENCE | _FTMS_FEATURE_POWER
+        if config.LEVEL_TRACKING:
+            self._bike_flags |= _BIKE_FLAG_RESISTANCE_LEVEL
+            features |= _FTMS_FEATURE_RESISTANCE_LEVEL
+        if self.ftms_feature_handle is not None:
+            # Fitness Machine Features, then Target Setting Features: none, there is no control point
+            self.ble.gatts_write(self.ftms_feature_handle, struct.pack("<II", features, 0))
         
-        self.conn_handle = None
+        # Preallocated notification payloads, refilled in place on every send
+        # With POWER_ANALYTICS the power measurement also carries the accumulated energy
+        self._power_buf = bytearray(struct.calcsize(_POWER_ENERGY_FORMAT if config.POWER_ANALYTICS
+                                                    else _POWER_FORMAT))
+        self._speed_buf = bytearray(struct.calcsize(_SPEED_FORMAT))
+        self._cadence_buf = bytearray(struct.calcsize(_CADENCE_FORMAT))
+        self._csc_buf = bytearray(struct.calcsize(_CSC_FORMAT))
+        self._level_buf = bytearray(1)
+        self._bike_buf = bytearray(struct.calcsize(_BIKE_FORMAT if config.LEVEL_TRACKING else _BIKE_FORMAT_NO_LEVEL))
+        self._power_data = memoryview(self._power_buf)
+        self._speed_data = memoryview(self._speed_buf)
+        self._cadence_data = memoryview(self._cadence_buf)
+        self._csc_data = memoryview(self._csc_buf)
+        self._bike_data = memoryview(self._bike_buf)
+
+        # --- Connections, by slot ---
+        self.max_connections = config.BLE_MAX_CONNECTIONS
+        self.conn_handles = [None] * self.max_connections
+        self.conn_intervals_ms = array("H", [config.BLE_DEFAULT_CONN_INTERVAL_MS] * self.max_connections)
+        self.connected_mask = 0
+        self.subscribed = {handle: 0 for handle in (self.power_handle, self.csc_handle, self.bike_handle,
+                                                    self.level_handle) if handle is not None}
+        self.connections = 0
+        self.conn_interval_ms = config.BLE_DEFAULT_CONN_INTERVAL_MS  # Shortest of the connections'
+        self.refused = 0  # Notifications the stack refused, see _fan_out()
         self.advertising = False
-        
+        self.adv_interval_us = _ADV_INTERVAL_US  # Widened while idle, see set_idle()
+        self.scheduler = NotificationScheduler(self)
+
         # Start advertising
+        self._adv_payload = self._advertising_payload()
         self._advertise()
 
     def _irq(self, event, data):
         """BLE event handler"""
         if event == 1: # _IRQ_CENTRAL_CONNECT
-            self.conn_handle, _, _ = data
-            log("INFO", f"Connected to central device: handle={self.conn_handle}")
-            self.ble.gap_advertise(0) # Stop advertising on connect
+            conn_handle, _, _ = data
+            # The stack stops advertising when a central connects
             self.advertising = False
+            slot = self._slot(None)
+            if slot < 0:
+                log("WARN", f"No free connection slot, disconnecting handle={conn_handle}")
+                self.ble.gap_disconnect(conn_handle)
+                return
+            self.conn_handles[slot] = conn_handle
+            self.conn_intervals_ms[slot] = config.BLE_DEFAULT_CONN_INTERVAL_MS
+            self.connected_mask |= 1 << slot
+            self.connections += 1
+            self._update_interval()
+            log("INFO", f"Connected to central device: handle={conn_handle}, "
+                        f"{self.connections} of {self.max_connections}")
+            if self.connections < self.max_connections:
+                self._advertise() # Keep advertising while slots remain
         elif event == 2: # _IRQ_CENTRAL_DISCONNECT
-            self.conn_handle = None
-            log("INFO", "Disconnected from central device")
-            self._advertise() # Start advertising again
+            conn_handle, _, _ = data
+            slot = self._slot(conn_handle)
+            if slot < 0:
+                return
+            self.conn_handles[slot] = None
+            self.connected_mask &= ~(1 << slot)
+            for value_handle in self.subscribed:
+                self.subscribed[value_handle] &= ~(1 << slot)
+            self.connections -= 1
+            self._update_interval()
+            log("INFO", f"Disconnected from central device: handle={conn_handle}")
+            if not self.advertising:
+                self._advertise() # Start advertising again
+        elif event == 3: # _IRQ_GATTS_WRITE
+            conn_handle, attr_handle = data
+            slot = self._slot(conn_handle)
+            value_handle = attr_handle - 1
+            if slot >= 0 and value_handle in self.subscribed:
+                cccd = self.ble.gatts_read(attr_handle)
+                if cccd and cccd[0] & 0x01: # Notifications enabled
+                    self.subscribed[value_handle] |= 1 << slot
+                    self.scheduler.reset(slot)
+                else:
+                    self.subscribed[value_handle] &= ~(1 << slot)
+        elif event == 27: # _IRQ_CONNECTION_UPDATE
+            conn_handle, conn_interval, _, _, _ = data
+            slot = self._slot(conn_handle)
+            if slot >= 0:
+                self.conn_intervals_ms[slot] = conn_interval * 5 // 4 # Units of 1.25 ms
+                self._update_interval()
 
-    def _advertise(self):
-        """Constructs and starts the BLE advertising payload."""
+    def _slot(self, conn_handle):
+        """Slot holding conn_handle (None: a free slot), or -1."""
+        for slot in range(self.max_connections):
+            if self.conn_handles[slot] == conn_handle:
+                return slot
+        return -1
+
+    def _update_interval(self):
+        interval = config.BLE_DEFAULT_CONN_INTERVAL_MS
+        if self.connections:
+            interval = min(self.conn_intervals_ms[slot] for slot in range(self.max_connections)
+                           if self.conn_handles[slot] is not None)
+        self.conn_interval_ms = interval
+
+    def _advertising_payload(self):
+        """Constructs the BLE advertising payload."""
         payload = bytearray()
         
         def _add_payload(adv_type, data):
@@ -64,51 +260,437 @@ class BLEPeripheral:
         
         # --- FIX: Use the raw integer UUIDs for advertising ---
         # The struct.pack function needs a number, not a bluetooth.UUID object.
-        _add_payload(0x03, struct.pack("<H", 0x1818)) # Cycling Power Service
-        _add_payload(0x03, struct.pack("<H", 0x1816)) # Cycling Speed and Cadence
-        
-        _add_payload(0x19, struct.pack("<h", _ADV_APPEARANCE_CYCLING_POWER))
+        if config.FTMS_PROFILE == "off":
+            _add_payload(0x03, struct.pack("<H", 0x1818)) # Cycling Power Service
+            _add_payload(0x03, struct.pack("<H", 0x1816)) # Cycling Speed and Cadence
+            _add_payload(0x19, struct.pack("<h", _ADV_APPEARANCE_CYCLING_POWER))
+        else:
+            # One list of 16-bit UUIDs, FTMS first, and the FTMS service data
+            # (Fitness Machine Available, indoor bike) apps look for; the
+            # appearance would take the payload past 31 bytes
+            uuids = struct.pack("<H", 0x1826)
+            if config.FTMS_PROFILE == "primary":
+                uuids += struct.pack("<HH", 0x1818, 0x1816)
+            _add_payload(0x03, uuids)
+            _add_payload(0x16, struct.pack("<HBH", 0x1826, 0x01, _FTMS_TYPE_INDOOR_BIKE))
         _add_payload(0x09, self.name.encode())
+        return payload
 
-        self.ble.gap_advertise(100000, payload)
+    def _advertise(self):
+        """Starts advertising; it stops when a central connects."""
+        self.ble.gap_advertise(self.adv_interval_us, self._adv_payload)
         self.advertising = True
         log("INFO", f"Advertising as '{self.name}'...")
-        
+
+    def set_idle(self, idle):
+        """Advertises every IDLE_ADV_INTERVAL_US while idle (see idle.py), every 100 ms otherwise."""
+        self.adv_interval_us = config.IDLE_ADV_INTERVAL_US if idle else _ADV_INTERVAL_US
+        if self.advertising:
+            # Restarting with the new interval keeps the payload
+            self.ble.gap_advertise(self.adv_interval_us, self._adv_payload)
+
     def is_connected(self):
-        return self.conn_handle is not None
+        return self.connected_mask != 0
 
-    def send_power(self, power_watts):
-        if not self.is_connected(): return
-        flags = 0x00
-        power_data = struct.pack("<Hh", flags, power_watts)
-        self.ble.gatts_notify(self.conn_handle, self.power_handle, power_data)
+    def _fan_out(self, value_handle, data, mask):
+        """Notifies data to the subscribed connections in mask; returns the mask of those the stack refused.
 
-    # def send_csc_data(self, cumulative_crank_revs, last_crank_event_time, cumulative_wheel_revs, last_wheel_event_time):
-    #     if not self.is_connected(): return
-        
-    #     # Flags for both Wheel and Crank Revolution Data
-    #     flags = 0x03
-    #     log("DEBUG", f"Sending CSC data: Flags={flags}, Wheel Revs={cumulative_wheel_revs}, Wheel Time={last_wheel_event_time}, Crank Revs={cumulative_crank_revs}, Crank Time={last_crank_event_time}")
+        When gatts_notify raises OSError for one central, because the stack
+        has no room left for it (on the Pico W, BTstack's outgoing buffers),
+        only that central misses this notification, never the others.
+        """
+        mask &= self.subscribed[value_handle]
+        refused = 0
+        for slot in range(self.max_connections):
+            bit = 1 << slot
+            if mask & bit:
+                try:
+                    self.ble.gatts_notify(self.conn_handles[slot], value_handle, data)
+                except OSError:
+                    refused |= bit
+                    self.refused += 1
+        return refused
 
-    #     # Pack the data according to the BLE CSCS specification
-    #     # <B: Flags, <H: Cumulative Wheel Revs, <H: Last Wheel Event Time, <H: Cumulative Crank Revs, <H: Last Crank Event Time
-    #     csc_data = struct.pack("<BHH", flags, cumulative_wheel_revs, last_wheel_event_time, cumulative_crank_revs, last_crank_event_time)
-        
-    #     self.ble.gatts_notify(self.conn_handle, self.csc_handle, csc_data)
+    def write_stats(self, payload):
+        """Sets the value a central reads from the statistics characteristic."""
+        if self.stats_handle is not None:
+            self.ble.gatts_write(self.stats_handle, payload)
+
+    def write_analytics(self, payload):
+        """Sets the value a central reads from the analytics characteristic."""
+        if self.analytics_handle is not None:
+            self.ble.gatts_write(self.analytics_handle, payload)
+
+    def send_level(self, level):
+        """Sets the resistance level characteristic and notifies it to every subscribed connection."""
+        if self.level_handle is None:
+            return
+        self._level_buf[0] = level
+        self.ble.gatts_write(self.level_handle, self._level_buf)
+        if self.subscribed[self.level_handle]:
+            self._fan_out(self.level_handle, None, self.connected_mask)
+
+    def send_power(self, power_watts, energy_kj=0, mask=-1):
+        mask &= self.subscribed[self.power_handle]
+        if not mask: return 0
+        t = stats.start()
+        if config.POWER_ANALYTICS:
+            struct.pack_into(_POWER_ENERGY_FORMAT, self._power_buf, 0, _POWER_FLAG_ENERGY, power_watts,
+                             energy_kj & 0xFFFF)
+        else:
+            flags = 0x00
+            struct.pack_into(_POWER_FORMAT, self._power_buf, 0, flags, power_watts)
+        refused = self._fan_out(self.power_handle, self._power_data, mask)
+        stats.stop(stats.SEND_POWER, t)
+        return refused
+
+    def send_bike(self, speed, cadence, level, power_watts, mask=-1):
+        """Indoor Bike Data: speed in 0.01 km/h, cadence in 0.5 RPM, level as printed on the bike."""
+        mask &= self.subscribed[self.bike_handle]
+        if not mask: return 0
+        t = stats.start()
+        if config.LEVEL_TRACKING:
+            struct.pack_into(_BIKE_FORMAT, self._bike_buf, 0, self._bike_flags, speed, cadence, level, power_watts)
+        else:
+            struct.pack_into(_BIKE_FORMAT_NO_LEVEL, self._bike_buf, 0, self._bike_flags, speed, cadence, power_watts)
+        refused = self._fan_out(self.bike_handle, self._bike_data, mask)
+        stats.stop(stats.SEND_BIKE, t)
+        return refused
+
+    def send_csc(self, cumulative_wheel_revs, wheel_event_time, cumulative_crank_revs, crank_event_time, mask=-1):
+        mask &= self.subscribed[self.csc_handle]
+        if not mask: return 0
+        t = stats.start()
+
+        flags = 0x03 # Flags for both Wheel and Crank Revolution Data
+
+        struct.pack_into(_CSC_FORMAT, self._csc_buf, 0, flags, cumulative_wheel_revs, wheel_event_time & 0xFFFF,
+                         cumulative_crank_revs & 0xFFFF, crank_event_time & 0xFFFF)
+        refused = self._fan_out(self.csc_handle, self._csc_data, mask)
+        stats.stop(stats.SEND_CSC, t)
+        return refused
 
     ### CSC Flags: https://www.bluetooth.com/wp-content/uploads/Files/Specification/HTML/CSCS_v1.0/out/en/index-en.html#UUID-13a6d96c-b74e-a2ec-8f05-3ab21f119c35
-    def send_speed(self, cumulative_wheel_revs,  cumulative_wheel_time):
-        if not self.is_connected(): return
+    def send_speed(self, cumulative_wheel_revs,  cumulative_wheel_time, mask=-1):
+        mask &= self.subscribed[self.csc_handle]
+        if not mask: return 0
+        t = stats.start()
         
         flags = 0x01 # Flag for Speed data only
 
-        speed_data = struct.pack("<BIH", flags, cumulative_wheel_revs,  cumulative_wheel_time)
-        self.ble.gatts_notify(self.conn_handle, self.csc_handle, speed_data)
+        # Event times are uint16 in 1/1024 s and roll over by design
+        struct.pack_into(_SPEED_FORMAT, self._speed_buf, 0, flags, cumulative_wheel_revs, cumulative_wheel_time & 0xFFFF)
+        refused = self._fan_out(self.csc_handle, self._speed_data, mask)
+        stats.stop(stats.SEND_SPEED, t)
+        return refused
 
-    def send_cadence(self, cumulative_crank_revs, cumulative_crank_time):
-        if not self.is_connected(): return
+    def send_cadence(self, cumulative_crank_revs, cumulative_crank_time, mask=-1):
+        mask &= self.subscribed[self.csc_handle]
+        if not mask: return 0
+        t = stats.start()
         
         flags = 0x02 # Flag for Cadence data only
         
-        cadence_data = struct.pack("<BHH", flags, cumulative_crank_revs, cumulative_crank_time)
-        self.ble.gatts_notify(self.conn_handle, self.csc_handle, cadence_data)
\ No newline at end of file
+        struct.pack_into(_CADENCE_FORMAT, self._cadence_buf, 0, flags, cumulative_crank_revs & 0xFFFF, cumulative_crank_time & 0xFFFF)
+        refused = self._fan_out(self.csc_handle, self._cadence_data, mask)
+        stats.stop(stats.SEND_CADENCE, t)
+        return refused
+
+
+class NotificationScheduler:
+    """
+    Turns published measurements into as few notifications as the links can use.
+
+    Wheel and crank data are merged into one CSC measurement, a value equal to
+    the last one sent is suppressed (but re-sent every NOTIFY_KEEPALIVE_MS so
+    apps can tell the data is still live), and each characteristic is notified
+    at most once per connection interval; anything published in between is
+    merged into the next send.
+
+    With several centrals, values are paced to the shortest connection
+    interval and each connection only gets one per its own interval: a
+    connection that isn't due yet, or whose notification the stack refused,
+    is marked stale and gets the latest value once it is due. A slow central
+    thus gets fewer, newer values, and never holds up the others. Only the
+    connections subscribed to a characteristic get it, and one that
+    subscribes is due at once, with the latest values.
+
+    Indoor Bike Data is a third characteristic, paced and suppressed the same
+    way: power, speed, cadence and resistance level in one notification. Only
+    the characteristics the peripheral registered (FTMS_PROFILE) are sent.
+
+    Producers call publish_*() for each value and commit() once they are done,
+    which sends straight away unless pacing says to wait. Deferred sends are
+    made by run(), which must be running as a uasyncio task; it starts a
+    second one for stale connections, so waiting on a slow central never
+    delays a value for the others.
+    """
+    def __init__(self, peripheral):
+        self.peripheral = peripheral
+        self._wake = uasyncio.ThreadSafeFlag()
+        self._stale_wake = uasyncio.ThreadSafeFlag()
+        self._cycling = peripheral.power_handle is not None
+        self._ftms = peripheral.bike_handle is not None
+
+        # Latest published values
+        self.power = 0
+        self.energy_kj = 0
+        self.wheel_revs = 0
+        self.wheel_time = 0
+        self.crank_revs = 0
+        self.crank_time = 0
+        self.speed = 0    # 0.01 km/h
+        self.cadence = 0  # 0.5 RPM
+        self.level = 0
+        self._power_pending = False
+        self._csc_pending = False
+        self._bike_pending = False
+
+        # What is currently on air
+        self._sent_power = self._sent_energy = None
+        self._sent_wheel_revs = self._sent_wheel_time = None
+        self._sent_crank_revs = self._sent_crank_time = None
+        self._sent_bike_power = self._sent_speed = self._sent_cadence = self._sent_level = None
+        self._power_sent_ms = 0
+        self._csc_sent_ms = 0
+        self._bike_sent_ms = 0
+
+        # Per connection slot: when each characteristic was last notified to it,
+        # and slot masks of the connections still missing the value on air
+        slots = peripheral.max_connections
+        self._slot_power_ms = array("l", [0] * slots)
+        self._slot_csc_ms = array("l", [0] * slots)
+        self._slot_bike_ms = array("l", [0] * slots)
+        self._power_stale = 0
+        self._csc_stale = 0
+        self._bike_stale = 0
+
+        # --- Counters ---
+        self.published = 0  # publish_* calls
+        self.sent = 0       # Values put on air
+        self.suppressed = 0 # Pending values dropped because nothing changed
+        # published - sent - suppressed were merged into a later notification
+        self.skipped = 0    # Values a slow connection never got; a newer one replaced them
+
+    def publish_power(self, power_watts, energy_kj=0):
+        self.power = power_watts
+        self.energy_kj = energy_kj
+        if self._cycling:
+            self._power_pending = True
+            self.published += 1
+        if self._ftms:
+            self._bike_pending = True
+            self.published += 1
+
+    def publish_wheel(self, cumulative_wheel_revs, wheel_event_time):
+        self.wheel_revs = cumulative_wheel_revs
+        self.wheel_time = wheel_event_time
+        if self._cycling:
+            self._csc_pending = True
+            self.published += 1
+
+    def publish_crank(self, cumulative_crank_revs, crank_event_time):
+        self.crank_revs = cumulative_crank_revs
+        self.crank_time = crank_event_time
+        if self._cycling:
+            self._csc_pending = True
+            self.published += 1
+
+    def publish_bike(self, speed, cadence):
+        """Instantaneous speed in 0.01 km/h and cadence in 0.5 RPM, for Indoor Bike Data."""
+        self.speed = speed
+        self.cadence = cadence
+        if self._ftms:
+            self._bike_pending = True
+            self.published += 1
+
+    def publish_level(self, level):
+        self.level = level
+        if self._ftms:
+            self._bike_pending = True
+            self.published += 1
+
+    def _subscribed(self, value_handle):
+        """Slot mask of the connections subscribed to a characteristic; 0 if it isn't registered."""
+        return self.peripheral.subscribed[value_handle] if value_handle is not None else 0
+
+    def _due(self, stale, slot_sent_ms, now_ms):
+        """Slots in the stale mask whose connection interval has passed since their last notification."""
+        intervals = self.peripheral.conn_intervals_ms
+        due = 0
+        for slot in range(len(slot_sent_ms)):
+            bit = 1 << slot
+            if stale & bit and time.ticks_diff(now_ms, slot_sent_ms[slot]) >= intervals[slot]:
+                due |= bit
+        return due
+
+    def _stale_wait_ms(self, now_ms):
+        """How long until the first stale connection is due."""
+        intervals = self.peripheral.conn_intervals_ms
+        power_stale = self._power_stale & self._subscribed(self.peripheral.power_handle)
+        csc_stale = self._csc_stale & self._subscribed(self.peripheral.csc_handle)
+        bike_stale = self._bike_stale & self._subscribed(self.peripheral.bike_handle)
+        wait = 0x3FFFFFFF
+        for slot in range(len(intervals)):
+            bit = 1 << slot
+            if power_stale & bit:
+                wait = min(wait, intervals[slot] - time.ticks_diff(now_ms, self._slot_power_ms[slot]))
+            if csc_stale & bit:
+                wait = min(wait, intervals[slot] - time.ticks_diff(now_ms, self._slot_csc_ms[slot]))
+            if bike_stale & bit:
+                wait = min(wait, intervals[slot] - time.ticks_diff(now_ms, self._slot_bike_ms[slot]))
+        return wait if wait != 0x3FFFFFFF else 0
+
+    def _wait_ms(self, now_ms):
+        """How long until every pending characteristic may be notified again."""
+        interval = self.peripheral.conn_interval_ms
+        wait = 0
+        if self._power_pending:
+            wait = interval - time.ticks_diff(now_ms, self._power_sent_ms)
+        if self._csc_pending:
+            wait = max(wait, interval - time.ticks_diff(now_ms, self._csc_sent_ms))
+        if self._bike_pending:
+            wait = max(wait, interval - time.ticks_diff(now_ms, self._bike_sent_ms))
+        return wait
+
+    def _deliver_power(self, now_ms):
+        stale = self._power_stale & self._subscribed(self.peripheral.power_handle)
+        due = self._due(stale, self._slot_power_ms, now_ms)
+        refused = self.peripheral.send_power(self._sent_power, self._sent_energy, due) if due else 0
+        self._mark_sent(due, self._slot_power_ms, now_ms)
+        self._power_stale = (stale & ~due) | refused
+
+    def _deliver_csc(self, now_ms):
+        stale = self._csc_stale & self._subscribed(self.peripheral.csc_handle)
+        due = self._due(stale, self._slot_csc_ms, now_ms)
+        refused = 0
+        if due:
+            refused = self.peripheral.send_csc(self._sent_wheel_revs, self._sent_wheel_time,
+                                               self._sent_crank_revs, self._sent_crank_time, due)
+        self._mark_sent(due, self._slot_csc_ms, now_ms)
+        self._csc_stale = (stale & ~due) | refused
+
+    def _deliver_bike(self, now_ms):
+        stale = self._bike_stale & self._subscribed(self.peripheral.bike_handle)
+        due = self._due(stale, self._slot_bike_ms, now_ms)
+        refused = 0
+        if due:
+            refused = self.peripheral.send_bike(self._sent_speed, self._sent_cadence, self._sent_level,
+                                                self._sent_bike_power, due)
+        self._mark_sent(due, self._slot_bike_ms, now_ms)
+        self._bike_stale = (stale & ~due) | refused
+
+    def _mark_sent(self, due, slot_sent_ms, now_ms):
+        # Refused slots too: they retry once their interval has passed
+        for slot in range(len(slot_sent_ms)):
+            if due & (1 << slot):
+                slot_sent_ms[slot] = now_ms
+
+    def flush(self, now_ms):
+        """Sends every pending value that differs from what was last sent."""
+        keepalive = config.NOTIFY_KEEPALIVE_MS
+        if self._power_pending:
+            self._power_pending = False
+            if (self.power == self._sent_power and self.energy_kj == self._sent_energy
+                    and time.ticks_diff(now_ms, self._power_sent_ms) < keepalive):
+                self.suppressed += 1
+            else:
+                self._sent_power = self.power
+                self._sent_energy = self.energy_kj
+                self._power_sent_ms = now_ms
+                subscribed = self._subscribed(self.peripheral.power_handle)
+                self.skipped += _bits(self._power_stale & subscribed)
+                self._power_stale = subscribed
+                self.sent += 1
+        if self._csc_pending:
+            self._csc_pending = False
+            if (self.wheel_revs == self._sent_wheel_revs and self.wheel_time == self._sent_wheel_time
+                    and self.crank_revs == self._sent_crank_revs and self.crank_time == self._sent_crank_time
+                    and time.ticks_diff(now_ms, self._csc_sent_ms) < keepalive):
+                self.suppressed += 1
+            else:
+                self._sent_wheel_revs = self.wheel_revs
+                self._sent_wheel_time = self.wheel_time
+                self._sent_crank_revs = self.crank_revs
+                self._sent_crank_time = self.crank_time
+                self._csc_sent_ms = now_ms
+                subscribed = self._subscribed(self.peripheral.csc_handle)
+                self.skipped += _bits(self._csc_stale & subscribed)
+                self._csc_stale = subscribed
+                self.sent += 1
+        if self._bike_pending:
+            self._bike_pending = False
+            if (self.power == self._sent_bike_power and self.speed == self._sent_speed
+                    and self.cadence == self._sent_cadence and self.level == self._sent_level
+                    and time.ticks_diff(now_ms, self._bike_sent_ms) < keepalive):
+                self.suppressed += 1
+            else:
+                self._sent_bike_power = self.power
+                self._sent_speed = self.speed
+                self._sent_cadence = self.cadence
+                self._sent_level = self.level
+                self._bike_sent_ms = now_ms
+                subscribed = self._subscribed(self.peripheral.bike_handle)
+                self.skipped += _bits(self._bike_stale & subscribed)
+                self._bike_stale = subscribed
+                self.sent += 1
+        self._deliver(now_ms)
+
+    def _deliver(self, now_ms):
+        """Sends the values on air to the stale connections that are due."""
+        if self._power_stale:
+            self._deliver_power(now_ms)
+        if self._csc_stale:
+            self._deliver_csc(now_ms)
+        if self._bike_stale:
+            self._deliver_bike(now_ms)
+        if self._power_stale or self._csc_stale or self._bike_stale:
+            self._stale_wake.set()
+
+    def commit(self):
+        """Sends what was published, now or once the connection interval allows."""
+        now_ms = time.ticks_ms()
+        if self._wait_ms(now_ms) > 0:
+            self._wake.set()
+        elif self.peripheral.is_connected():
+            self.flush(now_ms)
+
+    def reset(self, slot):
+        """Makes a newly subscribed connection in slot due, and forgets what was sent so it gets fresh values at once."""
+        self._sent_power = self._sent_energy = None
+        self._sent_wheel_revs = self._sent_wheel_time = None
+        self._sent_crank_revs = self._sent_crank_time = None
+        self._sent_bike_power = self._sent_speed = self._sent_cadence = self._sent_level = None
+        due_ms = time.ticks_add(time.ticks_ms(), -self.peripheral.conn_intervals_ms[slot])
+        self._slot_power_ms[slot] = due_ms
+        self._slot_csc_ms[slot] = due_ms
+        self._slot_bike_ms[slot] = due_ms
+
+    async def run(self):
+        uasyncio.create_task(self._run_stale())
+        while True:
+            await self._wake.wait()
+            wait_ms = self._wait_ms(time.ticks_ms())
+            if wait_ms > 0:
+                # Pace to the connection interval; publishes meanwhile are merged
+                await uasyncio.sleep_ms(wait_ms)
+            if self.peripheral.is_connected():
+                self.flush(time.ticks_ms())
+
+
+    async def _run_stale(self):
+        while True:
+            await self._stale_wake.wait()
+            wait_ms = self._stale_wait_ms(time.ticks_ms())
+            if wait_ms > 0:
+                await uasyncio.sleep_ms(wait_ms)
+            self._deliver(time.ticks_ms())
+
+
+def _bits(mask):
+    """Number of slots in a slot mask."""
+    n = 0
+    while mask:
+        mask &= mask - 1
+        n += 1
+    return n
@@ -0,0 +1,146 @@
+import struct
+from array import array
+import uasyncio
+import config
+
+# --- Windows, in whole seconds ---
+_SHORT_S = 3
+_LONG_S = 30  # Also the rolling average normalized power is taken from
+# A longer gap between two samples (a pause, a reconnect) only counts this long
+_MAX_STEP_MS = 2000
+# Averages are clamped here so their fourth power splits into 22-bit limbs
+_MAX_WATTS = 2047
+_LIMB_BITS = 22
+_LIMB_MASK = (1 << _LIMB_BITS) - 1
+_HALF_BITS = 11
+_HALF_MASK = (1 << _HALF_BITS) - 1
+
+# --- Characteristic payload (host/device_stats.py reads the same layout) ---
+# version, zones, 3 s average W, 30 s average W, normalized power W, max W,
+# energy J, seconds, then seconds in each zone
+HEADER_FORMAT = "<BBHHHHII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+VERSION = 1
+
+
+class PowerAnalytics:
+    """
+    Rolling power statistics of the ride, at O(1) cost and no allocation per sample.
+
+    update() integrates each power value over the time since the previous one
+    and cuts the result into whole seconds. Each completed second's average
+    goes into circular sums over the last 3 and 30 seconds, the time-in-zone
+    counters and, once 30 s are in, the normalized power sum: the fourth power
+    of the 30 s average, kept in three 22-bit limbs so it stays a small int.
+    Only normalized_power() and pack() leave integers, off the hot path.
+    """
+    def __init__(self):
+        self._short = array("H", [0] * _SHORT_S)
+        self._long = array("H", [0] * _LONG_S)
+        self._short_sum = 0
+        self._long_sum = 0
+        self._second_wms = 0  # Watt-milliseconds so far in the current second
+        self._second_ms = 0
+        self._energy_wms = 0  # Below one joule, carried to the next sample
+        self._np_limbs = array("l", [0, 0, 0])
+        self._np_seconds = 0
+
+        # Zone n (from 0) holds seconds below _zone_watts[n]; the last, everything above
+        ftp = config.FTP_W
+        self._zone_watts = array("H", [ftp * pct // 100 for pct in config.POWER_ZONES_PCT])
+        self.zone_s = array("l", [0] * (len(self._zone_watts) + 1))
+
+        self.seconds = 0
+        self.avg_3s = 0
+        self.avg_30s = 0
+        self.max_power = 0
+        self.energy_j = 0
+        self._payload = bytearray(HEADER_SIZE + 4 * len(self.zone_s))
+
+    def update(self, power_watts, elapsed_ms):
+        """Adds power_watts held for elapsed_ms; returns the energy so far in kJ."""
+        if power_watts < 0:
+            power_watts = 0
+        if elapsed_ms > _MAX_STEP_MS:
+            elapsed_ms = _MAX_STEP_MS
+        if power_watts > self.max_power:
+            self.max_power = power_watts
+        wms = self._energy_wms + power_watts * elapsed_ms
+        joules = wms // 1000
+        self.energy_j += joules
+        self._energy_wms = wms - joules * 1000
+        # At most _MAX_STEP_MS // 1000 + 1 seconds are completed
+        while elapsed_ms > 0:
+            step = 1000 - self._second_ms
+            if step > elapsed_ms:
+                step = elapsed_ms
+            self._second_wms += power_watts * step
+            self._second_ms += step
+            elapsed_ms -= step
+            if self._second_ms == 1000:
+                self._close_second()
+        return self.energy_j // 1000
+
+    def _close_second(self):
+        watts = self._second_wms // 1000
+        if watts > _MAX_WATTS:
+            watts = _MAX_WATTS
+        self._second_wms = 0
+        self._second_ms = 0
+
+        i = self.seconds % _SHORT_S
+        self._short_sum += watts - self._short[i]
+        self._short[i] = watts
+        i = self.seconds % _LONG_S
+        self._long_sum += watts - self._long[i]
+        self._long[i] = watts
+        self.seconds += 1
+        self.avg_3s = self._short_sum // (self.seconds if self.seconds < _SHORT_S else _SHORT_S)
+        self.avg_30s = self._long_sum // (self.seconds if self.seconds < _LONG_S else _LONG_S)
+
+        zone = 0
+        last = len(self._zone_watts)
+        while zone < last and watts >= self._zone_watts[zone]:
+            zone += 1
+        self.zone_s[zone] += 1
+
+        if self.seconds >= _LONG_S:
+            self._add_fourth_power(self.avg_30s)
+
+    def _add_fourth_power(self, watts):
+        # watts^4 = u^2 with u = h * 2^11 + l: h^2 * 2^22 + 2hl * 2^11 + l^2
+        u = watts * watts
+        h = u >> _HALF_BITS
+        l = u & _HALF_MASK
+        t = 2 * h * l
+        limbs = self._np_limbs
+        limbs[0] += l * l + ((t & _HALF_MASK) << _HALF_BITS)
+        limbs[1] += h * h + (t >> _HALF_BITS) + (limbs[0] >> _LIMB_BITS)
+        limbs[0] &= _LIMB_MASK
+        limbs[2] += limbs[1] >> _LIMB_BITS
+        limbs[1] &= _LIMB_MASK
+        self._np_seconds += 1
+
+    def normalized_power(self):
+        """Fourth root of the mean fourth power of the 30 s average; 0 for the first 30 s."""
+        if not self._np_seconds:
+            return 0
+        limbs = self._np_limbs
+        total = (limbs[2] * 4194304.0 + limbs[1]) * 4194304.0 + limbs[0]
+        return int((total / self._np_seconds) ** 0.25 + 0.5)
+
+    def pack(self):
+        """Packs the statistics into the characteristic payload and returns it."""
+        struct.pack_into(HEADER_FORMAT, self._payload, 0, VERSION, len(self.zone_s), self.avg_3s, self.avg_30s,
+                         self.normalized_power(), min(self.max_power, 0xFFFF), self.energy_j, self.seconds)
+        offset = HEADER_SIZE
+        for i in range(len(self.zone_s)):
+            struct.pack_into("<I", self._payload, offset, self.zone_s[i])
+            offset += 4
+        return self._payload
+
+    async def publish_task(self, peripheral):
+        """Refreshes the analytics characteristic in the background, off the hot path."""
+        while True:
+            await uasyncio.sleep_ms(config.ANALYTICS_PUBLISH_MS)
+            peripheral.write_analytics(self.pack())
@@ -0,0 +1,134 @@
+import os
+import struct
+import time
+import uasyncio
+import config
+from logger import log
+
+# --- Record layout (host/ride_decoder.py reads the same layout) ---
+# ticks_ms, cadence x10, k x1e6, power W, speed x10, crank revs, crank event time
+RECORD_FORMAT = "<IHHhHHH"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)  # 16 bytes
+# File header: magic, version, record size, reserved
+HEADER_FORMAT = "<4sBBH"
+MAGIC = b"PPMR"
+VERSION = 1
+
+_FILE_PREFIX = "ride_"
+_FILE_SUFFIX = ".bin"
+# A block goes to flash this many bytes at a time, one flash page, with the
+# other tasks running in between
+_WRITE_CHUNK_BYTES = 256
+
+
+class RideRecorder:
+    """
+    Appends fixed-width samples to RAM blocks and writes full blocks to flash.
+
+    Two block buffers alternate: append() fills one while flush_task() writes
+    the other, so sampling never waits on flash. The write itself yields to
+    the event loop after every _WRITE_CHUNK_BYTES, so BLE notifications are
+    not held up for a whole block. Each file holds at most
+    RECORD_FILE_BLOCKS blocks and only the newest RECORD_MAX_FILES are kept.
+    """
+    def __init__(self):
+        self.block_records = config.RECORD_BLOCK_BYTES // RECORD_SIZE
+        self._blocks = (bytearray(config.RECORD_BLOCK_BYTES), bytearray(config.RECORD_BLOCK_BYTES))
+        # Slices made once, so writing a block allocates no memoryviews
+        self._chunks = tuple(
+            tuple(memoryview(block)[i:i + _WRITE_CHUNK_BYTES] for i in range(0, len(block), _WRITE_CHUNK_BYTES))
+            for block in self._blocks)
+        self._active = 0       # Block being filled
+        self._used = 0         # Records in the active block
+        self._full = None      # Index of a block waiting for flush_task, if any
+        self._ready = uasyncio.ThreadSafeFlag()
+
+        self.recorded = 0
+        self.dropped = 0       # Samples lost because both blocks were full
+        self.blocks_written = 0
+
+        self._file_index = self._next_file_index()
+        self._file_blocks = config.RECORD_FILE_BLOCKS  # Forces a new file on the first flush
+
+    def _files(self):
+        try:
+            names = os.listdir(config.RECORD_DIR)
+        except OSError:
+            os.mkdir(config.RECORD_DIR)
+            return []
+        return sorted(n for n in names if n.startswith(_FILE_PREFIX) and n.endswith(_FILE_SUFFIX))
+
+    def _next_file_index(self):
+        files = self._files()
+        if not files:
+            return 0
+        return int(files[-1][len(_FILE_PREFIX):-len(_FILE_SUFFIX)]) + 1
+
+    def _path(self, index):
+        return "{}/{}{:04d}{}".format(config.RECORD_DIR, _FILE_PREFIX, index, _FILE_SUFFIX)
+
+    def append(self, cadence, k_constant, power, speed_kph, crank_revs, crank_event_time):
+        """Adds one sample; never waits on flash."""
+        self.append_scaled(int(cadence * 10), int(k_constant * 1000000), power, int(speed_kph * 10),
+                           crank_revs, crank_event_time)
+
+    def append_scaled(self, cadence_x10, k_x1e6, power, speed_x10, crank_revs, crank_event_time):
+        """append() for values already scaled to the record's integers, as the fixed-point model has them."""
+        if self._used == self.block_records:
+            if self._full is not None:
+                self.dropped += 1
+                return
+            self._full = self._active
+            self._active ^= 1
+            self._used = 0
+            self._ready.set()
+        struct.pack_into(RECORD_FORMAT, self._blocks[self._active], self._used * RECORD_SIZE,
+                         time.ticks_ms(), cadence_x10, k_x1e6, power, speed_x10,
+                         crank_revs & 0xFFFF, crank_event_time & 0xFFFF)
+        self._used += 1
+        self.recorded += 1
+
+    def end_ride(self):
+        """Queues the partly filled block, zero-padded, so a ride's tail is kept."""
+        if self._used == 0 or self._full is not None:
+            return
+        block = self._blocks[self._active]
+        for i in range(self._used * RECORD_SIZE, len(block)):
+            block[i] = 0
+        self._full = self._active
+        self._active ^= 1
+        self._used = 0
+        self._ready.set()
+
+    def _rotate(self):
+        files = self._files()
+        while len(files) >= config.RECORD_MAX_FILES:
+            os.remove("{}/{}".format(config.RECORD_DIR, files.pop(0)))
+        self._file_index += 1
+        with open(self._path(self._file_index - 1), "wb") as f:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_SIZE, 0))
+        self._file_blocks = 0
+
+    async def write_full_block(self):
+        """Appends the waiting block, if any, yielding to the other tasks between chunks."""
+        if self._full is None:
+            return
+        if self._file_blocks >= config.RECORD_FILE_BLOCKS:
+            self._rotate()
+            await uasyncio.sleep_ms(0)
+        with open(self._path(self._file_index - 1), "ab") as f:
+            for chunk in self._chunks[self._full]:
+                f.write(chunk)
+                await uasyncio.sleep_ms(0)
+        self._file_blocks += 1
+        self.blocks_written += 1
+        self._full = None
+
+    async def flush_task(self):
+        while True:
+            await self._ready.wait()
+            try:
+                await self.write_full_block()
+            except OSError as e:
+                log("ERROR", f"Ride recorder write failed: {e}")
+                self._full = None
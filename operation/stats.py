@@ -0,0 +1,145 @@
+import gc
+import struct
+import time
+from array import array
+import uasyncio
+import config
+
+# --- Stage ids for start()/stop() ---
+CADENCE = 0
+K_CONSTANT = 1
+POWER = 2
+SPEED = 3
+SEND_POWER = 4
+SEND_CSC = 5
+SEND_SPEED = 6
+SEND_CADENCE = 7
+SEND_BIKE = 8
+STAGES = 9
+
+# Checked at the top of every call, so instrumentation costs one test when off
+ENABLED = config.STATS_ENABLED
+
+# --- Histograms ---
+# Stage cost: bucket i counts [2^i, 2^(i+1)) us, bucket 0 below 2 us, the last 32 ms and up.
+# Loop period: BUCKETS equal buckets from 0 to twice the target period, the last beyond.
+BUCKETS = 16
+_stage_hist = array("L", [0] * (STAGES * BUCKETS))
+_stage_max_us = array("L", [0] * STAGES)
+_loop_hist = array("L", [0] * BUCKETS)
+_loop_bucket_us = config.REFRESH_INTERVAL_MS * 1000 * 2 // BUCKETS
+_loop_last_us = 0
+_loops = 0
+_loop_max_us = 0
+
+# --- Heap watermarks ---
+# mem_free rising between two loops means a collection ran in between
+_mem_free_min = 0
+_mem_free_last = 0
+_gc_count = 0
+_last_gc_ms = 0
+_last_gc_loop_us = 0  # Period of the loop the collection landed in
+
+# --- Characteristic payload (host/device_stats.py reads the same layout) ---
+# version, stages, buckets, reserved, uptime ms, loops, loop bucket us, loop max us,
+# mem_free min, mem_free last, collections, last collection ms, its loop period us;
+# then loop histogram, per-stage max us, per-stage histograms. Counts saturate at 65535.
+HEADER_FORMAT = "<BBBBIIIIIIIII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+VERSION = 1
+PAYLOAD_SIZE = HEADER_SIZE + 2 * BUCKETS + 4 * STAGES + 2 * STAGES * BUCKETS
+_payload = bytearray(PAYLOAD_SIZE)
+
+
+def set_loop_period(period_ms):
+    """Centres the loop-period histogram on the loop's target period."""
+    global _loop_bucket_us
+    _loop_bucket_us = period_ms * 1000 * 2 // BUCKETS
+
+
+def start():
+    """Start time for stop(); 0 when disabled."""
+    if not ENABLED:
+        return 0
+    return time.ticks_us()
+
+
+def stop(stage, start_us):
+    """Adds the time since start_us to stage's histogram; returns the stop time, to start the next stage."""
+    if not ENABLED:
+        return 0
+    now = time.ticks_us()
+    us = time.ticks_diff(now, start_us)
+    if us > _stage_max_us[stage]:
+        _stage_max_us[stage] = us
+    bucket = 0
+    while us > 1 and bucket < BUCKETS - 1:
+        us >>= 1
+        bucket += 1
+    _stage_hist[stage * BUCKETS + bucket] += 1
+    return now
+
+
+def loop():
+    """Call once per main-loop iteration: records its period and samples the heap."""
+    global _loop_last_us, _loops, _loop_max_us
+    global _mem_free_min, _mem_free_last, _gc_count, _last_gc_ms, _last_gc_loop_us
+    if not ENABLED:
+        return
+    now = time.ticks_us()
+    free = gc.mem_free()
+    if _loops:
+        period = time.ticks_diff(now, _loop_last_us)
+        if period > _loop_max_us:
+            _loop_max_us = period
+        bucket = period // _loop_bucket_us
+        if bucket >= BUCKETS:
+            bucket = BUCKETS - 1
+        _loop_hist[bucket] += 1
+        if free > _mem_free_last:
+            _gc_count += 1
+            _last_gc_ms = time.ticks_ms()
+            _last_gc_loop_us = period
+        if free < _mem_free_min:
+            _mem_free_min = free
+    else:
+        _mem_free_min = free
+    _mem_free_last = free
+    _loop_last_us = now
+    _loops += 1
+
+
+def reset():
+    global _loops, _loop_max_us, _gc_count, _last_gc_ms, _last_gc_loop_us
+    for i in range(STAGES * BUCKETS):
+        _stage_hist[i] = 0
+    for i in range(STAGES):
+        _stage_max_us[i] = 0
+    for i in range(BUCKETS):
+        _loop_hist[i] = 0
+    _loops = _loop_max_us = _gc_count = _last_gc_ms = _last_gc_loop_us = 0
+
+
+def pack():
+    """Packs the current statistics into the characteristic payload and returns it."""
+    struct.pack_into(HEADER_FORMAT, _payload, 0, VERSION, STAGES, BUCKETS, 0, time.ticks_ms(), _loops,
+                     _loop_bucket_us, _loop_max_us, _mem_free_min, _mem_free_last, _gc_count,
+                     _last_gc_ms, _last_gc_loop_us)
+    offset = HEADER_SIZE
+    for i in range(BUCKETS):
+        struct.pack_into("<H", _payload, offset, min(_loop_hist[i], 0xFFFF))
+        offset += 2
+    for i in range(STAGES):
+        struct.pack_into("<I", _payload, offset, _stage_max_us[i])
+        offset += 4
+    for i in range(STAGES * BUCKETS):
+        struct.pack_into("<H", _payload, offset, min(_stage_hist[i], 0xFFFF))
+        offset += 2
+    return _payload
+
+
+async def publish_task(peripheral):
+    """Refreshes the statistics characteristic in the background, off the hot path."""
+    while True:
+        await uasyncio.sleep_ms(config.STATS_PUBLISH_MS)
+        peripheral.write_stats(pack())
@@ -0,0 +1,127 @@
+"""Host-side hardware simulator for the code in ``operation/``.
+
+Call install() before importing any operation module. It registers fake
+``machine``, ``bluetooth``, ``uasyncio``, ``_thread`` and ``micropython`` modules, adds
+the MicroPython ``ticks_*`` functions to ``time`` (backed by a virtual clock)
+and puts ``operation/`` on ``sys.path``. The flash filesystem is a temporary
+directory that lives as long as the process.
+"""
+import atexit
+import builtins
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+from simulator import bluetooth, machine, thread, uasyncio
+from simulator.clock import CLOCK, ticks_add, ticks_diff
+
+# Free heap gc.mem_free() reports: a Pico W after boot, held constant
+HEAP_FREE_BYTES = 150000
+
+# Flash write timing for flash_open(), typical figures of the Pico W's
+# W25Q16JV: the CPU stalls while a page is programmed or a sector erased
+FLASH_PAGE_BYTES = 256
+FLASH_PAGE_PROGRAM_US = 400
+FLASH_SECTOR_BYTES = 4096
+FLASH_SECTOR_ERASE_US = 45000
+
+OPERATION_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "operation")
+FLASH_DIR = None
+
+
+def _micropython_module():
+    mod = types.ModuleType("micropython")
+    mod.const = lambda value: value
+    mod.native = lambda fn: fn
+    mod.viper = lambda fn: fn
+    mod.schedule = lambda fn, arg: fn(arg)
+    mod.alloc_emergency_exception_buf = lambda size: None
+    return mod
+
+
+def install():
+    """Makes ``import machine`` & co. resolve to the simulated hardware."""
+    sys.modules["machine"] = machine
+    sys.modules["bluetooth"] = bluetooth
+    sys.modules["uasyncio"] = uasyncio
+    sys.modules["_thread"] = thread
+    sys.modules["micropython"] = _micropython_module()
+    builtins.const = lambda value: value
+
+    time.ticks_ms = CLOCK.ticks_ms
+    time.ticks_us = CLOCK.ticks_us
+    time.ticks_diff = ticks_diff
+    time.ticks_add = ticks_add
+    # On core 0 these busy-wait by advancing the clock; on core 1 they wait for it
+    time.sleep_ms = lambda ms: thread.sleep_us(ms * 1000)
+    time.sleep_us = thread.sleep_us
+    gc.mem_free = lambda: HEAP_FREE_BYTES
+
+    if OPERATION_DIR not in sys.path:
+        sys.path.insert(0, OPERATION_DIR)
+
+    global FLASH_DIR
+    if FLASH_DIR is None:
+        FLASH_DIR = tempfile.mkdtemp(prefix="pico-flash-")
+        atexit.register(shutil.rmtree, FLASH_DIR, True)
+    import config
+    config.RECORD_DIR = os.path.join(FLASH_DIR, os.path.basename(config.RECORD_DIR))
+
+
+def reset():
+    """Returns clock, GPIOs, ADC traces, radio and scheduler to power-on state."""
+    CLOCK.reset()
+    machine.reset()
+    bluetooth.reset()
+    uasyncio.reset()
+    thread.reset()
+
+
+def erase_flash():
+    """Deletes every file the operation code wrote to the simulated flash."""
+    for name in os.listdir(FLASH_DIR):
+        path = os.path.join(FLASH_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+class _FlashFile:
+    """A file on the simulated flash whose writes take virtual time."""
+    def __init__(self, f):
+        self._f = f
+
+    def write(self, data):
+        start = self._f.tell()
+        end = start + len(data)
+        # A sector is erased when a write first reaches into it
+        sectors = (end + FLASH_SECTOR_BYTES - 1) // FLASH_SECTOR_BYTES - \
+            (start + FLASH_SECTOR_BYTES - 1) // FLASH_SECTOR_BYTES
+        pages = (len(data) + FLASH_PAGE_BYTES - 1) // FLASH_PAGE_BYTES
+        thread.sleep_us(sectors * FLASH_SECTOR_ERASE_US + pages * FLASH_PAGE_PROGRAM_US)
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+
+def flash_open(path, mode="r"):
+    """open() whose writes stall the virtual clock like flash; set as a module's open to time its writes."""
+    f = open(path, mode)
+    return _FlashFile(f) if "a" in mode or "w" in mode else f
+
+
+def at_ms(t_ms, callback):
+    """Schedules a simulator action (connect, level change, ...) at t_ms."""
+    CLOCK.schedule(int(t_ms * 1000), callback)
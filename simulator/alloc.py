@@ -0,0 +1,80 @@
+"""Heap-allocation accounting for hot-path code.
+
+MicroPython allocates on the heap for every container, slice, bytes object
+and (on ports without an unboxed float representation, such as rp2) every
+float result; small ints are free. CPython instead boxes almost every int,
+so its allocator counters say little about the device. Two tools are
+therefore provided:
+
+* audit(fn) disassembles fn and lists the operations that allocate on
+  MicroPython, split into container allocations and float boxing.
+* bytes_per_call(fn) measures the heap actually consumed per call. Under
+  MicroPython this is exact (gc.mem_alloc with the collector disabled);
+  under CPython it is the heap still held after the calls, which catches
+  buffers that grow or are rebuilt and kept.
+"""
+import dis
+import gc
+import sys
+
+_MICROPYTHON = sys.implementation.name == "micropython"
+
+_CONTAINER_OPS = {
+    "BUILD_LIST", "BUILD_TUPLE", "BUILD_MAP", "BUILD_SET", "BUILD_SLICE",
+    "BUILD_STRING", "BUILD_CONST_KEY_MAP", "FORMAT_VALUE", "LIST_APPEND",
+    "LIST_EXTEND", "MAP_ADD", "SET_ADD", "MAKE_FUNCTION",
+}
+_ALLOCATING_METHODS = {
+    "append", "extend", "insert", "pop", "copy", "format", "join", "pack",
+    "encode", "decode", "split", "items", "keys", "values",
+}
+_ALLOCATING_BUILTINS = {"list", "tuple", "dict", "set", "bytes", "bytearray", "str", "sorted"}
+
+
+def _float_ops(instr):
+    if instr.opname == "BINARY_OP" and instr.argrepr in ("/", "/="):
+        return True
+    return instr.opname == "LOAD_CONST" and isinstance(instr.argval, float)
+
+
+def audit(fn):
+    """Returns (container_ops, float_ops): lists of "line: operation" strings."""
+    code = getattr(fn, "__func__", fn).__code__
+    containers, floats = [], []
+    line = code.co_firstlineno
+    for instr in dis.get_instructions(code):
+        if instr.starts_line:
+            line = instr.starts_line
+        where = "{}: {}".format(line, instr.opname)
+        if instr.opname in _CONTAINER_OPS:
+            containers.append(where)
+        elif instr.opname in ("LOAD_METHOD", "LOAD_ATTR") and instr.argval in _ALLOCATING_METHODS:
+            containers.append("{} .{}()".format(where, instr.argval))
+        elif instr.opname == "LOAD_GLOBAL" and instr.argval in _ALLOCATING_BUILTINS:
+            containers.append("{} {}()".format(where, instr.argval))
+        elif _float_ops(instr):
+            floats.append("{} {}".format(where, instr.argrepr))
+    return containers, floats
+
+
+def bytes_per_call(fn, n=1000):
+    """Heap bytes consumed per call of fn(); see the module docstring."""
+    fn()  # Warm up caches and lazily created attributes
+    gc.collect()
+    if _MICROPYTHON:
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(n):
+            fn()
+        after = gc.mem_alloc()
+        gc.enable()
+        return (after - before) / n
+    import tracemalloc
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(n):
+        fn()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return max(after - before, 0) / n
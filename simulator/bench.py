@@ -0,0 +1,128 @@
+"""Runs operation/main.py against simulated hardware and reports its cost.
+
+Usage (from the repository root):
+    python -m simulator.bench [--seconds 600] [--rpm 80] [--volts 0.6]
+"""
+import argparse
+import contextlib
+import os
+import time
+
+import simulator
+from simulator import bluetooth, machine, traces, uasyncio
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import config  # noqa: E402  (needs simulator.install() first)
+
+_CONNECT_AT_MS = 500
+
+
+def per_call_us(fn, n=20000):
+    """Average wall-clock cost of fn() in microseconds."""
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) * 1e6 / n
+
+
+def run_ride(seconds, rpm, volts, main_module="main", quiet=True, pulses=None, setup=None):
+    """Simulates a connected ride and returns a dict of loop statistics.
+
+    pulses, if given, replaces the steady rpm with explicit reed pulse times (ms).
+    setup, if given, is called after the simulator is reset to script extra events.
+    """
+    simulator.reset()
+    if setup is not None:
+        setup()
+    if pulses is None:
+        pulses = traces.steady(rpm, seconds * 1000)
+    machine.schedule_pulses(config.REED_PIN, pulses)
+    machine.set_adc_voltage(config.POTENTIOMETER_PIN, volts, config.PICO_REFERENCE_VOLTAGE)
+    simulator.at_ms(_CONNECT_AT_MS, lambda: bluetooth.BLE().connect())
+
+    module = __import__(main_module)
+    until_us = seconds * 1000000
+    sink = open(os.devnull, "w") if quiet else None
+    with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+        start = time.perf_counter()
+        task = uasyncio.run(module.main(), until_us=until_us)
+        wall = time.perf_counter() - start
+    if sink:
+        sink.close()
+
+    ble = bluetooth.BLE()
+    return {
+        "virtual_s": CLOCK.now_us / 1e6,
+        "wall_s": wall,
+        "iterations": task.steps,
+        "us_per_iteration": wall * 1e6 / max(task.steps, 1),
+        "wakeups": uasyncio.get_event_loop().steps,
+        "wakeups_per_s": uasyncio.get_event_loop().steps / (CLOCK.now_us / 1e6),
+        "notifications": ble.notify_count,
+        "notify_bytes": ble.notify_bytes,
+        "notifications_per_s_virtual": ble.notify_count / (CLOCK.now_us / 1e6),
+        "notifications_per_s_wall": ble.notify_count / wall,
+        "speedup": (CLOCK.now_us / 1e6) / wall,
+    }
+
+
+def component_costs(rpm, volts):
+    """Per-call wall cost of each stage of the main loop, in microseconds."""
+    simulator.reset()
+    from get_cadence import CadenceSensor
+    from get_k_constant import KConstant
+    from get_power import get_power
+    from get_speed import get_flat_speed, init_speed_table
+    from peripheral import BLEPeripheral
+
+    machine.schedule_pulses(config.REED_PIN, traces.steady(rpm, 10000))
+    machine.set_adc_voltage(config.POTENTIOMETER_PIN, volts, config.PICO_REFERENCE_VOLTAGE)
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        sensor = CadenceSensor()
+        k_constant = KConstant()
+        init_speed_table()
+        ble = BLEPeripheral(name=config.DEVICE_NAME)
+        bluetooth.BLE().connect()
+    bluetooth.BLE().capture = False
+    CLOCK.advance_to(5000000)
+    now_us = time.ticks_us()
+    k = k_constant.get_k_constant()
+    cadence = sensor.calculate_cadence(now_us)
+    power = get_power(cadence, k)
+
+    return {
+        "calculate_cadence": per_call_us(lambda: sensor.calculate_cadence(now_us)),
+        "get_k_constant": per_call_us(k_constant.get_k_constant),
+        "get_power": per_call_us(lambda: get_power(cadence, k)),
+        "get_flat_speed": per_call_us(lambda: get_flat_speed(power)),
+        "send_power": per_call_us(lambda: ble.send_power(power)),
+        "send_cadence": per_call_us(lambda: ble.send_cadence(10, 1024)),
+        "send_speed": per_call_us(lambda: ble.send_speed(10, 1024)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=600, help="virtual ride length")
+    parser.add_argument("--rpm", type=float, default=80, help="steady crank cadence")
+    parser.add_argument("--volts", type=float, default=0.6, help="potentiometer voltage")
+    args = parser.parse_args()
+
+    stats = run_ride(args.seconds, args.rpm, args.volts)
+    print("Main loop ({virtual_s:.0f} s simulated in {wall_s:.2f} s, {speedup:.0f}x real time)".format(**stats))
+    print("  iterations:            {iterations}".format(**stats))
+    print("  cost per iteration:    {us_per_iteration:.1f} us".format(**stats))
+    print("  task wakeups/s:        {wakeups_per_s:.1f}".format(**stats))
+    print("  notifications:         {notifications} ({notify_bytes} bytes)".format(**stats))
+    print("  notifications/s:       {notifications_per_s_virtual:.1f} virtual, "
+          "{notifications_per_s_wall:.0f} wall".format(**stats))
+    print("")
+    print("Per-call cost (host CPU)")
+    for name, cost in component_costs(args.rpm, args.volts).items():
+        print("  {:<22} {:8.2f} us".format(name + ":", cost))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Checks host.ride_analytics against the on-device functions and measures its throughput.
+
+Usage (from the repository root):
+    python -m simulator.bench_analytics [--samples 2000000] [--rides 4]
+
+Parity: the vectorised k table, interpolate_k, get_power and
+get_flat_speed must give the same floats as operation/ on the same
+inputs. Checked over every ADC code, a voltage grid that includes the
+breakpoints, random cadences and every whole watt to 2000 W. The
+smoothing is replayed on the pipeline scenarios of simulator.replay plus
+a stop long enough for the smoothed cadence to underflow, against
+CadenceSensor.calculate_cadence. A ride recorded by main.py, with and
+without LEVEL_TRACKING, is then reprocessed with the config it was
+recorded with. Every sample's k must be recovered exactly, and power is only off by the 0.1 RPM resolution
+of the recorded cadence. Exits non-zero if any of these fails.
+
+Throughput: synthetic ride files of --samples records are reprocessed
+whole and in chunks, against the scalar operation/ functions per sample.
+--rides rides are then reprocessed with one process and with one per core.
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import simulator
+from simulator import bench, bluetooth, replay, traces
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import config  # noqa: E402
+import get_k_constant  # noqa: E402
+import recorder  # noqa: E402
+from get_cadence import CadenceSensor  # noqa: E402
+from get_power import get_power  # noqa: E402
+from get_speed import get_flat_speed, get_flat_speed_cardano, init_speed_table  # noqa: E402
+from host import ride_analytics  # noqa: E402
+
+_SMOOTHING_BOUND_RPM = 1e-9
+# 0.1 RPM of recorded cadence at up to 120 RPM on the stiffest level
+_RECORDED_POWER_BOUND_W = 2
+
+
+def _settings(**overrides):
+    settings = {key: getattr(config, key) for key in dir(config) if key.isupper()}
+    settings.update(overrides)
+    return settings
+
+
+def _count_differences(a, b):
+    return int(np.count_nonzero(np.asarray(a) != np.asarray(b)))
+
+
+def model_parity(model, rng):
+    """Samples where the vectorised model differs from operation/, by stage."""
+    k_table = get_k_constant.build_k_table()
+    voltages = sorted(set(np.linspace(0, config.PICO_REFERENCE_VOLTAGE, 3301)) | set(config.LEVEL_VOLTAGE_SORTED))
+    cadences = [rng.uniform(0, 130) for _ in range(20000)]
+    ks = [k_table[rng.randrange(len(k_table))] for _ in cadences]
+    init_speed_table()
+    watts = list(range(-5, 2001))
+    cardano = ride_analytics.Model(_settings(SPEED_SOLVER="cardano"))
+    return {
+        "k table": _count_differences(model.k_table, np.array([k_table[get_k_constant.table_index(code)]
+                                                               for code in range(len(model.k_table))],
+                                                              dtype=np.float32)),
+        "interpolate_k": _count_differences(model.interpolate_k(voltages),
+                                            [get_k_constant.interpolate_k(v) for v in voltages]),
+        "get_power": _count_differences(model.power(cadences, ks), [get_power(c, k) for c, k in zip(cadences, ks)]),
+        "get_flat_speed (table)": _count_differences(model.flat_speed(watts), [get_flat_speed(w) for w in watts]),
+        "get_flat_speed (cardano)": _count_differences(cardano.flat_speed(watts),
+                                                       [get_flat_speed_cardano(w) for w in watts]),
+    }
+
+
+def smoothing_error(trace):
+    """Largest difference between smooth_cadence and CadenceSensor over a replayed trace."""
+    simulator.reset()
+    replay._schedule(trace)
+    sensor = CadenceSensor()
+    device, window = [], []
+    for t_ms in range(config.REFRESH_INTERVAL_MS, trace["duration_ms"] + 1, config.REFRESH_INTERVAL_MS):
+        CLOCK.advance_to(t_ms * 1000)
+        device.append(sensor.calculate_cadence(t_ms * 1000))
+        # The window calculate_cadence just used; streak is 0 if it timed out
+        if sensor.streak < 2:
+            window.append(0.0)
+        elif sensor.window_n:
+            window.append(60000000 * sensor.window_n / sensor.window_sum)
+        else:
+            window.append(float("nan"))
+    return float(np.max(np.abs(ride_analytics.smooth_cadence(window) - np.array(device))))
+
+
+def recorded_ride(level_tracking):
+    """Rides main.py with the recorder on; returns the ride files and the samples it took."""
+    taken = []
+    saved = config.LEVEL_TRACKING
+    original_append = recorder.RideRecorder.append
+
+    def spy(self, *sample):
+        taken.append(sample)
+        original_append(self, *sample)
+
+    ride = [(120000, 85), (30000, 0), (120000, 100)]
+    seconds = sum(d for d, _ in ride) // 1000
+    simulator.erase_flash()
+    recorder.RideRecorder.append = spy
+    config.LEVEL_TRACKING = level_tracking
+    try:
+        bench.run_ride(seconds, 0, 0.77, pulses=traces.pulse_times(ride),
+                       setup=lambda: simulator.at_ms(seconds * 1000 - 1000, lambda: bluetooth.BLE().disconnect()))
+    finally:
+        recorder.RideRecorder.append = original_append
+        config.LEVEL_TRACKING = saved
+    paths = sorted(os.path.join(config.RECORD_DIR, name) for name in os.listdir(config.RECORD_DIR))
+    return paths, taken
+
+
+def reprocess_recorded(paths, taken, level_tracking):
+    """(k mismatches, largest power difference) of an identity reprocess of a recorded ride."""
+    settings = _settings(LEVEL_TRACKING=level_tracking)
+    model = ride_analytics.Model(settings)
+    chunk = np.concatenate(list(ride_analytics.chunks(paths)))
+    voltages, unmatched = model.voltages_from_k(chunk["k_x1e6"])
+    k = model.k_at(voltages)
+    power = model.power(chunk["cadence_x10"] / 10, k)
+    recorded_k = (k.astype(float) * 1000000).astype(np.int64)
+    k_mismatches = unmatched + _count_differences(recorded_k, chunk["k_x1e6"])
+    samples = len(chunk)
+    device_power = np.array([sample[2] for sample in taken[-samples:]])
+    return samples, k_mismatches, int(np.max(np.abs(power - device_power)))
+
+
+def synthetic_ride(path, samples, rng_seed):
+    """Writes a ride file of random but plausible samples, a refresh every 250 ms."""
+    rng = np.random.default_rng(rng_seed)
+    model = ride_analytics.Model(_settings(LEVEL_TRACKING=False))
+    records = np.zeros(samples, dtype=ride_analytics.RECORD_DTYPE)
+    records["ticks_ms"] = (np.arange(samples) * 250 + 1000) % (1 << 30)
+    cadence = np.clip(85 + np.cumsum(rng.normal(0, 0.3, samples)) % 40, 0, 120)
+    records["cadence_x10"] = cadence * 10
+    keys = (model.k_table.astype(float) * 1000000).astype(np.int64)
+    records["k_x1e6"] = keys[rng.integers(0, len(keys), samples)]
+    power = model.power(cadence, model.k_table[rng.integers(0, len(keys), samples)])
+    records["power"] = power
+    records["speed_x10"] = model.flat_speed(power) * 10
+    with open(path, "wb") as f:
+        f.write(struct.pack(ride_analytics.HEADER_FORMAT, ride_analytics.MAGIC, ride_analytics.VERSION,
+                            ride_analytics.RECORD_SIZE, 0))
+        f.write(records.tobytes())
+
+
+def scalar_reprocess(path, limit):
+    """The per-sample loop with the operation/ functions, for comparison; samples per second."""
+    model = ride_analytics.Model(_settings(LEVEL_TRACKING=False))
+    chunk = next(ride_analytics.chunks([path], limit))
+    codes, _ = model.codes_from_k(chunk["k_x1e6"])
+    k_table = get_k_constant.build_k_table()
+    start = time.perf_counter()
+    for cadence_x10, code in zip(chunk["cadence_x10"].tolist(), codes.tolist()):
+        get_flat_speed(get_power(cadence_x10 / 10, k_table[get_k_constant.table_index(code)]))
+    return len(chunk) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=2000000, help="records per synthetic ride")
+    parser.add_argument("--rides", type=int, default=4, help="synthetic rides for the parallel run")
+    args = parser.parse_args()
+    failed = False
+
+    model = ride_analytics.Model(_settings())
+    print("Samples differing from operation/, same inputs")
+    for stage, differences in model_parity(model, random.Random(1)).items():
+        print("  {:<26} {}".format(stage, differences))
+        failed |= differences > 0
+
+    print("Smoothing vs. CadenceSensor, largest difference (RPM)")
+    scenarios = list(replay.scenarios().values())
+    scenarios.append(replay.synthetic("long_stop", [(20000, 80), (150000, 0), (20000, 85)], [(0, 6)]))
+    for trace in scenarios:
+        error = smoothing_error(trace)
+        print("  {:<14} {:.2e}".format(trace["name"], error))
+        failed |= not error <= _SMOOTHING_BOUND_RPM
+
+    print("Recorded ride reprocessed with its own config")
+    for level_tracking in (False, True):
+        paths, taken = recorded_ride(level_tracking)
+        samples, k_mismatches, power_error = reprocess_recorded(paths, taken, level_tracking)
+        print("  LEVEL_TRACKING {:<5}  {} samples, {} k mismatches, power within {} W of the device".format(
+            str(level_tracking), samples, k_mismatches, power_error))
+        failed |= not samples or k_mismatches > 0 or power_error > _RECORDED_POWER_BOUND_W
+        simulator.erase_flash()
+
+    # Synthetic rides draw k from the ADC-code table
+    settings = _settings(LEVEL_TRACKING=False)
+    with tempfile.TemporaryDirectory() as directory:
+        rides = []
+        for i in range(args.rides):
+            path = os.path.join(directory, "ride_{:04d}.bin".format(i))
+            synthetic_ride(path, args.samples, i)
+            rides.append([path])
+
+        print("Throughput, one ride of {} samples (host CPU)".format(args.samples))
+        print("  {:<30} {:>12.0f} samples/s".format("operation/ per sample", scalar_reprocess(rides[0][0], 50000)))
+        for chunk_records in (args.samples, ride_analytics.CHUNK_RECORDS, 4096):
+            start = time.perf_counter()
+            ride_analytics.reprocess(rides[0], settings, settings, chunk_records=chunk_records)
+            rate = args.samples / (time.perf_counter() - start)
+            print("  {:<30} {:>12.0f} samples/s".format("chunks of {}".format(chunk_records), rate))
+
+        cores = os.cpu_count() or 1
+        print("Throughput, {} rides".format(args.rides))
+        for jobs in sorted({1, cores}):
+            start = time.perf_counter()
+            ride_analytics.reprocess_all(rides, settings, settings, jobs=jobs)
+            rate = args.rides * args.samples / (time.perf_counter() - start)
+            print("  {:<30} {:>12.0f} samples/s".format("{} process{}".format(jobs, "es" if jobs > 1 else ""), rate))
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Checks that the BLEPeripheral send path is allocation-free and byte-identical.
+
+Usage (from the repository root):
+    python -m simulator.bench_ble
+
+The send_* methods must contain no heap-allocating operation (see
+simulator.alloc), must not retain heap across calls and must put exactly
+the bytes on air that the original struct.pack() implementation did,
+plus the accumulated energy field when POWER_ANALYTICS is set. send_bike's Indoor Bike Data is checked against struct.pack() of the
+FTMS layout, with and without the resistance level, and the advertising
+payload of every FTMS_PROFILE must fit in 31 bytes. Exits non-zero
+otherwise.
+"""
+import contextlib
+import os
+import random
+import struct
+import sys
+
+import simulator
+from simulator import alloc, bluetooth
+from simulator.bench import per_call_us
+
+simulator.install()
+
+import config  # noqa: E402
+from peripheral import BLEPeripheral  # noqa: E402
+
+_ADV_MAX_BYTES = 31
+
+
+def legacy_payloads(power, energy_kj, wheel_revs, wheel_time, crank_revs, crank_time):
+    """What the struct.pack() implementation sent for the same values; with POWER_ANALYTICS, plus energy."""
+    return (
+        struct.pack("<HhH", 0x0800, power, energy_kj) if config.POWER_ANALYTICS else struct.pack("<Hh", 0x00, power),
+        struct.pack("<BIH", 0x01, wheel_revs, wheel_time & 0xFFFF),
+        struct.pack("<BHH", 0x02, crank_revs & 0xFFFF, crank_time & 0xFFFF),
+    )
+
+
+def ftms_payload(speed, cadence, level, power, level_tracking):
+    """Indoor Bike Data as the FTMS specification lays it out, by struct.pack()."""
+    if level_tracking:
+        return struct.pack("<HHHhh", 0x0064, speed, cadence, level, power)
+    return struct.pack("<HHHh", 0x0044, speed, cadence, power)
+
+
+def ftms_checks():
+    """Returns (lines, failed) for the advertising payloads and Indoor Bike Data."""
+    saved = config.FTMS_PROFILE, config.LEVEL_TRACKING
+    lines, failed = [], False
+    for profile in ("off", "primary", "only"):
+        config.FTMS_PROFILE = profile
+        connected_peripheral(config.DEVICE_NAME)
+        size = len(bluetooth.BLE().adv_data)
+        lines.append("Advertising payload as {}, FTMS_PROFILE {!r}: {} bytes".format(
+            config.DEVICE_NAME, profile, size))
+        failed |= size > _ADV_MAX_BYTES
+    config.FTMS_PROFILE = "primary"
+    rng = random.Random(2)
+    for level_tracking in (True, False):
+        config.LEVEL_TRACKING = level_tracking
+        peripheral = connected_peripheral()
+        radio = bluetooth.BLE()
+        mismatches = 0
+        for _ in range(2000):
+            values = (rng.randint(0, 0xFFFF), rng.randint(0, 0xFFFF), rng.randint(1, 15), rng.randint(-2000, 2000))
+            del radio.notifications[:]
+            peripheral.send_bike(*values)
+            mismatches += radio.notifications[0][3] != ftms_payload(*values, level_tracking)
+        lines.append("Indoor Bike Data mismatches vs struct.pack, LEVEL_TRACKING {}: {} of 2000".format(
+            level_tracking, mismatches))
+        failed |= bool(mismatches)
+    config.FTMS_PROFILE, config.LEVEL_TRACKING = saved
+    return lines, failed
+
+
+def connected_peripheral(name="bench"):
+    simulator.reset()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        peripheral = BLEPeripheral(name=name)
+        bluetooth.BLE().connect()
+    return peripheral
+
+
+def main():
+    failed = False
+    print("Allocating operations (MicroPython heap)")
+    for name in ("is_connected", "_fan_out", "send_power", "send_speed", "send_cadence", "send_csc", "send_bike"):
+        containers, floats = alloc.audit(getattr(BLEPeripheral, name))
+        print("  {:<14} {} container, {} float".format(name + ":", len(containers), len(floats)))
+        for op in containers:
+            print("      " + op)
+        failed |= bool(containers or floats)
+
+    peripheral = connected_peripheral()
+    radio = bluetooth.BLE()
+    rng = random.Random(1)
+    mismatches = 0
+    for _ in range(2000):
+        values = (rng.randint(-2000, 2000), rng.randint(0, 0xFFFF), rng.randint(0, 1 << 24), rng.randint(0, 1 << 20),
+                  rng.randint(0, 1 << 20), rng.randint(0, 1 << 20))
+        power, energy_kj, wheel_revs, wheel_time, crank_revs, crank_time = values
+        del radio.notifications[:]
+        peripheral.send_power(power, energy_kj)
+        peripheral.send_speed(wheel_revs, wheel_time)
+        peripheral.send_cadence(crank_revs, crank_time)
+        sent = tuple(payload for _, _, _, payload in radio.notifications)
+        mismatches += sent != legacy_payloads(*values)
+    print("Payload mismatches vs struct.pack: {} of 2000".format(mismatches))
+    failed |= bool(mismatches)
+    lines, ftms_failed = ftms_checks()
+    for line in lines:
+        print(line)
+    failed |= ftms_failed
+
+    radio.capture = False
+    print("Heap retained and cost per call")
+    for name, send in (("send_power", lambda: peripheral.send_power(250)),
+                       ("send_speed", lambda: peripheral.send_speed(1234, 56789)),
+                       ("send_cadence", lambda: peripheral.send_cadence(321, 45678))):
+        retained = alloc.bytes_per_call(send, 10000)
+        print("  {:<14} {:.2f} bytes, {:.2f} us".format(name + ":", retained, per_call_us(send)))
+        # A fraction of a byte is one-off interpreter noise; growth shows up as >= 1
+        failed |= retained >= 1
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Measures what main.py does before it starts advertising, and after.
+
+Usage (from the repository root):
+    python -m simulator.bench_boot
+
+Boots main.py from a fresh import and stops the clock at the first
+gap_advertise(). For comparison it also boots with the previous startup
+order: every module imported and the speed table built on import, then
+the LED, then advertising. For each it reports the host CPU time and the
+heap (tracemalloc) used before advertising, and from there until the main
+loop starts. Also shown: the source the Pico compiles before advertising
+when deployed as .py, and in all, against the .mpy files host.build
+produces (needs mpy-cross).
+
+Host CPU time only ranks the two orders; the Pico's own numbers are in
+main.py's log ("Advertising N ms after boot, M bytes free" and "Ready
+..."). Exits non-zero if any lookup table is built before advertising,
+or if the speed computed before the table exists differs from the
+table's.
+"""
+import builtins
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import simulator
+from simulator import bluetooth, uasyncio
+
+simulator.install()
+
+import config  # noqa: E402
+
+_OPERATION_MODULES = ("main", "peripheral", "get_cadence", "get_k_constant", "get_power", "get_speed", "logger",
+                      "stats", "blink", "recorder", "mailbox", "fixed_point", "level_tracker", "power_analytics",
+                      "idle")
+
+
+def _fresh_import(name):
+    for module in _OPERATION_MODULES:
+        sys.modules.pop(module, None)
+    return __import__(name)
+
+
+def _source_bytes(names):
+    """Bytes of .py source of the named operation modules that are imported, config included."""
+    return sum(os.path.getsize(sys.modules[name].__file__) for name in names + ("config",) if name in sys.modules)
+
+
+class _Probe:
+    """Records host time, heap, table-building work and imported source at the first advertisement."""
+    def __init__(self):
+        self.advertise_s = None
+        self.advertise_heap = None
+        self.tables_at_advertise = None
+        self.source_at_advertise = None
+        self.tables = 0
+        self._start = 0
+
+    def start(self):
+        tracemalloc.start()
+        self._start = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def advertise(self):
+        if self.advertise_s is None:
+            self.advertise_s = self.elapsed()
+            self.advertise_heap = tracemalloc.get_traced_memory()[0]
+            self.tables_at_advertise = self.tables
+            self.source_at_advertise = _source_bytes(_OPERATION_MODULES)
+
+    def stop(self):
+        heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return self.elapsed(), heap
+
+
+def boot(order):
+    """Boots main.py ('advertise-first') or the previous sequence ('previous'); returns the probe and totals."""
+    simulator.reset()
+    probe = _Probe()
+    original_advertise = bluetooth.BLE.gap_advertise
+
+    def gap_advertise(ble, interval_us, adv_data=None, connectable=True):
+        if interval_us:
+            probe.advertise()
+        return original_advertise(ble, interval_us, adv_data, connectable)
+
+    # main.py imports the table builders' modules late, so count their calls as they are imported
+    original_import = builtins.__import__
+
+    def counting_import(name, *args, **kwargs):
+        module = original_import(name, *args, **kwargs)
+        for module_name, builder in (("get_k_constant", "build_k_table"), ("get_speed", "build_speed_table")):
+            imported = sys.modules.get(module_name)
+            # Skips a module still being initialised, until its builder is defined
+            if hasattr(imported, builder) and not hasattr(imported, "_counted"):
+                imported._counted = True
+                original = getattr(imported, builder)
+
+                def counted(*args, _original=original):
+                    probe.tables += 1
+                    return _original(*args)
+                setattr(imported, builder, counted)
+        return module
+
+    bluetooth.BLE.gap_advertise = gap_advertise
+    builtins.__import__ = counting_import
+    ready = {}
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            probe.start()
+            main = _fresh_import("main")
+
+            if order == "previous":
+                async def previous_main():
+                    # Every module used to be imported by main.py's first lines
+                    for name in _OPERATION_MODULES:
+                        __import__(name)
+                    sys.modules["get_speed"].init_speed_table()  # Used to run on import
+                    main.logger.log("INFO", "Starting BLE Sensor...")
+                    uasyncio.create_task(main.logger.flush_task())
+                    led_manager = sys.modules["blink"].LEDManager()
+                    led_manager.start_blinking()
+                    main.BLEPeripheral(name=config.DEVICE_NAME)
+                    sys.modules["get_k_constant"].KConstant()
+                    ready["s"], ready["heap"] = probe.stop()
+                uasyncio.run(previous_main(), until_us=1000)
+            else:
+                original_collect = main.gc.collect
+
+                def collect():
+                    original_collect()
+                    if "s" not in ready:
+                        ready["s"], ready["heap"] = probe.stop()
+                main.gc.collect = collect
+                try:
+                    uasyncio.run(main.main(), until_us=1000)
+                finally:
+                    main.gc.collect = original_collect
+    finally:
+        bluetooth.BLE.gap_advertise = original_advertise
+        builtins.__import__ = original_import
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+    return probe, ready["s"], ready["heap"]
+
+
+def compiled_sizes():
+    """(source bytes, .mpy bytes) of the modules main.py imports, or None without mpy-cross."""
+    from host import build
+    mpy_cross = shutil.which("mpy-cross")
+    if mpy_cross is None:
+        return None
+    with tempfile.TemporaryDirectory() as output:
+        results = build.build(output, mpy_cross)
+    compiled = [r for r in results if r[1].endswith(".mpy")]
+    return sum(r[2] for r in compiled), sum(r[3] for r in compiled)
+
+
+def speed_before_table_matches():
+    get_speed = _fresh_import("get_speed")
+    before = [get_speed.get_flat_speed(watts) for watts in range(0, config.SPEED_TABLE_MAX_WATTS + 1, 7)]
+    get_speed.init_speed_table()
+    after = [get_speed.get_flat_speed(watts) for watts in range(0, config.SPEED_TABLE_MAX_WATTS + 1, 7)]
+    # The table stores float32, the fallback computes in double
+    return max(abs(a - b) for a, b in zip(before, after)) < 1e-4
+
+
+def main():
+    failed = False
+    # Each boot stops once set up; the tasks it started are never run
+    warnings.simplefilter("ignore", RuntimeWarning)
+    print("Host CPU and heap (tracemalloc) from import to first advertisement, and to main loop start")
+    print("  {:<16} {:>12} {:>12} {:>14} {:>14} {:>12} {:>12}".format(
+        "order", "advertise", "heap", "tables before", "source before", "ready", "heap"))
+    for order in ("previous", "advertise-first"):
+        probe, ready_s, ready_heap = boot(order)
+        print("  {:<16} {:>9.1f} ms {:>9.1f} KB {:>14} {:>8} bytes {:>9.1f} ms {:>9.1f} KB".format(
+            order, probe.advertise_s * 1000, probe.advertise_heap / 1024, probe.tables_at_advertise,
+            probe.source_at_advertise, ready_s * 1000, ready_heap / 1024))
+        if order == "advertise-first" and probe.tables_at_advertise:
+            failed = True
+
+    sizes = compiled_sizes()
+    if sizes is None:
+        print("Compiled size: mpy-cross not installed")
+    else:
+        print("Compiled on the Pico at import: {} bytes of .py source, or none from {} bytes of .mpy".format(*sizes))
+
+    if not speed_before_table_matches():
+        print("Speed before the table is built differs from the table")
+        failed = True
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
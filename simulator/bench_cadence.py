@@ -0,0 +1,199 @@
+"""Benchmarks the ring-buffer CadenceSensor against the original list-based one.
+
+Usage (from the repository root):
+    python -m simulator.bench_cadence
+
+Reports per-pulse and per-calculate_cadence() cost, the MicroPython heap
+allocations each path contains (see simulator.alloc) and the largest
+difference in reported cadence over a ride with sprints and stops. Also
+replays stops nobody is connected through, so calculate_cadence() isn't
+called until after them. Exits non-zero if the IRQ handler or
+calculate_cadence() contains a container allocation, if heap is retained as
+pulses accumulate, or if a long stop leaves stale cadence or drops pulses.
+"""
+import sys
+import time
+
+import simulator
+from simulator import alloc, machine, traces
+from simulator.bench import per_call_us
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import config  # noqa: E402
+from machine import Pin  # noqa: E402
+from get_cadence import CadenceSensor  # noqa: E402
+
+_RIDE = [(20000, 85), (5000, 110), (15000, 70), (6000, 0), (20000, 95)]
+_MAX_RPM_DIFF = 1.0
+# Stops longer than ticks_diff can span on ticks_us (2**29 us, about 537 s)
+_LONG_STOPS_S = (60, 600, 900)
+_RESUME_RPM = 90
+
+
+class LegacyCadenceSensor:
+    """The list-based sensor this benchmark replaced, kept for comparison."""
+    def __init__(self):
+        self.pulse_times = []
+        self.debounce_time = 0
+        self.reed_switch = Pin(config.REED_PIN, Pin.IN, Pin.PULL_UP)
+        self.current_rpm = 0.0
+
+    def reed_callback(self, pin):
+        current_time = time.ticks_ms()
+        if (time.ticks_diff(current_time, self.debounce_time) > 50 and
+                (not self.pulse_times or time.ticks_diff(current_time, self.pulse_times[-1]) > 100)):
+            if pin.value() == 0:
+                self.pulse_times.append(current_time)
+                self.debounce_time = current_time
+                if len(self.pulse_times) > 5:
+                    self.pulse_times.pop(0)
+
+    def calculate_cadence(self, current_time):
+        if self.pulse_times and time.ticks_diff(current_time, self.pulse_times[-1]) > config.TIMEOUT_MS:
+            self.pulse_times = []
+            new_rpm = 0.0
+        elif len(self.pulse_times) >= 2:
+            recent_times = self.pulse_times[-min(len(self.pulse_times), 4):]
+            periods = []
+            for i in range(1, len(recent_times)):
+                period = recent_times[i] - recent_times[i-1]
+                if period >= 1000 * 60 / config.MAX_RPM:
+                    periods.append(period)
+            if periods:
+                new_rpm = 60000 / (sum(periods) / len(periods))
+            else:
+                new_rpm = self.current_rpm
+        else:
+            new_rpm = 0.0
+        if self.current_rpm == 0:
+            self.current_rpm = new_rpm
+        else:
+            self.current_rpm = 0.8 * new_rpm + 0.2 * self.current_rpm
+        return self.current_rpm
+
+
+class _ClosedSwitch:
+    def value(self):
+        return 0
+
+
+def compare_ride():
+    """Feeds both sensors the same ride; returns the largest cadence difference."""
+    simulator.reset()
+    new = CadenceSensor()
+    legacy = LegacyCadenceSensor()
+    # Both sensors listen on the same line
+    new_handler = new.reed_callback
+    machine.line(config.REED_PIN).handler = lambda pin: (new_handler(pin), legacy.reed_callback(pin))
+    machine.schedule_pulses(config.REED_PIN, traces.pulse_times(_RIDE))
+    worst = 0.0
+    end_us = sum(d for d, _ in _RIDE) * 1000
+    while CLOCK.now_us < end_us:
+        CLOCK.advance_to(CLOCK.now_us + 100000)
+        diff = abs(new.calculate_cadence(time.ticks_us()) - legacy.calculate_cadence(time.ticks_ms()))
+        worst = max(worst, diff)
+    return worst
+
+
+def long_stop(stop_s):
+    """Rides, stops for stop_s with nobody calling calculate_cadence(), then resumes.
+
+    Returns (cadence 1 s after someone connects at the end of the stop,
+    pulses accepted after it, pulses scheduled after it, cadence 20 s into
+    the resumed ride).
+    """
+    simulator.reset()
+    sensor = CadenceSensor()
+    stop_ms = 20000 + stop_s * 1000
+    ride = [(20000, 80), (stop_s * 1000, 0), (20000, _RESUME_RPM)]
+    times = traces.pulse_times(ride)
+    machine.schedule_pulses(config.REED_PIN, times)
+    while CLOCK.now_us < 20000000:
+        CLOCK.advance_to(CLOCK.now_us + 100000)
+        sensor.calculate_cadence(time.ticks_us())
+    # Disconnected: the loops don't calculate during the stop
+    CLOCK.advance_to((stop_ms - 1000) * 1000)
+    before = sensor.pulse_count
+    while CLOCK.now_us < stop_ms * 1000:
+        CLOCK.advance_to(CLOCK.now_us + 100000)
+        after_stop = sensor.calculate_cadence(time.ticks_us())
+    end_us = (stop_ms + 20000) * 1000
+    while CLOCK.now_us < end_us:
+        CLOCK.advance_to(CLOCK.now_us + 100000)
+        rpm = sensor.calculate_cadence(time.ticks_us())
+    scheduled = sum(1 for t in times if stop_ms < t and int(t * 1000) <= end_us)
+    return after_stop, sensor.pulse_count - before, scheduled, rpm
+
+
+def pulse_driver(sensor, period_us=700000):
+    """A callable that delivers one accepted pulse per call."""
+    pin = _ClosedSwitch()
+
+    def pulse():
+        CLOCK.now_us += period_us
+        sensor.reed_callback(pin)
+    return pulse
+
+
+def main():
+    failed = False
+
+    print("Allocating operations (MicroPython heap)")
+    for name, fn in (("reed_callback", CadenceSensor.reed_callback),
+                     ("calculate_cadence", CadenceSensor.calculate_cadence),
+                     ("last_pulse_us", CadenceSensor.last_pulse_us),
+                     ("_reset_window", CadenceSensor._reset_window),
+                     ("legacy reed_callback", LegacyCadenceSensor.reed_callback),
+                     ("legacy calculate_cadence", LegacyCadenceSensor.calculate_cadence)):
+        containers, floats = alloc.audit(fn)
+        print("  {:<26} {} container, {} float".format(name + ":", len(containers), len(floats)))
+        for op in containers:
+            print("      " + op)
+        if containers and not name.startswith("legacy"):
+            failed = True
+
+    print("Heap retained (bytes per call, over 10000 calls)")
+    for label, cls in (("ring buffer", CadenceSensor), ("legacy", LegacyCadenceSensor)):
+        simulator.reset()
+        sensor = cls()
+        pulse = pulse_driver(sensor)
+        now = time.ticks_us if cls is CadenceSensor else time.ticks_ms
+        per_pulse = alloc.bytes_per_call(pulse, 10000)
+        per_calc = alloc.bytes_per_call(lambda: sensor.calculate_cadence(now()), 10000)
+        print("  {:<12} per pulse {:.2f}, per calculate_cadence {:.2f}".format(label, per_pulse, per_calc))
+        # A fraction of a byte is one-off interpreter noise; growth shows up as >= 1
+        if cls is CadenceSensor and (per_pulse >= 1 or per_calc >= 1):
+            failed = True
+
+    print("Per-call cost (host CPU)")
+    for label, cls in (("ring buffer", CadenceSensor), ("legacy", LegacyCadenceSensor)):
+        simulator.reset()
+        sensor = cls()
+        pulse = pulse_driver(sensor)
+        now = time.ticks_us if cls is CadenceSensor else time.ticks_ms
+        print("  {:<12} pulse {:.2f} us, calculate_cadence {:.2f} us".format(
+            label, per_call_us(pulse), per_call_us(lambda: sensor.calculate_cadence(now()))))
+
+    worst = compare_ride()
+    print("Max cadence difference vs legacy over a {} s ride: {:.3f} RPM".format(
+        sum(d for d, _ in _RIDE) // 1000, worst))
+    if worst > _MAX_RPM_DIFF:
+        failed = True
+
+    print("Stops with nobody connected, then {} RPM for 20 s".format(_RESUME_RPM))
+    for stop_s in _LONG_STOPS_S:
+        after_stop, pulses, scheduled, rpm = long_stop(stop_s)
+        print("  {:>4} s stop: {:.1f} RPM on connecting, {}/{} pulses, {:.1f} RPM resumed".format(
+            stop_s, after_stop, pulses, scheduled, rpm))
+        if after_stop > 0.1 or pulses != scheduled or abs(rpm - _RESUME_RPM) > _MAX_RPM_DIFF:
+            failed = True
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Checks host.fit_k_table against simulated coast-down captures.
+
+Usage (from the repository root):
+    python -m simulator.bench_calibration [--sessions 4] [--bearing-w 3.0]
+
+Generates captures for all 15 levels from the k values in operation/config.py
+and a known bearing loss: five runs per level, each a spin-up past 850 RPM
+followed by a coast-down, with 30 us of timestamp jitter and the ticks_us
+counter wrapping mid-capture. Reports how far the fitted table and the
+README's 750 -> 300 RPM rule land from the true k, and how long the batch
+fit takes. Exits non-zero if any fitted k is off by more than 1%.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import simulator
+from simulator import traces
+
+simulator.install()
+
+import config  # noqa: E402
+from host import fit_k_table  # noqa: E402
+from host.capture import TICKS_PERIOD_US, Capture, load_capture, save_capture  # noqa: E402
+
+_RUNS = 5
+_JITTER_US = 30
+_TOLERANCE = 0.01
+
+
+def level_capture(level, k, voltage, bearing_w, rng):
+    times_ms = []
+    t = 0.0
+    for _ in range(_RUNS):
+        spin_up = traces.pulse_times([(1500, 300), (1500, 600), (1500, 850)], start_ms=t)
+        coast = traces.coast_down(k, bearing_w, fit_k_table.INERTIA_KG_M2, 850, 150, start_ms=spin_up[-1])
+        times_ms += spin_up + coast[1:]
+        t = coast[-1] + 2000
+    # Start close to the wrap so every capture crosses it
+    origin_us = TICKS_PERIOD_US - 20000000
+    ticks = [(origin_us + int(ms * 1000 + rng.gauss(0, _JITTER_US))) % TICKS_PERIOD_US for ms in times_ms]
+    return Capture(ticks, level, voltage, header={"simulated": "yes"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=4, help="independent capture sessions to fit together")
+    parser.add_argument("--bearing-w", type=float, default=3.0, help="simulated bearing loss")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    truth = config.LEVEL_K_SORTED
+    captures = []
+    with tempfile.TemporaryDirectory() as session_dir:
+        for session in range(args.sessions):
+            for level, (k, voltage) in enumerate(zip(truth, config.LEVEL_VOLTAGE_SORTED), start=1):
+                path = os.path.join(session_dir, "s{}_level_{:02d}.txt".format(session, level))
+                save_capture(path, level_capture(level, k, voltage, args.bearing_w, rng))
+                captures.append(load_capture(path))
+
+    start = time.perf_counter()
+    result = fit_k_table.fit(captures)
+    fit_ms = (time.perf_counter() - start) * 1000
+    pulses = sum(len(c.ticks_us) for c in captures)
+
+    fit_error = [abs(k / true - 1) for k, true in zip(result.k, truth)]
+    rule_error = [abs(k / true - 1) for k, true in zip(result.rule, truth)]
+    print("{:>5} {:>12} {:>12} {:>9} {:>12} {:>9}".format("Level", "true k", "fit", "error", "rule", "error"))
+    for level, true, k, fe, rk, re in zip(result.levels, truth, result.k, fit_error, result.rule, rule_error):
+        print("{:>5} {:>12.6g} {:>12.6g} {:>8.2%} {:>12.6g} {:>8.2%}".format(level, true, k, fe, rk, re))
+    print("Bearing loss: {:.2f} W fitted, {:.2f} W simulated".format(result.bearing_w, args.bearing_w))
+    print("Runs found: {} of {}".format(sum(result.runs), _RUNS * len(truth) * args.sessions))
+    print("Max k error: fit {:.2%}, rule {:.2%}".format(max(fit_error), max(rule_error)))
+    print("Batch fit: {} captures, {} pulses in {:.0f} ms".format(len(captures), pulses, fit_ms))
+
+    if max(fit_error) > _TOLERANCE or sum(result.runs) != _RUNS * len(truth) * args.sessions:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
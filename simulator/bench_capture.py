@@ -0,0 +1,121 @@
+"""Runs calibration/reed-wheel-capture.py on simulated hardware and decodes its stream.
+
+Usage (from the repository root):
+    python -m simulator.bench_capture
+
+Five coast-downs from 850 RPM are captured; the bytes the script writes to
+USB serial, preceded by REPL echo, are fed to host.capture_stream in random
+chunk sizes. Every pulse must come back with its exact ticks_us. For
+comparison it reports the period error of the old 2 ms busy-poll with
+ticks_ms timing. Exits non-zero if a pulse is lost or altered.
+"""
+import contextlib
+import io
+import math
+import os
+import random
+import sys
+import time
+
+import simulator
+from simulator import machine, traces
+from simulator.clock import CLOCK, TICKS_PERIOD
+
+simulator.install()
+
+from host import fit_k_table  # noqa: E402
+from host.capture_stream import StreamDecoder  # noqa: E402
+
+_SCRIPT = os.path.join(os.path.dirname(simulator.OPERATION_DIR), "calibration", "reed-wheel-capture.py")
+_REED_PIN = 9
+_K = 0.0156997  # Level 7
+_BEARING_W = 3.0
+_POLL_MS = 2
+_REPL_ECHO = b"exec(open('reed-wheel-capture.py').read())\r\n"
+
+
+class _Stdout:
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, text):
+        self.buffer.write(text.encode())
+
+
+def ride():
+    times_ms = []
+    t = 1000.0
+    for _ in range(5):
+        coast = traces.coast_down(_K, _BEARING_W, fit_k_table.INERTIA_KG_M2, 850, 200, start_ms=t)
+        times_ms += coast
+        t = coast[-1] + 3000
+    return times_ms
+
+
+def stop():
+    raise KeyboardInterrupt
+
+
+def run_script(times_ms, start_us):
+    simulator.reset()
+    CLOCK.now_us = start_us
+    machine.schedule_pulses(_REED_PIN, [start_us / 1000 + t for t in times_ms], width_ms=5)
+    machine.set_adc_voltage(27, 0.7)
+    CLOCK.schedule(start_us + int((times_ms[-1] + 1000) * 1000), stop)
+    stdout = _Stdout()
+    with contextlib.redirect_stdout(stdout):
+        exec(compile(open(_SCRIPT).read(), _SCRIPT, "exec"), {"__name__": "__main__"})
+    return stdout.buffer.getvalue()
+
+
+def polled_ticks_ms(times_ms):
+    """What the 2 ms busy-poll loop timestamps: the first poll at or after each edge, in whole ms."""
+    return [math.floor(math.ceil(t / _POLL_MS) * _POLL_MS) for t in times_ms]
+
+
+def main():
+    times_ms = ride()
+    # Start the clock 10 s before ticks_us wraps, so the capture crosses it
+    start_us = TICKS_PERIOD - 10000000
+    stream = run_script(times_ms, start_us)
+
+    rng = random.Random(1)
+    data = _REPL_ECHO + stream
+    decoder = StreamDecoder()
+    decode_start = time.perf_counter()
+    i = 0
+    while i < len(data):
+        n = rng.randint(1, 300)
+        decoder.feed(data[i:i + n])
+        i += n
+    decode_s = time.perf_counter() - decode_start
+
+    expected = [(start_us + int(t * 1000)) % TICKS_PERIOD for t in times_ms]
+    exact = decoder.ticks_us == expected
+    print("Pulses: {} sent, {} decoded, identical: {}".format(len(expected), len(decoder.ticks_us), exact))
+    print("Frames: {}, lost {}, bad CRC {}, edges dropped on Pico {}, non-frame bytes skipped {}".format(
+        decoder.frames, decoder.lost_frames, decoder.bad_frames, decoder.lost_edges, decoder.skipped_bytes))
+    print("Stream: {} bytes for {} pulses ({:.1f} bytes/pulse), voltage {:.3f} V".format(
+        len(stream), len(expected), len(stream) / len(expected), decoder.voltage()))
+    print("Host decode: {:.1f} MB/s".format(len(data) / decode_s / 1e6))
+
+    polled = polled_ticks_ms(times_ms)
+    periods = []
+    poll_error = []
+    for i in range(1, len(times_ms)):
+        period = times_ms[i] - times_ms[i - 1]
+        if period < 1000:  # Skip the pauses between runs
+            periods.append(period)
+            poll_error.append(abs(polled[i] - polled[i - 1] - period) * 1000)
+    fast = min(periods)
+    print("Period error, 2 ms poll + ticks_ms: max {:.0f} us, i.e. {:.1f} RPM at {:.0f} RPM".format(
+        max(poll_error), 60000 / (fast - max(poll_error) / 1000) - 60000 / fast, 60000 / fast))
+    print("Period error, IRQ + ticks_us: 0 us (simulated edges are exact; on the Pico IRQ latency is a few us)")
+
+    if not exact or decoder.lost_frames or decoder.bad_frames or decoder.lost_edges:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Compares the single-core event loop with the dual-core mode (LOOP_MODE "dual").
+
+Usage (from the repository root):
+    python -m simulator.bench_dual_core [--busy-ms 30] [--every-ms 400]
+
+Part 1 hammers operation/mailbox.py from two free-running CPython threads.
+It switches threads as often as the interpreter allows and counts torn
+snapshots, with a plain unguarded copy of the same slots as a control,
+and the reads that gave up and kept their last snapshot. It also lists
+the heap allocations in Mailbox.read (see simulator.alloc).
+
+Part 2 rides through main.py in both modes while core 0 is also busy for
+--busy-ms every --every-ms. That stands in for other work on core 0: BLE
+stack events, USB printing, a central's requests. It reports the jitter of
+the power/speed refresh (REFRESH_INTERVAL_MS apart when undisturbed) and
+the pulse-to-notification latency. Busy time is charged in virtual time
+only; the simulator does not model the cost of the Python code itself, or
+GC pauses and flash writes, which stop both cores. Exits non-zero if a
+torn snapshot gets through the mailbox, a read retries more than
+_MAX_TRIES times, or Mailbox.read allocates.
+"""
+import argparse
+import sys
+import threading
+import time
+
+import simulator
+from simulator import alloc, bench, bluetooth, traces, uasyncio
+from simulator.clock import CLOCK
+from simulator.bench_loop_modes import crank_notifications, pulse_latencies_ms
+
+simulator.install()
+
+import config  # noqa: E402
+import get_power  # noqa: E402
+import mailbox  # noqa: E402
+from mailbox import Mailbox  # noqa: E402
+
+_RIDE = [(40000, 85), (20000, 60), (30000, 100)]
+_VOLTS = 0.7
+_STRESS_S = 1.0
+
+
+def stress(guarded):
+    """Returns (reads, torn, retries, stale) for a producer and consumer racing for _STRESS_S."""
+    box = Mailbox(6)
+    slots = [0] * 6
+    stop = threading.Event()
+
+    def produce():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            box.begin()
+            for j in range(6):
+                box.slots[j] = i
+            box.end()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    reads = torn = most_retries = 0
+    deadline = time.perf_counter() + _STRESS_S
+    while time.perf_counter() < deadline:
+        if guarded:
+            retries = box.retries
+            box.read(slots)
+            most_retries = max(most_retries, box.retries - retries)
+        else:
+            slots[:] = box.slots
+        reads += 1
+        torn += len(set(slots)) != 1
+    stop.set()
+    producer.join()
+    return reads, torn, box.retries, box.stale, most_retries
+
+
+def ride(mode, busy_ms, every_ms):
+    config.LOOP_MODE = mode
+    refreshes = []
+    # main() imports get_power from its module on every run
+    original = get_power.get_power
+
+    def timed_get_power(cadence, k):
+        refreshes.append(CLOCK.now_us)
+        return original(cadence, k)
+
+    async def core0_busy():
+        while True:
+            await uasyncio.sleep_ms(every_ms)
+            time.sleep_ms(busy_ms)  # Blocks core 0 only
+
+    pulses = traces.pulse_times(_RIDE)
+    seconds = sum(d for d, _ in _RIDE) // 1000
+    get_power.get_power = timed_get_power
+    try:
+        stats = bench.run_ride(seconds, 0, _VOLTS, pulses=pulses,
+                               setup=lambda: simulator.at_ms(1, lambda: uasyncio.create_task(core0_busy())))
+    finally:
+        get_power.get_power = original
+    # In event mode get_power runs only while connected; compare the same span
+    refreshes = [t for t in refreshes if t > 2000000]
+    deviation = sorted(abs((b - a) / 1000 - config.REFRESH_INTERVAL_MS) for a, b in zip(refreshes, refreshes[1:]))
+    latencies = sorted(pulse_latencies_ms(pulses, crank_notifications(bluetooth.BLE())))
+    return stats, deviation, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--busy-ms", type=float, default=30, help="core 0 busy period")
+    parser.add_argument("--every-ms", type=float, default=400, help="time between busy periods")
+    args = parser.parse_args()
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        guarded = stress(True)
+        control = stress(False)
+    finally:
+        sys.setswitchinterval(switch_interval)
+    print("Mailbox under two racing threads ({:.0f} s each)".format(_STRESS_S))
+    print("  seqlock read:   {} reads, {} torn, {} retried, {} kept the last snapshot, "
+          "at most {} retries in one read".format(*guarded))
+    print("  unguarded copy: {} reads, {} torn".format(*control[:2]))
+    containers, floats = alloc.audit(Mailbox.read)
+    print("  Mailbox.read allocation sites: {} containers, {} floats".format(len(containers), len(floats)))
+
+    saved_mode = config.LOOP_MODE
+    print("")
+    print("Ride with core 0 busy {:.0f} ms every {:.0f} ms".format(args.busy_ms, args.every_ms))
+    print("{:<6} {:>12} {:>12} {:>10} {:>10} {:>10}".format(
+        "mode", "refresh p95", "refresh max", "lat mean", "lat p95", "lat max"))
+    for mode in ("event", "dual"):
+        _, deviation, latencies = ride(mode, args.busy_ms, args.every_ms)
+        print("{:<6} {:>10.1f}ms {:>10.1f}ms {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms".format(
+            mode, deviation[int(len(deviation) * 0.95)], deviation[-1],
+            sum(latencies) / len(latencies), latencies[int(len(latencies) * 0.95)], latencies[-1]))
+    config.LOOP_MODE = saved_mode
+
+    if guarded[1] or guarded[4] > mailbox._MAX_TRIES or containers or floats:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Measures BLEPeripheral with several centrals connected at once.
+
+Usage (from the repository root):
+    python -m simulator.bench_fanout
+
+Slots: centrals connect one after another; the peripheral must keep
+advertising until BLE_MAX_CONNECTIONS are connected, refuse the next one
+and advertise again when one leaves.
+
+Fan-out: the same ride is run with 1 to BLE_MAX_CONNECTIONS centrals on
+equal 30 ms connections. Every central must receive exactly the
+notifications (time, characteristic, bytes) the single central did.
+Reported: host CPU per send and per main-loop iteration, against
+encoding the measurement once per central.
+
+Backpressure: two centrals on 30 ms connections share the ride with a
+third on a slow 500 ms connection, and then with one that stopped
+listening (its link buffers fill up and the stack refuses further
+notifications). The fast centrals must still get what a single central
+gets, and everything the slow one gets must be the latest value.
+
+Subscriptions: with three centrals, one enables only the power
+measurement's notifications and one disables all of its own halfway
+through. Each must get exactly what a single central gets of the
+characteristics it is subscribed to, and nothing else.
+
+Exits non-zero if any of these fails, or if the fan-out path allocates.
+"""
+import contextlib
+import os
+import sys
+
+import simulator
+from simulator import alloc, bench, bluetooth, traces
+from simulator.bench import per_call_us
+
+simulator.install()
+
+import config  # noqa: E402
+from peripheral import BLEPeripheral, NotificationScheduler  # noqa: E402
+
+_RIDE = [(30000, 85), (10000, 0), (20000, 100)]
+_VOLTS = 0.7
+_FAST_MS = 30
+_SLOW_MS = 500
+_NEGOTIATE_AT_MS = 600
+_UNSUBSCRIBE_MS = 30000
+_CPS_MEASUREMENT = 0x2A63
+_FAN_OUT_CALLS = (BLEPeripheral._fan_out, BLEPeripheral.send_power, BLEPeripheral.send_csc, BLEPeripheral.send_bike,
+                  NotificationScheduler.flush, NotificationScheduler._due, NotificationScheduler._deliver_power,
+                  NotificationScheduler._deliver_csc, NotificationScheduler._deliver_bike,
+                  NotificationScheduler._mark_sent, NotificationScheduler._stale_wait_ms,
+                  NotificationScheduler._subscribed)
+
+
+def _quiet():
+    return contextlib.redirect_stdout(open(os.devnull, "w"))
+
+
+def slots():
+    """Advertising state as centrals come and go; returns (lines, failed)."""
+    simulator.reset()
+    radio = bluetooth.BLE()
+    lines, failed = [], False
+    with _quiet():
+        peripheral = BLEPeripheral(name="bench")
+        for handle in range(config.BLE_MAX_CONNECTIONS + 1):
+            connected = radio.connect(handle)
+            expected = handle < config.BLE_MAX_CONNECTIONS
+            lines.append("central {} {:<9} {} connected, advertising {}".format(
+                handle, "connects," if connected else "refused,", peripheral.connections, peripheral.advertising))
+            failed |= connected != expected or peripheral.advertising != (peripheral.connections
+                                                                          < config.BLE_MAX_CONNECTIONS)
+        radio.disconnect(1)
+        lines.append("central 1 leaves,   {} connected, advertising {}".format(
+            peripheral.connections, peripheral.advertising))
+        failed |= not peripheral.advertising
+        connected = radio.connect(config.BLE_MAX_CONNECTIONS)
+        lines.append("central {} {:<9} {} connected, advertising {}".format(
+            config.BLE_MAX_CONNECTIONS, "connects," if connected else "refused,", peripheral.connections,
+            peripheral.advertising))
+        failed |= not connected or peripheral.advertising
+    return lines, failed
+
+
+def send_costs(centrals):
+    """Host CPU per send_power and send_csc call with centrals connected."""
+    simulator.reset()
+    radio = bluetooth.BLE()
+    with _quiet():
+        peripheral = BLEPeripheral(name="bench")
+        for handle in range(centrals):
+            radio.connect(handle)
+    radio.capture = False
+    return (per_call_us(lambda: peripheral.send_power(250)),
+            per_call_us(lambda: peripheral.send_csc(1234, 56789, 321, 45678)))
+
+
+def ride(intervals_ms, links=None, only=None, unsubscribe=()):
+    """Rides main.py with one central per entry of intervals_ms; returns (notifications by handle, stats, peripheral).
+
+    The centrals in only subscribe to just the characteristics it lists
+    for them (UUID values), those in unsubscribe disable every
+    notification at _UNSUBSCRIBE_MS; the others subscribe to all.
+    """
+    links = links or {}
+    only = only or {}
+    seconds = sum(d for d, _ in _RIDE) // 1000
+
+    def setup():
+        # bench.run_ride connects central 0; the others connect at the same moment
+        for handle in range(1, len(intervals_ms)):
+            simulator.at_ms(bench._CONNECT_AT_MS, lambda handle=handle: connect(handle))
+        for handle, interval_ms in enumerate(intervals_ms):
+            simulator.at_ms(_NEGOTIATE_AT_MS,
+                            lambda handle=handle, interval_ms=interval_ms: negotiate(handle, interval_ms))
+        for handle in unsubscribe:
+            simulator.at_ms(_UNSUBSCRIBE_MS, lambda handle=handle: subscribe(handle, bluetooth.BLE().notify_handles,
+                                                                             False))
+
+    def connect(handle):
+        radio = bluetooth.BLE()
+        radio.connect(handle, subscribe=handle not in only)
+        if handle in only:
+            subscribe(handle, [radio.char_handles[uuid] for uuid in only[handle]], True)
+
+    def subscribe(handle, value_handles, enabled):
+        for value_handle in value_handles:
+            bluetooth.BLE().subscribe(handle, value_handle, enabled)
+
+    def negotiate(handle, interval_ms):
+        radio = bluetooth.BLE()
+        radio.update_connection(handle, interval_ms)
+        if handle in links:
+            radio.set_link(handle, interval_ms, **links[handle])
+
+    stats = bench.run_ride(seconds, 0, _VOLTS, pulses=traces.pulse_times(_RIDE), setup=setup)
+    radio = bluetooth.BLE()
+    by_handle = {handle: [] for handle in range(len(intervals_ms))}
+    for t_us, handle, value_handle, payload in radio.notifications:
+        by_handle[handle].append((t_us, value_handle, payload))
+    return by_handle, stats, radio._handler.__self__
+
+
+def stale_values(slow, fast):
+    """Notifications of the slow central that weren't the latest the fast one had at the time.
+
+    A value on air at that very moment counts too: the two tasks that send
+    may run in either order within one tick.
+    """
+    current, stale, i = {}, 0, 0
+    for t_us, value_handle, payload in slow:
+        while i < len(fast) and fast[i][0] < t_us:
+            current[fast[i][1]] = {fast[i][2]}
+            i += 1
+        at_once, j = set(), i
+        while j < len(fast) and fast[j][0] == t_us:
+            if fast[j][1] == value_handle:
+                at_once.add(fast[j][2])
+            j += 1
+        stale += payload not in current.get(value_handle, set()) | at_once
+    return stale
+
+
+def main():
+    failed = False
+
+    print("Connection slots (BLE_MAX_CONNECTIONS = {})".format(config.BLE_MAX_CONNECTIONS))
+    lines, slots_failed = slots()
+    for line in lines:
+        print("  " + line)
+    failed |= slots_failed
+
+    print("Allocation sites (containers, floats)")
+    for fn in _FAN_OUT_CALLS:
+        containers, floats = alloc.audit(fn)
+        print("  {:<40} {:>3}, {:<3}".format(fn.__qualname__, len(containers), len(floats)))
+        if containers or floats:
+            failed = True
+
+    single = single_costs = None
+    print("Fan-out, {} ms connections       identical  send_power  send_csc  (once per central)  "
+          "per iteration".format(_FAST_MS))
+    for centrals in range(1, config.BLE_MAX_CONNECTIONS + 1):
+        by_handle, stats, _ = ride([_FAST_MS] * centrals)
+        if single is None:
+            single = by_handle[0]
+        identical = sum(received == single for received in by_handle.values())
+        power_us, csc_us = send_costs(centrals)
+        single_costs = single_costs or (power_us, csc_us)
+        print("  {} central{:<23} {:>3} of {}  {:>7.2f} us  {:>5.2f} us  ({:>5.2f}, {:>5.2f} us)  {:>10.1f} us".format(
+            centrals, "s" if centrals > 1 else "", identical, centrals, power_us, csc_us,
+            single_costs[0] * centrals, single_costs[1] * centrals, stats["us_per_iteration"]))
+        failed |= identical != centrals or not single
+
+    print("Backpressure, two {} ms centrals and a third    fast identical  received  not latest  "
+          "refused   skipped".format(_FAST_MS))
+    for name, links in (("on a {} ms connection".format(_SLOW_MS), {}),
+                        ("that stopped listening", {2: {"buffers": 4, "per_event": 0}})):
+        by_handle, _, peripheral = ride([_FAST_MS, _FAST_MS, _SLOW_MS], links)
+        identical = (by_handle[0] == single) + (by_handle[1] == single)
+        stale = stale_values(by_handle[2], by_handle[0])
+        print("  {:<44} {:>6} of 2  {:>4} of {:<4} {:>8} {:>9} {:>9}".format(
+            name, identical, len(by_handle[2]), len(single), stale, peripheral.refused,
+            peripheral.scheduler.skipped))
+        failed |= identical != 2 or stale > 0 or not by_handle[2]
+
+    print("Subscriptions, three {} ms centrals                            received  expected".format(_FAST_MS))
+    by_handle, _, _ = ride([_FAST_MS] * 3, only={1: [_CPS_MEASUREMENT]}, unsubscribe=[2])
+    power = bluetooth.BLE().char_handles[_CPS_MEASUREMENT]
+    unsubscribed_us = _UNSUBSCRIBE_MS * 1000
+    for name, received, expected in (
+            ("all characteristics", by_handle[0], single),
+            ("power measurement only", by_handle[1], [n for n in single if n[1] == power]),
+            ("all, disabled at {} s".format(_UNSUBSCRIBE_MS // 1000), by_handle[2],
+             [n for n in single if n[0] < unsubscribed_us])):
+        print("  {:<58} {:>8} {:>9}".format(name, len(received), len(expected)))
+        failed |= received != expected
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
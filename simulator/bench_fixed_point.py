@@ -0,0 +1,224 @@
+"""Compares the fixed-point model (MODEL_ARITHMETIC "fixed") with the float one.
+
+Usage (from the repository root):
+    python -m simulator.bench_fixed_point [--seconds 120]
+
+Error bounds: every stage of operation/fixed_point.py is checked against
+its float counterpart on the same inputs, over a grid of reed periods,
+every 8th ADC code and every whole watt up to 1.2x SPEED_TABLE_MAX_WATTS.
+The whole chain, smoothing included, is then run side by side on the
+pipeline scenarios of simulator.replay. Exits non-zero if any error is
+beyond its bound below.
+
+Cost: the heap allocations in each stage (see simulator.alloc; floats
+are boxed on the Pico, small ints are not), the host CPU per call and
+per main-loop iteration of an event-mode ride in each mode. CPython
+boxes ints as well as floats, so host timings are only indicative; on
+the Pico the gain is the float allocations, and collections, avoided.
+"""
+import argparse
+import sys
+
+import simulator
+from simulator import alloc, bench, machine, replay, traces
+from simulator.bench import per_call_us
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import config  # noqa: E402
+import fixed_point  # noqa: E402
+from get_cadence import CadenceSensor, _MIN_PERIOD_US, _TIMEOUT_US  # noqa: E402
+from get_k_constant import KConstant, build_k_table, build_power_coefficient_table, table_index  # noqa: E402
+from get_power import get_power  # noqa: E402
+from get_speed import get_flat_speed_table, init_speed_table  # noqa: E402
+from main import wheel_time_per_rev_ms  # noqa: E402
+from recorder import RideRecorder  # noqa: E402
+
+# Largest difference allowed against the float path
+_CADENCE_BOUND_RPM = 1 / fixed_point.CADENCE_ONE
+_POWER_BOUND_W = 1
+_SPEED_BOUND_KPH = 0.006     # Rounding to 1/100 km/h, and the float table's float32
+_WHEEL_BOUND_MS = 0.5
+_RIDE_CADENCE_BOUND_RPM = 0.05
+_RIDE_POWER_BOUND_W = 1
+_ADC_STEP = 8
+
+_FLOAT_STAGES = {
+    "calculate_cadence": CadenceSensor.calculate_cadence,
+    "get_k_constant": KConstant.get_k_constant,
+    "get_power": get_power,
+    "get_flat_speed": get_flat_speed_table,
+    "wheel_time_per_rev_ms": wheel_time_per_rev_ms,
+    "recorder.append": RideRecorder.append,
+}
+_FIXED_STAGES = {
+    "calculate_cadence": CadenceSensor.calculate_cadence_fixed,
+    "get_k_constant": KConstant.get_power_coefficient,
+    "get_power": fixed_point.get_power,
+    "get_flat_speed": fixed_point.get_flat_speed,
+    "wheel_time_per_rev_ms": fixed_point.wheel_time_per_rev_ms,
+    "recorder.append": RideRecorder.append_scaled,
+}
+# Called by the stages above
+_HELPERS = (CadenceSensor._take_window, fixed_point.cadence)
+
+
+def _periods():
+    period = _MIN_PERIOD_US
+    while period < _TIMEOUT_US:
+        yield period
+        period = period * 101 // 100 + 7
+
+
+def grid_errors(k_table, coefficient_table):
+    """Largest fixed-vs-float difference of each stage on identical inputs."""
+    errors = {"cadence": 0.0, "power": 0, "speed": 0.0, "wheel": 0.0, "k_x1e6": 0}
+    for period_n in range(1, 4):
+        for period in _periods():
+            # Uneven windows too: the last period a little longer than the rest
+            period_sum = period * period_n + (period_n - 1) * 37
+            rpm = 60000000 * period_n / period_sum
+            cadence = fixed_point.cadence(period_sum, period_n)
+            errors["cadence"] = max(errors["cadence"], abs(cadence / fixed_point.CADENCE_ONE - rpm))
+            for code in range(0, 4096, _ADC_STEP):
+                i = table_index(code)
+                power = fixed_point.get_power(cadence, coefficient_table[i])
+                errors["power"] = max(errors["power"], abs(power - get_power(rpm, k_table[i])))
+    for code in range(0, 4096, _ADC_STEP):
+        i = table_index(code)
+        k_x1e6 = fixed_point.k_x1e6(coefficient_table[i])
+        errors["k_x1e6"] = max(errors["k_x1e6"], abs(k_x1e6 - int(k_table[i] * 1000000)))
+    for watts in range(0, config.SPEED_TABLE_MAX_WATTS * 6 // 5):
+        speed = fixed_point.get_flat_speed(watts)
+        errors["speed"] = max(errors["speed"], abs(speed / fixed_point.SPEED_ONE - get_flat_speed_table(watts)))
+        if speed:
+            wheel = fixed_point.wheel_time_per_rev_ms(speed)
+            errors["wheel"] = max(errors["wheel"], abs(wheel - wheel_time_per_rev_ms(speed / fixed_point.SPEED_ONE)))
+    return errors
+
+
+def ride_errors(trace, k_table, coefficient_table):
+    """Largest cadence and power difference over a replayed trace, both paths on one CadenceSensor."""
+    simulator.reset()
+    replay._schedule(trace)
+    sensor = CadenceSensor()
+    adc = machine.ADC(config.POTENTIOMETER_PIN)
+    cadence_error, power_error = 0.0, 0
+    for t_ms in range(config.REFRESH_INTERVAL_MS, trace["duration_ms"] + 1, config.REFRESH_INTERVAL_MS):
+        CLOCK.advance_to(t_ms * 1000)
+        now_us = t_ms * 1000
+        rpm = sensor.calculate_cadence(now_us)
+        # The window was taken (and any timeout applied) by the call above, so both see the same pulses
+        cadence = sensor.calculate_cadence_fixed(now_us)
+        code = table_index(adc.read_u16() >> 4)
+        cadence_error = max(cadence_error, abs(cadence / fixed_point.CADENCE_ONE - rpm))
+        power = fixed_point.get_power(cadence, coefficient_table[code])
+        power_error = max(power_error, abs(power - get_power(rpm, k_table[code])))
+    return cadence_error, power_error
+
+
+def stage_costs(k_table, coefficient_table):
+    """Host CPU per call of each stage, float and fixed, at 85 RPM."""
+    simulator.reset()
+    machine.schedule_pulses(config.REED_PIN, traces.steady(85, 10000))
+    machine.set_adc_voltage(config.POTENTIOMETER_PIN, 0.7, config.PICO_REFERENCE_VOLTAGE)
+    sensor = CadenceSensor()
+    k_constant = KConstant()
+    k_constant.k_table = k_table
+    k_constant.coefficient_table = coefficient_table
+    CLOCK.advance_to(5000000)
+    now_us = CLOCK.now_us
+    rpm = sensor.calculate_cadence(now_us)
+    cadence = sensor.calculate_cadence_fixed(now_us)
+    k = k_constant.get_k_constant()
+    coefficient = k_constant.get_power_coefficient()
+    power = get_power(rpm, k)
+    speed_kph = get_flat_speed_table(power)
+    speed = fixed_point.get_flat_speed(power)
+    return {
+        "calculate_cadence": (per_call_us(lambda: sensor.calculate_cadence(now_us)),
+                              per_call_us(lambda: sensor.calculate_cadence_fixed(now_us))),
+        "get_k_constant": (per_call_us(k_constant.get_k_constant), per_call_us(k_constant.get_power_coefficient)),
+        "get_power": (per_call_us(lambda: get_power(rpm, k)),
+                      per_call_us(lambda: fixed_point.get_power(cadence, coefficient))),
+        "get_flat_speed": (per_call_us(lambda: get_flat_speed_table(power)),
+                           per_call_us(lambda: fixed_point.get_flat_speed(power))),
+        "wheel_time_per_rev_ms": (per_call_us(lambda: wheel_time_per_rev_ms(speed_kph)),
+                                  per_call_us(lambda: fixed_point.wheel_time_per_rev_ms(speed))),
+    }
+
+
+def ride(arithmetic, seconds):
+    saved = config.MODEL_ARITHMETIC
+    config.MODEL_ARITHMETIC = arithmetic
+    # main.py picks the arithmetic on import
+    sys.modules.pop("main", None)
+    try:
+        return bench.run_ride(seconds, 85, 0.7)
+    finally:
+        config.MODEL_ARITHMETIC = saved
+        sys.modules.pop("main", None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=120, help="virtual ride length")
+    args = parser.parse_args()
+    failed = False
+
+    init_speed_table()
+    fixed_point.init_speed_table()
+    k_table = build_k_table()
+    coefficient_table = build_power_coefficient_table()
+
+    errors = grid_errors(k_table, coefficient_table)
+    print("Largest difference from the float path, same inputs")
+    for name, value, bound, unit in (
+            ("cadence", errors["cadence"], _CADENCE_BOUND_RPM, "RPM"),
+            ("power", errors["power"], _POWER_BOUND_W, "W"),
+            ("speed", errors["speed"], _SPEED_BOUND_KPH, "km/h"),
+            ("wheel time", errors["wheel"], _WHEEL_BOUND_MS, "ms"),
+            ("recorded k x 1e6", errors["k_x1e6"], 1, "")):
+        print("  {:<18} {:>9.4f} {:<5} (bound {:g})".format(name, value, unit, bound))
+        if value > bound:
+            failed = True
+
+    print("Largest difference over the pipeline scenarios, smoothing included")
+    for trace in replay.scenarios().values():
+        cadence_error, power_error = ride_errors(trace, k_table, coefficient_table)
+        print("  {:<14} cadence {:.4f} RPM, power {} W".format(trace["name"], cadence_error, power_error))
+        if cadence_error > _RIDE_CADENCE_BOUND_RPM or power_error > _RIDE_POWER_BOUND_W:
+            failed = True
+
+    print("Allocation sites (containers, floats)       float      fixed")
+    for name in _FLOAT_STAGES:
+        float_sites = alloc.audit(_FLOAT_STAGES[name])
+        fixed_sites = alloc.audit(_FIXED_STAGES[name])
+        print("  {:<40} {:>3}, {:<3}   {:>3}, {:<3}".format(
+            name, len(float_sites[0]), len(float_sites[1]), len(fixed_sites[0]), len(fixed_sites[1])))
+        if fixed_sites[0] or fixed_sites[1]:
+            failed = True
+    for fn in _HELPERS:
+        containers, floats = alloc.audit(fn)
+        print("  {:<40} {:>14}, {:<3}".format(fn.__qualname__, len(containers), len(floats)))
+        if containers or floats:
+            failed = True
+
+    print("Per-call cost (host CPU, us)                float      fixed")
+    for name, (float_us, fixed_us) in stage_costs(k_table, coefficient_table).items():
+        print("  {:<40} {:>7.2f}    {:>7.2f}".format(name, float_us, fixed_us))
+
+    print("Event-mode ride, {} s (host CPU per main-loop iteration)".format(args.seconds))
+    for arithmetic in ("float", "fixed"):
+        result = ride(arithmetic, args.seconds)
+        print("  {:<6} {:.1f} us, {} notifications".format(arithmetic, result["us_per_iteration"],
+                                                             result["notifications"]))
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
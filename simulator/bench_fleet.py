@@ -0,0 +1,225 @@
+"""Measures host.fleet_gateway on simulated fleets.
+
+Usage (from the repository root):
+    python -m simulator.bench_fleet [--bikes 10 100 500 1000 2000] [--seconds 10]
+
+Decoding: the notifications of eight simulated bikes (simulator.fleet,
+BLEPeripheral's own bytes) go through the gateway in 50 ms batches and in
+one batch, and one at a time through a plain struct.unpack decoder with
+the same rules. Every bike's power, rolling power, energy, cadence, speed,
+distance and counters must agree, and the steady rider's cadence must be
+the one ridden. Reported: notifications per second decoded each way, for
+a small and a large fleet.
+
+Load: fleets of --bikes sensors replayed in real time for --seconds
+through SimulatedTransport and the gateway's own batch loop. Reported:
+notifications per second offered and processed, and the time from a
+notification being sent to its bike's state being updated.
+
+Exits non-zero if decoding disagrees, or a notification is lost or
+counted malformed.
+"""
+import argparse
+import asyncio
+import math
+import struct
+import sys
+import time
+
+from host import fleet_gateway
+from host.fleet_gateway import CPS_MEASUREMENT, INDOOR_BIKE_DATA, FleetGateway, POWER_TAU_S, STALE_S
+from host.ride_analytics import OPERATION_CONFIG, load_config
+from simulator import fleet
+
+_BATCH_S = 0.05
+_DECODE_BIKES = 8
+_THROUGHPUT_BIKES = (100, 2000)
+_STEADY_RPM = fleet.PROFILES[0][1][-1][1]
+_COMPARED = ("power", "power_avg", "energy_j", "cadence", "speed_kph", "distance_m", "crank_revs", "wheel_revs",
+             "notifications")
+_KEPT_UP_MS = 250
+
+
+class OneAtATime:
+    """The gateway's rules, one notification at a time with struct.unpack."""
+    def __init__(self, wheel_circumference_mm):
+        self.wheel_m = wheel_circumference_mm / 1000
+        self.bikes = {}
+
+    def ingest(self, bike_id, characteristic, payload, sent_s):
+        bike = self.bikes.get(bike_id)
+        if bike is None:
+            bike = self.bikes[bike_id] = dict.fromkeys(_COMPARED, 0)
+            bike.update(power_s=-math.inf, crank_revs=-1, wheel_revs=-1, crank_time=0, wheel_time=0,
+                        bike_s=-math.inf)
+        bike["notifications"] += 1
+        if characteristic == CPS_MEASUREMENT:
+            _, power = struct.unpack_from("<Hh", payload)
+            self._power(bike, power, sent_s)
+            return
+        if characteristic == INDOOR_BIKE_DATA:
+            # Flags, speed, cadence, [level,] power; the level is only there with LEVEL_TRACKING
+            _, speed, cadence = struct.unpack_from("<HHH", payload)
+            power, = struct.unpack_from("<h", payload, len(payload) - 2)
+            self._power(bike, power, sent_s)
+            gap = sent_s - bike["bike_s"]
+            previous = bike["speed_kph"] if gap <= STALE_S else 0
+            bike["distance_m"] += previous / 3.6 * min(max(gap, 0), STALE_S)
+            bike["cadence"], bike["speed_kph"], bike["bike_s"] = cadence / 2, speed / 100, sent_s
+            return
+        flags = payload[0]
+        if flags == 0x03:
+            _, wheel_revs, wheel_time, crank_revs, crank_time = struct.unpack("<BIHHH", payload)
+        elif flags == 0x01:
+            _, wheel_revs, wheel_time = struct.unpack("<BIH", payload)
+            crank_revs = None
+        else:
+            _, crank_revs, crank_time = struct.unpack("<BHH", payload)
+            wheel_revs = None
+        if crank_revs is not None:
+            _, rate = self._event(bike, "crank", crank_revs, crank_time, 0xFFFF)
+            if rate is not None:
+                bike["cadence"] = rate * 60
+        if wheel_revs is not None:
+            added, rate = self._event(bike, "wheel", wheel_revs, wheel_time, 0xFFFFFFFF)
+            bike["distance_m"] += added * self.wheel_m
+            if rate is not None:
+                bike["speed_kph"] = rate * self.wheel_m * 3.6
+
+    @staticmethod
+    def _power(bike, power, sent_s):
+        gap = sent_s - bike["power_s"]
+        previous = bike["power"] if gap <= STALE_S else 0
+        dt = min(max(gap, 0), 10 * POWER_TAU_S)
+        bike["energy_j"] += previous * dt
+        decay = math.exp(-dt / POWER_TAU_S)
+        bike["power_avg"] = bike["power_avg"] * decay + previous * (1 - decay)
+        bike["power"], bike["power_s"] = power, sent_s
+
+    @staticmethod
+    def _event(bike, name, revs, event_time, revs_mask):
+        previous = bike[name + "_revs"]
+        ticks = (event_time - bike[name + "_time"]) & 0xFFFF
+        bike[name + "_revs"], bike[name + "_time"] = revs, event_time
+        if previous < 0:
+            return 0, None
+        added = (revs - previous) & revs_mask
+        return added, (added * 1024 / ticks if ticks else None)
+
+
+def _batched(events, batch_s):
+    """events split at every batch_s of send time; one batch if batch_s is None."""
+    if batch_s is None:
+        return [events]
+    batches, start = [], 0
+    for i, event in enumerate(events):
+        if i > start and event[0] >= (events[start][0] // batch_s + 1) * batch_s:
+            batches.append(events[start:i])
+            start = i
+    return batches + [events[start:]]
+
+
+def decode(batches, wheel_mm):
+    """Feeds batches of events to a gateway, on a clock that reads each batch's last send time."""
+    now = [0.0]
+    gateway = FleetGateway(wheel_mm, capacity=4, clock=lambda: now[0])
+    for batch in batches:
+        for t, bike_id, characteristic, payload in batch:
+            gateway.ingest(bike_id, characteristic, payload, t)
+        now[0] = batch[-1][0]
+        gateway.process_pending()
+    return gateway
+
+
+def disagreements(gateway, reference):
+    """Bike and column of every value that differs from the one-at-a-time decoder."""
+    found = []
+    for bike_id, expected in reference.bikes.items():
+        row = gateway.row(bike_id)
+        for name in _COMPARED:
+            value = float(gateway.column(name)[row])
+            if not math.isclose(value, expected[name], rel_tol=1e-9, abs_tol=1e-9):
+                found.append("{} {}: {} != {}".format(bike_id, name, value, expected[name]))
+    return found
+
+
+def decode_rates(events, wheel_mm):
+    """Notifications per second through the gateway in _BATCH_S batches, and one at a time."""
+    batches = _batched(events, _BATCH_S)
+    start = time.perf_counter()
+    decode(batches, wheel_mm)
+    batched = len(events) / (time.perf_counter() - start)
+    reference = OneAtATime(wheel_mm)
+    start = time.perf_counter()
+    for event in events:
+        reference.ingest(event[1], event[2], event[3], event[0])
+    return batched, len(events) / (time.perf_counter() - start)
+
+
+async def _load(gateway, transport):
+    batches = asyncio.create_task(gateway.run())
+    await transport.run(gateway)
+    batches.cancel()
+    gateway.process_pending()
+
+
+def load(bikes, seconds, wheel_mm):
+    """Replays bikes for seconds in real time; returns the gateway and transport."""
+    transport = fleet.SimulatedTransport(bikes, seconds=seconds)
+    gateway = FleetGateway(wheel_mm)
+    asyncio.run(_load(gateway, transport))
+    return gateway, transport
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bikes", type=int, nargs="+", default=[10, 100, 500, 1000, 2000])
+    parser.add_argument("--seconds", type=float, default=10.0, help="replayed per fleet size")
+    args = parser.parse_args()
+    wheel_mm = load_config(OPERATION_CONFIG)["WHEEL_CIRCUMFERENCE_MM"]
+    failed = False
+
+    events = fleet.timeline(_DECODE_BIKES)
+    reference = OneAtATime(wheel_mm)
+    for t, bike_id, characteristic, payload in events:
+        reference.ingest(bike_id, characteristic, payload, t)
+    print("Decoding {} bikes, {} notifications            disagreements  malformed".format(
+        _DECODE_BIKES, len(events)))
+    for name, batch_s in (("{:g} ms batches".format(_BATCH_S * 1000), _BATCH_S), ("one batch", None)):
+        gateway = decode(_batched(events, batch_s), wheel_mm)
+        found = disagreements(gateway, reference)
+        print("  {:<46} {:>6} {:>10}".format(name, len(found), gateway.malformed))
+        for line in found[:5]:
+            print("    " + line)
+        failed |= bool(found) or gateway.malformed > 0
+    steady = reference.bikes["sim-000"]
+    print("  {} rider's cadence at the end: {:.1f} rpm".format(fleet.PROFILES[0][0], steady["cadence"]))
+    failed |= abs(steady["cadence"] - _STEADY_RPM) > 1
+
+    print("Decode rate, notifications/s          gateway, {:g} ms batches  one at a time, struct.unpack".format(
+        _BATCH_S * 1000))
+    for bikes in _THROUGHPUT_BIKES:
+        batched, single = decode_rates(fleet.timeline(bikes), wheel_mm)
+        print("  {:>5} bikes {:>36.0f} {:>29.0f}".format(bikes, batched, single))
+
+    print("Load, {:g} s in real time each, batches every {:g} ms   offered  processed      latency p50    p99    "
+          "max  kept up".format(args.seconds, fleet_gateway.BATCH_INTERVAL_S * 1000))
+    for bikes in args.bikes:
+        gateway, transport = load(bikes, args.seconds, wheel_mm)
+        p50, p99, worst = gateway.latency_ms()
+        offered = len(transport.events) / args.seconds
+        print("  {:>5} bikes {:>38.0f}/s {:>8.0f}/s {:>14.1f} ms {:>6.1f} {:>6.1f}  {}".format(
+            bikes, offered, gateway.processed / args.seconds, p50, p99, worst,
+            "yes" if worst < _KEPT_UP_MS else "no"))
+        lost = len(transport.events) - gateway.processed
+        if lost or gateway.malformed:
+            print("  {} bikes: {} notifications lost, {} malformed".format(bikes, lost, gateway.malformed))
+            failed = True
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
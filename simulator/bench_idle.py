@@ -0,0 +1,181 @@
+"""Measures the idle power saving of operation/idle.py (config.IDLE_SAVING).
+
+Usage (from the repository root):
+    python -m simulator.bench_idle
+
+Rides 20 s, stops for 60 s and rides again, through main.py in every
+LOOP_MODE, with IDLE_SAVING off and on. Over the idle stretch it reports
+task wakeups and ADC reads per second and the advertising interval and LED
+toggles, the duty cycle being wakeups relative to IDLE_SAVING off. For the
+first pulse after the stop it reports the wake latency, from the pulse to
+the loop running at full rate again, and the time to the first non-zero
+power notification, which should not change with IDLE_SAVING.
+
+The same stop while disconnected, with IDLE_LIGHTSLEEP, reports the share
+of the idle stretch spent in machine.lightsleep() and the wake latency
+from it. A disconnected stop of _LONG_STOP_MS, longer than ticks_diff can
+span on ticks_us, checks that pedalling still wakes the sensor.
+
+Exits non-zero if idle does not cut wakeups and ADC reads, a wake takes
+longer than a core-1 poll, or the first power after the stop comes later
+than with IDLE_SAVING off by more than one loop period.
+"""
+import struct
+import sys
+
+import simulator
+from simulator import bench, bluetooth, machine, traces, uasyncio
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import config  # noqa: E402
+import idle  # noqa: E402
+
+_STOP_MS = 60000
+# Over 10 minutes, past half the ticks_us period (about 537 s)
+_LONG_STOP_MS = 660000
+_VOLTS = 0.6
+_CPS_MEASUREMENT = 0x2A63
+_LOOP_PERIOD_MS = {"poll": config.POLL_INTERVAL_MS, "event": config.REFRESH_INTERVAL_MS,
+                   "dual": config.REFRESH_INTERVAL_MS}
+
+_transitions = []
+_set_idle = idle.IdleScheduler._set_idle
+
+
+def _recording_set_idle(scheduler, value):
+    _transitions.append((CLOCK.now_us, value))
+    _set_idle(scheduler, value)
+
+
+idle.IdleScheduler._set_idle = _recording_set_idle
+
+
+def _counters():
+    return {
+        "t_us": CLOCK.now_us,
+        "wakeups": uasyncio.get_event_loop().steps,
+        "adc": machine.adc_reads,
+        "led": machine.line("LED").edges,
+        "slept_us": machine.slept_us,
+        "adv_us": bluetooth.BLE().adv_interval_us,
+    }
+
+
+def _window_ms(stop_ms):
+    """Idle counters are read over this window, from well after going idle to just before pedalling again."""
+    return 20000 + config.TIMEOUT_MS + config.IDLE_AFTER_MS + 2000, 20000 + stop_ms - 1000
+
+
+def ride(mode, saving, connected=True, lightsleep=False, stop_ms=_STOP_MS):
+    """Rides 20 s, stops for stop_ms and rides 20 s again.
+
+    Returns the idle-window rates, the wake latency and the first power
+    after the stop.
+    """
+    config.LOOP_MODE = mode
+    config.IDLE_SAVING = saving
+    config.IDLE_LIGHTSLEEP = lightsleep
+    del _transitions[:]
+    marks = []
+    segments = [(20000, 80), (stop_ms, 0), (20000, 90)]
+    pulses = traces.pulse_times(segments)
+    restart_ms = 20000 + stop_ms
+
+    def setup():
+        if not connected:
+            simulator.at_ms(1000, lambda: bluetooth.BLE().disconnect())
+        for t_ms in _window_ms(stop_ms):
+            simulator.at_ms(t_ms, lambda: marks.append(_counters()))
+
+    bench.run_ride(sum(d for d, _ in segments) // 1000, 0, _VOLTS, pulses=pulses, setup=setup)
+    start, end = marks
+    seconds = (end["t_us"] - start["t_us"]) / 1e6
+    result = {
+        "wakeups_per_s": (end["wakeups"] - start["wakeups"]) / seconds,
+        "adc_per_s": (end["adc"] - start["adc"]) / seconds,
+        "led_per_s": (end["led"] - start["led"]) / seconds,
+        "slept": (end["slept_us"] - start["slept_us"]) / 1e6 / seconds,
+        "adv_ms": (end["adv_us"] or 0) / 1000,
+    }
+    first_pulse_us = int(min(p for p in pulses if p >= restart_ms) * 1000)  # As machine.schedule_pulses has it
+    woke = [t for t, value in _transitions if not value and t >= first_pulse_us]
+    result["wake_ms"] = (woke[0] - first_pulse_us) / 1000 if woke else None
+    ble = bluetooth.BLE()
+    handle = ble.char_handles.get(_CPS_MEASUREMENT)
+    powers = [t for t, _, h, p in ble.notifications
+              if h == handle and t >= first_pulse_us and struct.unpack_from("<Hh", p)[1] > 0]
+    result["power_ms"] = (powers[0] - first_pulse_us) / 1000 if powers else None
+    return result
+
+
+def _ms(value):
+    return "{:.1f}".format(value) if value is not None else "-"
+
+
+def main():
+    saved = config.LOOP_MODE, config.IDLE_SAVING, config.IDLE_LIGHTSLEEP
+    failed = False
+
+    window_ms = _window_ms(_STOP_MS)
+    print("Connected, {} s stop: idle window {:.0f}-{:.0f} s".format(
+        _STOP_MS // 1000, window_ms[0] / 1000, window_ms[1] / 1000))
+    print("{:<6} {:<7} {:>10} {:>9} {:>11} {:>10} {:>14}".format(
+        "mode", "saving", "wakeups/s", "ADC/s", "duty cycle", "wake ms", "first power ms"))
+    for mode in ("poll", "event", "dual"):
+        off = ride(mode, False)
+        on = ride(mode, True)
+        for name, r in (("off", off), ("on", on)):
+            print("{:<6} {:<7} {:>10.1f} {:>9.1f} {:>10.0f}% {:>10} {:>14}".format(
+                mode, name, r["wakeups_per_s"], r["adc_per_s"], 100 * r["wakeups_per_s"] / off["wakeups_per_s"],
+                _ms(r["wake_ms"]), _ms(r["power_ms"])))
+        if on["wakeups_per_s"] >= off["wakeups_per_s"] or on["adc_per_s"] >= off["adc_per_s"]:
+            print("  {}: idle does not reduce wakeups or ADC reads".format(mode))
+            failed = True
+        if on["wake_ms"] is None or on["wake_ms"] > config.CORE1_POLL_MS:
+            print("  {}: wake latency {} ms".format(mode, _ms(on["wake_ms"])))
+            failed = True
+        if on["power_ms"] is None or on["power_ms"] > off["power_ms"] + _LOOP_PERIOD_MS[mode]:
+            print("  {}: first power after the stop {} ms, {} ms with IDLE_SAVING off".format(
+                mode, _ms(on["power_ms"]), _ms(off["power_ms"])))
+            failed = True
+
+    print("")
+    print("Disconnected, {} s stop".format(_STOP_MS // 1000))
+    print("{:<6} {:<11} {:>10} {:>9} {:>8} {:>8} {:>9} {:>8}".format(
+        "mode", "saving", "wakeups/s", "ADC/s", "LED/s", "adv ms", "asleep", "wake ms"))
+    for mode in ("poll", "event"):
+        for name, saving, lightsleep in (("off", False, False), ("on", True, False), ("lightsleep", True, True)):
+            r = ride(mode, saving, connected=False, lightsleep=lightsleep)
+            print("{:<6} {:<11} {:>10.1f} {:>9.1f} {:>8.2f} {:>8.1f} {:>8.0f}% {:>8}".format(
+                mode, name, r["wakeups_per_s"], r["adc_per_s"], r["led_per_s"], r["adv_ms"], 100 * r["slept"],
+                _ms(r["wake_ms"])))
+            if saving and (r["wake_ms"] is None or r["wake_ms"] > config.CORE1_POLL_MS):
+                print("  {} {}: wake latency {} ms".format(mode, name, _ms(r["wake_ms"])))
+                failed = True
+            if saving and r["adv_ms"] * 1000 != config.IDLE_ADV_INTERVAL_US:
+                print("  {} {}: advertising every {} ms while idle".format(mode, name, r["adv_ms"]))
+                failed = True
+
+    print("")
+    print("Disconnected, {} s stop".format(_LONG_STOP_MS // 1000))
+    print("{:<6} {:<11} {:>9} {:>8}".format("mode", "saving", "asleep", "wake ms"))
+    for mode in ("poll", "event", "dual"):
+        for name, lightsleep in (("on", False), ("lightsleep", True)):
+            if lightsleep and mode == "dual":
+                continue  # IDLE_LIGHTSLEEP doesn't apply with core 1 running
+            r = ride(mode, True, connected=False, lightsleep=lightsleep, stop_ms=_LONG_STOP_MS)
+            print("{:<6} {:<11} {:>8.0f}% {:>8}".format(mode, name, 100 * r["slept"], _ms(r["wake_ms"])))
+            if r["wake_ms"] is None or r["wake_ms"] > config.CORE1_POLL_MS:
+                print("  {} {}: wake latency {} ms".format(mode, name, _ms(r["wake_ms"])))
+                failed = True
+
+    config.LOOP_MODE, config.IDLE_SAVING, config.IDLE_LIGHTSLEEP = saved
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compares the ADC-indexed k table against the original interpolation.
+
+Usage (from the repository root):
+    python -m simulator.bench_k_constant
+
+Exits non-zero if the table disagrees with interpolate_k() beyond tolerance:
+  * for readings the RP2040 ADC can actually produce (12-bit codes stretched
+    to 16 bits), the only difference is float32 rounding: relative error <= 1e-6;
+  * for arbitrary 16-bit values, the table returns the k of the enclosing
+    12-bit code, so the error is bounded by one code step times the steepest
+    slope of the k table.
+"""
+import sys
+
+import simulator
+from simulator import machine
+from simulator.bench import per_call_us
+
+simulator.install()
+
+import config  # noqa: E402
+from get_k_constant import KConstant, interpolate_k, table_index  # noqa: E402
+
+_REL_TOLERANCE = 1e-6
+
+
+def legacy_k(raw_adc_value):
+    """The pre-table get_k_constant(): float conversion plus interval scan."""
+    voltage = (raw_adc_value / config.MAX_ADC_VALUE) * config.PICO_REFERENCE_VOLTAGE
+    return interpolate_k(voltage)
+
+
+def max_slope():
+    v, k = config.LEVEL_VOLTAGE_SORTED, config.LEVEL_K_SORTED
+    return max((k[i + 1] - k[i]) / (v[i + 1] - v[i]) for i in range(len(v) - 1))
+
+
+def main():
+    simulator.reset()
+    k_constant = KConstant()
+    table = k_constant.k_table
+
+    worst_rel = 0.0
+    for code in range(4096):
+        raw = (code << 4) | (code >> 8)
+        expected = legacy_k(raw)
+        rel = abs(table[table_index(raw >> 4)] - expected) / expected
+        worst_rel = max(worst_rel, rel)
+
+    code_step_volts = 16 / config.MAX_ADC_VALUE * config.PICO_REFERENCE_VOLTAGE
+    abs_tolerance = max_slope() * code_step_volts + _REL_TOLERANCE * max(config.LEVEL_K_SORTED)
+    worst_abs = 0.0
+    for raw in range(65536):
+        worst_abs = max(worst_abs, abs(table[table_index(raw >> 4)] - legacy_k(raw)))
+
+    print("Accuracy")
+    print("  12-bit ADC codes: max relative error {:.2e} (tolerance {:.0e})".format(worst_rel, _REL_TOLERANCE))
+    print("  any u16 value:    max absolute error {:.2e} (tolerance {:.2e})".format(worst_abs, abs_tolerance))
+
+    # Mid-range reading so the legacy scan walks about half the intervals
+    machine.set_adc_voltage(config.POTENTIOMETER_PIN, 0.72, config.PICO_REFERENCE_VOLTAGE)
+    pot = k_constant.pot
+    legacy_us = per_call_us(lambda: legacy_k(pot.read_u16()))
+    table_us = per_call_us(k_constant.get_k_constant)
+    print("Per-call cost (host CPU)")
+    print("  interval scan:    {:.2f} us".format(legacy_us))
+    print("  table lookup:     {:.2f} us ({:.1f}x)".format(table_us, legacy_us / table_us))
+    print("  table size:       {} entries, {} bytes".format(len(table), len(table) * table.itemsize))
+
+    if worst_rel > _REL_TOLERANCE or worst_abs > abs_tolerance:
+        print("FAIL: table deviates from interpolate_k()")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Compares LevelTracker (LEVEL_TRACKING) with KConstant's per-tick ADC lookup.
+
+Usage (from the repository root):
+    python -m simulator.bench_level [--noise-mv 4] [--seed 1]
+
+The potentiometer voltage of each pipeline scenario of simulator.replay
+(actuator ramps included) gets independent Gaussian noise on every ADC
+read, --noise-mv standard deviation. An "off_centre" scenario also parks
+the actuator 20% of the way to the next level, as a worn or badly
+calibrated one would. Both are sampled as main.py would: KConstant once
+per POLL_INTERVAL_MS tick, LevelTracker every LEVEL_SAMPLE_MS in the
+background with the tick reading its cached k.
+
+Reported per scenario, away from level changes (the SETTLE window of
+simulator.replay after each): how often k changed from one tick to the
+next and the RMS power error it causes at the true cadence. For the
+tracker also the level events against the true level changes and the
+time from a change to the right level. Exits non-zero on a level event
+or a wrong level away from changes, a change that is never followed, or
+an allocation in the tracker's per-tick calls.
+"""
+import argparse
+import math
+import random
+import sys
+
+import simulator
+from simulator import alloc, machine, replay
+from simulator.bench import per_call_us
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import config  # noqa: E402
+from get_k_constant import KConstant  # noqa: E402
+from get_power import get_power  # noqa: E402
+from level_tracker import LevelTracker  # noqa: E402
+
+_OFF_CENTRE = 0.2
+# Called by main.py's loops on every tick
+_TICK_CALLS = (LevelTracker.get_k_constant, LevelTracker.get_power_coefficient)
+# Called every LEVEL_SAMPLE_MS; sample() only allocates when the level moves
+_SAMPLE_CALLS = (LevelTracker.read,)
+
+
+def off_centre():
+    """level_changes with every level parked _OFF_CENTRE of the gap towards the next one."""
+    trace = replay.synthetic("off_centre", [(60000, 85)], [(0, 3), (12000, 8), (24000, 12), (36000, 5), (48000, 14)])
+    voltages = config.LEVEL_VOLTAGE_SORTED
+    offsets = {v: (voltages[i + 1] - v) * _OFF_CENTRE for i, v in enumerate(voltages[:-1])}
+    level_at = {}
+    for t_ms, _, level in trace["truth"]:
+        level_at[t_ms] = voltages[level - 1]
+    change_times = sorted(level_at)
+    for sample in trace["adc"]:
+        # The ramp ends on the level voltage; shift the whole trace by the offset of the current target
+        target = level_at[max(t for t in change_times if t <= sample[0])]
+        sample[1] += offsets[target]
+    return trace
+
+
+def _install_noise(trace, noise_v, rng):
+    """Schedules the trace, then adds noise_v of Gaussian noise to every potentiometer read."""
+    replay._schedule(trace)
+    held = machine._adc_traces[config.POTENTIOMETER_PIN]
+    scale = 65535 / config.PICO_REFERENCE_VOLTAGE
+    machine.set_adc(config.POTENTIOMETER_PIN, lambda now_us: held(now_us) + rng.gauss(0, noise_v) * scale)
+
+
+def _settled(t_ms, changes):
+    return all(not (c <= t_ms < c + replay._SETTLE_EXCLUDE_MS) for c in changes)
+
+
+def run(trace, noise_v, seed):
+    """Ticks both lookups through trace; returns the metrics of each."""
+    simulator.reset()
+    _install_noise(trace, noise_v, random.Random(seed))
+    k_constant = KConstant()
+    tracker = LevelTracker()
+    truth = trace["truth"]
+    level_changes = [row[0] for i, row in enumerate(truth) if i and row[2] != truth[i - 1][2]]
+    changes = [0] + level_changes
+
+    tick_ms = config.POLL_INTERVAL_MS
+    step_ms = math.gcd(tick_ms, config.LEVEL_SAMPLE_MS)
+    results = {name: {"k_changes": 0, "squared_error": 0.0, "ticks": 0} for name in ("KConstant", "LevelTracker")}
+    last_k = {}
+    spurious = wrong = 0
+    latencies = {}
+    for t_ms in range(step_ms, trace["duration_ms"] + 1, step_ms):
+        CLOCK.advance_to(t_ms * 1000)
+        if t_ms % config.LEVEL_SAMPLE_MS == 0:
+            moved = tracker.sample()
+            if moved and _settled(t_ms, changes):
+                spurious += 1
+        if t_ms % tick_ms:
+            continue
+        _, true_rpm, true_level = replay._truth_at(truth, t_ms)
+        true_power = get_power(true_rpm, config.LEVEL_K_SORTED[true_level - 1])
+        for t_change in level_changes:
+            if t_change <= t_ms and t_change not in latencies and tracker.level == true_level:
+                latencies[t_change] = t_ms - t_change
+        if not _settled(t_ms, changes):
+            # k changes count from the first tick after the window
+            last_k.clear()
+            continue
+        wrong += tracker.level != true_level
+        for name, k in (("KConstant", k_constant.get_k_constant()), ("LevelTracker", tracker.get_k_constant())):
+            result = results[name]
+            result["k_changes"] += name in last_k and k != last_k[name]
+            result["squared_error"] += (get_power(true_rpm, k) - true_power) ** 2
+            result["ticks"] += 1
+            last_k[name] = k
+    for result in results.values():
+        result["power_rms"] = math.sqrt(result["squared_error"] / max(result["ticks"], 1))
+    missed = len(level_changes) - len(latencies)
+    return results, {"events": tracker.changes - 1, "level_changes": len(level_changes), "spurious": spurious,
+                     "wrong": wrong, "missed": missed, "latency_ms": max(latencies.values(), default=0)}
+
+
+def costs():
+    """Host CPU per call: KConstant's lookup, the tracker's cached read and one background sample."""
+    simulator.reset()
+    machine.set_adc_voltage(config.POTENTIOMETER_PIN, config.LEVEL_VOLTAGE_SORTED[6], config.PICO_REFERENCE_VOLTAGE)
+    k_constant = KConstant()
+    tracker = LevelTracker()
+    return {
+        "KConstant.get_k_constant (per tick)": per_call_us(k_constant.get_k_constant),
+        "LevelTracker.get_k_constant (per tick)": per_call_us(tracker.get_k_constant),
+        "LevelTracker.sample (every {} ms)".format(config.LEVEL_SAMPLE_MS): per_call_us(tracker.sample),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--noise-mv", type=float, default=4.0, help="ADC noise per read, standard deviation")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    noise_v = args.noise_mv / 1000
+    failed = False
+
+    print("Away from level changes, {:g} mV noise per read        k changes   power RMS   "
+          "level events   wrong  latency".format(args.noise_mv))
+    scenarios = list(replay.scenarios().values()) + [off_centre()]
+    for trace in scenarios:
+        results, levels = run(trace, noise_v, args.seed)
+        for name, result in results.items():
+            line = "  {:<14} {:<14} {:>21} {:>9.1f} W".format(
+                trace["name"] if name == "KConstant" else "", name, result["k_changes"], result["power_rms"])
+            if name == "LevelTracker":
+                line += "   {:>3} for {:>3}   {:>5}  {:>5} ms".format(
+                    levels["events"], levels["level_changes"], levels["wrong"], levels["latency_ms"])
+            print(line)
+        if levels["spurious"] or levels["wrong"] or levels["missed"]:
+            print("  {}: {} spurious level events, {} ticks on a wrong level, {} changes missed".format(
+                trace["name"], levels["spurious"], levels["wrong"], levels["missed"]))
+            failed = True
+
+    print("Allocation sites (containers, floats)")
+    for fn in _TICK_CALLS + _SAMPLE_CALLS:
+        containers, floats = alloc.audit(fn)
+        print("  {:<40} {:>3}, {:<3}".format(fn.__qualname__, len(containers), len(floats)))
+        if containers or floats:
+            failed = True
+
+    print("Per-call cost (host CPU)")
+    for name, us in costs().items():
+        print("  {:<40} {:>6.2f} us".format(name, us))
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
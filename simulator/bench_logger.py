@@ -0,0 +1,72 @@
+"""Measures the overhead of the buffered logger against print-per-call logging.
+
+Usage (from the repository root):
+    python -m simulator.bench_logger
+
+Printing goes to /dev/null here, so the original logger's figure leaves out
+the time the Pico spends blocked on USB-CDC output; on the device the gap is
+larger. Exits non-zero if log_values() contains a heap-allocating operation.
+"""
+import contextlib
+import os
+import sys
+import time
+
+import simulator
+from simulator import alloc
+from simulator.bench import per_call_us
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import logger  # noqa: E402
+
+_FORMAT = "Cadence: {:.1f} RPM, Power: {:.0f} Watts, Flat Speed: {:.1f} KPH"
+
+
+def legacy_log(level, message):
+    ms_since_boot = time.ticks_ms()
+    print(f"[{ms_since_boot}] [{level}] {message}")
+
+
+def main():
+    cadence, power, speed = 82.5, 214, 31.7
+    every_call = logger.log_site("INFO", _FORMAT)
+    rate_limited = logger.log_site("INFO", _FORMAT, 1000)
+    debug_site = logger.log_site("DEBUG", _FORMAT)
+
+    containers, floats = alloc.audit(logger.log_values)
+    print("log_values allocating operations: {} container, {} float".format(len(containers), len(floats)))
+    for op in containers:
+        print("    " + op)
+
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        costs = (
+            ("f-string + print (original)",
+             per_call_us(lambda: legacy_log("INFO", f"Generated Cadence: {cadence} RPM, Power: {power} Watts, Flat Speed: {speed} KPH"))),
+            ("log_values, recorded", per_call_us(lambda: logger.log_values(every_call, cadence, power, speed))),
+            ("log_values, rate-limited", per_call_us(lambda: logger.log_values(rate_limited, cadence, power, speed))),
+            ("log_values, level disabled", per_call_us(lambda: logger.log_values(debug_site, cadence, power, speed))),
+            ("log, level disabled", per_call_us(lambda: logger.log("DEBUG", "Connected"))),
+        )
+        logger.flush()
+        for _ in range(logger._RING_RECORDS):
+            CLOCK.now_us += 1000
+            logger.log_values(every_call, cadence, power, speed)
+        start = time.perf_counter()
+        flushed = logger.flush()
+        flush_us = (time.perf_counter() - start) * 1e6 / flushed
+
+    print("Per-call cost on the loop (host CPU)")
+    for label, cost in costs:
+        print("  {:<30} {:6.2f} us".format(label + ":", cost))
+    print("Deferred cost in flush_task: {:.2f} us per record".format(flush_us))
+    print("Ring: {} records, {} bytes preallocated".format(logger._RING_RECORDS, len(logger._ring)))
+
+    if containers or floats:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Compares the polling and event-driven main loops (config.LOOP_MODE).
+
+Usage (from the repository root):
+    python -m simulator.bench_loop_modes
+
+For each mode it reports task wakeups per second over a ride and while
+connected but idle, and the pulse-to-notification latency: the time from a
+reed pulse to the first CSC notification that reports a new crank revolution.
+Latency is in virtual time, so it excludes the CPU time of the handlers.
+
+For the modes that time crank events from the reed pulses ("event",
+"dual") it then stops for _LONG_STOP_MS, longer than ticks_diff can span
+on ticks_us, and checks that the first crank event after the stop is
+stamped the length of the stop later. Every mode also stops for
+_LONG_STOP_MS with nobody connected, and must report no power once a
+central connects again. Exits non-zero if either check fails.
+"""
+import struct
+import sys
+
+import simulator
+from simulator import bench, bluetooth, traces
+
+simulator.install()
+
+import config  # noqa: E402
+import peripheral  # noqa: E402, F401  (registers handles in a fixed order)
+
+# 30 s pedalling, 30 s idle while connected, 30 s pedalling
+_RIDE = [(30000, 80), (30000, 0), (30000, 95)]
+_VOLTS = 0.6
+# Past half the ticks_us period (about 537 s)
+_LONG_STOP_MS = 600000
+_LONG_STOP_RIDE = [(20000, 80), (_LONG_STOP_MS, 0), (20000, 80)]
+# Disconnects just after the first segment, reconnects after the stop
+_DISCONNECT_MS = _LONG_STOP_RIDE[0][0] + 1000
+_RECONNECT_MS = _LONG_STOP_RIDE[0][0] + _LONG_STOP_MS - 5000
+_CPS_MEASUREMENT = 0x2A63
+# Event times are in 1/1024 s; the check allows for the task running a few ms after the pulse
+_EVENT_TIME_TOLERANCE = 16
+
+
+def crank_notifications(ble, event_times=False):
+    """(time_us, cumulative crank revs[, event time]) for every CSC notification with crank data."""
+    events = []
+    for at_us, _, _, payload in ble.notifications:
+        if payload[0] & 0x02:
+            offset = 1 + (6 if payload[0] & 0x01 else 0)
+            revs, event_time = struct.unpack_from("<HH", payload, offset)
+            events.append((at_us, revs, event_time) if event_times else (at_us, revs))
+    return events
+
+
+def pulse_latencies_ms(pulses_ms, events):
+    """For each pulse, the delay until a notification first reports a new revolution."""
+    latencies = []
+    j = 0
+    for pulse_ms in pulses_ms:
+        pulse_us = int(pulse_ms * 1000)  # As scheduled by machine.schedule_pulses
+        while j < len(events) and events[j][0] < pulse_us:
+            j += 1
+        revs_before = events[j - 1][1] if j else 0
+        k = j
+        while k < len(events) and events[k][1] == revs_before:
+            k += 1
+        if k == len(events):
+            break
+        latencies.append((events[k][0] - pulse_us) / 1000)
+    return latencies
+
+
+def wakeups_per_s(mode, segments):
+    config.LOOP_MODE = mode
+    seconds = sum(d for d, _ in segments) // 1000
+    stats = bench.run_ride(seconds, 0, _VOLTS, pulses=traces.pulse_times(segments))
+    return stats["wakeups_per_s"]
+
+
+def long_stop_error(mode):
+    """1/1024 s between the event time step over _LONG_STOP_RIDE's stop and the true time between the pulses."""
+    config.LOOP_MODE = mode
+    pulses = traces.pulse_times(_LONG_STOP_RIDE)
+    bench.run_ride(sum(d for d, _ in _LONG_STOP_RIDE) // 1000, 0, _VOLTS, pulses=pulses)
+    restart_ms = _LONG_STOP_RIDE[0][0] + _LONG_STOP_MS
+    after = min(p for p in pulses if p >= restart_ms)
+    before = max(p for p in pulses if p < restart_ms)
+    events = crank_notifications(bluetooth.BLE(), event_times=True)
+    revs_after = max(revs for t_us, revs, _ in events if t_us < after * 1000) + 1
+    time_before = [event_time for _, revs, event_time in events if revs == revs_after - 1][-1]
+    time_after = [event_time for _, revs, event_time in events if revs == revs_after][0]
+    expected = int((after - before) * 1.024) % 65536
+    step = (time_after - time_before) % 65536
+    return min(abs(step - expected), 65536 - abs(step - expected))
+
+
+def disconnected_stop_power(mode):
+    """Largest power (W) notified from 2 s after reconnecting at the end of a stop nobody was connected for."""
+    config.LOOP_MODE = mode
+
+    def script():
+        simulator.at_ms(_DISCONNECT_MS, lambda: bluetooth.BLE().disconnect())
+        simulator.at_ms(_RECONNECT_MS, lambda: bluetooth.BLE().connect())
+    ride = _LONG_STOP_RIDE[:2]
+    bench.run_ride(sum(d for d, _ in ride) // 1000, 0, _VOLTS, pulses=traces.pulse_times(ride), setup=script)
+    ble = bluetooth.BLE()
+    power_handle = ble.char_handles[_CPS_MEASUREMENT]
+    settled_us = (_RECONNECT_MS + 2000) * 1000
+    return max(struct.unpack_from("<h", payload, 2)[0] for at_us, _, handle, payload in ble.notifications
+               if handle == power_handle and at_us >= settled_us)
+
+
+def main():
+    saved_mode = config.LOOP_MODE
+    failed = False
+    pulses = traces.pulse_times(_RIDE)
+    seconds = sum(d for d, _ in _RIDE) // 1000
+
+    print("{:<7} {:>12} {:>12} {:>10} {:>10} {:>10} {:>8}".format(
+        "mode", "wakeups/s", "idle wk/s", "lat mean", "lat p95", "lat max", "notif/s"))
+    for mode in ("poll", "event"):
+        config.LOOP_MODE = mode
+        stats = bench.run_ride(seconds, 0, _VOLTS, pulses=pulses)
+        latencies = sorted(pulse_latencies_ms(pulses, crank_notifications(bluetooth.BLE())))
+        idle = wakeups_per_s(mode, [(30000, 0)])
+        print("{:<7} {:>12.1f} {:>12.1f} {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms {:>8.1f}".format(
+            mode, stats["wakeups_per_s"], idle,
+            sum(latencies) / len(latencies),
+            latencies[int(len(latencies) * 0.95)],
+            latencies[-1],
+            stats["notifications_per_s_virtual"]))
+
+    print("First crank event after a {} s stop, event time off by (1/1024 s)".format(_LONG_STOP_MS // 1000))
+    for mode in ("event", "dual"):
+        error = long_stop_error(mode)
+        print("  {:<7} {:>6}".format(mode, error))
+        failed |= error > _EVENT_TIME_TOLERANCE
+
+    print("Power after a {} s stop nobody was connected for (W)".format(_LONG_STOP_MS // 1000))
+    for mode in ("poll", "event", "dual"):
+        power = disconnected_stop_power(mode)
+        print("  {:<7} {:>6}".format(mode, power))
+        failed |= power != 0
+    config.LOOP_MODE = saved_mode
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Measures what the notification scheduler puts on air.
+
+Usage (from the repository root):
+    python -m simulator.bench_notify
+
+Runs the same ride through both loop modes at several connection intervals.
+For each run it reports how many values were published and how many of them
+were sent, suppressed as unchanged or merged into a later packet, plus the
+on-air time. The baseline is the original scheme: three separate
+notifications (power, cadence, speed) every 100 ms.
+
+Then the same ride at 30 ms with each FTMS_PROFILE: Cycling Power and CSC
+only, Indoor Bike Data next to them, and Indoor Bike Data alone, which
+carries power, cadence and speed in one notification.
+"""
+import simulator
+from simulator import bench, bluetooth, traces
+
+simulator.install()
+
+import config  # noqa: E402
+
+_RIDE = [(60000, 85), (20000, 0), (40000, 100)]
+_VOLTS = 0.7
+# LE 1M PHY: preamble 1, access address 4, LL header 2, L2CAP 4, ATT 3, CRC 3 bytes
+_PACKET_OVERHEAD_BYTES = 17
+_US_PER_BYTE = 8
+_LEGACY_PAYLOAD_BYTES = (4, 7, 5)  # Power, speed, cadence
+_PROFILE_INTERVAL_MS = 30
+
+
+def airtime_us(packets, payload_bytes):
+    return (packets * _PACKET_OVERHEAD_BYTES + payload_bytes) * _US_PER_BYTE
+
+
+def run(mode, interval_ms, profile="off"):
+    config.LOOP_MODE = mode
+    config.FTMS_PROFILE = profile
+    seconds = sum(d for d, _ in _RIDE) // 1000
+    # Connect happens at 500 ms in bench.run_ride; negotiate right after
+    def negotiate():
+        simulator.at_ms(600, lambda: bluetooth.BLE().update_connection(0, interval_ms))
+    stats = bench.run_ride(seconds, 0, _VOLTS, pulses=traces.pulse_times(_RIDE), setup=negotiate)
+    radio = bluetooth.BLE()
+    scheduler = radio._handler.__self__.scheduler
+    return stats, radio, scheduler
+
+
+def main():
+    saved_mode, saved_profile = config.LOOP_MODE, config.FTMS_PROFILE
+    seconds = sum(d for d, _ in _RIDE) // 1000
+
+    connected_s = seconds - 0.5
+    legacy_packets = int(connected_s * 10) * 3
+    legacy_airtime = airtime_us(legacy_packets, int(connected_s * 10) * sum(_LEGACY_PAYLOAD_BYTES))
+    print("{:<6} {:>9} {:>9} {:>7} {:>10} {:>7} {:>9} {:>12}".format(
+        "mode", "interval", "published", "sent", "suppressed", "merged", "packets/s", "airtime/s"))
+    print("{:<6} {:>9} {:>9} {:>7} {:>10} {:>7} {:>9.1f} {:>10.0f}us".format(
+        "legacy", "-", legacy_packets, legacy_packets, 0, 0,
+        legacy_packets / connected_s, legacy_airtime / connected_s))
+    for mode in ("poll", "event"):
+        for interval_ms in (8, 30, 50, 100):
+            stats, radio, scheduler = run(mode, interval_ms)
+            merged = scheduler.published - scheduler.sent - scheduler.suppressed
+            print("{:<6} {:>7}ms {:>9} {:>7} {:>10} {:>7} {:>9.1f} {:>10.0f}us".format(
+                mode, interval_ms, scheduler.published, scheduler.sent, scheduler.suppressed, merged,
+                scheduler.sent / connected_s,
+                airtime_us(radio.notify_count, radio.notify_bytes) / connected_s))
+
+    print("FTMS_PROFILE at {} ms   packets/s  bytes/packet    airtime/s  vs legacy".format(_PROFILE_INTERVAL_MS))
+    for mode in ("poll", "event"):
+        for profile in ("off", "primary", "only"):
+            stats, radio, scheduler = run(mode, _PROFILE_INTERVAL_MS, profile)
+            airtime = airtime_us(radio.notify_count, radio.notify_bytes) / connected_s
+            print("{:<6} {:<14} {:>9.1f} {:>13.1f} {:>10.0f}us {:>9.0%}".format(
+                mode, profile, radio.notify_count / connected_s, radio.notify_bytes / radio.notify_count,
+                airtime, airtime / (legacy_airtime / connected_s)))
+    config.LOOP_MODE, config.FTMS_PROFILE = saved_mode, saved_profile
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Runs the online mode of calibration/reed-wheel-callibration.py on simulated coast-downs.
+
+Usage (from the repository root):
+    python -m simulator.bench_online_k [--bearing-w 3.0] [--jitter-us 10]
+
+For each of the 15 levels in operation/config.py the rider spins the
+flywheel up past 900 RPM and lets it coast, again and again, until the
+script reports that k has converged. Reports the k it settled on, the
+error against the simulated k, and the time spent against the timed mode's
+five runs. Exits non-zero if a level does not converge or its true k is
+more than two reported half-widths away.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import re
+import sys
+
+import simulator
+from simulator import machine, traces
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import config  # noqa: E402
+
+_CALIBRATION_DIR = os.path.join(os.path.dirname(simulator.OPERATION_DIR), "calibration")
+_SCRIPT = os.path.join(_CALIBRATION_DIR, "reed-wheel-callibration.py")
+_REED_PIN = 9
+_INERTIA = 0.0588
+_RUNS = 8
+_PAUSE_MS = 2000
+_RESULT = re.compile(r"k:\s+([0-9.]+) ± ([0-9.]+)")
+
+
+def rides(k, bearing_w, jitter_ms, rng):
+    """Pulse times for _RUNS spin-ups and coast-downs, and when each run passes 300 RPM."""
+    times = []
+    at_300 = []
+    t = 500.0
+    for _ in range(_RUNS):
+        spin_up = traces.pulse_times([(1500, 300), (1500, 600), (1500, 900)], start_ms=t)
+        coast = traces.coast_down(k, bearing_w, _INERTIA, 900, 150, start_ms=spin_up[-1])
+        at_300.append(next(b for a, b in zip(coast, coast[1:]) if b - a > 200))
+        times += spin_up + coast[1:]
+        t = coast[-1] + _PAUSE_MS
+    return [x + rng.gauss(0, jitter_ms) for x in times], at_300
+
+
+def run_level(k, bearing_w, jitter_us, rng):
+    simulator.reset()
+    pulses, at_300 = rides(k, bearing_w, jitter_us / 1000, rng)
+    machine.schedule_pulses(_REED_PIN, pulses, width_ms=5)
+    CLOCK.schedule(int((pulses[-1] + 2000) * 1000), lambda: (_ for _ in ()).throw(KeyboardInterrupt))
+    source = open(_SCRIPT).read().replace('MODE = "timed"', 'MODE = "online"', 1)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            exec(compile(source, _SCRIPT, "exec"), {"__name__": "__main__"})
+        except SystemExit:
+            pass
+    match = _RESULT.search(out.getvalue())
+    if match is None:
+        return None
+    return float(match.group(1)), float(match.group(2)), CLOCK.now_us / 1e6, at_300[4] / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bearing-w", type=float, default=3.0, help="simulated bearing loss")
+    parser.add_argument("--jitter-us", type=float, default=10, help="reed edge timing noise")
+    args = parser.parse_args()
+
+    sys.path.insert(0, _CALIBRATION_DIR)
+    rng = random.Random(1)
+    failed = False
+    online_total = timed_total = 0.0
+    print("{:>5} {:>11} {:>11} {:>9} {:>7} {:>9} {:>9}".format(
+        "Level", "true k", "online k", "+/-", "error", "online s", "timed s"))
+    for level, true_k in enumerate(config.LEVEL_K_SORTED, start=1):
+        result = run_level(true_k, args.bearing_w, args.jitter_us, rng)
+        if result is None:
+            print("{:>5} {:>11.6g}  did not converge in {} runs".format(level, true_k, _RUNS))
+            failed = True
+            continue
+        k, half_width, online_s, timed_s = result
+        online_total += online_s
+        timed_total += timed_s
+        failed |= abs(k - true_k) > 2 * half_width
+        print("{:>5} {:>11.6g} {:>11.6g} {:>9.2g} {:>6.2f}% {:>9.1f} {:>9.1f}".format(
+            level, true_k, k, half_width, 100 * (k / true_k - 1), online_s, timed_s))
+    print("Calibration time, all levels: online {:.0f} s, timed {:.0f} s ({:.1f}x less)".format(
+        online_total, timed_total, timed_total / max(online_total, 1e-9)))
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
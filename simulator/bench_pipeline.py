@@ -0,0 +1,173 @@
+"""Replays sensor traces through the cadence/k/power/speed pipeline and checks for regressions.
+
+Usage (from the repository root):
+    python -m simulator.bench_pipeline [--trace ride.json ...] [--update-baseline]
+    python -m simulator.bench_pipeline --save-traces traces/
+
+Each trace (see simulator.replay) runs through the real CadenceSensor,
+KConstant (LevelTracker with LEVEL_TRACKING), get_power and
+get_flat_speed on the virtual clock. The
+standard scenarios are steady riding, sprints, stops, resistance level
+changes and a bouncing reed switch. For each one it reports the cost of
+every stage per refresh, the RMS error against the ground truth once
+settled, and the worst time to settle after a cadence or level step. It
+also lists the heap allocations each stage contains (see simulator.alloc).
+
+Results are compared with simulator/baselines/pipeline.json. A change in
+accuracy, settle time or allocations beyond the tolerances below is a
+regression and makes the script exit non-zero. Host CPU time is too noisy
+to fail on, so timing regressions are only reported, unless
+--strict-timing is given. --update-baseline stores the current results as
+the new baseline, after an intended change.
+"""
+import argparse
+import json
+import os
+import sys
+
+import simulator
+from simulator import alloc, replay
+
+simulator.install()
+
+from get_cadence import CadenceSensor  # noqa: E402
+import config  # noqa: E402
+from get_k_constant import KConstant  # noqa: E402
+from level_tracker import LevelTracker  # noqa: E402
+from get_power import get_power  # noqa: E402
+from get_speed import get_flat_speed  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "pipeline.json")
+
+# metric: (absolute, relative) slack before a higher value counts as a regression
+_TOLERANCES = {
+    "cadence_rms": (0.05, 0.10),
+    "power_rms": (0.5, 0.10),
+    "speed_rms": (0.05, 0.10),
+    "power_rms_all": (1.0, 0.10),
+    "cadence_latency_ms": (0, 0),
+    "power_latency_ms": (0, 0),
+}
+_TIMING_TOLERANCE = (0.5, 0.50)
+_STAGES = {
+    "reed_callback": CadenceSensor.reed_callback,
+    "calculate_cadence": CadenceSensor.calculate_cadence,
+    "get_k_constant": LevelTracker.get_k_constant if config.LEVEL_TRACKING else KConstant.get_k_constant,
+    "get_power": get_power,
+    "get_flat_speed": get_flat_speed,
+}
+
+
+def allocations():
+    """Allocation sites per stage: {stage: [containers, floats]}."""
+    counts = {}
+    for name, fn in _STAGES.items():
+        containers, floats = alloc.audit(fn)
+        counts[name] = [len(containers), len(floats)]
+    return counts
+
+
+def run(traces):
+    results = {}
+    for name, trace in traces.items():
+        result = replay.replay(trace)
+        del result["outputs"]
+        results[name] = result
+    return {"scenarios": results, "allocations": allocations()}
+
+
+def _exceeds(value, base, tolerance):
+    absolute, relative = tolerance
+    return value > base + max(absolute, relative * abs(base))
+
+
+def compare(current, baseline):
+    """Returns (regressions, timing_regressions) as lists of messages."""
+    regressions, timing = [], []
+    for name, result in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            continue
+        for metric, tolerance in _TOLERANCES.items():
+            if _exceeds(result[metric], base[metric], tolerance):
+                regressions.append("{} {}: {:.3f} (baseline {:.3f})".format(
+                    name, metric, result[metric], base[metric]))
+        for stage, us in result["stage_us"].items():
+            if _exceeds(us, base["stage_us"][stage], _TIMING_TOLERANCE):
+                timing.append("{} {}: {:.2f} us (baseline {:.2f} us)".format(
+                    name, stage, us, base["stage_us"][stage]))
+    for stage, counts in current["allocations"].items():
+        base = baseline["allocations"].get(stage, [0, 0])
+        if counts[0] > base[0] or counts[1] > base[1]:
+            regressions.append("{} allocations: {} containers, {} floats (baseline {}, {})".format(
+                stage, counts[0], counts[1], base[0], base[1]))
+    return regressions, timing
+
+
+def report(current):
+    print("Per refresh (host CPU, us), and replay speed vs. real time")
+    print("  {:<14} {:>9} {:>9} {:>9} {:>9} {:>9}".format("scenario", "cadence", "k", "power", "speed", "replay"))
+    for name, result in current["scenarios"].items():
+        print("  {:<14} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.0f}x".format(
+            name, *result["stage_us"].values(), result["speedup"]))
+    print("Error vs. ground truth (RMS once settled) and worst settle time after a step")
+    print("  {:<14} {:>8} {:>8} {:>9} {:>10} {:>12} {:>12}".format(
+        "scenario", "RPM", "W", "km/h", "W (all)", "RPM settle", "W settle"))
+    for name, r in current["scenarios"].items():
+        print("  {:<14} {:>8.3f} {:>8.2f} {:>9.3f} {:>10.2f} {:>9} ms {:>9} ms".format(
+            name, r["cadence_rms"], r["power_rms"], r["speed_rms"], r["power_rms_all"],
+            r["cadence_latency_ms"], r["power_latency_ms"]))
+    print("Allocation sites (containers, floats)")
+    for stage, (containers, floats) in current["allocations"].items():
+        print("  {:<18} {}, {}".format(stage, containers, floats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trace", action="append", default=[], help="recorded trace file to replay as well")
+    parser.add_argument("--save-traces", metavar="DIR", help="write the synthetic traces to DIR and exit")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--strict-timing", action="store_true", help="fail on timing regressions too")
+    args = parser.parse_args()
+
+    traces = replay.scenarios()
+    if args.save_traces:
+        os.makedirs(args.save_traces, exist_ok=True)
+        for name, trace in traces.items():
+            replay.save_trace(os.path.join(args.save_traces, name + ".json"), trace)
+        print("{} traces written to {}".format(len(traces), args.save_traces))
+        return
+    for path in args.trace:
+        trace = replay.load_trace(path)
+        traces[trace["name"]] = trace
+
+    current = run(traces)
+    report(current)
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+        with open(BASELINE, "w") as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+            f.write("\n")
+        print("Baseline written to {}".format(os.path.relpath(BASELINE)))
+        return
+    try:
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+    except OSError:
+        print("No baseline at {}; run with --update-baseline to create one".format(os.path.relpath(BASELINE)))
+        sys.exit(1)
+
+    regressions, timing = compare(current, baseline)
+    for message in timing:
+        print("SLOWER: " + message)
+    for message in regressions:
+        print("REGRESSION: " + message)
+    if regressions or (timing and args.strict_timing):
+        print("FAIL")
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Checks the ride recorder end to end and measures its cost on the loop.
+
+Usage (from the repository root):
+    python -m simulator.bench_recorder
+
+Rides through operation/main.py with small recorder files so rotation
+happens, decodes what reached the simulated flash with host.ride_decoder
+and compares it with the samples taken. Then rides again with flash writes
+taking virtual time (simulator.flash_open) and reports the longest the
+event loop was held by one task, writing each block whole and in
+recorder._WRITE_CHUNK_BYTES chunks. Exits non-zero if append() contains
+a heap-allocating container operation, a sample is lost or corrupted, more
+than RECORD_MAX_FILES files are left on flash, or a chunked block write
+holds the loop for longer than a sector erase and two page writes.
+"""
+import contextlib
+import os
+import sys
+import time
+
+import simulator
+from simulator import alloc, bench, bluetooth, traces, uasyncio
+from simulator.bench import per_call_us
+
+simulator.install()
+
+import config  # noqa: E402
+import recorder  # noqa: E402
+from host import ride_decoder  # noqa: E402
+
+_RIDE = [(300000, 85), (60000, 0), (240000, 95)]
+_VOLTS = 0.7
+_FILE_BLOCKS = 2
+_MAX_FILES = 3
+_STALL_RIDE_S = 200  # Three blocks at REFRESH_INTERVAL_MS = 250
+
+
+def _run(coro):
+    """Runs a coroutine that only yields sleep_ms(0) to completion, outside the loop."""
+    try:
+        while True:
+            coro.send(None)
+    except StopIteration:
+        pass
+
+
+def loop_stall_ms(chunk_bytes):
+    """Longest one task step held the loop, in ms, on a ride with timed flash writes in chunk_bytes pieces."""
+    saved = recorder._WRITE_CHUNK_BYTES
+    recorder._WRITE_CHUNK_BYTES = chunk_bytes
+    recorder.open = simulator.flash_open
+    simulator.erase_flash()
+    try:
+        bench.run_ride(_STALL_RIDE_S, 85, _VOLTS)
+    finally:
+        recorder._WRITE_CHUNK_BYTES = saved
+        del recorder.open
+    return uasyncio.get_event_loop().max_step_us / 1000
+
+
+def main():
+    failed = False
+    saved = config.RECORD_FILE_BLOCKS, config.RECORD_MAX_FILES
+    config.RECORD_FILE_BLOCKS, config.RECORD_MAX_FILES = _FILE_BLOCKS, _MAX_FILES
+
+    containers, floats = alloc.audit(recorder.RideRecorder.append)
+    print("append allocating operations: {} container, {} float".format(len(containers), len(floats)))
+    for op in containers:
+        print("    " + op)
+    failed |= bool(containers)
+
+    # Keep every sample the loop takes so the decoded files can be checked
+    taken = []
+    original_append = recorder.RideRecorder.append
+
+    def spy(self, *sample):
+        taken.append((time.ticks_ms(),) + sample)
+        original_append(self, *sample)
+
+    seconds = sum(d for d, _ in _RIDE) // 1000
+    simulator.erase_flash()
+    recorder.RideRecorder.append = spy
+    try:
+        bench.run_ride(seconds, 0, _VOLTS, pulses=traces.pulse_times(_RIDE),
+                       setup=lambda: simulator.at_ms(seconds * 1000 - 1000, lambda: bluetooth.BLE().disconnect()))
+    finally:
+        recorder.RideRecorder.append = original_append
+
+    files = sorted(os.listdir(config.RECORD_DIR))
+    paths = [os.path.join(config.RECORD_DIR, name) for name in files]
+    rows = list(ride_decoder.decode(paths))
+    block_records = config.RECORD_BLOCK_BYTES // recorder.RECORD_SIZE
+    # Rotation drops whole files from the front; the decoded rows are the tail of the ride
+    expected = taken[-len(rows):] if rows else []
+    mismatches = 0
+    for row, (ticks, cadence, k, power, speed, revs, event_time) in zip(rows, expected):
+        mismatches += (float(row[1]) != int(cadence * 10) / 10 or float(row[2]) != round(int(k * 1e6) / 1e6, 6)
+                       or row[3] != power or float(row[4]) != int(speed * 10) / 10
+                       or row[5] != revs & 0xFFFF or row[6] != event_time & 0xFFFF)
+    print("Samples taken: {}, files on flash: {} (limit {}), decoded rows: {}, mismatches: {}".format(
+        len(taken), len(files), _MAX_FILES, len(rows), mismatches))
+    failed |= mismatches > 0 or len(files) > _MAX_FILES or not rows
+    # Only whole deleted files may be missing; the tail left in RAM is written on disconnect
+    failed |= (len(taken) - len(rows)) % (_FILE_BLOCKS * block_records) != 0
+
+    config.RECORD_FILE_BLOCKS, config.RECORD_MAX_FILES = saved
+    simulator.erase_flash()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        rec = recorder.RideRecorder()
+    start = time.perf_counter()
+    blocks = 0
+    for i in range(block_records * 20):
+        rec.append(85.3, 0.0213, 214, 31.7, i, i * 700)
+        if rec._full is not None:
+            _run(rec.write_full_block())
+            blocks += 1
+    write_us = (time.perf_counter() - start) * 1e6
+    append_us = per_call_us(lambda: rec.append(85.3, 0.0213, 214, 31.7, 12, 3456), block_records - 1)
+    print("append: {:.2f} us per sample (host CPU)".format(append_us))
+    print("write_full_block: {:.0f} us per {}-byte block, incl. appends (host filesystem)".format(
+        write_us / blocks, config.RECORD_BLOCK_BYTES))
+    print("RAM: {} bytes in two blocks".format(2 * config.RECORD_BLOCK_BYTES))
+
+    whole = loop_stall_ms(config.RECORD_BLOCK_BYTES)
+    chunked = loop_stall_ms(recorder._WRITE_CHUNK_BYTES)
+    limit_ms = (simulator.FLASH_SECTOR_ERASE_US + 2 * simulator.FLASH_PAGE_PROGRAM_US) / 1000
+    print("Worst loop stall, flash timed: {:.1f} ms writing whole blocks, {:.1f} ms in {}-byte chunks "
+          "(limit {:.1f} ms)".format(whole, chunked, recorder._WRITE_CHUNK_BYTES, limit_ms))
+    failed |= chunked > limit_ms
+    simulator.erase_flash()
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Checks the rolling power analytics (operation/power_analytics.py) and what they cost.
+
+Usage (from the repository root):
+    python -m simulator.bench_rolling_power [--seconds 900] [--ride 180]
+
+Feeds PowerAnalytics a jittered power trace (loop periods of 20 to 180 ms,
+surges, a pause longer than its step limit) and compares every statistic
+with a plain reference that keeps the whole trace in a list and
+recomputes from it: 3 s and 30 s averages, normalized power, maximum,
+energy and the seconds in each zone must agree exactly. It then lists the
+heap allocations in update() and the per-second work (see
+simulator.alloc), and times update() after 10, 1000 and 100000 samples
+next to the reference, whose cost grows with the ride.
+
+Finally rides through main.py: the accumulated energy in the Cycling
+Power Measurement must follow the ride, the Cycling Power Feature must
+declare it, and the analytics characteristic, decoded by
+host.device_stats, must match it.
+
+Exits non-zero on any disagreement, on an allocation, or if update()
+costs more than _FLAT_LIMIT times as much late in a ride as early on.
+"""
+import argparse
+import random
+import struct
+import sys
+
+import simulator
+from simulator import alloc, bluetooth, bench
+from simulator.bench import per_call_us
+
+simulator.install()
+
+import config  # noqa: E402
+import power_analytics  # noqa: E402
+from power_analytics import PowerAnalytics  # noqa: E402
+from peripheral import _ANALYTICS_CHAR_UUID  # noqa: E402
+from host import device_stats  # noqa: E402
+
+_RPM = 85
+_VOLTS = 0.7
+_COST_AT = (10, 1000, 100000)
+_FLAT_LIMIT = 2.0
+_CPS_MEASUREMENT = 0x2A63
+_CPS_FEATURE = 0x2A65
+_CPS_FEATURE_ENERGY = 1 << 3
+
+
+class Reference:
+    """Keeps every (power, elapsed) sample and recomputes the statistics from the whole list."""
+    def __init__(self):
+        self.samples = []
+
+    def update(self, power_watts, elapsed_ms):
+        self.samples.append((max(power_watts, 0), min(elapsed_ms, power_analytics._MAX_STEP_MS)))
+        return self.stats()["energy_j"] // 1000
+
+    def stats(self):
+        # Watt-milliseconds in each second of ride time, from the absolute start and end of every sample
+        wms, t = {}, 0
+        for power, elapsed in self.samples:
+            end = t + elapsed
+            while t < end:
+                second = t // 1000
+                step = min(end, (second + 1) * 1000) - t
+                wms[second] = wms.get(second, 0) + power * step
+                t += step
+        seconds = t // 1000
+        watts = [min(wms.get(s, 0) // 1000, power_analytics._MAX_WATTS) for s in range(seconds)]
+        avg_3s = [sum(watts[max(0, s - 2):s + 1]) // min(s + 1, 3) for s in range(seconds)]
+        avg_30s = [sum(watts[max(0, s - 29):s + 1]) // min(s + 1, 30) for s in range(seconds)]
+        fourth = [w ** 4 for w in avg_30s[29:]]
+        limits = [config.FTP_W * pct // 100 for pct in config.POWER_ZONES_PCT]
+        zone_s = [0] * (len(limits) + 1)
+        for w in watts:
+            zone_s[sum(w >= limit for limit in limits)] += 1
+        return {
+            "seconds": seconds,
+            "avg_3s": avg_3s[-1] if seconds else 0,
+            "avg_30s": avg_30s[-1] if seconds else 0,
+            "normalized_power": int((sum(fourth) / len(fourth)) ** 0.25 + 0.5) if fourth else 0,
+            "max_power": max((p for p, _ in self.samples), default=0),
+            "energy_j": sum(p * e for p, e in self.samples) // 1000,
+            "zone_s": zone_s,
+        }
+
+
+def trace(seconds, seed=7):
+    """[(power, elapsed_ms)] of an interval ride with jittered loop periods and one long pause."""
+    rng = random.Random(seed)
+    samples, t = [], 0
+    while t < seconds * 1000:
+        elapsed = rng.randint(20, 180)
+        phase = (t // 1000) % 240
+        power = 320 if phase < 40 else 140
+        if rng.random() < 0.01:
+            power = rng.randint(600, 1400)
+        samples.append((power + rng.randint(-25, 25), elapsed))
+        t += elapsed
+        if len(samples) == 500:
+            samples.append((0, 5000))  # A stop at the lights, longer than _MAX_STEP_MS
+    return samples
+
+
+def actual(analytics):
+    return {
+        "seconds": analytics.seconds,
+        "avg_3s": analytics.avg_3s,
+        "avg_30s": analytics.avg_30s,
+        "normalized_power": analytics.normalized_power(),
+        "max_power": analytics.max_power,
+        "energy_j": analytics.energy_j,
+        "zone_s": list(analytics.zone_s),
+    }
+
+
+def exactness(seconds):
+    """Names of the statistics that differ from the reference, checked every simulated minute and at the end."""
+    analytics, reference = PowerAnalytics(), Reference()
+    found, next_check = [], 60000
+    t = 0
+    samples = trace(seconds)
+    for i, (power, elapsed) in enumerate(samples):
+        kj = analytics.update(power, elapsed)
+        reference.samples.append((power, min(elapsed, power_analytics._MAX_STEP_MS)))
+        t += elapsed
+        if t >= next_check or i == len(samples) - 1:
+            next_check += 60000
+            expected = reference.stats()
+            got = actual(analytics)
+            found += ["{} at {} s: {} != {}".format(k, got["seconds"], got[k], expected[k])
+                      for k in expected if got[k] != expected[k]]
+            if kj != expected["energy_j"] // 1000:
+                found.append("returned kJ at {} s: {} != {}".format(got["seconds"], kj, expected["energy_j"] // 1000))
+    return found, actual(analytics)
+
+
+def cost_after(samples, n):
+    """Per-call cost of update() once samples calls are in, over n more 100 ms samples; and the reference's."""
+    analytics, reference = PowerAnalytics(), Reference()
+    for i in range(samples):
+        analytics.update(200 + i % 50, 100)
+        reference.samples.append((200 + i % 50, 100))
+    return per_call_us(lambda: analytics.update(230, 100), n), per_call_us(lambda: reference.update(230, 100), 3)
+
+
+def ride(seconds):
+    result = bench.run_ride(seconds, _RPM, _VOLTS)
+    ble = bluetooth.BLE()
+    handle = ble.char_handles.get(_ANALYTICS_CHAR_UUID.value)
+    result["payload"] = ble.gatts_read(handle) if handle is not None else None
+    power_handle = ble.char_handles[_CPS_MEASUREMENT]
+    result["power"] = [(t_us, bytes(p)) for t_us, _, h, p in ble.notifications if h == power_handle]
+    feature_handle = ble.char_handles.get(_CPS_FEATURE)
+    result["feature"] = struct.unpack("<I", ble.gatts_read(feature_handle))[0] if feature_handle is not None else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=900, help="length of the compared trace")
+    parser.add_argument("--ride", type=int, default=180, help="virtual ride length through main.py")
+    args = parser.parse_args()
+    failed = False
+
+    found, final = exactness(args.seconds)
+    print("Against the full-history reference, {} s jittered trace: {} disagreements".format(
+        args.seconds, len(found)))
+    for line in found[:10]:
+        print("  " + line)
+    failed |= bool(found)
+    print("  end: 3 s {avg_3s} W, 30 s {avg_30s} W, NP {normalized_power} W, max {max_power} W, "
+          "{energy_j} J, zones {zone_s}".format(**final))
+
+    print("Allocation sites (containers, floats)")
+    for fn in (PowerAnalytics.update, PowerAnalytics._close_second, PowerAnalytics._add_fourth_power):
+        containers, floats = alloc.audit(fn)
+        print("  {:<18} {}, {}".format(fn.__name__, len(containers), len(floats)))
+        failed |= bool(containers or floats)
+    analytics = PowerAnalytics()
+    retained = alloc.bytes_per_call(lambda: analytics.update(250, 100), 10000)
+    print("  heap retained per update() call: {:.2f} bytes".format(retained))
+    # A fraction of a byte is one-off interpreter noise; growth shows up as >= 1
+    failed |= retained >= 1
+
+    print("update() cost after n samples (host CPU, us)    PowerAnalytics    reference")
+    costs = []
+    for n in _COST_AT:
+        cost, naive = cost_after(n, 20000)
+        costs.append(cost)
+        print("  {:>7} {:>41.2f} {:>12.0f}".format(n, cost, naive))
+    if max(costs) > _FLAT_LIMIT * min(costs):
+        print("update() cost grows with the ride: {}".format(", ".join("{:.2f}".format(c) for c in costs)))
+        failed = True
+
+    result = ride(args.ride)
+    print("Main loop, {} s ride: {:.1f} us per iteration".format(args.ride, result["us_per_iteration"]))
+    if result["payload"] is None or not result["power"]:
+        print("No analytics characteristic or power notifications")
+        failed = True
+    else:
+        decoded = device_stats.decode_analytics(result["payload"])
+        print("Characteristic ({} bytes) as read by host.device_stats:".format(len(result["payload"])))
+        for line in device_stats.report_analytics(decoded):
+            print("  " + line)
+        flags, _, energy_kj = struct.unpack("<HhH", result["power"][-1][1])
+        print("Last power measurement: flags 0x{:04x}, accumulated energy {} kJ".format(flags, energy_kj))
+        print("Cycling Power Feature: {}".format(
+            "missing" if result["feature"] is None else "0x{:08x}".format(result["feature"])))
+        if result["feature"] is None or not result["feature"] & _CPS_FEATURE_ENERGY:
+            print("Accumulated energy is sent but not declared in the Cycling Power Feature")
+            failed = True
+        # Published every ANALYTICS_PUBLISH_MS, so the characteristic may trail the last notification
+        lag_s = config.ANALYTICS_PUBLISH_MS // 1000 + 1
+        if flags != 0x0800 or abs(energy_kj - decoded["energy_j"] // 1000) > 1:
+            print("Accumulated energy does not match the analytics characteristic")
+            failed = True
+        if not args.ride - lag_s - 1 <= decoded["seconds"] <= args.ride:
+            print("Analytics cover {} s of a {} s ride".format(decoded["seconds"], args.ride))
+            failed = True
+        kjs = [struct.unpack("<HhH", p)[2] for _, p in result["power"]]
+        if any(b < a for a, b in zip(kjs, kjs[1:])):
+            print("Accumulated energy went backwards")
+            failed = True
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Runs calibration/reed-wheel-session.py through a simulated session with a power cut.
+
+Usage (from the repository root):
+    python -m simulator.bench_session [--cut-after-s 400]
+
+A simulated rider works through levels 1 to 15: they press the level button,
+the brake actuator ramps the potentiometer to the new voltage, and they
+coast the flywheel down from 900 RPM again and again until that level
+appears in the session file on (simulated) flash. Power is cut partway
+through; the script is started again and the rider begins from level 1.
+Exits non-zero if a level saved before the cut is calibrated again, the
+detected voltages or fitted k are off, or no result file is written.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+
+import simulator
+from simulator import machine, traces
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import config  # noqa: E402
+
+_CALIBRATION_DIR = os.path.join(os.path.dirname(simulator.OPERATION_DIR), "calibration")
+_SCRIPT = os.path.join(_CALIBRATION_DIR, "reed-wheel-session.py")
+_INERTIA = 0.0588
+_BEARING_W = 3.0
+_ACTUATOR_MS = 1500   # Potentiometer ramp between levels
+_NOISE_V = 0.003      # Per-read ADC noise
+_LOOK_MS = 4000       # Rider waits this long after a level press before pedalling
+_PAUSE_MS = 2000
+
+
+class PowerCut(BaseException):
+    pass
+
+
+class Rider:
+    """Drives the reed and potentiometer, and reacts to what the script saves."""
+    def __init__(self, rng, start_level=1):
+        self.rng = rng
+        self.level = start_level
+        self.volts_from = 0.0
+        self.volts_to = config.LEVEL_VOLTAGE_SORTED[start_level - 1]
+        self.ramp_start_us = CLOCK.now_us
+        self.runs = 0
+        self.presses = 0
+        machine.set_adc_voltage(config.POTENTIOMETER_PIN, self.voltage, config.PICO_REFERENCE_VOLTAGE)
+        CLOCK.schedule(CLOCK.now_us + _LOOK_MS * 1000, self.next_step)
+
+    def voltage(self, now_us):
+        progress = min(1.0, (now_us - self.ramp_start_us) / (_ACTUATOR_MS * 1000))
+        return self.volts_from + (self.volts_to - self.volts_from) * progress + self.rng.gauss(0, _NOISE_V)
+
+    def saved(self):
+        path = os.path.join(simulator.FLASH_DIR, "calibration_session.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)["levels"]
+
+    def next_step(self):
+        if str(self.level) in self.saved():
+            if self.level == len(config.LEVEL_K_SORTED):
+                return
+            self.volts_from, self.level = self.volts_to, self.level + 1
+            self.volts_to = config.LEVEL_VOLTAGE_SORTED[self.level - 1]
+            self.ramp_start_us = CLOCK.now_us
+            self.presses += 1
+            CLOCK.schedule(CLOCK.now_us + _LOOK_MS * 1000, self.next_step)
+            return
+        self.runs += 1
+        start_ms = CLOCK.now_us / 1000 + 10
+        spin_up = traces.pulse_times([(1500, 300), (1500, 600), (1500, 900)], start_ms=start_ms)
+        coast = traces.coast_down(config.LEVEL_K_SORTED[self.level - 1], _BEARING_W, _INERTIA,
+                                  900, 150, start_ms=spin_up[-1])
+        machine.schedule_pulses(config.REED_PIN, [t + self.rng.gauss(0, 0.01) for t in spin_up + coast[1:]],
+                                width_ms=5)
+        CLOCK.schedule(int((coast[-1] + _PAUSE_MS) * 1000), self.next_step)
+
+
+def cut():
+    raise PowerCut
+
+
+def boot(rng, cut_at_s=None):
+    """Runs the script from power-on until it finishes or power is cut; returns its output."""
+    rider = Rider(rng)
+    if cut_at_s is not None:
+        CLOCK.schedule(CLOCK.now_us + int(cut_at_s * 1e6), cut)
+    out = io.StringIO()
+    cwd = os.getcwd()
+    os.chdir(simulator.FLASH_DIR)
+    try:
+        with contextlib.redirect_stdout(out):
+            exec(compile(open(_SCRIPT).read(), _SCRIPT, "exec"), {"__name__": "__main__"})
+    except PowerCut:
+        pass
+    finally:
+        os.chdir(cwd)
+    return out.getvalue(), rider
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cut-after-s", type=float, default=400, help="virtual time of the power cut")
+    args = parser.parse_args()
+
+    sys.path.insert(0, _CALIBRATION_DIR)
+    simulator.erase_flash()
+    rng = random.Random(1)
+
+    simulator.reset()
+    first_out, first_rider = boot(rng, args.cut_after_s)
+    before = dict(first_rider.saved())
+    first_s = CLOCK.now_us / 1e6
+
+    simulator.reset()
+    second_out, second_rider = boot(rng)
+    after = second_rider.saved()
+    second_s = CLOCK.now_us / 1e6
+    redone = [level for level in before if before[level] != after.get(level)]
+
+    failed = bool(redone)
+    print("{:>5} {:>9} {:>9} {:>11} {:>11} {:>7} {:>5}".format(
+        "Level", "nominal V", "found V", "true k", "fitted k", "error", "runs"))
+    for level, (volts, true_k) in enumerate(zip(config.LEVEL_VOLTAGE_SORTED, config.LEVEL_K_SORTED), start=1):
+        result = after.get(str(level))
+        if result is None:
+            print("{:>5} {:>9.3f}  not calibrated".format(level, volts))
+            failed = True
+            continue
+        error = result["k"] / true_k - 1
+        failed |= abs(result["voltage"] - volts) > 0.005 or abs(error) > 0.01
+        print("{:>5} {:>9.3f} {:>9.3f} {:>11.6g} {:>11.6g} {:>6.2f}% {:>5}".format(
+            level, volts, result["voltage"], true_k, result["k"], 100 * error, result["runs"]))
+    result_path = os.path.join(simulator.FLASH_DIR, "calibration_result.txt")
+    has_result = os.path.exists(result_path)
+    print("Before the power cut: {} levels saved in {:.0f} s".format(len(before), first_s))
+    print("After restart: {} levels in {:.0f} s, {} re-calibrated, result file written: {}".format(
+        len(after) - len(before), second_s, len(redone), has_result))
+    print("Session: {:.1f} min of riding, {} coast-downs".format(
+        (first_s + second_s) / 60, first_rider.runs + second_rider.runs))
+    failed |= not has_result
+    simulator.erase_flash()
+
+    if failed:
+        print(first_out[-2000:])
+        print(second_out[-2000:])
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
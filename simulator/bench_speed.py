@@ -0,0 +1,85 @@
+"""Benchmarks and sweeps the get_flat_speed solvers over 0-1500 W.
+
+Usage (from the repository root):
+    python -m simulator.bench_speed
+
+Every solver is compared against the original 5-step iterative result and
+against a fully converged root of the same cubic. The iterative solver is
+itself not converged far from its 18 km/h starting guess, so the exact
+solvers are checked against the converged root and exit non-zero if they
+deviate by more than _TOLERANCE_KPH.
+"""
+import sys
+
+import simulator
+from simulator.bench import per_call_us
+
+simulator.install()
+
+import get_speed  # noqa: E402
+
+_MAX_WATTS = 1500
+_TOLERANCE_KPH = 1e-3
+
+
+def converged_kph(power_watts):
+    """Newton's method on the force balance, run to machine precision."""
+    if power_watts <= 0:
+        return 0.0
+    a, b = get_speed._AERO, get_speed._F_ROLLING
+    target = power_watts * get_speed._EFF
+    v = 5.0
+    for _ in range(100):
+        step = (a * v ** 3 + b * v - target) / (3 * a * v ** 2 + b)
+        v -= step
+        if abs(step) < 1e-12:
+            break
+    return v * 3.6
+
+
+def sweep(solver, powers):
+    worst_vs_legacy = worst_vs_exact = 0.0
+    for watts in powers:
+        speed = solver(watts)
+        worst_vs_legacy = max(worst_vs_legacy, abs(speed - get_speed.get_flat_speed_iterative(watts)))
+        worst_vs_exact = max(worst_vs_exact, abs(speed - converged_kph(watts)))
+    return worst_vs_legacy, worst_vs_exact
+
+
+def main():
+    if get_speed._SPEED_TABLE is None:
+        get_speed._SPEED_TABLE = get_speed.build_speed_table(_MAX_WATTS)
+        get_speed._SPEED_TABLE_LEN = len(get_speed._SPEED_TABLE)
+
+    whole_watts = range(_MAX_WATTS + 1)
+    fractional = [w / 10 for w in range(_MAX_WATTS * 10 + 1)]
+    solvers = (
+        ("iterative", get_speed.get_flat_speed_iterative, fractional),
+        ("cardano", get_speed.get_flat_speed_cardano, fractional),
+        ("table", get_speed.get_flat_speed_table, whole_watts),
+    )
+
+    print("Accuracy over 0-{} W (max |error| in km/h)".format(_MAX_WATTS))
+    print("  {:<10} {:>12} {:>12}".format("solver", "vs iterative", "vs exact"))
+    failed = False
+    for name, solver, powers in solvers:
+        vs_legacy, vs_exact = sweep(solver, powers)
+        print("  {:<10} {:>12.6f} {:>12.6f}".format(name, vs_legacy, vs_exact))
+        if name != "iterative" and vs_exact > _TOLERANCE_KPH:
+            failed = True
+
+    print("Per-call cost at 250 W (host CPU)")
+    baseline = None
+    for name, solver, _ in solvers:
+        cost = per_call_us(lambda: solver(250))
+        baseline = baseline or cost
+        print("  {:<10} {:6.2f} us ({:.1f}x)".format(name, cost, baseline / cost))
+    print("  table size: {} bytes".format(get_speed._SPEED_TABLE_LEN * 4))
+
+    if failed:
+        print("FAIL: exact solver deviates from the converged root")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Checks the hot-path instrumentation (operation/stats.py) and what it costs.
+
+Usage (from the repository root):
+    python -m simulator.bench_stats [--seconds 120]
+
+Rides through main.py with STATS_ENABLED off and on. It compares the cost
+per main-loop iteration and per stats call, and lists the heap
+allocations in the instrumentation (see simulator.alloc). It then reads
+the statistics characteristic from the simulated radio and decodes it
+with host.device_stats. Exits non-zero if the characteristic is missing
+when enabled or present when disabled, or if the decoded loop and stage
+counts don't match the ride. It also fails if the calls allocate.
+
+The virtual clock does not move while a stage runs, so stage costs in the
+decoded characteristic read 0 here; on the Pico they are real.
+"""
+import argparse
+import sys
+
+import simulator
+from simulator import alloc, bluetooth, bench
+from simulator.bench import per_call_us
+
+simulator.install()
+
+import config  # noqa: E402
+import stats  # noqa: E402
+from peripheral import _STATS_CHAR_UUID  # noqa: E402
+from host import device_stats  # noqa: E402
+
+_RPM = 85
+_VOLTS = 0.7
+
+
+def ride(enabled, seconds):
+    stats.ENABLED = enabled
+    stats.reset()
+    result = bench.run_ride(seconds, _RPM, _VOLTS)
+    ble = bluetooth.BLE()
+    handle = ble.char_handles.get(_STATS_CHAR_UUID.value)
+    result["payload"] = ble.gatts_read(handle) if handle is not None else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=120, help="virtual ride length")
+    args = parser.parse_args()
+    failed = False
+
+    off = ride(False, args.seconds)
+    on = ride(True, args.seconds)
+    print("Main loop, {} s ride (host CPU)".format(args.seconds))
+    print("  disabled: {:.1f} us per iteration".format(off["us_per_iteration"]))
+    print("  enabled:  {:.1f} us per iteration".format(on["us_per_iteration"]))
+    if off["payload"] is not None:
+        print("Statistics characteristic registered while disabled")
+        failed = True
+
+    print("Per-call cost (host CPU)")
+    for enabled in (False, True):
+        stats.ENABLED = enabled
+        t = stats.start()
+        print("  {:<9} start {:.2f} us, stop {:.2f} us, loop {:.2f} us".format(
+            "enabled" if enabled else "disabled", per_call_us(stats.start),
+            per_call_us(lambda: stats.stop(stats.POWER, t)), per_call_us(stats.loop)))
+
+    print("Allocation sites (containers, floats)")
+    for fn in (stats.start, stats.stop, stats.loop):
+        containers, floats = alloc.audit(fn)
+        print("  {:<8} {}, {}".format(fn.__name__, len(containers), len(floats)))
+        if containers or floats:
+            failed = True
+
+    if on["payload"] is None:
+        print("No statistics characteristic while enabled")
+        failed = True
+    else:
+        decoded = device_stats.decode(on["payload"])
+        print("")
+        print("Characteristic ({} bytes) as read by host.device_stats:".format(len(on["payload"])))
+        for line in device_stats.report(decoded):
+            print("  " + line)
+        # Published every STATS_PUBLISH_MS, so it may trail the ride by that much
+        refreshes = args.seconds * 1000 // config.REFRESH_INTERVAL_MS
+        lag = config.STATS_PUBLISH_MS // config.REFRESH_INTERVAL_MS + 1
+        loops = decoded["loops"]
+        cadence_calls = sum(decoded["stages"]["cadence"]["hist"])
+        target_bucket = config.REFRESH_INTERVAL_MS * 1000 // decoded["loop_bucket_us"]
+        if not refreshes - 2 * lag <= loops <= refreshes:
+            print("Loop count {} does not match about {} refreshes".format(loops, refreshes))
+            failed = True
+        if cadence_calls != loops or decoded["loop_hist"][target_bucket] != loops - 1:
+            print("Stage or loop-period counts do not match the loop count")
+            failed = True
+
+    if failed:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Stand-in for MicroPython's ``bluetooth`` module that captures GATT traffic."""
+from simulator.clock import CLOCK
+
+FLAG_READ = 0x0002
+FLAG_WRITE_NO_RESPONSE = 0x0004
+FLAG_WRITE = 0x0008
+FLAG_NOTIFY = 0x0010
+FLAG_INDICATE = 0x0020
+
+_IRQ_CENTRAL_CONNECT = 1
+_IRQ_CENTRAL_DISCONNECT = 2
+_IRQ_GATTS_WRITE = 3
+_IRQ_CONNECTION_UPDATE = 27
+
+_ENOMEM = 12
+
+_instance = None
+
+
+class UUID:
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and other.value == self.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __repr__(self):
+        return "UUID({!r})".format(self.value)
+
+
+class BLE:
+    """A singleton radio, like the real one: every BLE() call returns it."""
+    def __new__(cls):
+        global _instance
+        if _instance is None:
+            _instance = super().__new__(cls)
+            _instance._setup()
+        return _instance
+
+    def _setup(self):
+        self._active = False
+        self._handler = None
+        self._values = {}
+        self._next_handle = 1
+        self.char_handles = {}  # Characteristic UUID value -> value handle
+        self.notify_handles = []  # Value handles of the characteristics with a CCCD
+        self.capture = True
+        self.notifications = []
+        self.notify_count = 0
+        self.notify_bytes = 0
+        self.adv_interval_us = None
+        self.adv_data = None
+        self.adv_starts = 0
+        self.links = {}  # conn_handle -> _Link, for connections given one with set_link()
+        self.refused = 0
+
+    # --- MicroPython BLE API ---
+    def active(self, value=None):
+        if value is not None:
+            self._active = bool(value)
+        return self._active
+
+    def config(self, *args, **kwargs):
+        if args and args[0] == "mtu":
+            return 23
+        return None
+
+    def irq(self, handler):
+        self._handler = handler
+
+    def gatts_register_services(self, services):
+        handles = []
+        for _, characteristics in services:
+            service_handles = []
+            for characteristic in characteristics:
+                self.char_handles[characteristic[0].value] = self._next_handle
+                service_handles.append(self._next_handle)
+                self._values[self._next_handle] = b""
+                self._next_handle += 1
+                if characteristic[1] & (FLAG_NOTIFY | FLAG_INDICATE):
+                    # Like the real stack, the CCCD is the handle after the value's
+                    self.notify_handles.append(self._next_handle - 1)
+                    self._values[self._next_handle] = b"\x00\x00"
+                    self._next_handle += 1
+            handles.append(tuple(service_handles))
+        return tuple(handles)
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        self._values[value_handle] = bytes(data)
+
+    def gatts_set_buffer(self, value_handle, size, append=False):
+        pass
+
+    def gatts_read(self, value_handle):
+        return self._values[value_handle]
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        link = self.links.get(conn_handle)
+        if link is not None and not link.take(CLOCK.now_us):
+            self.refused += 1
+            raise OSError(_ENOMEM)
+        payload = self._values[value_handle] if data is None else bytes(data)
+        self.notify_count += 1
+        self.notify_bytes += len(payload)
+        if self.capture:
+            self.notifications.append((CLOCK.now_us, conn_handle, value_handle, payload))
+
+    def gap_advertise(self, interval_us, adv_data=None, connectable=True):
+        self.adv_interval_us = interval_us
+        if interval_us:
+            self.adv_starts += 1
+            if adv_data is not None:
+                self.adv_data = bytes(adv_data)
+
+    def gap_disconnect(self, conn_handle):
+        self.disconnect(conn_handle)
+        return True
+
+    # --- Simulator controls ---
+    def connect(self, conn_handle=0, subscribe=True):
+        """Delivers a central-connect event to the registered IRQ handler.
+
+        Like a real stack, only while advertising, and advertising stops.
+        With subscribe, the central then enables notifications of every
+        characteristic that has them, as apps do. Returns False if the
+        peripheral wasn't advertising.
+        """
+        if not self.adv_interval_us:
+            return False
+        self.adv_interval_us = 0
+        self._handler(_IRQ_CENTRAL_CONNECT, (conn_handle, 0, b"\x00" * 6))
+        if subscribe:
+            for value_handle in self.notify_handles:
+                self.subscribe(conn_handle, value_handle)
+        return True
+
+    def subscribe(self, conn_handle, value_handle, enabled=True):
+        """Writes the CCCD of value_handle's characteristic for a central, as a GATT write."""
+        self._values[value_handle + 1] = b"\x01\x00" if enabled else b"\x00\x00"
+        self._handler(_IRQ_GATTS_WRITE, (conn_handle, value_handle + 1))
+
+    def disconnect(self, conn_handle=0):
+        self.links.pop(conn_handle, None)
+        self._handler(_IRQ_CENTRAL_DISCONNECT, (conn_handle, 0, b"\x00" * 6))
+
+    def set_link(self, conn_handle, interval_ms, buffers=4, per_event=2):
+        """Gives a connection a finite link: the stack holds at most buffers
+        notifications for it and puts per_event of them on air per connection
+        event. Further notifications raise OSError, as gatts_notify does when
+        the stack has no room for them; operation/ only relies on the type.
+        per_event=0 is a central that stopped listening (out of range)."""
+        self.links[conn_handle] = _Link(interval_ms * 1000, buffers, per_event, CLOCK.now_us)
+
+    def update_connection(self, conn_handle=0, interval_ms=30):
+        """Delivers a connection-parameter update (interval in 1.25 ms units on air)."""
+        self._handler(_IRQ_CONNECTION_UPDATE, (conn_handle, interval_ms * 4 // 5, 0, 400, 0))
+
+
+class _Link:
+    def __init__(self, interval_us, buffers, per_event, now_us):
+        self.interval_us = interval_us
+        self.buffers = buffers
+        self.per_event = per_event
+        self.queued = 0
+        self.event_us = now_us
+
+    def take(self, now_us):
+        """Queues one notification if a buffer is free, after draining the events since the last call."""
+        events = (now_us - self.event_us) // self.interval_us
+        if events:
+            self.event_us += events * self.interval_us
+            self.queued = max(0, self.queued - events * self.per_event)
+        if self.queued >= self.buffers:
+            return False
+        self.queued += 1
+        return True
+
+
+def reset():
+    global _instance
+    _instance = None
@@ -0,0 +1,66 @@
+import heapq
+
+# MicroPython's ticks_* counters wrap at 2**30 on every port.
+TICKS_PERIOD = 1 << 30
+_TICKS_HALF = TICKS_PERIOD // 2
+_TICKS_MAX = TICKS_PERIOD - 1
+
+
+class VirtualClock:
+    """A microsecond clock that only moves when the simulator advances it.
+
+    Hardware events (reed pulses, BLE connects, ...) are scheduled against
+    this clock and fired in timestamp order while it is being advanced, so
+    IRQ handlers observe the exact time their edge happened.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.now_us = 0
+        self._events = []
+        self._seq = 0
+
+    def schedule(self, at_us, callback):
+        """Runs callback() when the clock reaches at_us (absolute, unwrapped)."""
+        self._seq += 1
+        heapq.heappush(self._events, (int(at_us), self._seq, callback))
+
+    def next_event_us(self):
+        return self._events[0][0] if self._events else None
+
+    def advance_to(self, target_us, stop=None):
+        """Moves time forward to target_us, firing due events on the way.
+
+        If stop() becomes true after an event fires, the clock is left at that
+        event's timestamp so a woken task can run before time moves on.
+        """
+        events = self._events
+        while events and events[0][0] <= target_us:
+            at_us, _, callback = heapq.heappop(events)
+            if at_us > self.now_us:
+                self.now_us = at_us
+            callback()
+            if stop is not None and stop():
+                return
+        if target_us > self.now_us:
+            self.now_us = target_us
+
+    # --- MicroPython ``time`` API ---
+    def ticks_ms(self):
+        return (self.now_us // 1000) & _TICKS_MAX
+
+    def ticks_us(self):
+        return self.now_us & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    """Signed difference of two wrapped tick values, as on MicroPython."""
+    return ((ticks1 - ticks2 + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+CLOCK = VirtualClock()
@@ -0,0 +1,96 @@
+"""Simulated sensors for host.fleet_gateway.
+
+SimulatedTransport rides main.py through a few rider profiles in the
+simulator and keeps every notification BLEPeripheral sent, bytes and
+virtual time. A fleet of any size is built from those: bike n replays
+profile n % len(PROFILES), started a different fraction of a second in so
+the bikes don't notify in lockstep. The transport hands the merged
+timeline to FleetGateway.ingest() at the times it was sent (sped up by
+speed), with that time as the send time, so the gateway's latency
+includes any lag of its own. Like BleakTransport, it reads a sensor
+without Cycling Power (FTMS_PROFILE "only") through Indoor Bike Data.
+"""
+import asyncio
+import time
+
+import simulator
+from simulator import bench, bluetooth, traces
+from host.fleet_gateway import CPS_MEASUREMENT, CSC_MEASUREMENT, INDOOR_BIKE_DATA, Transport
+
+# (name, [(duration_ms, rpm)], potentiometer volts, FTMS_PROFILE)
+PROFILES = [
+    ("steady", [(60000, 85)], 0.7, "off"),
+    ("intervals", [(15000, 70), (15000, 105), (15000, 70), (15000, 105)], 0.9, "off"),
+    ("stops", [(20000, 90), (8000, 0), (32000, 80)], 0.5, "off"),
+    ("climb", [(60000, 65)], 1.3, "off"),
+    ("ftms only", [(25000, 95), (10000, 0), (25000, 75)], 0.8, "only"),
+]
+# At most this many notifications per burst before the gateway gets a turn
+_BURST = 1024
+
+_rides = {}
+
+
+def ride(profile):
+    """[(t_s, characteristic, payload)] main.py notified riding profile, cached."""
+    if profile[0] not in _rides:
+        import config  # operation/config.py, on the path once simulator.install() has run
+        name, segments, volts, ftms_profile = profile
+        seconds = sum(d for d, _ in segments) // 1000
+        saved, config.FTMS_PROFILE = config.FTMS_PROFILE, ftms_profile
+        try:
+            bench.run_ride(seconds, 0, volts, pulses=traces.pulse_times(segments))
+        finally:
+            config.FTMS_PROFILE = saved
+        radio = bluetooth.BLE()
+        wanted = (CPS_MEASUREMENT, CSC_MEASUREMENT) if CPS_MEASUREMENT in radio.char_handles else (INDOOR_BIKE_DATA,)
+        characteristics = {radio.char_handles[uuid]: uuid for uuid in wanted}
+        _rides[name] = [(t_us / 1e6, characteristics[value_handle], bytes(payload))
+                       for t_us, _, value_handle, payload in radio.notifications
+                       if value_handle in characteristics]
+    return _rides[profile[0]]
+
+
+def timeline(bikes, profiles=PROFILES):
+    """[(t_s, bike_id, characteristic, payload)] of a fleet of bikes, in time order."""
+    simulator.install()
+    events = []
+    for n in range(bikes):
+        notifications = ride(profiles[n % len(profiles)])
+        # Spread the starts over one keepalive period
+        offset = (n * 0.618034) % 1.0
+        bike_id = "sim-{:03d}".format(n)
+        events.extend((t + offset, bike_id, c, p) for t, c, p in notifications)
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+class SimulatedTransport(Transport):
+    """Replays timeline(bikes), or its first seconds, into the gateway in real time or speed times faster."""
+    def __init__(self, bikes, speed=1.0, profiles=PROFILES, seconds=None):
+        self.events = timeline(bikes, profiles)
+        if seconds is not None:
+            self.events = [e for e in self.events if e[0] < seconds]
+        self.speed = speed
+        self.behind_s = 0.0  # Longest the replay itself ran late
+
+    async def run(self, gateway):
+        start = time.perf_counter()
+        events, speed, i = self.events, self.speed, 0
+        ingest = gateway.ingest
+        while i < len(events):
+            due = start + events[i][0] / speed
+            now = time.perf_counter()
+            if due > now:
+                await asyncio.sleep(due - now)
+                now = time.perf_counter()
+            self.behind_s = max(self.behind_s, now - due)
+            end = min(i + _BURST, len(events))
+            while i < end:
+                t, bike_id, characteristic, payload = events[i]
+                due = start + t / speed
+                if due > now:
+                    break
+                ingest(bike_id, characteristic, payload, due)
+                i += 1
+            await asyncio.sleep(0)
@@ -0,0 +1,149 @@
+"""Stand-in for MicroPython's ``machine`` module, driven by the virtual clock."""
+from simulator.clock import CLOCK
+
+# --- Scripted hardware state, keyed by pin id ---
+_lines = {}
+_adc_traces = {}
+# Counters for the benchmarks
+adc_reads = 0
+slept_us = 0  # Time spent in lightsleep()
+
+
+class _Line:
+    """The electrical state of one GPIO, shared by every Pin object on it."""
+    def __init__(self):
+        self.value = 1
+        self.handler = None
+        self.trigger = 0
+        self.pin = None
+        self.edges = 0
+
+    def drive(self, value):
+        if value == self.value:
+            return
+        self.value = value
+        self.edges += 1
+        if self.handler is None:
+            return
+        edge = Pin.IRQ_FALLING if value == 0 else Pin.IRQ_RISING
+        if self.trigger & edge:
+            self.handler(self.pin)
+
+
+def _line(pin_id):
+    line = _lines.get(pin_id)
+    if line is None:
+        line = _lines[pin_id] = _Line()
+    return line
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.id = pin_id
+        self._line = _line(pin_id)
+        if value is not None:
+            self._line.value = value
+        elif mode == Pin.OUT:
+            self._line.value = 0
+
+    def value(self, v=None):
+        if v is None:
+            return self._line.value
+        self._line.drive(1 if v else 0)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(not self._line.value)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self._line.handler = handler
+        self._line.trigger = trigger
+        self._line.pin = self
+
+
+class ADC:
+    def __init__(self, pin_id):
+        self.id = pin_id
+
+    def read_u16(self):
+        global adc_reads
+        adc_reads += 1
+        trace = _adc_traces.get(self.id, 0)
+        if callable(trace):
+            trace = trace(CLOCK.now_us)
+        return max(0, min(65535, int(trace)))
+
+
+def disable_irq():
+    # Scripted edges only fire while the clock is advanced, never mid-statement
+    return 0
+
+
+def enable_irq(state):
+    pass
+
+
+def lightsleep(time_ms=None):
+    """Moves the clock on by time_ms, or less if a scripted hardware event wakes the chip first.
+
+    Nothing else runs meanwhile, as on the device: uasyncio tasks due in
+    between run late. Any scripted event (a reed edge, a central
+    connecting) ends the sleep, like the interrupt it stands for.
+    """
+    global slept_us
+    start_us = CLOCK.now_us
+    if time_ms is None:
+        target_us = CLOCK.next_event_us()
+        if target_us is None:
+            raise RuntimeError("lightsleep() with no wake-up source scheduled")
+    else:
+        target_us = start_us + int(time_ms * 1000)
+    CLOCK.advance_to(target_us, stop=lambda: True)
+    slept_us += CLOCK.now_us - start_us
+
+
+# --- Simulator controls ---
+def reset():
+    global adc_reads, slept_us
+    _lines.clear()
+    _adc_traces.clear()
+    adc_reads = slept_us = 0
+
+
+def line(pin_id):
+    """Returns the shared state of a GPIO (value, edge count, IRQ handler)."""
+    return _line(pin_id)
+
+
+def schedule_pulses(pin_id, times_ms, width_ms=20):
+    """Pulls the pin low at each time in times_ms for width_ms, like a reed switch."""
+    state = _line(pin_id)
+    for t in times_ms:
+        at_us = int(t * 1000)
+        CLOCK.schedule(at_us, lambda: state.drive(0))
+        CLOCK.schedule(at_us + int(width_ms * 1000), lambda: state.drive(1))
+
+
+def set_adc(pin_id, trace):
+    """Scripts an ADC input: a raw u16 value or a function of time in microseconds."""
+    _adc_traces[pin_id] = trace
+
+
+def set_adc_voltage(pin_id, trace, vref=3.3):
+    """Like set_adc, but in volts (a value or a function of time in microseconds)."""
+    if callable(trace):
+        _adc_traces[pin_id] = lambda now_us: trace(now_us) / vref * 65535
+    else:
+        _adc_traces[pin_id] = trace / vref * 65535
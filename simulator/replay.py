@@ -0,0 +1,262 @@
+"""Record-and-replay of sensor traces through the cadence/k/power/speed pipeline.
+
+A trace is what the Pico's pins see on a ride plus what really happened:
+
+    {"name": ..., "duration_ms": ...,
+     "pulses": [[t_ms, width_ms], ...],   # reed closures, bounce included
+     "adc":    [[t_ms, volts], ...],      # potentiometer, held until the next sample
+     "truth":  [[t_ms, rpm, level], ...]} # true cadence and level from t_ms on
+
+Traces are stored as JSON (save_trace/load_trace), so a recorded ride can be
+replayed the same way as the synthetic scenarios below. replay() drives the
+real operation modules (CadenceSensor, KConstant or with LEVEL_TRACKING
+LevelTracker, get_power, get_flat_speed) at the main loop's refresh rate
+on the virtual clock, and compares every output with the ground truth.
+"""
+import json
+import math
+import random
+import time
+
+import simulator
+from simulator import machine, traces
+from simulator.clock import CLOCK
+
+simulator.install()
+
+import config  # noqa: E402
+from get_cadence import CadenceSensor  # noqa: E402
+from get_k_constant import KConstant  # noqa: E402
+from level_tracker import LevelTracker  # noqa: E402
+from get_power import get_power  # noqa: E402
+from get_speed import get_flat_speed, get_flat_speed_cardano, init_speed_table  # noqa: E402
+
+# Outputs count as settled on a new value when within max(absolute, relative)
+_CADENCE_TOLERANCE = (2.0, 0.03)
+_POWER_TOLERANCE = (5.0, 0.05)
+_SETTLE_EXCLUDE_MS = 4000  # Steady-state error ignores this long after a change
+
+
+# --- Trace files ---
+def save_trace(path, trace):
+    with open(path, "w") as f:
+        json.dump(trace, f)
+
+
+def load_trace(path):
+    with open(path) as f:
+        trace = json.load(f)
+    for key in ("name", "duration_ms", "pulses", "adc", "truth"):
+        if key not in trace:
+            raise ValueError("{}: trace has no '{}'".format(path, key))
+    return trace
+
+
+# --- Synthetic scenarios ---
+def _level_volts(level):
+    return config.LEVEL_VOLTAGE_SORTED[level - 1]
+
+
+def _adc_samples(duration_ms, level_steps, rng, ramp_ms=1500, noise_v=0.002, every_ms=10):
+    """Potentiometer samples: the actuator ramps between levels, plus ADC noise."""
+    samples = []
+    volts = _level_volts(level_steps[0][1])
+    step = 0
+    ramp_from, ramp_start = volts, 0
+    for t in range(0, duration_ms, every_ms):
+        while step + 1 < len(level_steps) and t >= level_steps[step + 1][0]:
+            step += 1
+            ramp_from, ramp_start = volts, level_steps[step][0]
+        target = _level_volts(level_steps[step][1])
+        progress = min(1.0, (t - ramp_start) / ramp_ms) if step else 1.0
+        volts = ramp_from + (target - ramp_from) * progress
+        samples.append([t, volts + rng.gauss(0, noise_v)])
+    return samples
+
+
+def _truth(segments, level_steps):
+    """Merges cadence segments [(duration_ms, rpm)] and level steps [(t_ms, level)]."""
+    changes = {}
+    t = 0
+    for duration_ms, rpm in segments:
+        changes.setdefault(t, {})["rpm"] = rpm
+        t += duration_ms
+    for t_ms, level in level_steps:
+        changes.setdefault(t_ms, {})["level"] = level
+    truth = []
+    rpm, level = 0, level_steps[0][1]
+    for t_ms in sorted(changes):
+        rpm = changes[t_ms].get("rpm", rpm)
+        level = changes[t_ms].get("level", level)
+        truth.append([t_ms, rpm, level])
+    return truth
+
+
+def synthetic(name, segments, level_steps, seed=1, bounce=False):
+    rng = random.Random(seed)
+    duration_ms = sum(d for d, _ in segments)
+    pulses = [[t, 20] for t in traces.pulse_times(segments)]
+    if bounce:
+        # Contact chatter: 1-3 short closures within 8 ms after each edge, and
+        # now and then a lone spurious closure mid-revolution
+        chatter = []
+        for t, _ in pulses:
+            for i in range(rng.randint(1, 3)):
+                chatter.append([t + 21 + 2 * i + rng.random(), 0.5])
+            if rng.random() < 0.05:
+                chatter.append([t + 150 + rng.random() * 100, 1])
+        pulses = sorted(pulses + chatter)
+    return {"name": name, "duration_ms": duration_ms, "pulses": pulses,
+            "adc": _adc_samples(duration_ms, level_steps, rng),
+            "truth": _truth(segments, level_steps)}
+
+
+def scenarios():
+    """The standard synthetic traces, by name."""
+    return {trace["name"]: trace for trace in (
+        synthetic("steady", [(60000, 90)], [(0, 7)]),
+        synthetic("sprints", [(15000, 75), (8000, 115), (12000, 75), (8000, 115), (12000, 75)], [(0, 9)]),
+        synthetic("stops", [(20000, 80), (10000, 0), (20000, 85), (6000, 0), (10000, 70)], [(0, 5)]),
+        synthetic("level_changes", [(60000, 85)], [(0, 3), (12000, 8), (24000, 12), (36000, 5), (48000, 15)]),
+        synthetic("bounce", [(20000, 60), (20000, 95), (20000, 110)], [(0, 10)], bounce=True),
+    )}
+
+
+# --- Replay ---
+def _schedule(trace):
+    width_groups = {}
+    for t_ms, width_ms in trace["pulses"]:
+        width_groups.setdefault(width_ms, []).append(t_ms)
+    for width_ms, times in width_groups.items():
+        machine.schedule_pulses(config.REED_PIN, times, width_ms=width_ms)
+    adc = trace["adc"]
+    times = [t for t, _ in adc]
+    scale = 65535 / config.PICO_REFERENCE_VOLTAGE
+
+    def read(now_us):
+        # Sample-and-hold of the recorded voltage
+        lo, hi = 0, len(times)
+        t_ms = now_us / 1000
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[mid] <= t_ms:
+                lo = mid + 1
+            else:
+                hi = mid
+        return adc[max(lo - 1, 0)][1] * scale
+    machine.set_adc(config.POTENTIOMETER_PIN, read)
+
+
+def _truth_at(truth, t_ms):
+    current = truth[0]
+    for row in truth:
+        if row[0] > t_ms:
+            break
+        current = row
+    return current
+
+
+def _within(value, target, tolerance):
+    absolute, relative = tolerance
+    return abs(value - target) <= max(absolute, relative * abs(target))
+
+
+def _settle_latencies(steps, changes, key, tolerance):
+    """For each change time, ms until the output stays within tolerance of the truth."""
+    latencies = []
+    for i, t_change in enumerate(changes):
+        t_next = changes[i + 1] if i + 1 < len(changes) else float("inf")
+        window = [s for s in steps if t_change <= s["t_ms"] < t_next]
+        settled_at = None
+        for s in window:
+            if _within(s[key], s["true_" + key], tolerance):
+                if settled_at is None:
+                    settled_at = s["t_ms"]
+            else:
+                settled_at = None
+        if settled_at is not None:
+            latencies.append(settled_at - t_change)
+        elif window:
+            latencies.append(window[-1]["t_ms"] - t_change)  # Never settled: count the whole window
+    return latencies
+
+
+def replay(trace, refresh_ms=None):
+    """Replays trace through the pipeline; returns per-stage cost, outputs and error metrics."""
+    refresh_ms = refresh_ms or config.REFRESH_INTERVAL_MS
+    simulator.reset()
+    _schedule(trace)
+    sensor = CadenceSensor()
+    if config.LEVEL_TRACKING:
+        # Sampled every LEVEL_SAMPLE_MS in between refreshes, as main.py runs LevelTracker.run()
+        k_constant = LevelTracker()
+        sample_ms = config.LEVEL_SAMPLE_MS
+    else:
+        k_constant = KConstant()
+        sample_ms = 0
+    next_sample_ms = sample_ms
+    init_speed_table()
+
+    stage_ns = {"calculate_cadence": 0, "get_k_constant": 0, "get_power": 0, "get_flat_speed": 0}
+    steps = []
+    clock = time.perf_counter_ns
+    wall_start = clock()
+    for t_ms in range(refresh_ms, trace["duration_ms"] + 1, refresh_ms):
+        sample_ns = 0
+        while sample_ms and next_sample_ms <= t_ms:
+            CLOCK.advance_to(next_sample_ms * 1000)
+            t0 = clock()
+            k_constant.sample()
+            sample_ns += clock() - t0
+            next_sample_ms += sample_ms
+        CLOCK.advance_to(t_ms * 1000)
+        now_us = time.ticks_us()
+        t0 = clock()
+        cadence = sensor.calculate_cadence(now_us)
+        t1 = clock()
+        k = k_constant.get_k_constant()
+        t2 = clock()
+        power = get_power(cadence, k)
+        t3 = clock()
+        speed = get_flat_speed(power)
+        t4 = clock()
+        stage_ns["calculate_cadence"] += t1 - t0
+        # The background samples since the last refresh count towards k
+        stage_ns["get_k_constant"] += t2 - t1 + sample_ns
+        stage_ns["get_power"] += t3 - t2
+        stage_ns["get_flat_speed"] += t4 - t3
+
+        _, true_rpm, level = _truth_at(trace["truth"], t_ms)
+        true_k = config.LEVEL_K_SORTED[level - 1]
+        true_power = get_power(true_rpm, true_k)
+        steps.append({"t_ms": t_ms, "cadence": cadence, "power": power, "speed": speed,
+                      "true_cadence": true_rpm, "true_power": true_power,
+                      "true_speed": get_flat_speed_cardano(true_power)})
+
+    wall_s = (clock() - wall_start) / 1e9
+    n = len(steps)
+    changes = [row[0] for row in trace["truth"]]
+
+    def settled(s):
+        return all(not (c <= s["t_ms"] < c + _SETTLE_EXCLUDE_MS) for c in changes[1:]) \
+            and s["t_ms"] >= _SETTLE_EXCLUDE_MS
+
+    steady = [s for s in steps if settled(s)] or steps
+
+    def rms(key, rows):
+        return math.sqrt(sum((s[key] - s["true_" + key]) ** 2 for s in rows) / len(rows))
+
+    cadence_latency = _settle_latencies(steps, changes, "cadence", _CADENCE_TOLERANCE)
+    power_latency = _settle_latencies(steps, changes, "power", _POWER_TOLERANCE)
+    return {
+        "steps": n,
+        "speedup": trace["duration_ms"] / 1000 / wall_s,
+        "stage_us": {name: ns / 1000 / n for name, ns in stage_ns.items()},
+        "cadence_rms": rms("cadence", steady),
+        "power_rms": rms("power", steady),
+        "speed_rms": rms("speed", steady),
+        "power_rms_all": rms("power", steps),
+        "cadence_latency_ms": max(cadence_latency) if cadence_latency else 0,
+        "power_latency_ms": max(power_latency) if power_latency else 0,
+        "outputs": steps,
+    }
@@ -0,0 +1,98 @@
+"""Stand-in for MicroPython's ``_thread``: a second core run in lockstep with the virtual clock.
+
+start_new_thread() runs the function on a real CPython thread. Only one
+side runs at a time: the main thread (core 0, with the uasyncio loop and
+the scripted hardware events) blocks while core 1 runs, and core 1 blocks
+in time.sleep_ms()/sleep_us() until the virtual clock reaches its wake-up
+time. Core 1 therefore keeps its timing while core 0 is busy (see
+CLOCK.advance_to), and runs are deterministic. The code on each side still
+runs on its own OS thread, and may be preempted anywhere by CPython, so
+shared-memory code is genuinely exercised across threads.
+"""
+import threading
+
+from simulator.clock import CLOCK
+
+_threads = []
+
+
+class _Halt(BaseException):
+    """Raised in a core 1 thread when the simulator is reset."""
+
+
+class _Core:
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.resume = threading.Event()
+        self.parked = threading.Event()
+        self.halted = False
+        self.thread = threading.Thread(target=self._main, daemon=True)
+
+    def _main(self):
+        self.resume.wait()
+        try:
+            self.fn(*self.args)
+        except _Halt:
+            pass
+        finally:
+            self.halted = True
+            self.parked.set()
+
+    def run_until_parked(self):
+        """Lets core 1 run until it sleeps again (or returns); called on core 0."""
+        if self.halted:
+            return
+        self.parked.clear()
+        self.resume.set()
+        self.parked.wait()
+
+    def sleep_until(self, at_us):
+        """Parks core 1 until the clock reaches at_us; called on core 1."""
+        CLOCK.schedule(at_us, self.run_until_parked)
+        self.resume.clear()
+        self.parked.set()
+        self.resume.wait()
+        if self.halted:
+            raise _Halt
+
+
+def _current():
+    ident = threading.get_ident()
+    for core in _threads:
+        if core.thread.ident == ident:
+            return core
+    return None
+
+
+def sleep_us(us):
+    """time.sleep_us for both cores: core 0 advances the clock, core 1 waits for it."""
+    core = _current()
+    if core is None:
+        CLOCK.advance_to(CLOCK.now_us + int(us))
+    else:
+        core.sleep_until(CLOCK.now_us + max(int(us), 1))
+
+
+def start_new_thread(fn, args):
+    core = _Core(fn, args)
+    _threads.append(core)
+    core.thread.start()
+    core.run_until_parked()
+    return core.thread.ident
+
+
+def allocate_lock():
+    return threading.Lock()
+
+
+def get_ident():
+    return threading.get_ident()
+
+
+def reset():
+    """Stops every core 1 thread at its next wake-up."""
+    for core in _threads:
+        core.halted = True
+        core.resume.set()
+    _threads.clear()
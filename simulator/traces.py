@@ -0,0 +1,79 @@
+"""Generators for scripted sensor inputs (reed pulse trains, potentiometer traces)."""
+import math
+
+
+def pulse_times(segments, start_ms=0):
+    """Turns [(duration_ms, rpm), ...] into reed pulse timestamps in ms.
+
+    Rotation phase is carried across segments, so a cadence change does not
+    produce a spurious short or long period at the boundary. rpm 0 is a stop.
+    """
+    times = []
+    t = start_ms
+    phase = 0.0  # Fraction of a revolution since the last pulse
+    for duration_ms, rpm in segments:
+        end = t + duration_ms
+        if rpm <= 0:
+            phase = 0.0
+            t = end
+            continue
+        period_ms = 60000.0 / rpm
+        t_next = t + (1.0 - phase) * period_ms
+        while t_next <= end:
+            times.append(t_next)
+            t_next += period_ms
+        phase = 1.0 - (t_next - end) / period_ms
+        t = end
+    return times
+
+
+def steady(rpm, duration_ms, start_ms=0):
+    return pulse_times([(duration_ms, rpm)], start_ms)
+
+
+def steps(levels):
+    """A piecewise-constant trace from [(start_us, value), ...] for set_adc*()."""
+    def trace(now_us):
+        value = levels[0][1]
+        for start_us, level_value in levels:
+            if now_us < start_us:
+                break
+            value = level_value
+        return value
+    return trace
+
+
+def coast_down(k, bearing_w, inertia, start_rpm, stop_rpm, start_ms=0):
+    """Reed pulse times (ms) of a flywheel coasting from start_rpm to stop_rpm.
+
+    Exact solution of I * w * dw/dt = -(k * w^2 + bearing_w), the model the
+    k table is fitted with. The first pulse is at start_ms, at start_rpm.
+    """
+    b = 2 * k / inertia
+    a = bearing_w / k
+    w0 = start_rpm * math.pi / 30
+    w_stop = stop_rpm * math.pi / 30
+    amplitude = w0 * w0 + a
+
+    # Angle turned while the speed falls from w0 to s
+    def angle(s):
+        if a == 0:
+            return 2 * (w0 - s) / b
+        root_a = math.sqrt(a)
+        return 2 / b * (w0 - s - root_a * (math.atan(w0 / root_a) - math.atan(s / root_a)))
+
+    times = [start_ms]
+    revolution = 1
+    while angle(w_stop) >= 2 * math.pi * revolution:
+        target = 2 * math.pi * revolution
+        lo, hi = w_stop, w0
+        for _ in range(60):
+            mid = (lo + hi) / 2
+            if angle(mid) < target:
+                hi = mid
+            else:
+                lo = mid
+        t_s = -math.log((lo * lo + a) / amplitude) / b
+        times.append(start_ms + t_s * 1000)
+        revolution += 1
+    return times
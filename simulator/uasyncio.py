@@ -0,0 +1,240 @@
+"""Stand-in for ``uasyncio`` that runs coroutines against the virtual clock.
+
+The scheduler never sleeps for real: when no task is runnable it jumps the
+clock straight to the next wake-up, firing any scripted hardware events in
+between. A 100 ms loop therefore runs as fast as the host CPU allows.
+"""
+import heapq
+from collections import deque
+from simulator.clock import CLOCK
+
+
+class CancelledError(BaseException):
+    pass
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class _Sleep:
+    __slots__ = ("delay_us",)
+
+    def __init__(self, delay_us):
+        self.delay_us = delay_us
+
+    def __await__(self):
+        yield self
+
+
+class _Wait:
+    __slots__ = ("waitable",)
+
+    def __init__(self, waitable):
+        self.waitable = waitable
+
+    def __await__(self):
+        yield self
+
+
+def sleep_ms(ms):
+    return _Sleep(int(ms * 1000))
+
+
+def sleep(s):
+    return _Sleep(int(s * 1000000))
+
+
+def wait_for(awaitable, timeout):
+    """Like uasyncio.wait_for: the awaitable's result, or TimeoutError after timeout s (it is then cancelled)."""
+    return _wait_for_us(awaitable, int(timeout * 1000000))
+
+
+def wait_for_ms(awaitable, timeout):
+    return _wait_for_us(awaitable, int(timeout * 1000))
+
+
+async def _wait_for_us(awaitable, timeout_us):
+    done = Event()
+    outcome = []
+
+    async def run():
+        # Not in a finally: closing a leftover coroutine after reset() must not wake anything
+        try:
+            outcome.append((await awaitable, None))
+        except Exception as e:
+            outcome.append((None, e))
+        done.set()
+
+    async def expire():
+        await _Sleep(timeout_us)
+        done.set()
+
+    inner = create_task(run())
+    timer = create_task(expire())
+    await done.wait()
+    if not outcome:
+        inner.cancel()
+        raise TimeoutError
+    timer.cancel()
+    value, error = outcome[0]
+    if error is not None:
+        raise error
+    return value
+
+
+class Task:
+    def __init__(self, coro):
+        self.coro = coro
+        self.done = False
+        self.steps = 0
+        self._token = 0
+        self._throw = None
+
+    def cancel(self):
+        if self.done:
+            return False
+        self._throw = CancelledError()
+        _loop.wake(self)
+        return True
+
+
+class ThreadSafeFlag:
+    """Set from an IRQ (or another thread), awaited by exactly one task."""
+    def __init__(self):
+        self._flag = False
+        self._waiter = None
+
+    def set(self):
+        self._flag = True
+        if self._waiter is not None:
+            task, self._waiter = self._waiter, None
+            _loop.wake(task)
+
+    def clear(self):
+        self._flag = False
+
+    async def wait(self):
+        if not self._flag:
+            await _Wait(self)
+        self._flag = False
+
+    def _park(self, task):
+        self._waiter = task
+
+
+class Event:
+    def __init__(self):
+        self.state = False
+        self._waiters = []
+
+    def is_set(self):
+        return self.state
+
+    def set(self):
+        self.state = True
+        waiters, self._waiters = self._waiters, []
+        for task in waiters:
+            _loop.wake(task)
+
+    def clear(self):
+        self.state = False
+
+    async def wait(self):
+        if not self.state:
+            await _Wait(self)
+        return True
+
+    def _park(self, task):
+        self._waiters.append(task)
+
+
+class Loop:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._ready = deque()
+        self._sleepers = []
+        self._seq = 0
+        self.current = None
+        self.steps = 0  # Task resumptions, i.e. CPU wakeups
+        self.max_step_us = 0  # Longest virtual time one resumption held the loop (busy-waits, flash writes)
+
+    def wake(self, task):
+        task._token += 1
+        self._ready.append((task, task._token))
+
+    def _step(self, task):
+        self.current = task
+        task.steps += 1
+        self.steps += 1
+        start_us = CLOCK.now_us
+        try:
+            if task._throw is not None:
+                exc, task._throw = task._throw, None
+                request = task.coro.throw(exc)
+            else:
+                request = task.coro.send(None)
+        except (StopIteration, CancelledError):
+            task.done = True
+            return
+        finally:
+            self.current = None
+            self.max_step_us = max(self.max_step_us, CLOCK.now_us - start_us)
+        if isinstance(request, _Sleep):
+            task._token += 1
+            self._seq += 1
+            deadline = CLOCK.now_us + request.delay_us
+            heapq.heappush(self._sleepers, (deadline, self._seq, task, task._token))
+        elif isinstance(request, _Wait):
+            task._token += 1
+            request.waitable._park(task)
+        else:
+            self.wake(task)
+
+    def run(self, main, until_us=None):
+        """Runs until main finishes or the virtual clock reaches until_us."""
+        ready = self._ready
+        sleepers = self._sleepers
+        while not main.done:
+            if ready:
+                task, token = ready.popleft()
+                if token == task._token and not task.done:
+                    self._step(task)
+                continue
+            next_us = sleepers[0][0] if sleepers else CLOCK.next_event_us()
+            if next_us is None and until_us is None:
+                raise RuntimeError("deadlock: no runnable task and no scheduled event")
+            if until_us is not None and (next_us is None or next_us > until_us):
+                CLOCK.advance_to(until_us)
+                return
+            CLOCK.advance_to(next_us, stop=lambda: bool(ready))
+            while sleepers and sleepers[0][0] <= CLOCK.now_us:
+                _, _, task, token = heapq.heappop(sleepers)
+                if token == task._token:
+                    ready.append((task, token))
+
+
+_loop = Loop()
+
+
+def get_event_loop():
+    return _loop
+
+
+def create_task(coro):
+    task = Task(coro)
+    _loop.wake(task)
+    return task
+
+
+def run(coro, until_us=None):
+    """Like uasyncio.run; until_us bounds the run in virtual time."""
+    main = create_task(coro)
+    _loop.run(main, until_us)
+    return main
+
+
+def reset():
+    _loop.reset()